@@ -0,0 +1,58 @@
+"""\
+Measures the throughput of ``snuba.state.get_config`` against the previous
+implementation, which copied the whole memoized config dictionary on every
+call.
+
+Requires the config Redis to be reachable. Usage:
+
+    SNUBA_SETTINGS=test python scripts/bench-get-config.py [configs] [calls]
+"""
+
+import sys
+import time
+from typing import Any, Callable, Mapping, Optional
+
+from snuba import settings, state
+
+config_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+calls = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+
+
+@state.memoize(settings.CONFIG_MEMOIZE_TIMEOUT)
+def legacy_raw_configs() -> Mapping[str, Optional[Any]]:
+    return {
+        k.decode("utf-8"): state.get_typed_value(v.decode("utf-8"))
+        for k, v in state.rds.hgetall(state.config_hash).items()
+    }
+
+
+def legacy_get_config(key: str, default: Optional[Any] = None) -> Optional[Any]:
+    return {k: v for k, v in legacy_raw_configs().items()}.get(key, default)
+
+
+def run(name: str, get_config: Callable[[str, Optional[Any]], Optional[Any]]) -> None:
+    start = time.perf_counter()
+    for _ in range(calls):
+        get_config("bench_config_0", None)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>8}: {calls / elapsed:>14,.0f} calls/s")
+
+
+def _main() -> None:
+    for i in range(config_count):
+        state.rds.hset(state.config_hash, f"bench_config_{i}", str(i))
+    state.set_config("bench_config_0", 0)
+    try:
+        print(
+            f"{config_count} configs, {calls} calls, "
+            f"CONFIG_MEMOIZE_TIMEOUT={settings.CONFIG_MEMOIZE_TIMEOUT}"
+        )
+        run("before", legacy_get_config)
+        run("after", state.get_config)
+    finally:
+        for i in range(config_count):
+            state.delete_config(f"bench_config_{i}")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,123 @@
+"""\
+Measures how long the outcomes consumer takes to process and encode
+messages one at a time, as the transform step does, and in blocks with
+process_batch.
+
+Usage:
+
+    SNUBA_SETTINGS=test python scripts/bench-process-batch.py [messages] [block size]
+"""
+
+import json
+import sys
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, List, Optional
+
+from arroyo import Message, Partition, Topic
+from arroyo.backends.kafka import KafkaPayload
+from arroyo.processing.strategies import ProcessingStrategy
+
+from snuba.consumers.consumer import ProcessBatchStep, process_message
+from snuba.datasets.processors.outcomes_processor import OutcomesProcessor
+from snuba.utils.metrics.backends.dummy import DummyMetricsBackend
+
+messages_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+block_size = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+
+class CountingStep(ProcessingStrategy[Any]):
+    def __init__(self) -> None:
+        self.rows = 0
+
+    def poll(self) -> None:
+        pass
+
+    def submit(self, message: Message[Any]) -> None:
+        if message.payload is not None:
+            self.rows += len(message.payload.rows)
+
+    def close(self) -> None:
+        pass
+
+    def terminate(self) -> None:
+        pass
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        pass
+
+
+def build_messages() -> List[Message[KafkaPayload]]:
+    partition = Partition(Topic("outcomes"), 0)
+    return [
+        Message(
+            partition,
+            offset,
+            KafkaPayload(
+                None,
+                json.dumps(
+                    {
+                        "org_id": 1,
+                        "project_id": offset % 100,
+                        "key_id": 3,
+                        "timestamp": "2022-01-01T00:00:00.000000Z",
+                        "outcome": offset % 4,
+                        "category": 1,
+                        "quantity": 1,
+                        "reason": None,
+                        "event_id": str(uuid.UUID(int=offset)),
+                    }
+                ).encode("utf-8"),
+                [],
+            ),
+            datetime.now(),
+        )
+        for offset in range(messages_count)
+    ]
+
+
+def run(name: str, consume: Callable[[List[Message[KafkaPayload]]], int]) -> None:
+    messages = build_messages()
+    start = time.perf_counter()
+    rows = consume(messages)
+    elapsed = time.perf_counter() - start
+    assert rows == messages_count
+    print(f"{name:>12}: {elapsed / messages_count * 1_000_000:>8.2f} us/message")
+
+
+def per_message(messages: List[Message[KafkaPayload]]) -> int:
+    processor = OutcomesProcessor()
+    rows = 0
+    for message in messages:
+        result = process_message(processor, "bench", message)
+        if result is not None:
+            rows += len(result.rows)
+    return rows
+
+
+def per_block(messages: List[Message[KafkaPayload]]) -> int:
+    next_step = CountingStep()
+    step = ProcessBatchStep(
+        OutcomesProcessor(),
+        "bench",
+        next_step,
+        block_size,
+        60.0,
+        DummyMetricsBackend(),
+    )
+    for message in messages:
+        step.submit(message)
+    step.close()
+    step.join()
+    return next_step.rows
+
+
+def _main() -> None:
+    print(f"{messages_count} messages, blocks of {block_size}")
+    run("per message", per_message)
+    run("per block", per_block)
+
+
+if __name__ == "__main__":
+    _main()
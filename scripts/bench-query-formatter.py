@@ -0,0 +1,162 @@
+"""\
+Measures how long it takes to format processed storage queries into SQL,
+both with the two separate ``format_query`` calls (normal and sorted
+fields) and with the single ``format_query_and_sorted`` call.
+
+The corpus is made of SnQL queries shaped like the ones the product sends
+most often. They go through the regular query pipeline, up to the storage
+query, so the formatted ASTs are the ones ClickHouse would receive. Every
+iteration formats a fresh copy of the query, since in production each
+request formats a new AST and what is memoized on the expressions is never
+reused across requests.
+
+Requires the same environment as the API (Redis for runtime config).
+Usage:
+
+    SNUBA_SETTINGS=test python scripts/bench-query-formatter.py [iterations]
+"""
+
+import copy
+import sys
+import time
+from typing import Callable, List, Union
+
+from snuba.clickhouse.formatter.query import format_query, format_query_and_sorted
+from snuba.clickhouse.query import Query
+from snuba.datasets.factory import get_dataset
+from snuba.query.composite import CompositeQuery
+from snuba.query.data_source.simple import Table
+from snuba.query.query_settings import HTTPQuerySettings, QuerySettings
+from snuba.reader import Reader
+from snuba.request.schema import RequestSchema
+from snuba.request.validation import build_request, parse_snql_query
+from snuba.utils.metrics.timer import Timer
+
+StorageQuery = Union[Query, CompositeQuery[Table]]
+
+iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+TIME_RANGE = (
+    "timestamp >= toDateTime('2022-07-12T19:45:01') "
+    "AND timestamp < toDateTime('2022-08-11T19:45:01')"
+)
+
+CORPUS = [
+    (
+        "events",
+        f"""
+        MATCH (events)
+        SELECT count() AS count, max(timestamp) AS last_seen BY group_id
+        WHERE project_id IN tuple(1, 2, 3) AND {TIME_RANGE}
+        ORDER BY count DESC
+        LIMIT 100
+        """,
+    ),
+    (
+        "events",
+        f"""
+        MATCH (events)
+        SELECT event_id, title, message, tags[environment], timestamp
+        WHERE project_id = 1 AND {TIME_RANGE}
+        AND (tags[level] = 'error' OR tags[level] = 'fatal')
+        AND group_id IN tuple(10, 11, 12, 13)
+        ORDER BY timestamp DESC
+        LIMIT 50
+        """,
+    ),
+    (
+        "events",
+        f"""
+        MATCH (events)
+        SELECT uniq(user) AS users, count() AS count BY time
+        WHERE project_id = 1 AND {TIME_RANGE}
+        AND tags[sentry:release] IN tuple('1.0.0', '1.0.1')
+        GRANULARITY 3600
+        """,
+    ),
+    (
+        "transactions",
+        """
+        MATCH (transactions)
+        SELECT quantile(0.95)(duration) AS p95, count() AS count
+        BY transaction_name
+        WHERE project_id = 1
+        AND finish_ts >= toDateTime('2022-07-12T19:45:01')
+        AND finish_ts < toDateTime('2022-08-11T19:45:01')
+        AND transaction_op = 'http.server'
+        ORDER BY count DESC
+        LIMIT 20
+        """,
+    ),
+    (
+        "discover",
+        f"""
+        MATCH (discover)
+        SELECT count() AS count
+        WHERE {TIME_RANGE}
+        AND project_id IN tuple(300688)
+        AND ifNull(tags[duration_group], '') != ''
+        AND ifNull(tags[duration_group], '') = '<10s'
+        LIMIT 50
+        """,
+    ),
+]
+
+
+def build_corpus() -> List[StorageQuery]:
+    queries: List[StorageQuery] = []
+
+    def collect(query: StorageQuery, settings: QuerySettings, reader: Reader) -> None:
+        queries.append(query)
+
+    schema = RequestSchema.build(HTTPQuerySettings)
+    for dataset_name, snql in CORPUS:
+        dataset = get_dataset(dataset_name)
+        request = build_request(
+            {"query": snql, "dataset": dataset_name},
+            parse_snql_query,
+            HTTPQuerySettings,
+            schema,
+            dataset,
+            Timer("bench"),
+            "bench",
+        )
+        dataset.get_query_pipeline_builder().build_execution_pipeline(
+            request, collect
+        ).execute()
+    return queries
+
+
+def format_twice(query: StorageQuery) -> None:
+    format_query(query).get_sql()
+    format_query(query, sort_fields=True).get_sql()
+
+
+def format_once(query: StorageQuery) -> None:
+    normal, sorted_fields = format_query_and_sorted(query)
+    normal.get_sql()
+    sorted_fields.get_sql()
+
+
+def run(
+    name: str, corpus: List[StorageQuery], func: Callable[[StorageQuery], None]
+) -> None:
+    copies = [copy.deepcopy(corpus) for _ in range(iterations)]
+    start = time.perf_counter()
+    for queries in copies:
+        for query in queries:
+            func(query)
+    elapsed = time.perf_counter() - start
+    per_query = elapsed / (iterations * len(corpus)) * 1_000_000
+    print(f"{name:>24}: {per_query:>8.1f} us/query")
+
+
+def _main() -> None:
+    corpus = build_corpus()
+    print(f"{len(corpus)} queries, {iterations} iterations")
+    run("format_query x2", corpus, format_twice)
+    run("format_query_and_sorted", corpus, format_once)
+
+
+if __name__ == "__main__":
+    _main()
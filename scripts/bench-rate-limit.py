@@ -0,0 +1,62 @@
+"""\
+Measures the overhead rate limiting adds to a query: how long entering and
+exiting a ``RateLimitAggregator`` takes with the legacy mode (a pipeline
+per bucket on entry and a command per bucket on exit) and with the batched
+mode (one script call on entry and one on exit).
+
+The buckets mimic the ones a query usually goes through (global, project,
+referrer, table), with limits high enough to never reject a query. Run it
+against a local Redis to see the cost of the commands, or against a remote
+one to see the effect of the round trips.
+
+Requires the same environment as the API (Redis for runtime config and
+rate limiting).
+Usage:
+
+    SNUBA_SETTINGS=test python scripts/bench-rate-limit.py [iterations]
+"""
+
+import sys
+import time
+import uuid
+from typing import Sequence
+
+from snuba import state
+from snuba.state.rate_limit import RateLimitAggregator, RateLimitParameters
+
+iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+
+def build_params() -> Sequence[RateLimitParameters]:
+    run_id = uuid.uuid4().hex
+    return [
+        RateLimitParameters("global", f"bench-global-{run_id}", None, 100000),
+        RateLimitParameters("project", f"bench-project-{run_id}", 100000, 100000),
+        RateLimitParameters("referrer", f"bench-referrer-{run_id}", 100000, 100000),
+        RateLimitParameters("table", f"bench-table-{run_id}", 100000, 100000),
+    ]
+
+
+def run(name: str, batched: bool) -> None:
+    state.set_config("rate_limit_batched", 1 if batched else 0)
+    params = build_params()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        with RateLimitAggregator(params):
+            pass
+    elapsed = time.perf_counter() - start
+    per_query = elapsed / iterations * 1_000_000
+    print(f"{name:>8}: {per_query:>8.1f} us/query")
+
+
+def _main() -> None:
+    print(f"4 buckets, {iterations} iterations")
+    try:
+        run("legacy", False)
+        run("batched", True)
+    finally:
+        state.delete_config("rate_limit_batched")
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,85 @@
+"""\
+Measures how long converting the values of a query result takes (dates,
+datetimes and UUIDs to strings), on a wide and a long result, both with
+row and columnar data.
+
+``per value`` uses the same transformations without their column
+transformers, which is how every column used to be converted, and
+``per column`` is what the native reader uses.
+
+Usage:
+
+    SNUBA_SETTINGS=test python scripts/bench-result-transformer.py [iterations]
+"""
+
+import re
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Callable, List, Tuple
+
+from snuba.clickhouse.native import (
+    transform_column_types,
+    transform_date,
+    transform_datetime,
+    transform_uuid,
+)
+from snuba.reader import Column, ColumnarRows, Result, Row, build_result_transformer
+
+iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+per_value = build_result_transformer(
+    [
+        (re.compile(r"^Date(\(.+\))?$"), transform_date, None),
+        (re.compile(r"^DateTime(\(.+\))?$"), transform_datetime, None),
+        (re.compile(r"^UUID$"), transform_uuid, None),
+    ]
+)
+
+TYPES = [
+    ("DateTime", lambda i: datetime(2022, 1, 1) + timedelta(seconds=i)),
+    ("Nullable(DateTime)", lambda i: None if i % 10 == 0 else datetime(2022, 1, 1)),
+    ("Date", lambda i: date(2022, 1, 1) + timedelta(days=i % 30)),
+    ("UUID", lambda i: uuid.UUID(int=i)),
+    ("String", lambda i: f"value-{i}"),
+    ("UInt64", lambda i: i),
+]
+
+
+def build_result(columns: int, rows: int, columnar: bool) -> Result:
+    meta: List[Column] = []
+    values = []
+    for index in range(columns):
+        type, build = TYPES[index % len(TYPES)]
+        meta.append({"name": f"column_{index}", "type": type})
+        values.append([build(row) for row in range(rows)])
+    names = [column["name"] for column in meta]
+    if columnar:
+        return {"meta": meta, "data": ColumnarRows(names, values)}
+    data: List[Row] = [dict(zip(names, row)) for row in zip(*values)]
+    return {"meta": meta, "data": data}
+
+
+def run(name: str, shape: Tuple[int, int], transform: Callable[[Result], None]) -> None:
+    columns, rows = shape
+    for columnar in (False, True):
+        elapsed = 0.0
+        for _ in range(iterations):
+            result = build_result(columns, rows, columnar)
+            start = time.perf_counter()
+            transform(result)
+            elapsed += time.perf_counter() - start
+        per_result = elapsed / iterations * 1000
+        layout = "columnar" if columnar else "rows"
+        print(f"{columns:>3} x {rows:>6} {layout:>8} {name:>10}: {per_result:>8.2f} ms")
+
+
+def _main() -> None:
+    for shape in [(60, 1000), (6, 100000)]:
+        run("per value", shape, per_value)
+        run("per column", shape, transform_column_types)
+
+
+if __name__ == "__main__":
+    _main()
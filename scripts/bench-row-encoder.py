@@ -0,0 +1,108 @@
+"""\
+Measures how long encoding rows for an insert takes with JSONEachRow and
+with RowBinary, on the writable columns of a storage, and how large the
+encoded batches are.
+
+The rows are built from the columns of the storage: values matching the
+type of each column, with empty arrays and None in nullable columns for
+part of them.
+
+Usage:
+
+    SNUBA_SETTINGS=test python scripts/bench-row-encoder.py [storage] [rows]
+"""
+
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Sequence
+
+from snuba.clickhouse.columns import (
+    UUID,
+    Array,
+    ColumnType,
+    Date,
+    DateTime,
+    Enum,
+    FixedString,
+    FlattenedColumn,
+    Float,
+    IPv4,
+    IPv6,
+    Nullable,
+    ReadOnly,
+    UInt,
+)
+from snuba.clickhouse.http import JSONRowEncoder
+from snuba.clickhouse.row_binary import RowBinaryRowEncoder
+from snuba.datasets.storages.factory import get_writable_storage
+from snuba.datasets.storages.storage_key import StorageKey
+from snuba.utils.codecs import Encoder
+from snuba.writer import WriterTableRow
+
+storage_name = sys.argv[1] if len(sys.argv) > 1 else "errors"
+rows_count = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+
+def build_value(type: ColumnType[Any], index: int) -> Any:
+    if type.has_modifier(Nullable) and index % 3 == 0:
+        return None
+    if isinstance(type, UInt):
+        return index % 200
+    if isinstance(type, Float):
+        return index / 7
+    if isinstance(type, DateTime):
+        return (datetime(2022, 1, 1) + timedelta(seconds=index)).strftime(
+            "%Y-%m-%dT%H:%M:%S"
+        )
+    if isinstance(type, Date):
+        return "2022-01-01"
+    if isinstance(type, UUID):
+        return str(uuid.UUID(int=index))
+    if isinstance(type, IPv4):
+        return "127.0.0.1"
+    if isinstance(type, IPv6):
+        return "::1"
+    if isinstance(type, FixedString):
+        return "a" * type.length
+    if isinstance(type, Enum):
+        return type.values[0][0]
+    if isinstance(type, Array):
+        return [build_value(type.inner_type, index + i) for i in range(index % 4)]
+    return f"value-{index}"
+
+
+def build_rows(columns: Sequence[FlattenedColumn]) -> Sequence[WriterTableRow]:
+    return [
+        {column.flattened: build_value(column.type, index) for column in columns}
+        for index in range(rows_count)
+    ]
+
+
+def run(name: str, encoder: Encoder[bytes, WriterTableRow], rows: Any) -> None:
+    start = time.perf_counter()
+    encoded = [encoder.encode(row) for row in rows]
+    elapsed = time.perf_counter() - start
+    size = sum(len(row) for row in encoded)
+    print(
+        f"{name:>10}: {elapsed / len(rows) * 1_000_000:>8.2f} us/row, "
+        f"{size / len(rows):>8.1f} bytes/row"
+    )
+
+
+def _main() -> None:
+    table_writer = get_writable_storage(StorageKey(storage_name)).get_table_writer()
+    columns = [
+        column
+        for column in table_writer.get_schema().get_columns()
+        if not column.type.has_modifier(ReadOnly)
+    ]
+    rows = build_rows(columns)
+    print(f"{storage_name}: {len(columns)} columns, {rows_count} rows")
+    run("json", JSONRowEncoder(), rows)
+    run("row binary", RowBinaryRowEncoder(columns), rows)
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,98 @@
+"""\
+Measures how long parsing SnQL query bodies takes with the full grammar and
+with the parsed-query cache.
+
+The corpus is either a file with one captured query body per line (the
+``sql`` field of the querylog does not work, these have to be SnQL bodies)
+or a few queries shaped like the ones the product sends most often. Every
+iteration goes through the whole corpus with different literals where the
+built-in queries are used, so the cache has to bind new values each time.
+The hit rate is reported along with the timings: captured corpora with a
+lot of distinct shapes will mostly measure misses.
+
+Usage:
+
+    SNUBA_SETTINGS=test python scripts/bench-snql-parse-cache.py \\
+        [iterations] [corpus file]
+"""
+
+import sys
+import time
+from collections import Counter
+from typing import Callable, Sequence
+
+from snuba.query.snql.parse_cache import SnQLParseCache
+from snuba.query.snql.parser import _parse_snql_body
+
+iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+corpus_path = sys.argv[2] if len(sys.argv) > 2 else None
+
+TIME_RANGE = (
+    "timestamp >= toDateTime('2022-07-12T19:{minute:02d}:01') "
+    "AND timestamp < toDateTime('2022-07-13T19:{minute:02d}:01')"
+)
+
+QUERIES = [
+    "MATCH (events) SELECT count() AS count, uniq(user) AS users "
+    "BY group_id WHERE project_id IN tuple({project_id}, 2) "
+    f"AND {TIME_RANGE} AND type != 'transaction' "
+    "ORDER BY count DESC LIMIT 50",
+    "MATCH (discover) SELECT title, count() AS count BY title "
+    f"WHERE project_id = {{project_id}} AND {TIME_RANGE} "
+    "AND environment = 'production-{project_id}' "
+    "AND tags[level] = 'error' LIMIT 100",
+    "MATCH (transactions) SELECT quantile(0.95)(duration) AS p95, "
+    "count() AS count BY transaction_name "
+    f"WHERE project_id = {{project_id}} AND {TIME_RANGE} "
+    "AND duration > {project_id}.5 LIMIT 20",
+]
+
+
+def build_corpus(iteration: int) -> Sequence[str]:
+    return [
+        query.format(project_id=iteration + 1, minute=iteration % 60)
+        for query in QUERIES
+    ]
+
+
+def load_corpus() -> Sequence[str]:
+    assert corpus_path is not None
+    with open(corpus_path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def run(name: str, parse: Callable[[str], object]) -> None:
+    captured = load_corpus() if corpus_path else None
+    parsed = 0
+    start = time.perf_counter()
+    for iteration in range(iterations):
+        for body in captured or build_corpus(iteration):
+            parse(body)
+            parsed += 1
+    elapsed = time.perf_counter() - start
+    per_query = elapsed / parsed * 1_000_000
+    print(f"{name:>8}: {per_query:>8.1f} us/query")
+
+
+def _main() -> None:
+    cache = SnQLParseCache(_parse_snql_body)
+    statuses: Counter[str] = Counter()
+
+    def parse_cached(body: str) -> object:
+        parsed, status = cache.parse(body)
+        statuses[status.value] += 1
+        return parsed
+
+    print(f"{iterations} iterations")
+    run("parse", _parse_snql_body)
+    run("cached", parse_cached)
+    total = sum(statuses.values())
+    print(
+        ", ".join(
+            f"{status} {count / total:.1%}" for status, count in statuses.most_common()
+        )
+    )
+
+
+if __name__ == "__main__":
+    _main()
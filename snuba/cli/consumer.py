@@ -90,6 +90,18 @@ logger = logging.getLogger(__name__)
     is_flag=True,
     default=True,
 )
+@click.option(
+    "--max-batches-in-flight",
+    default=1,
+    type=int,
+    help="Max number of batches written to ClickHouse at once.",
+)
+@click.option(
+    "--process-batch",
+    is_flag=True,
+    default=False,
+    help="Process blocks of messages at once on storages whose processor supports it.",
+)
 @click.option("--log-level", help="Logging level to use.")
 @click.option(
     "--processes",
@@ -128,6 +140,8 @@ def consumer(
     queued_max_messages_kbytes: int,
     queued_min_messages: int,
     parallel_collect: bool,
+    max_batches_in_flight: int,
+    process_batch: bool,
     processes: Optional[int],
     input_block_size: Optional[int],
     output_block_size: Optional[int],
@@ -177,6 +191,8 @@ def consumer(
         stats_callback=stats_callback,
         parallel_collect=parallel_collect,
         cooperative_rebalancing=cooperative_rebalancing,
+        max_batches_in_flight=max_batches_in_flight,
+        process_batch=process_batch,
     )
 
     consumer = consumer_builder.build_base_consumer()
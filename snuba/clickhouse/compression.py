@@ -0,0 +1,103 @@
+"""
+Compression of the body of the insert requests sent over HTTP.
+
+The body is compressed incrementally while it is streamed, and sent with
+the matching ``Content-Encoding`` which ClickHouse decompresses on its
+side. gzip and deflate only need zlib, lz4 and zstd need the lz4 and
+zstandard packages, and a ClickHouse version accepting them as content
+encodings.
+"""
+from __future__ import annotations
+
+import zlib
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Optional, Protocol, cast
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None  # type: ignore
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: no cover
+    lz4_frame = None  # type: ignore
+
+
+class Compression(Enum):
+    """
+    The values are the content encodings of the compressed bodies.
+    """
+
+    GZIP = "gzip"
+    DEFLATE = "deflate"
+    LZ4 = "lz4"
+    ZSTD = "zstd"
+
+
+class StreamCompressor(Protocol):
+    def compress(self, data: bytes) -> bytes:
+        ...
+
+    def flush(self) -> bytes:
+        ...
+
+
+class _LZ4StreamCompressor:
+    def __init__(self, level: int) -> None:
+        self.__compressor = lz4_frame.LZ4FrameCompressor(compression_level=level)
+        self.__header: Optional[bytes] = self.__compressor.begin()
+
+    def __prefix(self, data: bytes) -> bytes:
+        if self.__header is None:
+            return data
+        header, self.__header = self.__header, None
+        return header + data
+
+    def compress(self, data: bytes) -> bytes:
+        return self.__prefix(cast(bytes, self.__compressor.compress(data)))
+
+    def flush(self) -> bytes:
+        return self.__prefix(cast(bytes, self.__compressor.flush()))
+
+
+@dataclass(frozen=True)
+class InsertCompression:
+    """
+    How the insert requests of a storage are compressed. Without a level
+    the default level of the compression is used.
+    """
+
+    compression: Compression
+    level: Optional[int] = None
+
+    def __post_init__(self) -> None:
+        if self.compression == Compression.LZ4 and lz4_frame is None:
+            raise ValueError("lz4 compression requires the lz4 package")
+        if self.compression == Compression.ZSTD and zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+
+    def get_content_encoding(self) -> str:
+        return self.compression.value
+
+    def build_compressor(self) -> StreamCompressor:
+        compressor: Any
+        if self.compression in (Compression.GZIP, Compression.DEFLATE):
+            compressor = zlib.compressobj(
+                self.level if self.level is not None else zlib.Z_DEFAULT_COMPRESSION,
+                zlib.DEFLATED,
+                # gzip and zlib headers respectively.
+                31 if self.compression == Compression.GZIP else 15,
+            )
+        elif self.compression == Compression.ZSTD:
+            compressor = zstandard.ZstdCompressor(
+                level=self.level if self.level is not None else 3
+            ).compressobj()
+        elif self.compression == Compression.LZ4:
+            compressor = _LZ4StreamCompressor(
+                self.level if self.level is not None else 0
+            )
+        else:
+            raise TypeError("unknown compression", self.compression)
+        return cast(StreamCompressor, compressor)
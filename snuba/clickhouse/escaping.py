@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 from typing import Optional, Pattern
 
 ESCAPE_STRING_RE = re.compile(r"(['\\])")
@@ -33,9 +34,13 @@ def escape_expression(expr: Optional[str], regex: Pattern[str]) -> Optional[str]
         return "{}`{}`".format(*negate_match.groups())
 
 
+# Identifiers and aliases come from a small set (the schemas and the
+# aliases used by the product), so their escaping is cached.
+@lru_cache(maxsize=4096)
 def escape_alias(alias: Optional[str]) -> Optional[str]:
     return escape_expression(alias, SAFE_ALIAS_RE)
 
 
+@lru_cache(maxsize=4096)
 def escape_identifier(col: Optional[str]) -> Optional[str]:
     return escape_expression(col, SAFE_COL_RE)
@@ -1,7 +1,7 @@
 import re
 from abc import ABC, abstractmethod
 from datetime import date, datetime
-from typing import Optional, Sequence, cast
+from typing import Callable, MutableMapping, Optional, Sequence, Tuple, Type, cast
 
 from snuba.clickhouse.escaping import escape_alias, escape_identifier, escape_string
 from snuba.query.conditions import (
@@ -24,6 +24,37 @@ from snuba.query.parsing import ParsingContext
 
 _BETWEEN_SQUARE_BRACKETS_REGEX = re.compile(r"(?<=\[)(.*?)(?=\])")
 
+# Expressions are immutable, so the parts of the formatting that do not
+# depend on the ParsingContext are memoized on the nodes themselves, which
+# makes formatting the same query a second time (sorted) cheaper. These
+# attributes are not dataclass fields, so they do not affect equality or
+# hashing.
+#
+# The formatted column does not depend on the formatter class, the alias
+# is applied to it afterwards.
+_FORMATTED_COLUMN_ATTR = "_formatted_column"
+_FIRST_LEVEL_CONDITIONS_ATTR = "_first_level_conditions"
+# Formatted functions and literals, keyed by formatter class and whether
+# fields are sorted, with whether they contain AND/OR conditions (and so
+# depend on the fields being sorted). Only expressions without any alias in
+# them are memoized, since how an alias is formatted depends on the aliases
+# the ParsingContext has already seen.
+_FORMATTED_ATTR = "_formatted"
+
+FormattedKey = Tuple[Type["ExpressionFormatterBase"], bool]
+
+
+def _get_first_level_conditions(
+    exp: FunctionCall, getter: Callable[[FunctionCall], Sequence[Expression]]
+) -> Sequence[Expression]:
+    conditions: Optional[Sequence[Expression]] = exp.__dict__.get(
+        _FIRST_LEVEL_CONDITIONS_ATTR
+    )
+    if conditions is None:
+        conditions = tuple(getter(exp))
+        object.__setattr__(exp, _FIRST_LEVEL_CONDITIONS_ATTR, conditions)
+    return conditions
+
 
 class ExpressionFormatterBase(ExpressionVisitor[str], ABC):
     """
@@ -41,11 +72,16 @@ class ExpressionFormatterBase(ExpressionVisitor[str], ABC):
         self._parsing_context = (
             parsing_context if parsing_context is not None else ParsingContext()
         )
+        # Number of aliases and of AND/OR conditions formatted so far, which
+        # tell whether the output of a sub-expression can be memoized.
+        self.__aliases_formatted = 0
+        self.__boolean_conditions_formatted = 0
 
     def _alias(self, formatted_exp: str, alias: Optional[str]) -> str:
         if not alias:
             return formatted_exp
-        elif self._parsing_context.is_alias_present(alias):
+        self.__aliases_formatted += 1
+        if self._parsing_context.is_alias_present(alias):
             ret = escape_alias(alias)
             # This is for the type checker. escape_alias can return None if
             # we pass None. But here we do not pass None so a None return value
@@ -54,7 +90,47 @@ class ExpressionFormatterBase(ExpressionVisitor[str], ABC):
             return ret
         else:
             self._parsing_context.add_alias(alias)
-            return f"({formatted_exp} AS {escape_alias(alias)})"
+            return f"({formatted_exp} AS {self._escape_alias_definition(alias)})"
+
+    def _escape_alias_definition(self, alias: str) -> Optional[str]:
+        return escape_alias(alias)
+
+    def __memoized(self, exp: Expression, format_exp: Callable[[], str]) -> str:
+        """
+        Returns the memoized output of ``format_exp`` for ``exp``, or runs it and
+        memoizes it if ``exp`` does not contain any alias. The output of
+        expressions without AND/OR conditions does not depend on the
+        fields being sorted, so it is shared between the two.
+        """
+        key = (type(self), self._parsing_context.sort_fields)
+        memo: Optional[
+            MutableMapping[FormattedKey, Tuple[str, bool]]
+        ] = exp.__dict__.get(_FORMATTED_ATTR)
+        if memo is not None:
+            memoized = memo.get(key)
+            if memoized is not None:
+                formatted, sort_dependent = memoized
+                if sort_dependent:
+                    # So that the expressions containing this one are not
+                    # shared between sorted and unsorted fields either.
+                    self.__boolean_conditions_formatted += 1
+                return formatted
+
+        aliases_formatted = self.__aliases_formatted
+        boolean_conditions_formatted = self.__boolean_conditions_formatted
+        formatted = format_exp()
+        if self.__aliases_formatted != aliases_formatted:
+            return formatted
+
+        if memo is None:
+            memo = {}
+            object.__setattr__(exp, _FORMATTED_ATTR, memo)
+        if self.__boolean_conditions_formatted == boolean_conditions_formatted:
+            memo[(type(self), False)] = (formatted, False)
+            memo[(type(self), True)] = (formatted, False)
+        else:
+            memo[key] = (formatted, True)
+        return formatted
 
     @abstractmethod
     def _format_string_literal(self, exp: Literal) -> str:
@@ -77,6 +153,9 @@ class ExpressionFormatterBase(ExpressionVisitor[str], ABC):
         raise NotImplementedError
 
     def visit_literal(self, exp: Literal) -> str:
+        return self.__memoized(exp, lambda: self.__format_literal(exp))
+
+    def __format_literal(self, exp: Literal) -> str:
         if exp.value is None:
             return self._alias("NULL", exp.alias)
         if isinstance(exp.value, bool):
@@ -93,6 +172,16 @@ class ExpressionFormatterBase(ExpressionVisitor[str], ABC):
             raise ValueError(f"Unexpected literal type {type(exp.value)}")
 
     def visit_column(self, exp: Column) -> str:
+        # The formatted column, before applying the alias, and whether the
+        # alias has to be applied.
+        formatted: Optional[Tuple[str, bool]] = exp.__dict__.get(_FORMATTED_COLUMN_ATTR)
+        if formatted is None:
+            formatted = self.__format_column(exp)
+            object.__setattr__(exp, _FORMATTED_COLUMN_ATTR, formatted)
+        ret, aliased = formatted
+        return self._alias(ret, exp.alias) if aliased else ret
+
+    def __format_column(self, exp: Column) -> Tuple[str, bool]:
         ret = []
         ret_unescaped = []
         if exp.table_name:
@@ -112,10 +201,7 @@ class ExpressionFormatterBase(ExpressionVisitor[str], ABC):
         # the query more readable.
         # This happens often since we apply column aliases during
         # parsing so the names are preserved during query processing.
-        if exp.alias != "".join(ret_unescaped):
-            return self._alias("".join(ret), exp.alias)
-        else:
-            return "".join(ret)
+        return "".join(ret), exp.alias != "".join(ret_unescaped)
 
     def __visit_params(self, parameters: Sequence[Expression]) -> str:
         ret = [p.accept(self) for p in parameters]
@@ -131,6 +217,9 @@ class ExpressionFormatterBase(ExpressionVisitor[str], ABC):
         return f"{self.visit_column(exp.column)}[{self.visit_literal(exp.key)}]"
 
     def visit_function_call(self, exp: FunctionCall) -> str:
+        return self.__memoized(exp, lambda: self.__format_function_call(exp))
+
+    def __format_function_call(self, exp: FunctionCall) -> str:
         if exp.function_name == "array":
             # Workaround for https://github.com/ClickHouse/ClickHouse/issues/11622
             # Some distributed queries fail when arrays are passed as array(1,2,3)
@@ -145,16 +234,22 @@ class ExpressionFormatterBase(ExpressionVisitor[str], ABC):
             return self._alias(f"({self.__visit_params(exp.parameters)})", exp.alias)
 
         elif exp.function_name == BooleanFunctions.AND:
-            current_level = get_first_level_and_conditions(exp)
-            if self._parsing_context.sort_fields and isinstance(current_level, list):
-                current_level.sort()
+            self.__boolean_conditions_formatted += 1
+            current_level = _get_first_level_conditions(
+                exp, get_first_level_and_conditions
+            )
+            if self._parsing_context.sort_fields:
+                current_level = sorted(current_level)
             formatted = (c.accept(self) for c in current_level)
             return " AND ".join(formatted)
 
         elif exp.function_name == BooleanFunctions.OR:
-            current_level = get_first_level_or_conditions(exp)
-            if self._parsing_context.sort_fields and isinstance(current_level, list):
-                current_level.sort()
+            self.__boolean_conditions_formatted += 1
+            current_level = _get_first_level_conditions(
+                exp, get_first_level_or_conditions
+            )
+            if self._parsing_context.sort_fields:
+                current_level = sorted(current_level)
             formatted = (c.accept(self) for c in current_level)
             return f"({' OR '.join(formatted)})"
 
@@ -235,16 +330,5 @@ class ExpressionFormatterAnonymized(ClickhouseExpressionFormatter):
         # if they are input by the user, but that is better than leaking PII
         return _BETWEEN_SQUARE_BRACKETS_REGEX.sub("$A", alias)
 
-    def _alias(self, formatted_exp: str, alias: Optional[str]) -> str:
-        if not alias:
-            return formatted_exp
-        elif self._parsing_context.is_alias_present(alias):
-            ret = escape_alias(alias)
-            # This is for the type checker. escape_alias can return None if
-            # we pass None. But here we do not pass None so a None return value
-            # is not valid.
-            assert ret is not None
-            return ret
-        else:
-            self._parsing_context.add_alias(alias)
-            return f"({formatted_exp} AS {escape_alias(self._anonimize_alias(alias))})"
+    def _escape_alias_definition(self, alias: str) -> Optional[str]:
+        return escape_alias(self._anonimize_alias(alias))
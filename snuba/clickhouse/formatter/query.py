@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Optional, Sequence, Type, Union
+from typing import Optional, Sequence, Tuple, Type, Union
 
 from snuba.clickhouse.formatter.expression import (
     ClickhouseExpressionFormatter,
@@ -42,6 +42,24 @@ def format_query(query: FormattableQuery, sort_fields: bool = False) -> Formatte
     )
 
 
+def format_query_and_sorted(
+    query: FormattableQuery,
+) -> Tuple[FormattedQuery, FormattedQuery]:
+    """
+    Formats the query both as format_query does and with sorted fields.
+
+    Aliases are expanded at their first occurrence in visiting order, so
+    the sorted query needs its own pass. The second pass reuses what the
+    first one memoized on the expressions: formatted columns, the flattened
+    AND/OR conditions and every function or literal without aliases or
+    AND/OR conditions in it.
+    """
+    return (
+        format_query(query),
+        format_query(query, sort_fields=True),
+    )
+
+
 def format_query_anonymized(
     query: FormattableQuery, sort_fields: bool = False
 ) -> FormattedQuery:
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
+import itertools
 import logging
 import re
+import time
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from queue import Queue, SimpleQueue
@@ -12,18 +14,22 @@ import rapidjson
 from urllib3.connectionpool import HTTPConnectionPool
 from urllib3.exceptions import HTTPError
 
-from snuba import settings
+from snuba import environment, settings
 from snuba.clickhouse import DATETIME_FORMAT
+from snuba.clickhouse.compression import InsertCompression, StreamCompressor
 from snuba.clickhouse.errors import ClickhouseWriterError
 from snuba.clickhouse.formatter.expression import ClickhouseExpressionFormatter
 from snuba.clickhouse.query import Expression
 from snuba.utils.codecs import Encoder
 from snuba.utils.iterators import chunked
 from snuba.utils.metrics import MetricsBackend
+from snuba.utils.metrics.wrapper import MetricsWrapper
 from snuba.writer import BatchWriter, WriterTableRow
 
 logger = logging.getLogger(__name__)
 
+metrics = MetricsWrapper(environment.metrics, "clickhouse.http")
+
 
 CLICKHOUSE_ERROR_RE = re.compile(
     r"^Code: (?P<code>\d+), e.displayText\(\) = (?P<type>(?:\w+)::(?:\w+)): (?P<message>.+?(?: \(at row (?P<row>\d+)\))?)$",
@@ -134,6 +140,10 @@ class HTTPWriteBatch:
     case.
     If the buffer size is higher and the buffer is full, the `append`
     command will block while the value is sent to the server.
+
+    With a `compression`, the body is compressed chunk by chunk while it
+    is sent, and the compression ratio and the CPU time spent compressing
+    are reported once the batch is joined.
     """
 
     def __init__(
@@ -147,9 +157,13 @@ class HTTPWriteBatch:
         buffer_size: int,  # 0 means unbounded
         options: Mapping[str, Any],  # should be ``Mapping[str, str]``?
         chunk_size: Optional[int] = None,
+        compression: Optional[InsertCompression] = None,
     ) -> None:
         if chunk_size is None:
             chunk_size = settings.CLICKHOUSE_HTTP_CHUNK_SIZE
+        assert not (
+            encoding and compression
+        ), "values cannot be encoded and compressed by the batch"
 
         self.__queue: Union[
             Queue[Union[bytes, None]], SimpleQueue[Union[bytes, None]]
@@ -161,6 +175,14 @@ class HTTPWriteBatch:
         elif not chunk_size > 0:
             raise ValueError("chunk size must be greater than zero")
 
+        self.__statement = statement
+        self.__compression = compression
+        self.__compressed_size = 0
+        self.__compression_time = 0.0
+        if compression is not None:
+            encoding = compression.get_content_encoding()
+            body = self.__compress(body, compression.build_compressor())
+
         headers = {
             "X-ClickHouse-User": user,
             "Connection": "keep-alive",
@@ -186,6 +208,22 @@ class HTTPWriteBatch:
     def __repr__(self) -> str:
         return f"<{type(self).__name__}: {self.__rows} rows ({self.__size} bytes)>"
 
+    def __compress(
+        self, body: Iterator[bytes], compressor: StreamCompressor
+    ) -> Iterator[bytes]:
+        # This runs in the thread sending the request, the totals are only
+        # read once the response is received.
+        for chunk in itertools.chain(body, [None]):
+            start = time.thread_time()
+            compressed = (
+                compressor.compress(chunk) if chunk is not None else compressor.flush()
+            )
+            self.__compression_time += time.thread_time() - start
+            # An empty chunk would end a chunked transfer encoding.
+            if compressed:
+                self.__compressed_size += len(compressed)
+                yield compressed
+
     def __read_until_eof(self) -> Iterator[bytes]:
         while True:
             value = self.__queue.get()
@@ -210,6 +248,23 @@ class HTTPWriteBatch:
         response = self.__result.result(timeout)
         logger.debug("Received response for %r.", self)
 
+        if self.__compression is not None and self.__compressed_size:
+            tags = {
+                "table": self.__statement.get_qualified_table(),
+                "compression": self.__compression.compression.value,
+            }
+            metrics.gauge(
+                "insert.compression_ratio",
+                self.__size / self.__compressed_size,
+                tags=tags,
+            )
+            metrics.timing(
+                "insert.compression_cpu_ms", self.__compression_time * 1000, tags=tags
+            )
+            metrics.increment(
+                "insert.compressed_bytes", self.__compressed_size, tags=tags
+            )
+
         if response.status != 200:
             # XXX: This should be switched to just parse the JSON body after
             # https://github.com/yandex/ClickHouse/issues/6272 is available.
@@ -239,8 +294,12 @@ class HTTPBatchWriter(BatchWriter[bytes]):
         options: Optional[Mapping[str, Any]] = None,
         chunk_size: Optional[int] = None,
         buffer_size: int = 0,
+        compression: Optional[InsertCompression] = None,
+        max_connections: int = 1,
     ):
-        self.__pool = HTTPConnectionPool(host, port)
+        # Every batch being written holds a connection, so the pool keeps
+        # one per batch written at once instead of discarding them.
+        self.__pool = HTTPConnectionPool(host, port, maxsize=max_connections)
         self.__executor = ThreadPoolExecutor()
 
         self.__options = options if options is not None else {}
@@ -250,6 +309,7 @@ class HTTPBatchWriter(BatchWriter[bytes]):
         self.__statement = statement
         self.__buffer_size = buffer_size
         self.__chunk_size = chunk_size
+        self.__compression = compression
 
     def __repr__(self) -> str:
         return f"<{type(self).__name__}: {self.__statement.get_qualified_table()} on {self.__pool.host}:{self.__pool.port}>"
@@ -265,6 +325,7 @@ class HTTPBatchWriter(BatchWriter[bytes]):
             self.__buffer_size,
             self.__options,
             self.__chunk_size,
+            self.__compression,
         )
 
         for value in values:
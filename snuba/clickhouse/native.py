@@ -4,7 +4,9 @@ import logging
 import queue
 import random
 import re
+import threading
 import time
+from collections import defaultdict
 from contextlib import contextmanager
 from dataclasses import dataclass, field
 from datetime import date, datetime
@@ -12,8 +14,12 @@ from functools import partial
 from io import StringIO
 from typing import (
     Any,
+    Callable,
     Generator,
+    List,
     Mapping,
+    MutableMapping,
+    MutableSequence,
     Optional,
     Sequence,
     Tuple,
@@ -22,6 +28,7 @@ from typing import (
     cast,
 )
 from uuid import UUID
+from weakref import WeakKeyDictionary
 
 from clickhouse_driver import Client, errors
 from dateutil.tz import tz
@@ -29,7 +36,8 @@ from dateutil.tz import tz
 from snuba import environment, settings, state
 from snuba.clickhouse.errors import ClickhouseError
 from snuba.clickhouse.formatter.nodes import FormattedQuery
-from snuba.reader import Reader, Result, build_result_transformer
+from snuba.reader import ColumnarRows, Reader, Result, Row, build_result_transformer
+from snuba.utils.clock import Clock, SystemClock
 from snuba.utils.metrics.gauge import ThreadSafeGauge
 from snuba.utils.metrics.wrapper import MetricsWrapper
 
@@ -38,6 +46,7 @@ trace_logger = logging.getLogger("clickhouse_driver.log")
 trace_logger.setLevel("INFO")
 
 Params = Optional[Union[Sequence[Any], Mapping[str, Any]]]
+HostPort = Tuple[str, int]
 
 metrics = MetricsWrapper(environment.metrics, "clickhouse.native")
 
@@ -69,6 +78,111 @@ def capture_logging() -> Generator[StringIO, None, None]:
     buffer.close()
 
 
+class HostLoadTracker:
+    """
+    Keeps track of the queries in flight and of an exponentially weighted
+    moving average of the latency of the queries sent to each host, and
+    reports both as gauges tagged with the host.
+
+    Failures that point at an unhealthy host (network errors, too many
+    simultaneous queries) are recorded as very slow queries, so the average
+    of a failing host goes up quickly and recovers as queries succeed again.
+
+    A host avoided because of its latency would never be measured again, so
+    averages older than ``max_age_sec`` are forgotten and the host is tried
+    again as if it had not run any query yet.
+    """
+
+    ERROR_LATENCY_MS = 10000.0
+
+    def __init__(
+        self,
+        alpha: float = 0.2,
+        max_age_sec: float = 60.0,
+        clock: Optional[Clock] = None,
+    ) -> None:
+        self.__alpha = alpha
+        self.__max_age_sec = max_age_sec
+        self.__clock = clock if clock is not None else SystemClock()
+        self.__lock = threading.Lock()
+        self.__inflight: MutableMapping[HostPort, int] = defaultdict(int)
+        self.__latency_ms: MutableMapping[HostPort, float] = {}
+        self.__measured_at: MutableMapping[HostPort, float] = {}
+
+    def __tags(self, host: HostPort) -> Mapping[str, str]:
+        return {"host": f"{host[0]}:{host[1]}"}
+
+    def start(self, host: HostPort) -> None:
+        with self.__lock:
+            self.__inflight[host] += 1
+            inflight = self.__inflight[host]
+        metrics.gauge("host.inflight", inflight, tags=self.__tags(host))
+
+    def finish(self, host: HostPort, latency_ms: Optional[float]) -> None:
+        """
+        Records the end of a query. The latency is None if the query
+        failed for a reason unrelated to the health of the host.
+        """
+        with self.__lock:
+            self.__inflight[host] -= 1
+            inflight = self.__inflight[host]
+        metrics.gauge("host.inflight", inflight, tags=self.__tags(host))
+        if latency_ms is not None:
+            self.record(host, latency_ms)
+
+    def record(self, host: HostPort, latency_ms: float) -> None:
+        with self.__lock:
+            previous = self.get_latency(host)
+            latency = (
+                latency_ms
+                if previous is None
+                else previous + self.__alpha * (latency_ms - previous)
+            )
+            self.__latency_ms[host] = latency
+            self.__measured_at[host] = self.__clock.time()
+        metrics.gauge("host.latency_ewma_ms", latency, tags=self.__tags(host))
+
+    def get_latency(self, host: HostPort) -> Optional[float]:
+        measured_at = self.__measured_at.get(host)
+        if (
+            measured_at is None
+            or self.__clock.time() - measured_at > self.__max_age_sec
+        ):
+            return None
+        return self.__latency_ms.get(host)
+
+    def pick(self, hosts: Sequence[HostPort]) -> HostPort:
+        """
+        Returns the host expected to answer first: the one with the lowest
+        average latency weighted by the queries it is already running.
+        Hosts that did not run any query yet are tried first.
+        """
+        with self.__lock:
+            return min(
+                hosts,
+                key=lambda host: (
+                    (self.get_latency(host) or 0.0) * (self.__inflight[host] + 1),
+                    self.__inflight[host],
+                ),
+            )
+
+    def is_degraded(
+        self, host: HostPort, hosts: Sequence[HostPort], factor: float
+    ) -> bool:
+        """
+        Whether the average latency of the host is more than ``factor``
+        times the one of the fastest of the hosts.
+        """
+        latency = self.get_latency(host)
+        if latency is None:
+            return False
+        fastest = min(
+            (self.get_latency(other) or latency for other in hosts),
+            default=latency,
+        )
+        return latency > fastest * factor
+
+
 class ClickhousePool(object):
     FALLBACK_POOL_SIZE = 3
 
@@ -98,6 +212,12 @@ class ClickhousePool(object):
             self.FALLBACK_POOL_SIZE
         )
         self.__gauge = ThreadSafeGauge(metrics, "connections")
+        self.__tracker = HostLoadTracker()
+        # The host each connection was opened to and the last time it was
+        # returned to the pool.
+        self.__hosts: WeakKeyDictionary[Client, HostPort] = WeakKeyDictionary()
+        self.__last_used: WeakKeyDictionary[Client, float] = WeakKeyDictionary()
+        self.__stop_probing = threading.Event()
 
         # Fill the queue up so that doing get() on it will block properly
         for _ in range(max_pool_size):
@@ -109,20 +229,36 @@ class ClickhousePool(object):
     def fallback_pool_enabled(self) -> bool:
         return state.get_config("use_fallback_host_in_native_connection_pool", 0) == 1
 
-    def get_fallback_host(self) -> Tuple[str, int]:
+    def get_fallback_hosts(self) -> Sequence[HostPort]:
         config_hosts_str = state.get_config(
             f"fallback_hosts:{self.host}:{self.port}", None
         )
-        assert config_hosts_str, f"no fallback hosts found for {self.host}:{self.port}"
+        if not config_hosts_str:
+            return []
+
+        fallback_hosts = []
+        for config_host in cast(str, config_hosts_str).split(","):
+            host_port = config_host.split(":")
+            assert (
+                len(host_port) == 2
+            ), f"expected host:port format in fallback hosts for {self.host}:{self.port}"
+            fallback_hosts.append((host_port[0], int(host_port[1])))
+        return fallback_hosts
 
-        config_hosts = cast(str, config_hosts_str).split(",")
-        selected_host_port = random.choice(config_hosts).split(":")
+    def get_fallback_host(self) -> Tuple[str, int]:
+        fallback_hosts = self.get_fallback_hosts()
+        assert fallback_hosts, f"no fallback hosts found for {self.host}:{self.port}"
+        return random.choice(fallback_hosts)
 
-        assert (
-            len(selected_host_port) == 2
-        ), f"expected host:port format in fallback hosts for {self.host}:{self.port}"
+    def routing_enabled(self) -> bool:
+        return state.get_config("native_pool_least_loaded_routing", 0) == 1
 
-        return (selected_host_port[0], int(selected_host_port[1]))
+    def get_replicas(self) -> Sequence[HostPort]:
+        """
+        The hosts queries can be routed to: the host of the pool and the
+        fallback hosts, which serve the same data.
+        """
+        return [(self.host, self.port), *self.get_fallback_hosts()]
 
     # This will actually return an int if an INSERT query is run, but we never capture the
     # output of INSERT queries so I left this as a Sequence.
@@ -185,11 +321,12 @@ class ClickhousePool(object):
                     trace_output = ""
                     if capture_trace:
                         with capture_logging() as buffer:
-                            query_execute()  # In order to avoid exposing PII the results are discarded
+                            # In order to avoid exposing PII the results are discarded
+                            self.__run_tracked(conn, query_execute)
                             result_data = [[], []] if with_column_types else []
                             trace_output = buffer.getvalue()
                     else:
-                        result_data = query_execute()
+                        result_data = self.__run_tracked(conn, query_execute)
 
                     profile_data = ClickhouseProfile(
                         bytes=conn.last_query.profile_info.bytes or 0,
@@ -269,7 +406,14 @@ class ClickhousePool(object):
         finally:
             # Return finished connection to the appropriate connection pool
             if not fallback_mode:
-                self.pool.put(conn, block=False)
+                try:
+                    released = self.__release(conn)
+                except Exception:
+                    # The slot of the pool must not be lost, whatever the
+                    # reason the connection could not be released.
+                    logger.exception("Failed to release a connection")
+                    released = conn
+                self.pool.put(released, block=False)
             else:
                 self.fallback_pool.put(conn, block=False)
 
@@ -356,10 +500,14 @@ class ClickhousePool(object):
 
     def _create_conn(self, use_fallback_host: bool = False) -> Client:
         if use_fallback_host:
-            (fallback_host, fallback_port) = self.get_fallback_host()
-        return Client(
-            host=(self.host if not use_fallback_host else fallback_host),
-            port=(self.port if not use_fallback_host else fallback_port),
+            host, port = self.get_fallback_host()
+        elif self.routing_enabled():
+            host, port = self.__tracker.pick(self.get_replicas())
+        else:
+            host, port = self.host, self.port
+        conn = Client(
+            host=host,
+            port=port,
             user=self.user,
             password=self.password,
             database=self.database,
@@ -367,8 +515,151 @@ class ClickhousePool(object):
             send_receive_timeout=self.send_receive_timeout,
             settings=self.client_settings,
         )
+        self.__hosts[conn] = (host, port)
+        return conn
+
+    def __get_host(self, conn: Client) -> HostPort:
+        return self.__hosts.get(conn, (self.host, self.port))
+
+    def __run_tracked(self, conn: Client, query_execute: Callable[[], Any]) -> Any:
+        host = self.__get_host(conn)
+        self.__tracker.start(host)
+        start = time.time()
+        latency_ms: Optional[float] = None
+        try:
+            result = query_execute()
+            latency_ms = (time.time() - start) * 1000
+            return result
+        except (errors.NetworkError, errors.SocketTimeoutError, EOFError):
+            latency_ms = self.__tracker.ERROR_LATENCY_MS
+            raise
+        except errors.Error as e:
+            if e.code == errors.ErrorCodes.TOO_MANY_SIMULTANEOUS_QUERIES:
+                latency_ms = self.__tracker.ERROR_LATENCY_MS
+            raise
+        finally:
+            self.__tracker.finish(host, latency_ms)
+
+    def __release(self, conn: Optional[Client]) -> Optional[Client]:
+        """
+        Returns what to put back in the pool once a query is done. When
+        routing across replicas, connections to a host much slower than the
+        others are closed, so the next query opens one to a faster host.
+        """
+        if conn is None:
+            return None
+        self.__last_used[conn] = time.time()
+        if not self.routing_enabled():
+            return conn
+
+        host = self.__get_host(conn)
+        degraded_factor = float(
+            state.get_config("native_pool_degraded_host_factor", 2.0) or 2.0
+        )
+        if not self.__tracker.is_degraded(host, self.get_replicas(), degraded_factor):
+            return conn
+
+        metrics.increment("host.recycled", tags={"host": f"{host[0]}:{host[1]}"})
+        conn.disconnect()
+        self.__gauge.decrement()
+        return None
+
+    def __probe(self, conn: Client) -> bool:
+        host = self.__get_host(conn)
+        start = time.time()
+        try:
+            conn.execute("SELECT 1")
+        except Exception as e:
+            logger.warning("ClickHouse probe of %s:%d failed: %s", *host, e)
+            self.__tracker.record(host, self.__tracker.ERROR_LATENCY_MS)
+            conn.disconnect()
+            return False
+        self.__tracker.record(host, (time.time() - start) * 1000)
+        self.__last_used[conn] = time.time()
+        return True
+
+    def __take_idle(self, count: int) -> MutableSequence[Optional[Client]]:
+        taken: MutableSequence[Optional[Client]] = []
+        try:
+            while len(taken) < count:
+                taken.append(self.pool.get(block=False))
+        except queue.Empty:
+            pass
+        return taken
+
+    def warmup(self, connections: int) -> int:
+        """
+        Opens up to ``connections`` connections ahead of the first queries,
+        so these do not pay for the connection setup. Returns the number of
+        connections that are open.
+        """
+        taken = self.__take_idle(connections)
+        opened = 0
+        try:
+            for i, conn in enumerate(taken):
+                if conn is None:
+                    conn = self._create_conn()
+                    if not self.__probe(conn):
+                        continue
+                    self.__gauge.increment()
+                    taken[i] = conn
+                opened += 1
+        finally:
+            for conn in taken:
+                self.pool.put(conn, block=False)
+        return opened
+
+    def probe_idle(self, min_idle_seconds: float) -> int:
+        """
+        Checks the connections that have not been used for a while, so
+        broken connections are dropped before a query tries to use them and
+        the latency of the hosts is known even without traffic. Returns the
+        number of connections probed.
+        """
+        now = time.time()
+        stale = []
+        # Only hold the connections to probe, the others can serve queries
+        # in the meantime.
+        for conn in self.__take_idle(self.pool.maxsize):
+            if (
+                conn is not None
+                and now - self.__last_used.get(conn, 0) >= min_idle_seconds
+            ):
+                stale.append(conn)
+            else:
+                self.pool.put(conn, block=False)
+
+        for conn in stale:
+            healthy = False
+            try:
+                healthy = self.__probe(conn)
+            finally:
+                if healthy:
+                    self.pool.put(conn, block=False)
+                else:
+                    self.__gauge.decrement()
+                    self.pool.put(None, block=False)
+        return len(stale)
+
+    def start_probing(self, interval_seconds: float) -> None:
+        """
+        Probes the idle connections every ``interval_seconds`` in a
+        background thread until the pool is closed.
+        """
+
+        def run() -> None:
+            while not self.__stop_probing.wait(interval_seconds):
+                try:
+                    self.probe_idle(interval_seconds)
+                except Exception as e:
+                    logger.exception(e)
+
+        threading.Thread(
+            target=run, name=f"clickhouse-probe-{self.host}", daemon=True
+        ).start()
 
     def close(self) -> None:
+        self.__stop_probing.set()
         try:
             while True:
                 conn = self.pool.get(block=False)
@@ -409,11 +700,41 @@ def transform_uuid(value: UUID) -> str:
     return str(value)
 
 
+def transform_dates(values: Sequence[date]) -> List[str]:
+    """
+    Same as ``transform_date`` for a whole column. Date columns have few
+    distinct values, each of them is only converted once.
+    """
+    converted = {value: transform_date(value) for value in set(values)}
+    return [converted[value] for value in values]
+
+
+def transform_datetimes(values: Sequence[datetime]) -> List[str]:
+    """
+    Same as ``transform_datetime`` for a whole column. Timezone-naive values,
+    which are the vast majority, are UTC so only the offset is appended.
+    """
+    return [
+        value.isoformat() + "+00:00"
+        if value.tzinfo is None
+        else transform_datetime(value)
+        for value in values
+    ]
+
+
+def transform_uuids(values: Sequence[UUID]) -> List[str]:
+    return list(map(str, values))
+
+
 transform_column_types = build_result_transformer(
     [
-        (re.compile(r"^Date(\(.+\))?$"), transform_date),
-        (re.compile(r"^DateTime(\(.+\))?$"), transform_datetime),
-        (re.compile(r"^UUID$"), transform_uuid),
+        (re.compile(r"^Date(\(.+\))?$"), transform_date, transform_dates),
+        (
+            re.compile(r"^DateTime(\(.+\))?$"),
+            transform_datetime,
+            transform_datetimes,
+        ),
+        (re.compile(r"^UUID$"), transform_uuid, transform_uuids),
     ]
 )
 
@@ -431,13 +752,17 @@ class NativeDriverReader(Reader):
         )
         self.__client = client
 
-    def __transform_result(self, result: ClickhouseResult, with_totals: bool) -> Result:
+    def __transform_result(
+        self, result: ClickhouseResult, with_totals: bool, columnar: bool = False
+    ) -> Result:
         """
         Transform a native driver response into a response that is
         structurally similar to a ClickHouse-flavored JSON response.
+
+        With ``columnar``, the driver response is expected to be made of
+        columns and the rows are returned as ``ColumnarRows``.
         """
         meta = result.meta if result.meta is not None else []
-        data = result.results
         profile = result.profile
         # XXX: Rows are represented as mappings that are keyed by column or
         # alias, which is problematic when the result set contains duplicate
@@ -445,18 +770,36 @@ class NativeDriverReader(Reader):
         # duplicated names are discarded at this stage.
         columns = {c[0]: i for i, c in enumerate(meta)}
 
-        data = [
-            {column: row[index] for column, index in columns.items()} for row in data
-        ]
+        data: MutableSequence[Row]
+        totals: Optional[Row] = None
+        if columnar:
+            # The driver returns no column at all for an empty result.
+            values = [
+                list(result.results[index]) if result.results else []
+                for index in columns.values()
+            ]
+            if with_totals:
+                assert len(values) > 0 and len(values[0]) > 0
+                totals = {
+                    column: column_values.pop(-1)
+                    for column, column_values in zip(columns, values)
+                }
+            data = ColumnarRows(list(columns), values)
+        else:
+            data = [
+                {column: row[index] for column, index in columns.items()}
+                for row in result.results
+            ]
+            if with_totals:
+                assert len(data) > 0
+                totals = data.pop(-1)
 
         meta = [
             {"name": m[0], "type": m[1]} for m in [meta[i] for i in columns.values()]
         ]
 
         new_result: Result = {}
-        if with_totals:
-            assert len(data) > 0
-            totals = data.pop(-1)
+        if totals is not None:
             new_result = {
                 "data": data,
                 "meta": meta,
@@ -484,6 +827,7 @@ class NativeDriverReader(Reader):
         with_totals: bool = False,
         robust: bool = False,
         capture_trace: bool = False,
+        columnar: bool = False,
     ) -> Result:
         settings = {**settings} if settings is not None else {}
 
@@ -502,6 +846,8 @@ class NativeDriverReader(Reader):
                 query_id=query_id,
                 settings=settings,
                 capture_trace=capture_trace,
+                columnar=columnar,
             ),
             with_totals=with_totals,
+            columnar=columnar,
         )
@@ -0,0 +1,319 @@
+"""
+Encodes rows in the ClickHouse RowBinary format.
+
+With JSONEachRow every row is serialized to JSON by the consumer and parsed
+back by ClickHouse. RowBinary values are written the way ClickHouse stores
+them, so it is cheaper on both sides, but the encoder has to know the type
+of every column. ``RowBinaryRowEncoder`` is built once from the writable
+columns of a storage: each column gets a function packing its values, and
+runs of numeric columns are packed together with a single ``struct`` call.
+
+Since RowBinary has no notion of missing field, the insert statement lists
+the columns of the encoder and rows missing a column (or having None in a
+column that is not nullable) are written with the default value of the type,
+as ClickHouse does for JSON rows. Columns with a DEFAULT expression in the
+table do not get it, so storages relying on those must keep using JSON.
+"""
+from __future__ import annotations
+
+import calendar
+import ipaddress
+import struct
+import uuid
+from datetime import date, datetime
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from snuba.clickhouse.columns import (
+    UUID,
+    Array,
+    ColumnType,
+    Date,
+    DateTime,
+    Enum,
+    FixedString,
+    FlattenedColumn,
+    Float,
+    IPv4,
+    IPv6,
+    Nullable,
+    String,
+    UInt,
+)
+from snuba.utils.codecs import Encoder
+from snuba.writer import WriterTableRow
+
+ValueEncoder = Callable[[Any], bytes]
+RowEncoder = Callable[[WriterTableRow], bytes]
+# The column a part of the row encoder is given the value of, or None if it
+# is given the whole row.
+EncoderPart = Tuple[Optional[str], Callable[[Any], bytes]]
+
+_UINT_FORMATS = {8: "B", 16: "H", 32: "I", 64: "Q"}
+_FLOAT_FORMATS = {32: "f", 64: "d"}
+_EPOCH_DATE = date(1970, 1, 1)
+
+_UINT16 = struct.Struct("<H")
+_UINT32 = struct.Struct("<I")
+_UUID = struct.Struct("<QQ")
+_UINT64_MASK = (1 << 64) - 1
+_SMALL_VARINTS = [bytes((value,)) for value in range(0x80)]
+
+
+def encode_varint(value: int) -> bytes:
+    """
+    Unsigned LEB128, used by RowBinary for string and array lengths.
+    """
+    if value < 0x80:
+        return _SMALL_VARINTS[value]
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _encode_string(value: Any) -> bytes:
+    if value.__class__ is str:
+        value = value.encode("utf-8")
+    elif value is None:
+        return b"\x00"
+    elif not isinstance(value, bytes):
+        value = str(value).encode("utf-8")
+    length = len(value)
+    if length < 0x80:
+        return _SMALL_VARINTS[length] + value
+    return encode_varint(length) + value
+
+
+def _to_datetime(value: Any) -> datetime:
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    assert isinstance(value, datetime)
+    return value
+
+
+def _encode_datetime(value: Any) -> bytes:
+    if value is None:
+        return _UINT32.pack(0)
+    if isinstance(value, (int, float)):
+        return _UINT32.pack(int(value))
+    if isinstance(value, str) and value.isdigit():
+        return _UINT32.pack(int(value))
+    # Like the JSON encoder, which formats the wall time of the value, the
+    # time zone of aware datetimes is ignored: ClickHouse expects UTC.
+    return _UINT32.pack(calendar.timegm(_to_datetime(value).timetuple()))
+
+
+def _encode_date(value: Any) -> bytes:
+    if value is None:
+        return _UINT16.pack(0)
+    if isinstance(value, int):
+        return _UINT16.pack(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        value = value.date()
+    return _UINT16.pack((value - _EPOCH_DATE).days)
+
+
+def _encode_uuid(value: Any) -> bytes:
+    if value is None:
+        return _UUID.pack(0, 0)
+    if not isinstance(value, uuid.UUID):
+        value = uuid.UUID(str(value))
+    return _UUID.pack(value.int >> 64, value.int & _UINT64_MASK)
+
+
+def _encode_ipv4(value: Any) -> bytes:
+    if value is None:
+        return _UINT32.pack(0)
+    return _UINT32.pack(int(ipaddress.IPv4Address(value)))
+
+
+def _encode_ipv6(value: Any) -> bytes:
+    if value is None:
+        return bytes(16)
+    return ipaddress.IPv6Address(value).packed
+
+
+def _build_numeric_encoder(format: str, cast: Callable[[Any], Any]) -> ValueEncoder:
+    packer = struct.Struct(f"<{format}")
+
+    def encode(value: Any) -> bytes:
+        return packer.pack(cast(value) if value is not None else 0)
+
+    return encode
+
+
+def _build_fixed_string_encoder(length: int) -> ValueEncoder:
+    def encode(value: Any) -> bytes:
+        if value is None:
+            return bytes(length)
+        if not isinstance(value, bytes):
+            value = str(value).encode("utf-8")
+        if len(value) > length:
+            raise ValueError(f"Value too long for FixedString({length})")
+        return value.ljust(length, b"\x00")
+
+    return encode
+
+
+def _build_enum_encoder(values: Sequence[Tuple[str, int]]) -> ValueEncoder:
+    # ClickHouse picks Enum8 when all the values fit in it.
+    small = all(-128 <= value <= 127 for _, value in values)
+    packer = struct.Struct("<b" if small else "<h")
+    by_name = dict(values)
+    default = min(value for _, value in values)
+
+    def encode(value: Any) -> bytes:
+        if value is None:
+            return packer.pack(default)
+        if isinstance(value, str):
+            return packer.pack(by_name[value])
+        return packer.pack(value)
+
+    return encode
+
+
+def _build_array_encoder(inner: ValueEncoder) -> ValueEncoder:
+    def encode(value: Any) -> bytes:
+        if not value:
+            return b"\x00"
+        return encode_varint(len(value)) + b"".join(map(inner, value))
+
+    return encode
+
+
+def _build_nullable_encoder(inner: ValueEncoder) -> ValueEncoder:
+    def encode(value: Any) -> bytes:
+        if value is None:
+            return b"\x01"
+        return b"\x00" + inner(value)
+
+    return encode
+
+
+def _numeric_format(type: ColumnType[Any]) -> Optional[str]:
+    """
+    The struct format of the values of the type if it can be packed along
+    with other numeric columns.
+    """
+    if type.has_modifier(Nullable):
+        return None
+    if isinstance(type, UInt):
+        return _UINT_FORMATS[type.size]
+    if isinstance(type, Float):
+        return _FLOAT_FORMATS[type.size]
+    return None
+
+
+def build_value_encoder(type: ColumnType[Any]) -> ValueEncoder:
+    """
+    Returns the function encoding a value of the type. Raises TypeError for
+    types that cannot be written with RowBinary by this encoder.
+    """
+    encoder: ValueEncoder
+    if isinstance(type, UInt):
+        encoder = _build_numeric_encoder(_UINT_FORMATS[type.size], int)
+    elif isinstance(type, Float):
+        encoder = _build_numeric_encoder(_FLOAT_FORMATS[type.size], float)
+    elif isinstance(type, String):
+        encoder = _encode_string
+    elif isinstance(type, FixedString):
+        encoder = _build_fixed_string_encoder(type.length)
+    elif isinstance(type, DateTime):
+        encoder = _encode_datetime
+    elif isinstance(type, Date):
+        encoder = _encode_date
+    elif isinstance(type, UUID):
+        encoder = _encode_uuid
+    elif isinstance(type, IPv4):
+        encoder = _encode_ipv4
+    elif isinstance(type, IPv6):
+        encoder = _encode_ipv6
+    elif isinstance(type, Enum):
+        encoder = _build_enum_encoder(type.values)
+    elif isinstance(type, Array):
+        encoder = _build_array_encoder(build_value_encoder(type.inner_type))
+    else:
+        raise TypeError(f"Type {type!r} is not supported by RowBinary")
+
+    if type.has_modifier(Nullable):
+        encoder = _build_nullable_encoder(encoder)
+    return encoder
+
+
+def _build_numeric_run_encoder(
+    names: Sequence[str], formats: Sequence[str], fallback: Sequence[ValueEncoder]
+) -> RowEncoder:
+    packer = struct.Struct("<" + "".join(formats))
+    columns = list(zip(names, fallback))
+
+    def encode(row: WriterTableRow) -> bytes:
+        try:
+            return packer.pack(*[row.get(name, 0) for name in names])
+        except (struct.error, TypeError):
+            # Missing values, None or values of another type (strings for
+            # instance) are converted one column at a time.
+            return b"".join([column(row.get(name)) for name, column in columns])
+
+    return encode
+
+
+class RowBinaryRowEncoder(Encoder[bytes, WriterTableRow]):
+    """
+    Encodes a row of the columns provided, in their order, in RowBinary.
+    The insert statement has to list the same columns.
+    """
+
+    def __init__(self, columns: Sequence[FlattenedColumn]) -> None:
+        self.__columns = columns
+        self.__parts = self.__compile(columns)
+
+    @staticmethod
+    def __compile(columns: Sequence[FlattenedColumn]) -> Sequence[EncoderPart]:
+        parts: List[EncoderPart] = []
+        run: List[FlattenedColumn] = []
+
+        def close_run() -> None:
+            if len(run) == 1:
+                parts.append((run[0].flattened, build_value_encoder(run[0].type)))
+            elif run:
+                parts.append(
+                    (
+                        None,
+                        _build_numeric_run_encoder(
+                            [column.flattened for column in run],
+                            [_numeric_format(column.type) or "" for column in run],
+                            [build_value_encoder(column.type) for column in run],
+                        ),
+                    )
+                )
+            run.clear()
+
+        for column in columns:
+            if _numeric_format(column.type) is not None:
+                run.append(column)
+                continue
+            close_run()
+            parts.append((column.flattened, build_value_encoder(column.type)))
+        close_run()
+        return parts
+
+    def get_columns(self) -> Sequence[str]:
+        return [column.flattened for column in self.__columns]
+
+    def encode(self, value: WriterTableRow) -> bytes:
+        get = value.get
+        return b"".join(
+            [
+                encoder(get(name) if name is not None else value)
+                for name, encoder in self.__parts
+            ]
+        )
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # The compiled encoders are closures: only the columns are pickled
+        # when the encoder is sent to the processes transforming messages.
+        return (RowBinaryRowEncoder, (self.__columns,))
@@ -1,3 +1,4 @@
+import logging
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import Enum
@@ -17,6 +18,7 @@ from typing import (
 )
 
 from snuba import settings
+from snuba.clickhouse.compression import InsertCompression
 from snuba.clickhouse.escaping import escape_string
 from snuba.clickhouse.http import HTTPBatchWriter, InsertStatement, JSONRow
 from snuba.clickhouse.native import ClickhousePool, NativeDriverReader
@@ -30,6 +32,8 @@ from snuba.utils.metrics import MetricsBackend
 from snuba.utils.serializable_exception import SerializableException
 from snuba.writer import BatchWriter
 
+logger = logging.getLogger(__name__)
+
 
 class ClickhouseClientSettingsType(NamedTuple):
     settings: Mapping[str, Any]
@@ -133,6 +137,8 @@ class Cluster(ABC, Generic[TWriterOptions]):
         options: TWriterOptions,
         chunk_size: Optional[int],
         buffer_size: int,
+        compression: Optional[InsertCompression] = None,
+        max_connections: int = 1,
     ) -> BatchWriter[JSONRow]:
         raise NotImplementedError
 
@@ -281,6 +287,8 @@ class ClickhouseCluster(Cluster[ClickhouseWriterOptions]):
         options: ClickhouseWriterOptions,
         chunk_size: Optional[int],
         buffer_size: int,
+        compression: Optional[InsertCompression] = None,
+        max_connections: int = 1,
     ) -> BatchWriter[JSONRow]:
         return HTTPBatchWriter(
             host=self.__query_node.host_name,
@@ -293,6 +301,8 @@ class ClickhouseCluster(Cluster[ClickhouseWriterOptions]):
             options=options,
             chunk_size=chunk_size,
             buffer_size=buffer_size,
+            compression=compression,
+            max_connections=max_connections,
         )
 
     def is_single_node(self) -> bool:
@@ -477,3 +487,28 @@ def get_cluster(
                 f"{storage_set_key} is not defined in the CLUSTERS setting for this environment"
             )
     return res
+
+
+def prepare_query_connections(
+    warmup_connections: int, probe_interval_sec: float
+) -> None:
+    """
+    Opens connections to the query node of every cluster ahead of the
+    first queries and starts probing the idle ones, as configured.
+    """
+    # Clusters can share their query node, and with it the connection pool.
+    connections = {
+        cluster.get_query_connection(ClickhouseClientSettings.QUERY)
+        for cluster in [*CLUSTERS, *_get_sliced_storage_set_cluster_map().values()]
+    }
+    for connection in connections:
+        if warmup_connections > 0:
+            opened = connection.warmup(warmup_connections)
+            logger.info(
+                "Opened %d connections to %s:%d",
+                opened,
+                connection.host,
+                connection.port,
+            )
+        if probe_interval_sec > 0:
+            connection.start_probing(probe_interval_sec)
@@ -2,7 +2,7 @@ import itertools
 import logging
 import time
 from collections import defaultdict, deque
-from concurrent.futures import Future
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from functools import partial
 from pickle import PickleBuffer
@@ -11,6 +11,7 @@ from typing import (
     Callable,
     Deque,
     Dict,
+    FrozenSet,
     List,
     Mapping,
     MutableMapping,
@@ -21,6 +22,7 @@ from typing import (
     Set,
     SupportsIndex,
     Tuple,
+    TypeVar,
     Union,
     cast,
 )
@@ -29,11 +31,19 @@ import rapidjson
 from arroyo import Message, Partition, Topic
 from arroyo.backends.abstract import Producer as AbstractProducer
 from arroyo.backends.kafka import KafkaPayload
-from arroyo.processing.strategies import FilterStep
+from arroyo.processing.strategies import (
+    CollectStep,
+    FilterStep,
+    MessageRejected,
+    ParallelCollectStep,
+)
 from arroyo.processing.strategies import ProcessingStrategy
 from arroyo.processing.strategies import ProcessingStrategy as ProcessingStep
 from arroyo.processing.strategies import ProcessingStrategyFactory, TransformStep
+from arroyo.processing.strategies.collect import Batch
 from arroyo.processing.strategies.dead_letter_queue import (
+    DeadLetterQueue,
+    DeadLetterQueuePolicy,
     InvalidKafkaMessage,
     InvalidMessages,
 )
@@ -46,6 +56,7 @@ from confluent_kafka import Producer as ConfluentKafkaProducer
 
 from snuba.clickhouse.http import JSONRow, JSONRowEncoder, ValuesRowEncoder
 from snuba.consumers.types import KafkaMessageMetadata
+from snuba.datasets.row_aggregation import RowAggregation
 from snuba.datasets.storage import WritableTableStorage
 from snuba.datasets.storages.factory import get_writable_storage
 from snuba.datasets.storages.storage_key import StorageKey, are_writes_identical
@@ -56,14 +67,17 @@ from snuba.processor import (
     MessageProcessor,
     ReplacementBatch,
 )
-from snuba.state import get_config
+from snuba.state import get_config, get_str_set_config
+from snuba.utils.codecs import Encoder
 from snuba.utils.metrics import MetricsBackend
 from snuba.utils.metrics.wrapper import MetricsWrapper
 from snuba.utils.streams.configuration_builder import build_kafka_producer_configuration
-from snuba.writer import BatchWriter, MockBatchWriter
+from snuba.writer import BatchWriter, MockBatchWriter, WriterTableRow
 
 logger = logging.getLogger("snuba.consumer")
 
+TPayload = TypeVar("TPayload")
+
 
 class BytesInsertBatch(NamedTuple):
     rows: Sequence[bytes]
@@ -81,34 +95,75 @@ class BytesInsertBatch(NamedTuple):
             return type(self), (self.rows, self.origin_timestamp)
 
 
-class InsertBatchWriter(ProcessingStep[BytesInsertBatch]):
-    def __init__(self, writer: BatchWriter[JSONRow], metrics: MetricsBackend) -> None:
+class InsertBatchWriter(ProcessingStep[Union[BytesInsertBatch, InsertBatch]]):
+    """
+    Writes the rows of the messages of a batch at once. Rows of InsertBatch
+    messages have not been encoded yet: they are merged according to the
+    row aggregation of the storage, if any, and encoded with the row
+    encoder before being written.
+    """
+
+    def __init__(
+        self,
+        writer: BatchWriter[JSONRow],
+        metrics: MetricsBackend,
+        row_aggregation: Optional[RowAggregation] = None,
+        row_encoder: Optional[Encoder[bytes, WriterTableRow]] = None,
+    ) -> None:
         self.__writer = writer
         self.__metrics = metrics
+        self.__row_aggregation = row_aggregation
+        self.__row_encoder = row_encoder
 
-        self.__messages: MutableSequence[Message[BytesInsertBatch]] = []
+        self.__messages: MutableSequence[
+            Message[Union[BytesInsertBatch, InsertBatch]]
+        ] = []
         self.__closed = False
 
     def poll(self) -> None:
         pass
 
-    def submit(self, message: Message[BytesInsertBatch]) -> None:
+    def submit(self, message: Message[Union[BytesInsertBatch, InsertBatch]]) -> None:
         assert not self.__closed
 
         self.__messages.append(message)
 
+    def __encode_rows(self, rows: Sequence[WriterTableRow]) -> Sequence[bytes]:
+        assert self.__row_encoder is not None, "no encoder for unencoded rows"
+
+        if self.__row_aggregation is not None and get_config(
+            "consumer_row_aggregation_enabled", 1
+        ):
+            aggregate_start = time.time()
+            aggregated_rows = self.__row_aggregation.aggregate(rows)
+            self.__metrics.timing(
+                "batch_aggregate_ms", (time.time() - aggregate_start) * 1000
+            )
+            self.__metrics.increment(
+                "batch_aggregated_msgs", len(rows) - len(aggregated_rows)
+            )
+            rows = aggregated_rows
+
+        return [self.__row_encoder.encode(row) for row in rows]
+
     def close(self) -> None:
         self.__closed = True
 
         if not self.__messages:
             return
 
+        encoded_rows: MutableSequence[Sequence[bytes]] = []
+        unencoded_rows: MutableSequence[WriterTableRow] = []
+        for message in self.__messages:
+            if isinstance(message.payload, BytesInsertBatch):
+                encoded_rows.append(message.payload.rows)
+            else:
+                unencoded_rows.extend(message.payload.rows)
+        if unencoded_rows:
+            encoded_rows.append(self.__encode_rows(unencoded_rows))
+
         write_start = time.time()
-        self.__writer.write(
-            itertools.chain.from_iterable(
-                message.payload.rows for message in self.__messages
-            )
-        )
+        self.__writer.write(itertools.chain.from_iterable(encoded_rows))
         write_finish = time.time()
 
         max_latency: Optional[float] = None
@@ -247,7 +302,7 @@ class MockReplacementBatchWriter(ProcessingStep[ReplacementBatch]):
 
 
 class ProcessedMessageBatchWriter(
-    ProcessingStep[Union[None, BytesInsertBatch, ReplacementBatch]]
+    ProcessingStep[Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]]
 ):
     def __init__(
         self,
@@ -266,15 +321,18 @@ class ProcessedMessageBatchWriter(
             self.__replacement_batch_writer.poll()
 
     def submit(
-        self, message: Message[Union[None, BytesInsertBatch, ReplacementBatch]]
+        self,
+        message: Message[Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]],
     ) -> None:
         assert not self.__closed
 
         if message.payload is None:
             return
 
-        if isinstance(message.payload, BytesInsertBatch):
-            self.__insert_batch_writer.submit(cast(Message[BytesInsertBatch], message))
+        if isinstance(message.payload, (BytesInsertBatch, InsertBatch)):
+            self.__insert_batch_writer.submit(
+                cast(Message[Union[BytesInsertBatch, InsertBatch]], message)
+            )
         elif isinstance(message.payload, ReplacementBatch):
             if self.__replacement_batch_writer is None:
                 raise TypeError("writer not configured to support replacements")
@@ -334,19 +392,26 @@ def build_batch_writer(
     metrics: MetricsBackend,
     replacements_producer: Optional[ConfluentKafkaProducer] = None,
     replacements_topic: Optional[Topic] = None,
+    max_batches_in_flight: int = 1,
 ) -> Callable[[], ProcessedMessageBatchWriter]:
 
     assert not (replacements_producer is None) ^ (replacements_topic is None)
     supports_replacements = replacements_producer is not None
 
+    # The writer is shared by the batches in flight, each of them writing
+    # over its own connection.
     writer = table_writer.get_batch_writer(
         metrics,
         {"load_balancing": "in_order", "insert_distributed_sync": 1},
+        max_connections=max_batches_in_flight,
     )
 
     def build_writer() -> ProcessedMessageBatchWriter:
         insert_batch_writer = InsertBatchWriter(
-            writer, MetricsWrapper(metrics, "insertions")
+            writer,
+            MetricsWrapper(metrics, "insertions"),
+            row_aggregation=table_writer.get_row_aggregation(),
+            row_encoder=table_writer.get_row_encoder(),
         )
 
         replacement_batch_writer: Optional[ReplacementBatchWriter]
@@ -384,6 +449,8 @@ def build_mock_batch_writer(
                     "mock_insertions",
                     {"storage": storage.get_storage_key().value},
                 ),
+                row_aggregation=storage.get_table_writer().get_row_aggregation(),
+                row_encoder=storage.get_table_writer().get_row_encoder(),
             ),
             MockReplacementBatchWriter() if with_replacements is not None else None,
         )
@@ -392,7 +459,9 @@ def build_mock_batch_writer(
 
 
 class DeadLetterStep(
-    ProcessingStep[Tuple[StorageKey, Union[None, BytesInsertBatch, ReplacementBatch]]]
+    ProcessingStep[
+        Tuple[StorageKey, Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]]
+    ]
 ):
     """
     If a batch failed to be inserted to ClickHouse for some reason, we put those messages
@@ -420,16 +489,28 @@ class DeadLetterStep(
     def __format_payload(
         self,
         message: Message[
-            Tuple[StorageKey, Union[None, BytesInsertBatch, ReplacementBatch]]
+            Tuple[
+                StorageKey, Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]
+            ]
         ],
     ) -> List[KafkaPayload]:
         kafka_payloads: List[KafkaPayload] = []
         storage_key, payload = message.payload
         if isinstance(payload, BytesInsertBatch):
-            for row in payload.rows:
-                kafka_payloads.append(
-                    KafkaPayload(storage_key.value.encode("utf-8"), row, [])
-                )
+            rows: Sequence[bytes] = payload.rows
+        elif isinstance(payload, InsertBatch):
+            # Rows of storages aggregating their batches are encoded by the
+            # writer.
+            row_encoder = (
+                get_writable_storage(storage_key).get_table_writer().get_row_encoder()
+            )
+            rows = [row_encoder.encode(row) for row in payload.rows]
+        else:
+            return kafka_payloads
+        for row in rows:
+            kafka_payloads.append(
+                KafkaPayload(storage_key.value.encode("utf-8"), row, [])
+            )
         return kafka_payloads
 
     def poll(self) -> None:
@@ -438,7 +519,9 @@ class DeadLetterStep(
     def submit(
         self,
         message: Message[
-            Tuple[StorageKey, Union[None, BytesInsertBatch, ReplacementBatch]]
+            Tuple[
+                StorageKey, Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]
+            ]
         ],
     ) -> None:
         submit_start = time.time()
@@ -486,18 +569,27 @@ class DeadLetterStep(
 
 class MultistorageCollector(
     ProcessingStep[
-        Sequence[Tuple[StorageKey, Union[None, BytesInsertBatch, ReplacementBatch]]]
+        Sequence[
+            Tuple[
+                StorageKey, Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]
+            ]
+        ]
     ]
 ):
     def __init__(
         self,
         steps: Mapping[
             StorageKey,
-            ProcessingStep[Union[None, BytesInsertBatch, ReplacementBatch]],
+            ProcessingStep[
+                Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]
+            ],
         ],
         dead_letter_step: Optional[
             ProcessingStep[
-                Tuple[StorageKey, Union[None, BytesInsertBatch, ReplacementBatch]]
+                Tuple[
+                    StorageKey,
+                    Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch],
+                ]
             ]
         ],
         ignore_errors: Optional[Set[StorageKey]] = None,
@@ -510,7 +602,10 @@ class MultistorageCollector(
             StorageKey,
             List[
                 Message[
-                    Tuple[StorageKey, Union[None, BytesInsertBatch, ReplacementBatch]]
+                    Tuple[
+                        StorageKey,
+                        Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch],
+                    ]
                 ]
             ],
         ] = defaultdict(list)
@@ -522,7 +617,12 @@ class MultistorageCollector(
     def submit(
         self,
         message: Message[
-            Sequence[Tuple[StorageKey, Union[None, BytesInsertBatch, ReplacementBatch]]]
+            Sequence[
+                Tuple[
+                    StorageKey,
+                    Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch],
+                ]
+            ]
         ],
     ) -> None:
         assert not self.__closed
@@ -602,7 +702,7 @@ class MultistorageKafkaPayload(NamedTuple):
 
 
 MultistorageProcessedMessage = Sequence[
-    Tuple[StorageKey, Union[None, BytesInsertBatch, ReplacementBatch]]
+    Tuple[StorageKey, Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]]
 ]
 
 
@@ -617,9 +717,14 @@ def __message_to_dict(
     }
 
 
-def skip_kafka_message(message: Message[KafkaPayload]) -> bool:
+def skip_kafka_message(
+    message: Message[KafkaPayload], messages_to_skip: Optional[FrozenSet[str]] = None
+) -> bool:
     # expected format is "[topic:partition_index:offset,...]" eg [snuba-metrics:0:1,snuba-metrics:0:3]
-    messages_to_skip = (get_config("kafka_messages_to_skip") or "[]")[1:-1].split(",")
+    if messages_to_skip is None:
+        messages_to_skip = get_str_set_config("kafka_messages_to_skip")
+    if not messages_to_skip:
+        return False
     return (
         f"{message.partition.topic.name}:{message.partition.index}:{message.offset}"
         in messages_to_skip
@@ -643,8 +748,16 @@ def __invalid_kafka_message(
 
 
 def process_message(
-    processor: MessageProcessor, consumer_group: str, message: Message[KafkaPayload]
-) -> Union[None, BytesInsertBatch, ReplacementBatch]:
+    processor: MessageProcessor,
+    consumer_group: str,
+    message: Message[KafkaPayload],
+    row_encoder: Optional[Encoder[bytes, WriterTableRow]] = json_row_encoder,
+) -> Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]:
+    """
+    Processes a message and encodes the rows to insert. Without an encoder
+    the rows are returned as they are, so that they can be aggregated by
+    the InsertBatchWriter.
+    """
 
     if skip_kafka_message(message):
         logger.warning(
@@ -666,22 +779,575 @@ def process_message(
             [__invalid_kafka_message(message, consumer_group, err)]
         ) from err
 
-    if isinstance(result, InsertBatch):
+    if isinstance(result, InsertBatch) and row_encoder is not None:
         return BytesInsertBatch(
-            [json_row_encoder.encode(row) for row in result.rows],
+            [row_encoder.encode(row) for row in result.rows],
             result.origin_timestamp,
         )
     else:
         return result
 
 
+def process_message_batch(
+    processor: MessageProcessor,
+    messages: Sequence[Message[KafkaPayload]],
+    row_encoder: Optional[Encoder[bytes, WriterTableRow]] = json_row_encoder,
+) -> Union[None, BytesInsertBatch, InsertBatch]:
+    """
+    Processes messages of a partition with the process_batch method of the
+    processor. Raises if any message of the block cannot be processed: the
+    caller has to fall back to process_message to find which one.
+    """
+    messages_to_skip = get_str_set_config("kafka_messages_to_skip")
+    if messages_to_skip:
+        kept = []
+        for message in messages:
+            if skip_kafka_message(message, messages_to_skip):
+                logger.warning(
+                    f"A consumer for {message.partition.topic.name} skipped a message!",
+                    extra=__message_to_dict(message),
+                )
+            else:
+                kept.append(message)
+        if not kept:
+            return None
+        messages = kept
+
+    # The payloads are decoded at once as a JSON array. Payloads that are not
+    # a single JSON value each fail here or change the number of values.
+    values = rapidjson.loads(
+        b"[" + b",".join([message.payload.value for message in messages]) + b"]"
+    )
+    if len(values) != len(messages):
+        raise ValueError("Payloads do not contain one value each")
+
+    result = processor.process_batch(
+        [
+            (
+                value,
+                KafkaMessageMetadata(
+                    message.offset, message.partition.index, message.timestamp
+                ),
+            )
+            for value, message in zip(values, messages)
+        ]
+    )
+    if result is None or row_encoder is None:
+        return result
+    return BytesInsertBatch(
+        [row_encoder.encode(row) for row in result.rows],
+        result.origin_timestamp,
+    )
+
+
+class ProcessBatchStep(ProcessingStep[KafkaPayload]):
+    """
+    Processes messages in blocks with process_message_batch instead of one
+    at a time. A block only contains messages of one partition: its rows
+    are submitted to the next step as a single message, with the offset and
+    timestamp of the last message of the block, so committing the offsets
+    of the next step covers the whole block.
+
+    When a block fails, its messages are processed one at a time with
+    process_message and submitted individually. Invalid messages are then
+    raised one by one as with a TransformStep, and the messages that follow
+    them stay in the step.
+
+    When the next step rejects the rows of a block, they are kept and
+    submitted again on the next call, and messages are rejected until the
+    next step accepts them.
+    """
+
+    def __init__(
+        self,
+        processor: MessageProcessor,
+        consumer_group: str,
+        next_step: ProcessingStep[
+            Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]
+        ],
+        max_block_size: int,
+        max_block_time: float,
+        metrics: MetricsBackend,
+        row_encoder: Optional[Encoder[bytes, WriterTableRow]] = json_row_encoder,
+    ) -> None:
+        self.__processor = processor
+        self.__consumer_group = consumer_group
+        self.__next_step = next_step
+        self.__max_block_size = max_block_size
+        self.__max_block_time = max_block_time
+        self.__metrics = metrics
+        self.__row_encoder = row_encoder
+
+        self.__messages: Deque[Message[KafkaPayload]] = deque()
+        self.__pending: Optional[
+            Message[Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]]
+        ] = None
+        self.__block_created = 0.0
+        self.__closed = False
+
+    def poll(self) -> None:
+        if (
+            self.__messages
+            and time.time() > self.__block_created + self.__max_block_time
+        ):
+            self.__flush(force=True)
+        elif self.__pending is not None:
+            self.__flush(force=False)
+
+        self.__next_step.poll()
+
+    def submit(self, message: Message[KafkaPayload]) -> None:
+        assert not self.__closed
+
+        if self.__pending is not None:
+            self.__submit_next(self.__pending)
+
+        if not self.__messages:
+            self.__block_created = time.time()
+        self.__messages.append(message)
+
+        if (
+            len(self.__messages) >= self.__max_block_size
+            or message.partition != self.__messages[0].partition
+        ):
+            self.__flush(force=False)
+
+    def __submit_next(
+        self,
+        message: Message[Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]],
+    ) -> None:
+        self.__pending = None
+        try:
+            self.__next_step.submit(message)
+        except MessageRejected:
+            self.__pending = message
+            raise
+
+    def __flush(self, force: bool) -> None:
+        try:
+            if self.__pending is not None:
+                self.__submit_next(self.__pending)
+
+            while self.__messages:
+                partition = self.__messages[0].partition
+                block = list(
+                    itertools.takewhile(
+                        lambda message: message.partition == partition,
+                        itertools.islice(self.__messages, self.__max_block_size),
+                    )
+                )
+                if (
+                    not force
+                    and len(block) == len(self.__messages)
+                    and len(block) < self.__max_block_size
+                ):
+                    # Only an incomplete block is left, it waits for more.
+                    break
+                self.__process_block(block)
+        except MessageRejected:
+            pass
+
+        if self.__messages:
+            self.__block_created = time.time()
+
+    def __process_block(self, block: Sequence[Message[KafkaPayload]]) -> None:
+        start = time.time()
+        try:
+            result = process_message_batch(self.__processor, block, self.__row_encoder)
+        except Exception:
+            self.__metrics.increment("process_batch.fallback")
+            logger.warning(
+                "Failed to process a block of %d messages, processing them "
+                "one at a time",
+                len(block),
+                exc_info=True,
+            )
+            for message in block:
+                self.__messages.popleft()
+                self.__submit_next(
+                    Message(
+                        message.partition,
+                        message.offset,
+                        process_message(
+                            self.__processor,
+                            self.__consumer_group,
+                            message,
+                            self.__row_encoder,
+                        ),
+                        message.timestamp,
+                    )
+                )
+            return
+
+        self.__metrics.increment("process_batch.blocks")
+        self.__metrics.increment("process_batch.messages", len(block))
+        self.__metrics.timing("process_batch.duration_ms", (time.time() - start) * 1000)
+        for _ in block:
+            self.__messages.popleft()
+        last = block[-1]
+        self.__submit_next(Message(last.partition, last.offset, result, last.timestamp))
+
+    def close(self) -> None:
+        self.__closed = True
+
+    def terminate(self) -> None:
+        self.__closed = True
+
+        logger.debug("Terminating %r...", self.__next_step)
+        self.__next_step.terminate()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        deadline = time.time() + timeout if timeout is not None else None
+        try:
+            self.__flush(force=True)
+            while self.__pending is not None:
+                if deadline is not None and time.time() >= deadline:
+                    logger.warning("Timed out waiting for the next step to accept rows")
+                    break
+                time.sleep(0.01)
+                self.__next_step.poll()
+                self.__flush(force=True)
+        finally:
+            self.__next_step.close()
+            self.__next_step.join(
+                max(deadline - time.time(), 0) if deadline is not None else None
+            )
+
+
+class PipelinedCollectStep(ProcessingStep[TPayload]):
+    """
+    Collects messages into batches like CollectStep, but closes batches in
+    a thread pool so that up to ``max_batches_in_flight`` batches are being
+    written while the next one is collected. Batches are joined, and their
+    offsets committed, in the order they were collected once they are
+    written, so committed offsets never cover a batch still in flight.
+
+    When all the batches in flight are still being written and the batch
+    being collected is full, messages are rejected with MessageRejected
+    until the oldest batch is done, which bounds the memory used to
+    ``max_batches_in_flight + 1`` batches.
+
+    The size of a batch is its number of messages, unless ``get_length``
+    is given: it then returns how much each message counts towards
+    ``max_batch_size``, like the number of rows of a message carrying the
+    rows of several Kafka messages.
+    """
+
+    def __init__(
+        self,
+        step_factory: Callable[[], ProcessingStep[TPayload]],
+        commit_function: Callable[[Mapping[Partition, Position]], None],
+        max_batch_size: int,
+        max_batch_time: float,
+        max_batches_in_flight: int,
+        metrics: MetricsBackend,
+        get_length: Optional[Callable[[Message[TPayload]], int]] = None,
+    ) -> None:
+        assert max_batches_in_flight > 0
+        self.__step_factory = step_factory
+        self.__commit_function = commit_function
+        self.__max_batch_size = max_batch_size
+        self.__max_batch_time = max_batch_time
+        self.__max_batches_in_flight = max_batches_in_flight
+        self.__metrics = metrics
+        self.__get_length = get_length
+
+        self.__executor = ThreadPoolExecutor(max_workers=max_batches_in_flight)
+        self.__batch: Optional[Batch[TPayload]] = None
+        self.__batch_length = 0
+        self.__in_flight: Deque[Tuple[Batch[TPayload], float, Future[None]]] = deque()
+        self.__closed = False
+
+    def __close_batch(self) -> None:
+        assert self.__batch is not None
+        batch = self.__batch
+        self.__batch = None
+        self.__batch_length = 0
+        self.__in_flight.append(
+            (batch, time.time(), self.__executor.submit(batch.close))
+        )
+        self.__metrics.gauge("pipelined_collect.in_flight", len(self.__in_flight))
+
+    def __join_batches(
+        self, timeout: Optional[float] = None, wait: bool = False
+    ) -> None:
+        deadline = time.time() + timeout if timeout is not None else None
+        while self.__in_flight:
+            batch, started, future = self.__in_flight[0]
+            if not wait and not future.done():
+                break
+
+            # Errors raised while writing the batch are raised here.
+            future.result(
+                max(deadline - time.time(), 0) if deadline is not None else None
+            )
+            batch.join()
+            self.__in_flight.popleft()
+            self.__metrics.timing(
+                "pipelined_collect.batch_ms", (time.time() - started) * 1000
+            )
+            self.__metrics.gauge("pipelined_collect.in_flight", len(self.__in_flight))
+
+    def poll(self) -> None:
+        self.__join_batches()
+
+        if self.__batch is None:
+            return
+
+        self.__batch.poll()
+
+        if (
+            self.__batch_length >= self.__max_batch_size
+            or self.__batch.duration() >= self.__max_batch_time
+        ) and len(self.__in_flight) < self.__max_batches_in_flight:
+            self.__close_batch()
+
+    def submit(self, message: Message[TPayload]) -> None:
+        assert not self.__closed
+
+        if self.__batch is not None and self.__batch_length >= self.__max_batch_size:
+            self.__join_batches()
+            if len(self.__in_flight) >= self.__max_batches_in_flight:
+                self.__metrics.increment("pipelined_collect.rejected")
+                raise MessageRejected
+            self.__close_batch()
+
+        if self.__batch is None:
+            self.__batch = Batch(self.__step_factory(), self.__commit_function)
+
+        self.__batch.submit(message)
+        self.__batch_length += (
+            self.__get_length(message) if self.__get_length is not None else 1
+        )
+
+    def close(self) -> None:
+        self.__closed = True
+
+        if self.__batch is not None:
+            logger.debug("Closing %r...", self.__batch)
+            self.__close_batch()
+
+    def terminate(self) -> None:
+        self.__closed = True
+
+        if self.__batch is not None:
+            self.__batch.terminate()
+        for batch, _, _ in self.__in_flight:
+            batch.terminate()
+        self.__executor.shutdown(wait=False)
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        try:
+            self.__join_batches(timeout, wait=True)
+        finally:
+            self.__executor.shutdown(wait=False)
+
+
+def build_collect_step(
+    step_factory: Callable[[], ProcessingStep[TPayload]],
+    commit: Callable[[Mapping[Partition, Position]], None],
+    max_batch_size: int,
+    max_batch_time: float,
+    parallel_collect: bool,
+    max_batches_in_flight: int,
+    metrics: MetricsBackend,
+    get_length: Optional[Callable[[Message[TPayload]], int]] = None,
+) -> ProcessingStep[TPayload]:
+    # The collect steps of arroyo count batches in messages, so batches
+    # measured with get_length go through a PipelinedCollectStep.
+    if max_batches_in_flight > 1 or get_length is not None:
+        return PipelinedCollectStep(
+            step_factory,
+            commit,
+            max_batch_size,
+            max_batch_time,
+            max_batches_in_flight,
+            metrics,
+            get_length,
+        )
+    elif parallel_collect:
+        return ParallelCollectStep(step_factory, commit, max_batch_size, max_batch_time)
+    else:
+        return CollectStep(step_factory, commit, max_batch_size, max_batch_time)
+
+
+def get_rows_count(
+    message: Message[Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]]
+) -> int:
+    """
+    Returns the number of rows carried by a processed message. Messages
+    without rows still count as one, as they were read from Kafka.
+    """
+    if isinstance(message.payload, (BytesInsertBatch, InsertBatch)):
+        return max(len(message.payload.rows), 1)
+    return 1
+
+
+class ProcessBatchStrategyFactory(ProcessingStrategyFactory[KafkaPayload]):
+    """
+    Builds the same strategy as KafkaConsumerStrategyFactory with a
+    ProcessBatchStep in place of the transform step, for processors
+    implementing process_batch. The collector receives one message per
+    block, and counts each of them as the number of rows of the block, so
+    blocks cut short by their time limit or by a change of partition do
+    not make the batches written to ClickHouse smaller.
+    """
+
+    def __init__(
+        self,
+        prefilter: Optional[StreamMessageFilter[KafkaPayload]],
+        processor: MessageProcessor,
+        consumer_group: str,
+        collector: Callable[
+            [],
+            ProcessingStep[
+                Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]
+            ],
+        ],
+        max_batch_size: int,
+        max_batch_time: float,
+        max_block_size: int,
+        max_block_time: float,
+        metrics: MetricsBackend,
+        row_encoder: Optional[Encoder[bytes, WriterTableRow]] = json_row_encoder,
+        dead_letter_queue_policy_creator: Optional[
+            Callable[[], DeadLetterQueuePolicy]
+        ] = None,
+        parallel_collect: bool = False,
+        max_batches_in_flight: int = 1,
+    ) -> None:
+        self.__prefilter = prefilter
+        self.__processor = processor
+        self.__consumer_group = consumer_group
+        self.__collector = collector
+        self.__max_batch_size = max_batch_size
+        self.__max_batch_time = max_batch_time
+        self.__max_block_size = max_block_size
+        self.__max_block_time = min(max_block_time, max_batch_time)
+        self.__metrics = metrics
+        self.__row_encoder = row_encoder
+        self.__dead_letter_queue_policy_creator = dead_letter_queue_policy_creator
+        self.__parallel_collect = parallel_collect
+        self.__max_batches_in_flight = max_batches_in_flight
+
+    def __should_accept(self, message: Message[KafkaPayload]) -> bool:
+        assert self.__prefilter is not None
+        return not self.__prefilter.should_drop(message)
+
+    def create_with_partitions(
+        self,
+        commit: Callable[[Mapping[Partition, Position]], None],
+        partitions: Mapping[Partition, int],
+    ) -> ProcessingStrategy[KafkaPayload]:
+        collect = build_collect_step(
+            self.__collector,
+            commit,
+            self.__max_batch_size,
+            self.__max_batch_time,
+            self.__parallel_collect,
+            self.__max_batches_in_flight,
+            self.__metrics,
+            get_rows_count,
+        )
+
+        strategy: ProcessingStrategy[KafkaPayload] = ProcessBatchStep(
+            self.__processor,
+            self.__consumer_group,
+            collect,
+            self.__max_block_size,
+            self.__max_block_time,
+            self.__metrics,
+            self.__row_encoder,
+        )
+
+        if self.__prefilter is not None:
+            strategy = FilterStep(self.__should_accept, strategy)
+
+        if self.__dead_letter_queue_policy_creator is not None:
+            strategy = DeadLetterQueue(
+                strategy, self.__dead_letter_queue_policy_creator()
+            )
+
+        return strategy
+
+
+class PipelinedInsertStrategyFactory(ProcessingStrategyFactory[KafkaPayload]):
+    """
+    Builds the same strategy as KafkaConsumerStrategyFactory without
+    multiprocessing, with a PipelinedCollectStep writing up to
+    ``max_batches_in_flight`` batches at once. The parallel transform step
+    does not handle messages rejected by the next step, so it cannot be
+    followed by a PipelinedCollectStep.
+    """
+
+    def __init__(
+        self,
+        prefilter: Optional[StreamMessageFilter[KafkaPayload]],
+        process_message: Callable[
+            [Message[KafkaPayload]],
+            Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch],
+        ],
+        collector: Callable[
+            [],
+            ProcessingStep[
+                Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]
+            ],
+        ],
+        max_batch_size: int,
+        max_batch_time: float,
+        max_batches_in_flight: int,
+        metrics: MetricsBackend,
+        dead_letter_queue_policy_creator: Optional[
+            Callable[[], DeadLetterQueuePolicy]
+        ] = None,
+    ) -> None:
+        self.__prefilter = prefilter
+        self.__process_message = process_message
+        self.__collector = collector
+        self.__max_batch_size = max_batch_size
+        self.__max_batch_time = max_batch_time
+        self.__max_batches_in_flight = max_batches_in_flight
+        self.__metrics = metrics
+        self.__dead_letter_queue_policy_creator = dead_letter_queue_policy_creator
+
+    def __should_accept(self, message: Message[KafkaPayload]) -> bool:
+        assert self.__prefilter is not None
+        return not self.__prefilter.should_drop(message)
+
+    def create_with_partitions(
+        self,
+        commit: Callable[[Mapping[Partition, Position]], None],
+        partitions: Mapping[Partition, int],
+    ) -> ProcessingStrategy[KafkaPayload]:
+        strategy: ProcessingStrategy[KafkaPayload] = TransformStep(
+            self.__process_message,
+            PipelinedCollectStep(
+                self.__collector,
+                commit,
+                self.__max_batch_size,
+                self.__max_batch_time,
+                self.__max_batches_in_flight,
+                self.__metrics,
+            ),
+        )
+
+        if self.__prefilter is not None:
+            strategy = FilterStep(self.__should_accept, strategy)
+
+        if self.__dead_letter_queue_policy_creator is not None:
+            strategy = DeadLetterQueue(
+                strategy, self.__dead_letter_queue_policy_creator()
+            )
+
+        return strategy
+
+
 def _process_message_multistorage_work(
     metadata: KafkaMessageMetadata, storage_key: StorageKey, storage_message: Any
-) -> Union[None, BytesInsertBatch, ReplacementBatch]:
+) -> Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]:
+    table_writer = get_writable_storage(storage_key).get_table_writer()
     result = (
-        get_writable_storage(storage_key)
-        .get_table_writer()
-        .get_stream_loader()
+        table_writer.get_stream_loader()
         .get_processor()
         .process_message(storage_message, metadata)
     )
@@ -693,8 +1359,11 @@ def _process_message_multistorage_work(
             result.origin_timestamp,
         )
     elif isinstance(result, InsertBatch):
+        if table_writer.get_row_aggregation() is not None:
+            return result
+        row_encoder = table_writer.get_row_encoder()
         return BytesInsertBatch(
-            [json_row_encoder.encode(row) for row in result.rows],
+            [row_encoder.encode(row) for row in result.rows],
             result.origin_timestamp,
         )
     else:
@@ -710,7 +1379,7 @@ def process_message_multistorage(
     )
 
     results: MutableSequence[
-        Tuple[StorageKey, Union[None, BytesInsertBatch, ReplacementBatch]]
+        Tuple[StorageKey, Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]]
     ] = []
 
     for index, storage_key in enumerate(message.payload.storage_keys):
@@ -745,7 +1414,7 @@ def process_message_multistorage_identical_storages(
     )
 
     intermediate_results: MutableMapping[
-        StorageKey, Union[None, BytesInsertBatch, ReplacementBatch]
+        StorageKey, Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]
     ] = {}
 
     for index, storage_key in enumerate(message.payload.storage_keys):
@@ -820,6 +1489,8 @@ def build_multistorage_batch_writer(
                 "insertions",
                 {"storage": storage.get_storage_key().value},
             ),
+            row_aggregation=storage.get_table_writer().get_row_aggregation(),
+            row_encoder=storage.get_table_writer().get_row_encoder(),
         ),
         replacement_batch_writer,
     )
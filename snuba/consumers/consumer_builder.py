@@ -13,7 +13,10 @@ from arroyo.utils.profiler import ProcessingStrategyProfilerWrapperFactory
 from arroyo.utils.retries import BasicRetryPolicy, RetryPolicy
 from confluent_kafka import KafkaError, KafkaException, Producer
 
+from snuba import settings
 from snuba.consumers.consumer import (
+    PipelinedInsertStrategyFactory,
+    ProcessBatchStrategyFactory,
     build_batch_writer,
     build_mock_batch_writer,
     process_message,
@@ -21,6 +24,7 @@ from snuba.consumers.consumer import (
 from snuba.datasets.storages.factory import get_writable_storage
 from snuba.datasets.storages.storage_key import StorageKey
 from snuba.environment import setup_sentry
+from snuba.processor import supports_batch_processing
 from snuba.state import get_config
 from snuba.utils.metrics import MetricsBackend
 from snuba.utils.streams.configuration_builder import (
@@ -82,6 +86,8 @@ class ConsumerBuilder:
         profile_path: Optional[str] = None,
         mock_parameters: Optional[MockParameters] = None,
         cooperative_rebalancing: bool = False,
+        max_batches_in_flight: int = 1,
+        process_batch: bool = False,
     ) -> None:
         self.storage = get_writable_storage(storage_key)
         self.bootstrap_servers = kafka_params.bootstrap_servers
@@ -156,6 +162,17 @@ class ConsumerBuilder:
         self.__parallel_collect = parallel_collect
         self.__cooperative_rebalancing = cooperative_rebalancing
 
+        if max_batches_in_flight > 1:
+            # Batches written concurrently could send replacements out of
+            # order, and the parallel transform step does not handle the
+            # messages rejected while too many batches are in flight.
+            assert (
+                self.replacements_topic is None
+            ), "batches cannot be pipelined on storages with replacements"
+            assert self.processes is None, "batches cannot be pipelined with processes"
+        self.__max_batches_in_flight = max_batches_in_flight
+        self.__process_batch = process_batch
+
         if commit_retry_policy is None:
             commit_retry_policy = BasicRetryPolicy(
                 3,
@@ -225,21 +242,25 @@ class ConsumerBuilder:
         stream_loader = table_writer.get_stream_loader()
 
         processor = stream_loader.get_processor()
+        # Rows of storages aggregating their batches are encoded by the writer.
+        row_encoder = (
+            table_writer.get_row_encoder()
+            if table_writer.get_row_aggregation() is None
+            else None
+        )
+        dead_letter_queue_policy_creator = (
+            stream_loader.get_dead_letter_queue_policy_creator()
+        )
 
-        strategy_factory: ProcessingStrategyFactory[
-            KafkaPayload
-        ] = KafkaConsumerStrategyFactory(
-            prefilter=stream_loader.get_pre_filter(),
-            process_message=functools.partial(
-                process_message, processor, self.consumer_group
-            ),
-            collector=build_batch_writer(
+        collector = (
+            build_batch_writer(
                 table_writer,
                 metrics=self.metrics,
                 replacements_producer=(
                     self.producer if self.replacements_topic is not None else None
                 ),
                 replacements_topic=self.replacements_topic,
+                max_batches_in_flight=self.__max_batches_in_flight,
             )
             if self.__mock_parameters is None
             else build_mock_batch_writer(
@@ -248,17 +269,68 @@ class ConsumerBuilder:
                 self.metrics,
                 self.__mock_parameters.avg_write_latency,
                 self.__mock_parameters.std_deviation,
-            ),
-            max_batch_size=self.max_batch_size,
-            max_batch_time=self.max_batch_time_ms / 1000.0,
-            processes=self.processes,
-            input_block_size=self.input_block_size,
-            output_block_size=self.output_block_size,
-            initialize_parallel_transform=setup_sentry,
-            dead_letter_queue_policy_creator=stream_loader.get_dead_letter_queue_policy_creator(),
-            parallel_collect=self.__parallel_collect,
+            )
         )
 
+        strategy_factory: ProcessingStrategyFactory[KafkaPayload]
+        if (
+            self.__process_batch
+            and self.processes is None
+            and supports_batch_processing(processor)
+        ):
+            # Blocks of messages are processed at once, which only works in
+            # the consumer process.
+            strategy_factory = ProcessBatchStrategyFactory(
+                prefilter=stream_loader.get_pre_filter(),
+                processor=processor,
+                consumer_group=self.consumer_group,
+                collector=collector,
+                max_batch_size=self.max_batch_size,
+                max_batch_time=self.max_batch_time_ms / 1000.0,
+                max_block_size=settings.CONSUMER_PROCESS_BLOCK_SIZE,
+                max_block_time=settings.CONSUMER_PROCESS_BLOCK_TIME_MS / 1000.0,
+                metrics=self.metrics,
+                row_encoder=row_encoder,
+                dead_letter_queue_policy_creator=dead_letter_queue_policy_creator,
+                parallel_collect=self.__parallel_collect,
+                max_batches_in_flight=self.__max_batches_in_flight,
+            )
+        elif self.__max_batches_in_flight > 1:
+            strategy_factory = PipelinedInsertStrategyFactory(
+                prefilter=stream_loader.get_pre_filter(),
+                process_message=functools.partial(
+                    process_message,
+                    processor,
+                    self.consumer_group,
+                    row_encoder=row_encoder,
+                ),
+                collector=collector,
+                max_batch_size=self.max_batch_size,
+                max_batch_time=self.max_batch_time_ms / 1000.0,
+                max_batches_in_flight=self.__max_batches_in_flight,
+                metrics=self.metrics,
+                dead_letter_queue_policy_creator=dead_letter_queue_policy_creator,
+            )
+        else:
+            strategy_factory = KafkaConsumerStrategyFactory(
+                prefilter=stream_loader.get_pre_filter(),
+                process_message=functools.partial(
+                    process_message,
+                    processor,
+                    self.consumer_group,
+                    row_encoder=row_encoder,
+                ),
+                collector=collector,
+                max_batch_size=self.max_batch_size,
+                max_batch_time=self.max_batch_time_ms / 1000.0,
+                processes=self.processes,
+                input_block_size=self.input_block_size,
+                output_block_size=self.output_block_size,
+                initialize_parallel_transform=setup_sentry,
+                dead_letter_queue_policy_creator=dead_letter_queue_policy_creator,
+                parallel_collect=self.__parallel_collect,
+            )
+
         if self.__profile_path is not None:
             strategy_factory = ProcessingStrategyProfilerWrapperFactory(
                 strategy_factory,
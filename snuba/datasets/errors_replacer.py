@@ -11,6 +11,7 @@ from collections import deque
 from dataclasses import dataclass
 from datetime import datetime
 from functools import cached_property
+from threading import Lock
 from typing import (
     Any,
     Deque,
@@ -221,6 +222,8 @@ def set_project_exclude_groups(
     truncate_group_id_replacement_set(p, type_key, now, max_group_ids_exclude)
     p.expire(type_key, int(settings.REPLACER_KEY_TTL))
 
+    _stamp_project_version(p, project_id, state_name)
+
     p.execute()
 
 
@@ -253,9 +256,26 @@ def set_project_needs_final(
     p = redis_client.pipeline()
     p.set(key, time.time(), ex=settings.REPLACER_KEY_TTL)
     p.set(type_key, replacement_type, ex=settings.REPLACER_KEY_TTL)
+    _stamp_project_version(p, project_id, state_name)
     p.execute()
 
 
+def _stamp_project_version(
+    p: StrictClusterPipeline, project_id: int, state_name: Optional[ReplacerState]
+) -> None:
+    """
+    Records that the replacement flags of a project changed. Each stamp is
+    unique so a reader can tell whether the flags it cached are still
+    current by comparing stamps, even after the key expired and was set
+    again.
+    """
+    p.set(
+        ProjectsQueryFlags._build_project_version_key(project_id, state_name),
+        uuid.uuid4().hex,
+        ex=settings.REPLACER_KEY_TTL,
+    )
+
+
 @dataclass
 class ProjectsQueryFlags:
     """
@@ -286,7 +306,23 @@ class ProjectsQueryFlags:
 
         - Searches through Redis for relevant replacements info
         - Splits up results from pipeline into something that makes sense
+
+        When the ``project_flags_cache_ttl_sec`` runtime config is set, the
+        flags of each project are cached in process (see
+        ``ProjectFlagsCache``) and Redis is only queried for the projects
+        whose cached flags are missing or outdated.
         """
+        cache_ttl = get_config("project_flags_cache_ttl_sec", 0)
+        assert isinstance(cache_ttl, (int, float))
+        if cache_ttl > 0:
+            return project_flags_cache.load(project_ids, state_name, cache_ttl)
+
+        return cls._load_from_redis(project_ids, state_name)
+
+    @classmethod
+    def _load_from_redis(
+        cls, project_ids: Sequence[int], state_name: Optional[ReplacerState]
+    ) -> ProjectsQueryFlags:
         s_project_ids = set(project_ids)
 
         p = redis_client.pipeline()
@@ -313,6 +349,54 @@ class ProjectsQueryFlags:
 
         return flags
 
+    @classmethod
+    def _load_by_project_from_redis(
+        cls, project_ids: Sequence[int], state_name: Optional[ReplacerState]
+    ) -> Mapping[int, ProjectsQueryFlags]:
+        """
+        Same as ``_load_from_redis`` but returns the flags of each project
+        separately, still using a single pipeline.
+        """
+        s_project_ids = set(project_ids)
+
+        p = redis_client.pipeline()
+        # _query_redis issues the same commands for each project, in the
+        # iteration order of the set it is given.
+        cls._query_redis(s_project_ids, state_name, p)
+        results = p.execute()
+
+        len_projects = len(s_project_ids)
+        commands = len(results) // len_projects if len_projects else 0
+        return {
+            project_id: cls._process_redis_results(
+                [results[command * len_projects + i] for command in range(commands)],
+                1,
+            )
+            for i, project_id in enumerate(s_project_ids)
+        }
+
+    @classmethod
+    def combine(cls, flags: Sequence[ProjectsQueryFlags]) -> ProjectsQueryFlags:
+        """
+        Merges the flags loaded separately for several projects into the
+        flags that would have been loaded for all of them at once.
+        """
+        replacement_times = [
+            f.latest_replacement_time
+            for f in flags
+            if f.latest_replacement_time is not None
+        ]
+        return cls(
+            any(f.needs_final for f in flags),
+            {group_id for f in flags for group_id in f.group_ids_to_exclude},
+            {
+                replacement_type
+                for f in flags
+                for replacement_type in f.replacement_types
+            },
+            max(replacement_times) if replacement_times else None,
+        )
+
     @classmethod
     def _process_redis_results(
         cls, results: List[Any], len_projects: int
@@ -489,6 +573,123 @@ class ProjectsQueryFlags:
         key = f"project_exclude_groups:{f'{state_name.value}:' if state_name else ''}{project_id}"
         return key, f"{key}-type"
 
+    @staticmethod
+    def _build_project_version_key(
+        project_id: int, state_name: Optional[ReplacerState]
+    ) -> str:
+        return f"project_replacement_version:{f'{state_name.value}:' if state_name else ''}{project_id}"
+
+
+@dataclass(frozen=True)
+class CachedProjectFlags:
+    flags: ProjectsQueryFlags
+    # The version stamp of the project when the flags were loaded.
+    version: Optional[bytes]
+    loaded_at: float
+    checked_at: float
+
+
+class ProjectFlagsCache:
+    """
+    In process cache of the replacement flags of each project.
+
+    Cached flags are used without going to Redis for ``ttl`` seconds. After
+    that, the version stamps the replacer writes for every replacement (see
+    ``set_project_needs_final`` and ``set_project_exclude_groups``) are
+    read and the flags of the projects whose stamp did not change are kept,
+    up to ``project_flags_cache_max_age_sec``, so flags that expire in Redis
+    also expire here. Only the remaining projects go through the full
+    pipeline.
+    """
+
+    def __init__(self, max_size: int = 10000) -> None:
+        self.__max_size = max_size
+        self.__entries: MutableMapping[
+            Tuple[Optional[ReplacerState], int], CachedProjectFlags
+        ] = {}
+        self.__lock = Lock()
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+
+    def __store(
+        self,
+        key: Tuple[Optional[ReplacerState], int],
+        entry: CachedProjectFlags,
+    ) -> None:
+        with self.__lock:
+            self.__entries.pop(key, None)
+            if len(self.__entries) >= self.__max_size:
+                # Entries are kept in insertion order, drop the oldest one.
+                del self.__entries[next(iter(self.__entries))]
+            self.__entries[key] = entry
+
+    def load(
+        self,
+        project_ids: Sequence[int],
+        state_name: Optional[ReplacerState],
+        ttl: float,
+    ) -> ProjectsQueryFlags:
+        max_age = get_config("project_flags_cache_max_age_sec", 60)
+        assert isinstance(max_age, (int, float))
+        now = time.time()
+
+        flags: List[ProjectsQueryFlags] = []
+        to_check: List[Tuple[int, Optional[CachedProjectFlags]]] = []
+        for project_id in set(project_ids):
+            entry = self.__entries.get((state_name, project_id))
+            if entry is not None and now - entry.checked_at < ttl:
+                flags.append(entry.flags)
+            elif entry is not None and now - entry.loaded_at < max_age:
+                to_check.append((project_id, entry))
+            else:
+                to_check.append((project_id, None))
+        hits = len(flags)
+
+        if not to_check:
+            metrics.increment("project_flags_cache.hit", hits)
+            return ProjectsQueryFlags.combine(flags)
+
+        p = redis_client.pipeline()
+        for project_id, _ in to_check:
+            p.get(ProjectsQueryFlags._build_project_version_key(project_id, state_name))
+        versions = p.execute()
+
+        to_load: MutableMapping[int, Optional[bytes]] = {}
+        for (project_id, entry), version in zip(to_check, versions):
+            if entry is not None and entry.version == version:
+                flags.append(entry.flags)
+                self.__store(
+                    (state_name, project_id),
+                    CachedProjectFlags(entry.flags, version, entry.loaded_at, now),
+                )
+            else:
+                to_load[project_id] = version
+        revalidated = len(to_check) - len(to_load)
+
+        if to_load:
+            # A replacement written between reading the stamps and loading
+            # the flags makes the stored stamp older than the flags, which
+            # only causes an extra reload later on.
+            loaded = ProjectsQueryFlags._load_by_project_from_redis(
+                list(to_load), state_name
+            )
+            for project_id, project_flags in loaded.items():
+                flags.append(project_flags)
+                self.__store(
+                    (state_name, project_id),
+                    CachedProjectFlags(project_flags, to_load[project_id], now, now),
+                )
+
+        metrics.increment("project_flags_cache.hit", hits)
+        metrics.increment("project_flags_cache.revalidated", revalidated)
+        metrics.increment("project_flags_cache.miss", len(to_load))
+        return ProjectsQueryFlags.combine(flags)
+
+
+project_flags_cache = ProjectFlagsCache()
+
 
 class ErrorsReplacer(ReplacerProcessor[Replacement]):
     def __init__(
@@ -1,9 +1,12 @@
 import copy
 import logging
 import math
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import replace
-from datetime import timedelta
-from typing import Optional
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Deque, Iterator, Optional, Tuple
 
 from snuba import environment, settings, state, util
 from snuba.clickhouse.query import Query
@@ -25,6 +28,10 @@ from snuba.query.expressions import FunctionCall as FunctionCallExpr
 from snuba.query.expressions import Literal as LiteralExpr
 from snuba.query.matchers import AnyExpression, Column, FunctionCall, Or, Param, String
 from snuba.query.query_settings import QuerySettings
+from snuba.querylog.query_metadata import (
+    ConcurrentQueryMetadata,
+    run_with_concurrent_query_metadata,
+)
 from snuba.utils.metrics.wrapper import MetricsWrapper
 from snuba.web import QueryResult
 
@@ -37,6 +44,13 @@ metrics = MetricsWrapper(environment.metrics, "query.splitter")
 # queries before hitting the 90d limit (2+20+200+2000 hours == 92 days).
 STEP_GROWTH = 10
 
+# Runs the time windows issued speculatively by TimeSplitQueryStrategy. The
+# number of windows in flight for a single query is bounded by the
+# split_parallel_windows runtime config.
+split_executor = ThreadPoolExecutor(
+    max_workers=settings.TIME_SPLIT_MAX_WORKERS, thread_name_prefix="time-split"
+)
+
 
 def _replace_ast_condition(
     query: Query, field: str, operator: str, new_operand: Expression
@@ -72,15 +86,79 @@ def _replace_ast_condition(
         )
 
 
+def _split_windows(
+    from_date: datetime, to_date: datetime, split_step: int
+) -> Iterator[Tuple[datetime, datetime]]:
+    """
+    Yields the time windows from the most recent one backwards, growing
+    the size of each window by STEP_GROWTH.
+    """
+    split_end = to_date
+    while from_date < split_end:
+        try:
+            split_start = max(split_end - timedelta(seconds=split_step), from_date)
+        except OverflowError:
+            split_start = from_date
+        yield split_start, split_end
+        split_end = split_start
+        split_step = split_step * STEP_GROWTH
+
+
 class TimeSplitQueryStrategy(QuerySplitStrategy):
     """
     A strategy that breaks the time window into smaller ones and executes
     them in sequence.
+
+    If the split_parallel_windows runtime config is higher than 1, up to
+    that many windows, of geometrically growing size, are executed
+    concurrently. Results are still consumed from the most recent window
+    backwards and the windows that were not started yet are cancelled as
+    soon as the limit is reached. Windows that are already running cannot
+    be interrupted, their results are discarded.
+
+    Every window is a query of its own, so each running window takes a slot
+    of the concurrent rate limits of the query. This is why the number of
+    windows in flight is capped by TIME_SPLIT_MAX_PARALLEL_WINDOWS.
+
+    Concurrent windows record their timings and queries separately, they
+    are merged into the ones of the request as the windows are consumed.
+    The windows whose results are discarded are not recorded.
     """
 
     def __init__(self, timestamp_col: str) -> None:
         self.__timestamp_col = timestamp_col
 
+    def __build_split_query(
+        self,
+        query: Query,
+        split_start: datetime,
+        split_end: datetime,
+        limit: int,
+    ) -> Query:
+        """
+        Builds the query for a single window. Each window gets a copy of
+        its own since windows may be executed concurrently and the query
+        is modified when executed. Expressions are immutable and the query
+        processors replace them instead of modifying them, so the copy is
+        shallow and only the condition is rebuilt. The experiments are
+        the only mutable part of the query.
+        """
+        split_query = copy.copy(query)
+        split_query.set_experiments(dict(query.get_experiments()))
+
+        _replace_ast_condition(
+            split_query, self.__timestamp_col, ">=", LiteralExpr(None, split_start)
+        )
+        _replace_ast_condition(
+            split_query, self.__timestamp_col, "<", LiteralExpr(None, split_end)
+        )
+
+        # Because its paged, we have to ask for (limit+offset) results
+        # and set offset=0 so we can then trim them ourselves.
+        split_query.set_offset(0)
+        split_query.set_limit(limit)
+        return split_query
+
     def execute(
         self,
         query: Query,
@@ -119,10 +197,26 @@ class TimeSplitQueryStrategy(QuerySplitStrategy):
         if from_date_ast is None or to_date_ast is None:
             return None
 
-        date_align, split_step = state.get_configs(
-            [("date_align_seconds", 1), ("split_step", 3600)]  # default 1 hour
+        date_align, split_step, parallel_windows = state.get_configs(
+            [
+                ("date_align_seconds", 1),
+                ("split_step", 3600),  # default 1 hour
+                ("split_parallel_windows", 1),
+            ]
         )
         assert isinstance(split_step, int)
+        parallel_windows = min(
+            int(parallel_windows or 1), settings.TIME_SPLIT_MAX_PARALLEL_WINDOWS
+        )
+        if parallel_windows > 1:
+            return self.__execute_parallel(
+                query,
+                query_settings,
+                runner,
+                _split_windows(from_date_ast, to_date_ast, split_step),
+                parallel_windows,
+            )
+
         remaining_offset = query.get_offset()
 
         overall_result: Optional[QueryResult] = None
@@ -130,22 +224,13 @@ class TimeSplitQueryStrategy(QuerySplitStrategy):
         split_start = max(split_end - timedelta(seconds=split_step), from_date_ast)
         total_results = 0
         while split_start < split_end and total_results < limit:
-            # We need to make a copy to use during the query execution because we replace
-            # the start-end conditions on the query at each iteration of this loop.
-            split_query = copy.deepcopy(query)
-
-            _replace_ast_condition(
-                split_query, self.__timestamp_col, ">=", LiteralExpr(None, split_start)
-            )
-            _replace_ast_condition(
-                split_query, self.__timestamp_col, "<", LiteralExpr(None, split_end)
+            split_query = self.__build_split_query(
+                query,
+                split_start,
+                split_end,
+                limit - total_results + remaining_offset,
             )
 
-            # Because its paged, we have to ask for (limit+offset) results
-            # and set offset=0 so we can then trim them ourselves.
-            split_query.set_offset(0)
-            split_query.set_limit(limit - total_results + remaining_offset)
-
             # At every iteration we only append the "data" key from the results returned by
             # the runner. The "extra" key is only populated at the first iteration of the
             # loop and never changed.
@@ -187,6 +272,67 @@ class TimeSplitQueryStrategy(QuerySplitStrategy):
 
         return overall_result
 
+    def __execute_parallel(
+        self,
+        query: Query,
+        query_settings: QuerySettings,
+        runner: SplitQueryRunner,
+        windows: Iterator[Tuple[datetime, datetime]],
+        parallel_windows: int,
+    ) -> Optional[QueryResult]:
+        limit = query.get_limit()
+        assert limit is not None
+        offset = query.get_offset()
+        # Any window may end up providing the whole page, and we do not
+        # know how many rows the previous windows return when issuing it.
+        window_limit = limit + offset
+
+        in_flight: Deque[Tuple[ConcurrentQueryMetadata, Future[QueryResult]]] = deque()
+
+        def submit_next_window() -> None:
+            window = next(windows, None)
+            if window is not None:
+                split_query = self.__build_split_query(query, *window, window_limit)
+                query_metadata = ConcurrentQueryMetadata()
+                future = split_executor.submit(
+                    run_with_concurrent_query_metadata,
+                    query_metadata,
+                    partial(runner, split_query, query_settings),
+                )
+                in_flight.append((query_metadata, future))
+
+        for _ in range(parallel_windows):
+            submit_next_window()
+
+        overall_result: Optional[QueryResult] = None
+        executed = 0
+        try:
+            while in_flight:
+                query_metadata, future = in_flight.popleft()
+                try:
+                    result = future.result()
+                finally:
+                    query_metadata.merge()
+                executed += 1
+                if overall_result is None:
+                    overall_result = result
+                else:
+                    overall_result.result["data"].extend(result.result["data"])
+
+                if len(overall_result.result["data"]) >= window_limit:
+                    break
+                submit_next_window()
+        finally:
+            cancelled = sum(1 for _, future in in_flight if future.cancel())
+            metrics.timing("time_split.parallel.executed", executed)
+            metrics.timing("time_split.parallel.wasted", len(in_flight) - cancelled)
+
+        if overall_result is not None:
+            overall_result.result["data"] = overall_result.result["data"][
+                offset:window_limit
+            ]
+        return overall_result
+
 
 class ColumnSplitQueryStrategy(QuerySplitStrategy):
     """
@@ -1,7 +1,7 @@
 import logging
 from abc import ABC, abstractmethod
 from datetime import datetime
-from typing import Any, Mapping, Optional
+from typing import Any, Mapping, Optional, Sequence, Tuple
 
 from snuba import settings
 from snuba.consumers.types import KafkaMessageMetadata
@@ -19,6 +19,7 @@ from snuba.datasets.metrics_messages import (
 )
 from snuba.datasets.processors import DatasetMessageProcessor
 from snuba.processor import InsertBatch, ProcessedMessage, _ensure_valid_date
+from snuba.writer import WriterTableRow
 
 DISABLED_MATERIALIZATION_VERSION = 1
 ILLEGAL_VALUE_FOR_COUNTER = "Illegal value for counter value."
@@ -38,6 +39,39 @@ class MetricsBucketProcessor(DatasetMessageProcessor, ABC):
     def process_message(
         self, message: Mapping[str, Any], metadata: KafkaMessageMetadata
     ) -> Optional[ProcessedMessage]:
+        row = self.__process_bucket(message, metadata, self.__get_mat_version())
+        if row is None:
+            return None
+
+        return InsertBatch([row], None)
+
+    def process_batch(
+        self, messages: Sequence[Tuple[Any, KafkaMessageMetadata]]
+    ) -> Optional[InsertBatch]:
+        mat_version = self.__get_mat_version()
+        rows = []
+        for message, metadata in messages:
+            row = self.__process_bucket(message, metadata, mat_version)
+            if row is not None:
+                rows.append(row)
+        if not rows:
+            return None
+
+        return InsertBatch(rows, None)
+
+    def __get_mat_version(self) -> int:
+        return (
+            DISABLED_MATERIALIZATION_VERSION
+            if settings.WRITE_METRICS_AGG_DIRECTLY
+            else settings.ENABLED_MATERIALIZATION_VERSION
+        )
+
+    def __process_bucket(
+        self,
+        message: Mapping[str, Any],
+        metadata: KafkaMessageMetadata,
+        mat_version: int,
+    ) -> Optional[WriterTableRow]:
         # TODO: Support messages with multiple buckets
 
         if not self._should_process(message):
@@ -55,18 +89,12 @@ class MetricsBucketProcessor(DatasetMessageProcessor, ABC):
             keys.append(int(key))
             values.append(value)
 
-        mat_version = (
-            DISABLED_MATERIALIZATION_VERSION
-            if settings.WRITE_METRICS_AGG_DIRECTLY
-            else settings.ENABLED_MATERIALIZATION_VERSION
-        )
-
         try:
             retention_days = enforce_retention(message["retention_days"], timestamp)
         except EventTooOld:
             return None
 
-        processed = {
+        return {
             "org_id": message["org_id"],
             "project_id": message["project_id"],
             "metric_id": message["metric_id"],
@@ -79,7 +107,6 @@ class MetricsBucketProcessor(DatasetMessageProcessor, ABC):
             "partition": metadata.partition,
             "offset": metadata.offset,
         }
-        return InsertBatch([processed], None)
 
 
 class SetsMetricsProcessor(MetricsBucketProcessor):
@@ -1,6 +1,6 @@
 import uuid
 from datetime import datetime
-from typing import Any, Mapping, Optional
+from typing import Any, Mapping, Optional, Sequence, Tuple
 
 from sentry_relay import DataCategory
 
@@ -14,6 +14,7 @@ from snuba.processor import (
     _unicodify,
 )
 from snuba.utils.metrics.wrapper import MetricsWrapper
+from snuba.writer import WriterTableRow
 
 metrics = MetricsWrapper(environment.metrics, "outcomes.processor")
 
@@ -38,6 +39,29 @@ class OutcomesProcessor(DatasetMessageProcessor):
     def process_message(
         self, value: Mapping[str, Any], metadata: KafkaMessageMetadata
     ) -> Optional[ProcessedMessage]:
+        row = self.__process_outcome(value)
+        if row is None:
+            return None
+
+        return InsertBatch([row], None)
+
+    def process_batch(
+        self, messages: Sequence[Tuple[Any, KafkaMessageMetadata]]
+    ) -> Optional[InsertBatch]:
+        rows = []
+        for value, _ in messages:
+            row = self.__process_outcome(value)
+            if row is not None:
+                rows.append(row)
+        if not rows:
+            return None
+
+        return InsertBatch(rows, None)
+
+    def __process_outcome(self, value: Mapping[str, Any]) -> Optional[WriterTableRow]:
+        """
+        Returns the row of the outcome, or None if it cannot be stored.
+        """
         assert isinstance(value, dict)
         v_uuid = value.get("event_id")
         reason = value.get("reason")
@@ -58,7 +82,6 @@ class OutcomesProcessor(DatasetMessageProcessor):
             if "quantity" not in value:
                 metrics.increment("missing_quantity")
 
-        message = None
         try:
             timestamp = _ensure_valid_date(
                 datetime.strptime(value["timestamp"], settings.PAYLOAD_DATETIME_FORMAT),
@@ -68,7 +91,7 @@ class OutcomesProcessor(DatasetMessageProcessor):
             timestamp = _ensure_valid_date(datetime.utcnow())
 
         try:
-            message = {
+            return {
                 "org_id": value.get("org_id", 0),
                 "project_id": value.get("project_id", 0),
                 "key_id": value.get("key_id"),
@@ -82,5 +105,3 @@ class OutcomesProcessor(DatasetMessageProcessor):
         except Exception:
             metrics.increment("bad_outcome")
             return None
-
-        return InsertBatch([message], None)
@@ -0,0 +1,89 @@
+"""
+Merging of the rows written to a storage within a consumer batch.
+
+Some storages receive a lot of rows that only differ by values ClickHouse
+aggregates anyway, by materialized views or by the table engine. A storage
+can declare which columns identify a row and how the other columns of two
+rows with the same key merge, and the consumer then writes one row per key
+and batch instead of one row per message.
+
+Only storages where merging rows gives the same end result can declare it:
+a materialized view counting rows, for instance, would count fewer rows.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Sequence, Tuple
+
+from snuba.writer import WriterTableRow
+
+Merge = Callable[[Any, Any], Any]
+
+_MISSING = object()
+
+
+def sum_values(left: Any, right: Any) -> Any:
+    return left + right
+
+
+def max_value(left: Any, right: Any) -> Any:
+    return max(left, right)
+
+
+def concat_values(left: Sequence[Any], right: Sequence[Any]) -> Sequence[Any]:
+    return [*left, *right]
+
+
+def union_values(left: Sequence[Any], right: Sequence[Any]) -> Sequence[Any]:
+    return list(dict.fromkeys([*left, *right]))
+
+
+def _hashable(value: Any) -> Any:
+    if isinstance(value, list):
+        return tuple(_hashable(item) for item in value)
+    return value
+
+
+@dataclass(frozen=True)
+class RowAggregation:
+    """
+    Rows with the same values in the key columns are merged by applying the
+    merge function of each of the merged columns. Rows with a column that is
+    neither a key nor merged are written as they are.
+    """
+
+    key_columns: Sequence[str]
+    merged_columns: Mapping[str, Merge]
+
+    def aggregate(self, rows: Iterable[WriterTableRow]) -> Sequence[WriterTableRow]:
+        known_columns = {*self.key_columns, *self.merged_columns}
+        aggregated: Dict[Tuple[Any, ...], WriterTableRow] = {}
+        # Rows are copied the first time something is merged into them.
+        merged: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+        unmerged: List[WriterTableRow] = []
+
+        for row in rows:
+            if not row.keys() <= known_columns:
+                unmerged.append(row)
+                continue
+
+            key = tuple(
+                _hashable(row.get(column, _MISSING)) for column in self.key_columns
+            )
+            if key not in aggregated:
+                aggregated[key] = row
+                continue
+
+            existing = merged.get(key)
+            if existing is None:
+                existing = merged[key] = dict(aggregated[key])
+                aggregated[key] = existing
+            for column, merge in self.merged_columns.items():
+                if column not in row:
+                    continue
+                if column in existing:
+                    existing[column] = merge(existing[column], row[column])
+                else:
+                    existing[column] = row[column]
+
+        return [*aggregated.values(), *unmerged]
@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
 from typing import Any, NamedTuple, Optional, Sequence
 
+from snuba.clickhouse.compression import InsertCompression
 from snuba.clickhouse.translators.snuba.mapping import TranslationMappers
 from snuba.clusters.cluster import (
     ClickhouseCluster,
@@ -9,6 +10,7 @@ from snuba.clusters.cluster import (
 )
 from snuba.clusters.storage_sets import StorageSetKey
 from snuba.datasets.plans.splitters import QuerySplitStrategy
+from snuba.datasets.row_aggregation import RowAggregation
 from snuba.datasets.schemas import Schema
 from snuba.datasets.schemas.tables import WritableTableSchema, WriteFormat
 from snuba.datasets.storages.storage_key import StorageKey
@@ -149,6 +151,8 @@ class WritableTableStorage(ReadableTableStorage, WritableStorage):
         writer_options: ClickhouseWriterOptions = None,
         write_format: WriteFormat = WriteFormat.JSON,
         ignore_write_errors: bool = False,
+        row_aggregation: Optional[RowAggregation] = None,
+        insert_compression: Optional[InsertCompression] = None,
     ) -> None:
         super().__init__(
             storage_key,
@@ -166,6 +170,8 @@ class WritableTableStorage(ReadableTableStorage, WritableStorage):
             replacer_processor=replacer_processor,
             writer_options=writer_options,
             write_format=write_format,
+            row_aggregation=row_aggregation,
+            insert_compression=insert_compression,
         )
         self.__ignore_write_errors = ignore_write_errors
 
@@ -31,6 +31,13 @@ from snuba.datasets.processors.metrics_aggregate_processor import (
 from snuba.datasets.processors.metrics_bucket_processor import (
     PolymorphicMetricsProcessor,
 )
+from snuba.datasets.row_aggregation import (
+    RowAggregation,
+    concat_values,
+    max_value,
+    sum_values,
+    union_values,
+)
 from snuba.datasets.schemas.tables import TableSchema, WritableTableSchema, WriteFormat
 from snuba.datasets.storage import ReadableTableStorage, WritableTableStorage
 from snuba.datasets.storages.storage_key import StorageKey
@@ -97,6 +104,30 @@ polymorphic_bucket = WritableTableStorage(
         subscription_result_topic=Topic.SUBSCRIPTION_RESULTS_METRICS,
         dead_letter_queue_policy_creator=produce_policy_creator,
     ),
+    # The materialized views reading from this table aggregate every value
+    # of the rows, not the rows themselves, so buckets of a batch with the
+    # same key can be merged.
+    row_aggregation=RowAggregation(
+        key_columns=[
+            "use_case_id",
+            "org_id",
+            "project_id",
+            "metric_id",
+            "timestamp",
+            "tags.key",
+            "tags.value",
+            "metric_type",
+            "materialization_version",
+            "retention_days",
+            "partition",
+        ],
+        merged_columns={
+            "count_value": sum_values,
+            "set_values": union_values,
+            "distribution_values": concat_values,
+            "offset": max_value,
+        },
+    ),
 )
 
 aggregated_columns = [
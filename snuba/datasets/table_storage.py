@@ -6,7 +6,14 @@ from arroyo.processing.strategies.dead_letter_queue.policies.abstract import (
 )
 
 from snuba import settings
-from snuba.clickhouse.http import InsertStatement, JSONRow
+from snuba.clickhouse.compression import InsertCompression
+from snuba.clickhouse.http import (
+    InsertStatement,
+    JSONRow,
+    JSONRowEncoder,
+    ValuesRowEncoder,
+)
+from snuba.clickhouse.row_binary import RowBinaryRowEncoder
 from snuba.clusters.cluster import (
     ClickhouseClientSettings,
     ClickhouseWriterOptions,
@@ -14,6 +21,7 @@ from snuba.clusters.cluster import (
 )
 from snuba.clusters.storage_sets import StorageSetKey
 from snuba.datasets.message_filters import StreamMessageFilter
+from snuba.datasets.row_aggregation import RowAggregation
 from snuba.datasets.schemas.tables import WritableTableSchema, WriteFormat
 from snuba.processor import MessageProcessor
 from snuba.replacers.replacer_processor import ReplacerProcessor
@@ -21,10 +29,11 @@ from snuba.snapshots import BulkLoadSource
 from snuba.snapshots.loaders import BulkLoader
 from snuba.snapshots.loaders.single_table import RowProcessor, SingleTableBulkLoader
 from snuba.subscriptions.utils import SchedulingWatermarkMode
+from snuba.utils.codecs import Encoder
 from snuba.utils.metrics import MetricsBackend
-from snuba.utils.schemas import ReadOnly
+from snuba.utils.schemas import FlattenedColumn, ReadOnly
 from snuba.utils.streams.topics import Topic, get_topic_creation_config
-from snuba.writer import BatchWriter
+from snuba.writer import BatchWriter, WriterTableRow
 
 
 class KafkaTopicSpec:
@@ -208,6 +217,8 @@ class TableWriter:
         replacer_processor: Optional[ReplacerProcessor[Any]] = None,
         writer_options: ClickhouseWriterOptions = None,
         write_format: WriteFormat = WriteFormat.JSON,
+        row_aggregation: Optional[RowAggregation] = None,
+        insert_compression: Optional[InsertCompression] = None,
     ) -> None:
         self.__storage_set = storage_set
         self.__table_schema = write_schema
@@ -215,6 +226,9 @@ class TableWriter:
         self.__replacer_processor = replacer_processor
         self.__writer_options = writer_options
         self.__write_format = write_format
+        self.__row_aggregation = row_aggregation
+        self.__insert_compression = insert_compression
+        self.__row_encoder: Optional[Encoder[bytes, WriterTableRow]] = None
 
     def get_schema(self) -> WritableTableSchema:
         return self.__table_schema
@@ -225,6 +239,7 @@ class TableWriter:
         options: ClickhouseWriterOptions = None,
         table_name: Optional[str] = None,
         chunk_size: int = settings.CLICKHOUSE_HTTP_CHUNK_SIZE,
+        max_connections: int = 1,
     ) -> BatchWriter[JSONRow]:
         table_name = table_name or self.__table_schema.get_table_name()
         if self.__write_format == WriteFormat.JSON:
@@ -236,6 +251,12 @@ class TableWriter:
                 .with_format("VALUES")
                 .with_columns(column_names)
             )
+        elif self.__write_format == WriteFormat.ROW_BINARY:
+            insert_statement = (
+                InsertStatement(table_name)
+                .with_format("RowBinary")
+                .with_columns(self.get_writeable_columns())
+            )
         else:
             raise TypeError("unknown table format", self.__write_format)
         options = self.__update_writer_options(options)
@@ -247,15 +268,45 @@ class TableWriter:
             options=options,
             chunk_size=chunk_size,
             buffer_size=0,
+            compression=self.__insert_compression,
+            max_connections=max_connections,
         )
 
     def get_writeable_columns(self) -> Sequence[str]:
+        return [column.flattened for column in self.__get_writeable_flattened_columns()]
+
+    def __get_writeable_flattened_columns(self) -> Sequence[FlattenedColumn]:
         return [
-            column.flattened
+            column
             for column in self.get_schema().get_columns()
             if not column.type.has_modifier(ReadOnly)
         ]
 
+    def get_row_encoder(self) -> Encoder[bytes, WriterTableRow]:
+        """
+        Returns the encoder of the rows produced by the processor of the
+        storage, in the format of the insert statement of ``get_batch_writer``.
+        """
+        if self.__row_encoder is None:
+            if self.__write_format == WriteFormat.JSON:
+                self.__row_encoder = JSONRowEncoder()
+            elif self.__write_format == WriteFormat.VALUES:
+                self.__row_encoder = ValuesRowEncoder(self.get_writeable_columns())
+            elif self.__write_format == WriteFormat.ROW_BINARY:
+                self.__row_encoder = RowBinaryRowEncoder(
+                    self.__get_writeable_flattened_columns()
+                )
+            else:
+                raise TypeError("unknown table format", self.__write_format)
+        return self.__row_encoder
+
+    def get_row_aggregation(self) -> Optional[RowAggregation]:
+        """
+        How the rows written in a batch by the consumer can be merged, if
+        they can.
+        """
+        return self.__row_aggregation
+
     def get_bulk_writer(
         self,
         metrics: MetricsBackend,
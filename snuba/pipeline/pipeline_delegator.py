@@ -1,9 +1,14 @@
 import copy
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import replace
 from functools import partial
-from typing import Callable, List, Mapping, Optional, Tuple
+from threading import Lock
+from typing import Callable, List, Mapping, MutableMapping, Optional, Tuple, Union
 
-from snuba import state
+from snuba import environment, settings, state
+from snuba.clickhouse.formatter.query import format_query
+from snuba.clickhouse.query import Query
 from snuba.datasets.plans.query_plan import ClickhouseQueryPlan, QueryRunner
 from snuba.pipeline.query_pipeline import (
     QueryExecutionPipeline,
@@ -11,13 +16,26 @@ from snuba.pipeline.query_pipeline import (
     QueryPlanner,
 )
 from snuba.pipeline.settings_delegator import RateLimiterDelegate
+from snuba.query.composite import CompositeQuery
+from snuba.query.data_source.simple import Table
 from snuba.query.logical import Query as LogicalQuery
 from snuba.query.query_settings import QuerySettings
+from snuba.reader import Reader
 from snuba.request import Request
 from snuba.state import get_config
+from snuba.utils.metrics.wrapper import MetricsWrapper
 from snuba.utils.threaded_function_delegator import Result, ThreadedFunctionDelegator
 from snuba.web import QueryResult
 
+metrics = MetricsWrapper(environment.metrics, "pipeline_delegator")
+
+# Shared by all the delegators of the process, so the number of threads
+# running secondary pipelines is bounded regardless of the traffic.
+executor = ThreadPoolExecutor(
+    max_workers=settings.PIPELINE_DELEGATOR_MAX_WORKERS,
+    thread_name_prefix="pipeline-delegator",
+)
+
 BuilderId = str
 Timing = float
 QueryPipelineBuilders = Mapping[BuilderId, QueryPipelineBuilder[ClickhouseQueryPlan]]
@@ -43,6 +61,84 @@ def _is_query_copying_disallowed(current_referrer: str) -> bool:
     return False
 
 
+class _Execution:
+    def __init__(self) -> None:
+        self.future: Future[QueryResult] = Future()
+        self.followers = 0
+
+
+class SharedQueryRunner:
+    """
+    Wraps the query runner of the delegates of a MultipleConcurrentPipeline
+    so that delegates whose storage query formats to the same SQL on the
+    same cluster run it once. The first delegate to get there runs the
+    query (rate limiting, cache and ClickHouse), the ones arriving while
+    it is running wait for it and get a copy of its result.
+
+    Only successful executions are shared: if the query fails the waiting
+    delegates run it on their own, since the failure may be specific to
+    the delegate that ran it (a rate limit on its namespace for instance).
+    Delegates arriving after the query completed run it as well.
+    """
+
+    def __init__(self, runner: QueryRunner) -> None:
+        self.__runner = runner
+        self.__lock = Lock()
+        self.__executions: MutableMapping[Tuple[str, Reader], _Execution] = {}
+
+    def __call__(
+        self,
+        query: Union[Query, CompositeQuery[Table]],
+        query_settings: QuerySettings,
+        reader: Reader,
+    ) -> QueryResult:
+        key = (format_query(query).get_sql(), reader)
+        with self.__lock:
+            execution = self.__executions.get(key)
+            if execution is None:
+                execution = _Execution()
+                self.__executions[key] = execution
+                leader = True
+            else:
+                execution.followers += 1
+                leader = False
+
+        if leader:
+            return self.__lead(key, execution, query, query_settings, reader)
+
+        try:
+            result = execution.future.result()
+        except Exception:
+            metrics.increment("shared_execution", tags={"status": "failed"})
+            return self.__runner(query, query_settings, reader)
+        metrics.increment("shared_execution", tags={"status": "success"})
+        return copy.deepcopy(result)
+
+    def __lead(
+        self,
+        key: Tuple[str, Reader],
+        execution: _Execution,
+        query: Union[Query, CompositeQuery[Table]],
+        query_settings: QuerySettings,
+        reader: Reader,
+    ) -> QueryResult:
+        try:
+            result = self.__runner(query, query_settings, reader)
+        except BaseException as e:
+            with self.__lock:
+                del self.__executions[key]
+            execution.future.set_exception(e)
+            raise
+
+        with self.__lock:
+            del self.__executions[key]
+            followers = execution.followers
+        # The caller owns the result and can modify it as soon as it is
+        # returned, so followers get a copy made before that.
+        execution.future.set_result(copy.deepcopy(result) if followers else result)
+        return result
+
+
 class MultipleConcurrentPipeline(QueryExecutionPipeline):
     """
     A query pipeline that executes a request against one or more other pipelines
@@ -64,6 +160,10 @@ class MultipleConcurrentPipeline(QueryExecutionPipeline):
     will be executed in separate threads. The results of these other queries are
     provided to the callback function if one is provided.
 
+    Pipelines producing the same SQL share its execution (see SharedQueryRunner)
+    unless the pipeline_delegator_share_executions runtime config is 0. The
+    execution time of each pipeline is recorded as the delegate metric.
+
     This component is produced by the PipelineDelegator.
     """
 
@@ -83,9 +183,9 @@ class MultipleConcurrentPipeline(QueryExecutionPipeline):
         self.__ignore_secondary_exceptions = ignore_secondary_exceptions
         self.__query_pipeline_builders = query_pipeline_builders
 
-        self.__selector_func = lambda query: selector_func(
-            query, self.__request.referrer
-        )
+        self.__selector_func: Callable[
+            [LogicalQuery], Tuple[BuilderId, List[BuilderId]]
+        ] = lambda query: selector_func(query, self.__request.referrer)
 
         self.__callback_func = (
             partial(
@@ -120,22 +220,60 @@ class MultipleConcurrentPipeline(QueryExecutionPipeline):
                 query_settings=RateLimiterDelegate(builder_id, request.query_settings),
             )
 
-        executor = ThreadedFunctionDelegator[LogicalQuery, QueryResult](
+        runner: QueryRunner = self.__runner
+        if get_config("pipeline_delegator_share_executions", 1):
+            runner = SharedQueryRunner(runner)
+
+        primary_builder_id: Optional[BuilderId] = None
+
+        def select(query: LogicalQuery) -> Tuple[BuilderId, List[BuilderId]]:
+            nonlocal primary_builder_id
+            primary_builder_id, others = self.__selector_func(query)
+            return primary_builder_id, others
+
+        def timed(
+            builder_id: BuilderId, execute: Callable[[], QueryResult]
+        ) -> Callable[[], QueryResult]:
+            def run() -> QueryResult:
+                start = time.time()
+                status = "error"
+                try:
+                    result = execute()
+                    status = "success"
+                    return result
+                finally:
+                    metrics.timing(
+                        "delegate",
+                        (time.time() - start) * 1000,
+                        tags={
+                            "builder_id": builder_id,
+                            "primary": str(builder_id == primary_builder_id),
+                            "status": status,
+                        },
+                    )
+
+            return run
+
+        delegator = ThreadedFunctionDelegator[LogicalQuery, QueryResult](
             callables={
-                builder_id: builder.build_execution_pipeline(
-                    build_delegate_request(self.__request, builder_id)
-                    if self.__split_rate_limtier
-                    else self.__request,
-                    self.__runner,
-                ).execute
+                builder_id: timed(
+                    builder_id,
+                    builder.build_execution_pipeline(
+                        build_delegate_request(self.__request, builder_id)
+                        if self.__split_rate_limtier
+                        else self.__request,
+                        runner,
+                    ).execute,
+                )
                 for builder_id, builder in self.__query_pipeline_builders.items()
             },
-            selector_func=self.__selector_func,
+            selector_func=select,
             callback_func=self.__callback_func,
             ignore_secondary_exceptions=self.__ignore_secondary_exceptions,
+            executor=executor,
         )
         assert isinstance(self.__request.query, LogicalQuery)
-        return executor.execute(self.__request.query)
+        return delegator.execute(self.__request.query)
 
 
 class PipelineDelegator(QueryPipelineBuilder[ClickhouseQueryPlan]):
@@ -71,3 +71,9 @@ class RateLimiterDelegate(QuerySettings):
 
     def set_resource_quota(self, quota: ResourceQuota) -> None:
         self.__delegate.set_resource_quota(quota)
+
+    def get_columnar_results(self) -> bool:
+        return self.__delegate.get_columnar_results()
+
+    def set_columnar_results(self, columnar_results: bool) -> None:
+        self.__delegate.set_columnar_results(columnar_results)
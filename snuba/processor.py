@@ -63,6 +63,24 @@ class MessageProcessor(ABC):
     ) -> Optional[ProcessedMessage]:
         raise NotImplementedError
 
+    def process_batch(
+        self, messages: Sequence[Tuple[Any, KafkaMessageMetadata]]
+    ) -> Optional[InsertBatch]:
+        """
+        Processes a block of messages at once and returns the rows of all of
+        them, which lets processors share work between messages. It is
+        optional: the consumers of processors that do not override it call
+        process_message for every message.
+
+        If it raises, every message of the block goes through
+        process_message so the invalid ones are reported individually.
+        """
+        raise NotImplementedError
+
+
+def supports_batch_processing(processor: MessageProcessor) -> bool:
+    return type(processor).process_batch is not MessageProcessor.process_batch
+
 
 class InvalidMessageType(SerializableException):
     pass
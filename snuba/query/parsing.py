@@ -1,4 +1,4 @@
-from typing import List
+from typing import Set
 
 
 class ParsingContext:
@@ -9,11 +9,11 @@ class ParsingContext:
     """
 
     def __init__(self, sort_fields: bool = False) -> None:
-        self.__alias_cache: List[str] = []
+        self.__alias_cache: Set[str] = set()
         self.sort_fields = sort_fields
 
     def add_alias(self, alias: str) -> None:
-        self.__alias_cache.append(alias)
+        self.__alias_cache.add(alias)
 
     def is_alias_present(self, alias: str) -> bool:
         return alias in self.__alias_cache
@@ -1,4 +1,4 @@
-from typing import Mapping, Optional, Sequence
+from typing import Mapping, Optional, Sequence, Tuple
 
 from snuba.query.conditions import ConditionFunctions
 from snuba.query.dsl import multiply
@@ -9,7 +9,7 @@ from snuba.query.matchers import Any
 from snuba.query.matchers import Column as ColumnMatch
 from snuba.query.matchers import FunctionCall as FunctionCallMatch
 from snuba.query.matchers import Literal as LiteralMatch
-from snuba.query.matchers import Or, Param, String
+from snuba.query.matchers import MatchResult, Or, Param, Pattern, String
 from snuba.query.processors.logical import LogicalQueryProcessor
 from snuba.query.query_settings import QuerySettings
 from snuba.util import parse_datetime
@@ -198,57 +198,92 @@ GRANULARITY_MAPPING = {
 }
 
 
-def extract_granularity_from_query(query: Query, column: str) -> Optional[int]:
+def _time_bucket_pattern(column_name: Pattern[str]) -> Pattern[Expression]:
     """
-    This extracts the `granularity` from the `groupby` statement of the query.
-    The matches are essentially the reverse of `TimeSeriesProcessor.__group_time_function`.
+    Matches the time bucket expressions built by
+    `TimeSeriesProcessor.__group_time_function` on the given column.
     """
-    groupby = query.get_groupby()
-
-    column_match = ColumnMatch(None, String(column))
-    fn_match = FunctionCallMatch(
-        Param(
-            "time_fn",
-            Or(
-                [
-                    String("toStartOfHour"),
-                    String("toStartOfMinute"),
-                    String("toStartOfDay"),
-                    String("toDate"),
-                ]
+    column_match = ColumnMatch(None, column_name)
+    return Or(
+        [
+            FunctionCallMatch(
+                Param(
+                    "time_fn",
+                    Or(
+                        [
+                            String("toStartOfHour"),
+                            String("toStartOfMinute"),
+                            String("toStartOfDay"),
+                            String("toDate"),
+                        ]
+                    ),
+                ),
+                (column_match,),
+                with_optionals=True,
             ),
-        ),
-        (column_match,),
-        with_optionals=True,
-    )
-    expr_match = FunctionCallMatch(
-        String("toDateTime"),
-        (
             FunctionCallMatch(
-                String("multiply"),
+                String("toDateTime"),
                 (
                     FunctionCallMatch(
-                        String("intDiv"),
+                        String("multiply"),
                         (
-                            FunctionCallMatch(String("toUInt32"), (column_match,)),
+                            FunctionCallMatch(
+                                String("intDiv"),
+                                (
+                                    FunctionCallMatch(
+                                        String("toUInt32"), (column_match,)
+                                    ),
+                                    LiteralMatch(Param("granularity", Any(int))),
+                                ),
+                            ),
                             LiteralMatch(Param("granularity", Any(int))),
                         ),
                     ),
-                    LiteralMatch(Param("granularity", Any(int))),
+                    LiteralMatch(Any(str)),
                 ),
             ),
-            LiteralMatch(Any(str)),
-        ),
+        ]
     )
 
+
+def _granularity(result: MatchResult) -> int:
+    if result.contains("time_fn"):
+        return GRANULARITY_MAPPING[result.string("time_fn")]
+    return result.integer("granularity")
+
+
+def extract_granularity_from_query(query: Query, column: str) -> Optional[int]:
+    """
+    This extracts the `granularity` from the `groupby` statement of the query.
+    The matches are essentially the reverse of `TimeSeriesProcessor.__group_time_function`.
+    """
+    groupby = query.get_groupby()
+    pattern = _time_bucket_pattern(String(column))
+
     for top_expr in groupby:
         for expr in top_expr:
-            result = fn_match.match(expr)
+            result = pattern.match(expr)
             if result is not None:
-                return GRANULARITY_MAPPING[result.string("time_fn")]
-
-            result = expr_match.match(expr)
-            if result is not None:
-                return result.integer("granularity")
+                return _granularity(result)
 
     return None
+
+
+_ANY_TIME_BUCKET = _time_bucket_pattern(Param("column_name", Any(str)))
+
+
+def get_time_bucket(exp: Expression) -> Optional[Tuple[str, int]]:
+    """
+    Returns the column and the granularity in seconds of a time bucket
+    expression built by TimeSeriesProcessor, or None if the expression is
+    not a time bucket. Unlike `extract_granularity_from_query`, it also
+    works on the Clickhouse query.
+    """
+    result = _ANY_TIME_BUCKET.match(exp)
+    if result is None:
+        return None
+    if result.contains("time_fn") and (
+        result.string("time_fn") not in GRANULARITY_MAPPING
+    ):
+        return None
+    return result.string("column_name"), _granularity(result)
@@ -15,7 +15,7 @@ from snuba.query.expressions import Column, FunctionCall, Literal
 from snuba.query.processors.physical import ClickhouseQueryProcessor
 from snuba.query.query_settings import QuerySettings
 from snuba.replacers.replacer_processor import ReplacerState
-from snuba.state import get_config
+from snuba.state import get_config, get_int_set_config
 from snuba.utils.metrics.wrapper import MetricsWrapper
 
 logger = logging.getLogger(__name__)
@@ -53,16 +53,12 @@ class PostReplacementConsistencyEnforcer(ClickhouseQueryProcessor):
             self._set_query_final(query, False)
             return
 
-        for denied_project_id_string in (
-            get_config("post_replacement_consistency_projects_denylist") or "[]"
-        )[1:-1].split(","):
-            if (
-                denied_project_id_string
-                and int(denied_project_id_string) in project_ids
-            ):
-                metrics.increment(name=CONSISTENCY_DENYLIST_METRIC)
-                self._set_query_final(query, True)
-                return
+        if not get_int_set_config(
+            "post_replacement_consistency_projects_denylist"
+        ).isdisjoint(project_ids):
+            metrics.increment(name=CONSISTENCY_DENYLIST_METRIC)
+            self._set_query_final(query, True)
+            return
 
         flags: ProjectsQueryFlags = ProjectsQueryFlags.load_from_redis(
             list(project_ids), self.__replacer_state_name
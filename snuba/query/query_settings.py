@@ -52,6 +52,18 @@ class QuerySettings(ABC):
     def set_resource_quota(self, quota: ResourceQuota) -> None:
         pass
 
+    @abstractmethod
+    def get_columnar_results(self) -> bool:
+        """
+        Whether the rows of the result can be returned as ``ColumnarRows``.
+        Only set by callers that can take advantage of it.
+        """
+        pass
+
+    @abstractmethod
+    def set_columnar_results(self, columnar_results: bool) -> None:
+        pass
+
 
 # TODO: I don't like that there are two different classes for the same thing
 # this could probably be replaces with a `source` attribute on the class
@@ -80,6 +92,7 @@ class HTTPQuerySettings(QuerySettings):
         self.__legacy = legacy
         self.__rate_limit_params: List[RateLimitParameters] = []
         self.__resource_quota: Optional[ResourceQuota] = None
+        self.__columnar_results = False
         self.referrer = referrer
 
     def get_turbo(self) -> bool:
@@ -109,6 +122,12 @@ class HTTPQuerySettings(QuerySettings):
     def set_resource_quota(self, quota: ResourceQuota) -> None:
         self.__resource_quota = quota
 
+    def get_columnar_results(self) -> bool:
+        return self.__columnar_results
+
+    def set_columnar_results(self, columnar_results: bool) -> None:
+        self.__columnar_results = columnar_results
+
 
 class SubscriptionQuerySettings(QuerySettings):
     """
@@ -170,3 +189,9 @@ class SubscriptionQuerySettings(QuerySettings):
 
     def set_resource_quota(self, quota: ResourceQuota) -> None:
         pass
+
+    def get_columnar_results(self) -> bool:
+        return False
+
+    def set_columnar_results(self, columnar_results: bool) -> None:
+        pass
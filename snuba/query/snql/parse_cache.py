@@ -0,0 +1,375 @@
+"""
+Cache of parsed SnQL query bodies.
+
+Most of the queries received are generated by a handful of products and
+only differ from each other by the literals they contain (project ids, time
+ranges, tag values). Parsing the body with the SnQL grammar is expensive, so
+the result of a parse is kept as a template keyed by the shape of the body:
+the body with its literals lifted out. A query with a known shape is built
+by copying the template and binding the literals of the query into it,
+without running the grammar.
+
+Not every literal can be lifted. Some literals in the body are not turned
+into ``Literal`` expressions by the parser (``LIMIT 10`` for instance sets
+an attribute of the query). To build a template the body is parsed again
+with each literal replaced by a unique sentinel value, and only the literals
+whose sentinel shows up as a ``Literal`` in the resulting AST are lifted.
+The text of the other literals becomes part of the template key. The
+template is then bound to the literals of the body it was built from and
+compared with the regular parse: if they differ the shape is never cached.
+
+Building a template costs up to two more runs of the grammar, so it is only
+done the second time a shape is seen: queries that are never repeated only
+pay for the regular parse. The shapes that cannot be cached are remembered
+apart from the templates, so they are not analysed again when templates are
+evicted.
+"""
+from __future__ import annotations
+
+import copy
+import re
+from collections import OrderedDict
+from dataclasses import replace
+from enum import Enum
+from threading import Lock
+from typing import (
+    Any,
+    Callable,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+from snuba.query.composite import CompositeQuery
+from snuba.query.data_source.simple import Entity as QueryEntity
+from snuba.query.expressions import Expression, Literal
+from snuba.query.logical import Query as LogicalQuery
+from snuba.query.snql.expression_visitor import (
+    numeric_literal_value,
+    quoted_literal_value,
+)
+
+ParsedQuery = Union[CompositeQuery[QueryEntity], LogicalQuery]
+
+# The same expression as the ``quoted_literal`` rule of the SnQL grammar, so
+# strings are split exactly where the parser splits them. Numbers are only
+# matched when they are not part of a name. The sign is never lifted.
+LITERALS_RE = re.compile(
+    r"(?P<string>(?<!\\)'(?:(?<!\\)(?:\\{2})*\\'|[^'])*(?<!\\)(?:\\{2})*')"
+    r"|(?<![\w.])(?P<number>[0-9]+(?:\.[0-9]+)?(?:e[\+\-][0-9]+)?)(?![\w.])"
+)
+
+KIND_STRING = "s"
+KIND_INT = "i"
+KIND_FLOAT = "f"
+
+SENTINEL_BASE = 987654321000
+
+
+class CacheStatus(Enum):
+    HIT = "hit"
+    MISS = "miss"
+    UNCACHEABLE = "uncacheable"
+
+
+class LiteralToken(NamedTuple):
+    kind: str
+    text: str
+    start: int
+    end: int
+
+
+# The body without its literals, and the kind of each literal.
+Shape = Tuple[Tuple[str, ...], Tuple[str, ...]]
+
+
+class Template(NamedTuple):
+    query: LogicalQuery
+    # Index of each lifted literal in the body and the sentinel value it
+    # has in the template.
+    lifted: Sequence[Tuple[int, Any]]
+
+
+def tokenize(body: str) -> Tuple[Shape, Sequence[LiteralToken]]:
+    """
+    Splits a query body into its shape and its literals.
+    """
+    segments = []
+    tokens = []
+    position = 0
+    for match in LITERALS_RE.finditer(body):
+        text = match.group(0)
+        if match.group("string") is not None:
+            kind = KIND_STRING
+        else:
+            kind = (
+                KIND_INT if isinstance(numeric_literal_value(text), int) else KIND_FLOAT
+            )
+        segments.append(body[position : match.start()])
+        tokens.append(LiteralToken(kind, text, match.start(), match.end()))
+        position = match.end()
+    segments.append(body[position:])
+    return (tuple(segments), tuple(token.kind for token in tokens)), tokens
+
+
+def _sentinel(kind: str, index: int) -> Tuple[str, Any]:
+    """
+    The text to put in the body in place of a literal and the value the
+    parser is expected to produce for it.
+    """
+    if kind == KIND_STRING:
+        value = f"__snql_literal_{index}__"
+        return f"'{value}'", value
+    if kind == KIND_INT:
+        return str(SENTINEL_BASE + index), SENTINEL_BASE + index
+    return f"{SENTINEL_BASE + index}.5", SENTINEL_BASE + index + 0.5
+
+
+def _literal_value(token: LiteralToken) -> Any:
+    if token.kind == KIND_STRING:
+        return quoted_literal_value(token.text)
+    return numeric_literal_value(token.text)
+
+
+def _substitute(
+    body: str, tokens: Sequence[LiteralToken], replacements: Mapping[int, str]
+) -> str:
+    parts = []
+    position = 0
+    for index, token in enumerate(tokens):
+        if index in replacements:
+            parts.append(body[position : token.start])
+            parts.append(replacements[index])
+            position = token.end
+    parts.append(body[position:])
+    return "".join(parts)
+
+
+def _bind(template: Template, tokens: Sequence[LiteralToken]) -> LogicalQuery:
+    values = {
+        (type(sentinel), sentinel): _literal_value(tokens[index])
+        for index, sentinel in template.lifted
+    }
+
+    def bind_literal(exp: Expression) -> Expression:
+        if isinstance(exp, Literal):
+            key = (type(exp.value), exp.value)
+            if key in values:
+                return replace(exp, value=values[key])
+        return exp
+
+    # transform_expressions replaces every expression container of the
+    # query, so a shallow copy does not share anything mutable with the
+    # template.
+    query = copy.copy(template.query)
+    query.set_experiments(dict(template.query.get_experiments()))
+    query.transform_expressions(bind_literal)
+    return query
+
+
+def _find_sentinels(query: LogicalQuery, sentinels: Mapping[Any, int]) -> Set[int]:
+    found = set()
+    for exp in query.get_all_expressions():
+        if isinstance(exp, Literal):
+            index = sentinels.get((type(exp.value), exp.value))
+            if index is not None:
+                found.add(index)
+    return found
+
+
+def _find_named_sentinels(
+    query: LogicalQuery, sentinels: Mapping[int, Tuple[str, Any]]
+) -> Set[int]:
+    """
+    Selected expressions without an alias are named after their text, so
+    the literals they contain cannot be lifted.
+    """
+    names = [
+        selected.name
+        for selected in query.get_selected_columns()
+        if selected.name is not None
+    ]
+    return {
+        index
+        for index, (text, _) in sentinels.items()
+        if any(text in name for name in names)
+    }
+
+
+class SnQLParseCache:
+    """
+    Wraps the function parsing a SnQL body into its AST, which has to raise
+    on invalid bodies, and keeps the templates of the most recently used
+    shapes. Only queries on a single entity are cached. Joins and subqueries
+    are always parsed.
+    """
+
+    def __init__(
+        self,
+        parse: Callable[[str], ParsedQuery],
+        max_size: int = 1024,
+        max_uncacheable_size: int = 1024,
+    ) -> None:
+        self.__parse = parse
+        self.__max_size = max_size
+        self.__max_uncacheable_size = max_uncacheable_size
+        self.__templates: OrderedDict[
+            Tuple[Shape, Tuple[str, ...]], Template
+        ] = OrderedDict()
+        # Lifted literal indexes of the shapes templates were built for.
+        self.__shapes: OrderedDict[Shape, Tuple[int, ...]] = OrderedDict()
+        # Shapes seen once, without a template yet.
+        self.__seen: OrderedDict[Shape, None] = OrderedDict()
+        self.__uncacheable: OrderedDict[Shape, None] = OrderedDict()
+        self.__lock = Lock()
+
+    def __lookup(self, cache: OrderedDict[Any, Any], key: Any) -> Tuple[bool, Any]:
+        with self.__lock:
+            if key not in cache:
+                return False, None
+            cache.move_to_end(key)
+            return True, cache[key]
+
+    def __store(
+        self, cache: OrderedDict[Any, Any], key: Any, value: Any, max_size: int
+    ) -> None:
+        with self.__lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > max_size:
+                cache.popitem(last=False)
+
+    def __set_uncacheable(self, shape: Shape) -> None:
+        with self.__lock:
+            self.__seen.pop(shape, None)
+            self.__shapes.pop(shape, None)
+        self.__store(self.__uncacheable, shape, None, self.__max_uncacheable_size)
+
+    def parse(self, body: str) -> Tuple[ParsedQuery, CacheStatus]:
+        """
+        Returns the AST of the body and how it was obtained. The AST is
+        never shared with other callers.
+        """
+        shape, tokens = tokenize(body)
+        if not tokens:
+            return self.__parse(body), CacheStatus.UNCACHEABLE
+
+        uncacheable, _ = self.__lookup(self.__uncacheable, shape)
+        if uncacheable:
+            return self.__parse(body), CacheStatus.UNCACHEABLE
+
+        known, lifted = self.__lookup(self.__shapes, shape)
+        if known:
+            key = (shape, self.__fixed_texts(tokens, lifted))
+            found, template = self.__lookup(self.__templates, key)
+            if found:
+                try:
+                    return _bind(template, tokens), CacheStatus.HIT
+                except Exception:
+                    # Whatever went wrong, the parser reports it properly.
+                    return self.__parse(body), CacheStatus.MISS
+
+        parsed = self.__parse(body)
+        if not isinstance(parsed, LogicalQuery):
+            self.__set_uncacheable(shape)
+            return parsed, CacheStatus.UNCACHEABLE
+
+        if not known:
+            seen, _ = self.__lookup(self.__seen, shape)
+            if not seen:
+                self.__store(self.__seen, shape, None, self.__max_size)
+                return parsed, CacheStatus.MISS
+
+        try:
+            template = self.__build_template(
+                body, tokens, parsed, set(lifted) if known else None
+            )
+        except Exception:
+            template = None
+        if template is None:
+            self.__set_uncacheable(shape)
+            return parsed, CacheStatus.UNCACHEABLE
+
+        lifted = tuple(index for index, _ in template.lifted)
+        with self.__lock:
+            self.__seen.pop(shape, None)
+        self.__store(self.__shapes, shape, lifted, self.__max_size)
+        self.__store(
+            self.__templates,
+            (shape, self.__fixed_texts(tokens, lifted)),
+            template,
+            self.__max_size,
+        )
+        return parsed, CacheStatus.MISS
+
+    @staticmethod
+    def __fixed_texts(
+        tokens: Sequence[LiteralToken], lifted: Sequence[int]
+    ) -> Tuple[str, ...]:
+        lifted_set = set(lifted)
+        return tuple(
+            token.text for index, token in enumerate(tokens) if index not in lifted_set
+        )
+
+    def __build_template(
+        self,
+        body: str,
+        tokens: Sequence[LiteralToken],
+        parsed: LogicalQuery,
+        liftable: Optional[Set[int]],
+    ) -> Optional[Template]:
+        """
+        Builds the template of the body. The literals that can be lifted are
+        found with an extra parse unless they are already known for the
+        shape.
+        """
+        sentinels = {
+            index: _sentinel(token.kind, index) for index, token in enumerate(tokens)
+        }
+        by_value = {
+            (type(value), value): index for index, (_, value) in sentinels.items()
+        }
+
+        candidate: Optional[ParsedQuery] = None
+        if liftable is None:
+            candidate = self.__parse(
+                _substitute(
+                    body,
+                    tokens,
+                    {index: text for index, (text, _) in sentinels.items()},
+                )
+            )
+            if not isinstance(candidate, LogicalQuery):
+                return None
+            liftable = _find_sentinels(candidate, by_value) - _find_named_sentinels(
+                candidate, sentinels
+            )
+            if not liftable:
+                return None
+
+        if candidate is None or len(liftable) < len(tokens):
+            # The literals that are not lifted keep their text.
+            candidate = self.__parse(
+                _substitute(
+                    body,
+                    tokens,
+                    {index: sentinels[index][0] for index in liftable},
+                )
+            )
+            if not isinstance(candidate, LogicalQuery):
+                return None
+            if _find_sentinels(candidate, by_value) != liftable:
+                return None
+
+        assert isinstance(candidate, LogicalQuery)
+        template = Template(
+            candidate,
+            [(index, sentinels[index][1]) for index in sorted(liftable)],
+        )
+        if _bind(template, tokens) != parsed:
+            return None
+        return template
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import logging
+import time
 from dataclasses import replace
 from datetime import datetime, timedelta
 from functools import partial
@@ -23,7 +24,7 @@ from parsimonious.exceptions import IncompleteParseError
 from parsimonious.grammar import Grammar
 from parsimonious.nodes import Node, NodeVisitor
 
-from snuba import state
+from snuba import environment, state
 from snuba.clickhouse.columns import Array
 from snuba.clickhouse.query_dsl.accessors import get_time_range_expressions
 from snuba.datasets.dataset import Dataset
@@ -99,9 +100,12 @@ from snuba.query.snql.expression_visitor import (
     visit_quoted_literal,
 )
 from snuba.query.snql.joins import RelationshipTuple, build_join_clause
+from snuba.query.snql.parse_cache import SnQLParseCache
 from snuba.util import parse_datetime
+from snuba.utils.metrics.wrapper import MetricsWrapper
 
 logger = logging.getLogger("snuba.snql.parser")
+metrics = MetricsWrapper(environment.metrics, "snql.parser")
 
 snql_grammar = Grammar(
     r"""
@@ -908,13 +912,10 @@ class SnQLVisitor(NodeVisitor):  # type: ignore
         return generic_visit(node, visited_children)
 
 
-def parse_snql_query_initial(
-    body: str,
-) -> Union[CompositeQuery[QueryEntity], LogicalQuery]:
+def _parse_snql_body(body: str) -> Union[CompositeQuery[QueryEntity], LogicalQuery]:
     """
-    Parses the query body generating the AST. This only takes into
-    account the initial query body. Extensions are parsed by extension
-    processors and are supposed to update the AST.
+    Runs the SnQL grammar and visitor on the body, reporting any failure as
+    a ParsingException.
     """
     try:
         exp_tree = snql_grammar.parse(body)
@@ -942,6 +943,33 @@ def parse_snql_query_initial(
         raise ParsingException(message)
 
     assert isinstance(parsed, (CompositeQuery, LogicalQuery))  # mypy
+    return parsed
+
+
+snql_parse_cache = SnQLParseCache(_parse_snql_body)
+
+
+def parse_snql_query_initial(
+    body: str,
+) -> Union[CompositeQuery[QueryEntity], LogicalQuery]:
+    """
+    Parses the query body generating the AST. This only takes into
+    account the initial query body. Extensions are parsed by extension
+    processors and are supposed to update the AST.
+    """
+    start = time.time()
+    if state.get_config("snql_parse_cache_enabled", 0):
+        parsed, status = snql_parse_cache.parse(body)
+        cache_status = status.value
+        metrics.increment("parse_cache", tags={"status": cache_status})
+    else:
+        parsed = _parse_snql_body(body)
+        cache_status = "disabled"
+    metrics.timing(
+        "parse_snql_query_initial",
+        (time.time() - start) * 1000,
+        tags={"cache": cache_status},
+    )
 
     # Add these defaults here to avoid them getting applied to subqueries
     limit = parsed.get_limit()
@@ -1,7 +1,19 @@
-from dataclasses import dataclass
+from contextvars import ContextVar
+from dataclasses import dataclass, replace
 from datetime import datetime
 from enum import Enum
-from typing import Any, Dict, Mapping, MutableSequence, Optional, Set
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    MutableSequence,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
 
 from snuba.request import Request
 from snuba.utils.metrics.timer import Timer
@@ -135,3 +147,64 @@ class SnubaQueryMetadata:
         # If we do not have any recorded query and we did not specifically log
         # invalid_query, we assume there was an error somewhere.
         return self.query_list[-1].status if self.query_list else QueryStatus.ERROR
+
+
+class ConcurrentQueryMetadata:
+    """
+    Collects the timings and the ClickHouse queries recorded by work that
+    runs on another thread on behalf of a Snuba query, like the windows of
+    a time split query executed concurrently. Neither the Timer nor the
+    query list of the SnubaQueryMetadata are thread safe, so that work
+    records them here and the thread that owns the query merges them with
+    ``merge`` once the work is done.
+    """
+
+    def __init__(self) -> None:
+        self.__query_list: List[ClickhouseQueryMetadata] = []
+        self.__timer: Optional[Timer] = None
+        self.__parent: Optional[Tuple[Timer, SnubaQueryMetadata]] = None
+
+    def isolate(
+        self, timer: Timer, query_metadata: SnubaQueryMetadata
+    ) -> Tuple[Timer, SnubaQueryMetadata]:
+        """
+        Returns the timer and query metadata to record the work with
+        instead of the ones of the query.
+        """
+        if self.__timer is None:
+            self.__parent = (timer, query_metadata)
+            self.__timer = Timer("concurrent")
+        return self.__timer, replace(
+            query_metadata, timer=self.__timer, query_list=self.__query_list
+        )
+
+    def merge(self) -> None:
+        if self.__parent is None or self.__timer is None:
+            return
+        timer, query_metadata = self.__parent
+        timer.merge(self.__timer)
+        query_metadata.query_list.extend(self.__query_list)
+
+
+_concurrent_query_metadata: ContextVar[Optional[ConcurrentQueryMetadata]] = ContextVar(
+    "concurrent_query_metadata", default=None
+)
+
+TResult = TypeVar("TResult")
+
+
+def run_with_concurrent_query_metadata(
+    metadata: ConcurrentQueryMetadata, function: Callable[[], TResult]
+) -> TResult:
+    """
+    Runs ``function``, recording the queries it executes in ``metadata``.
+    """
+    token = _concurrent_query_metadata.set(metadata)
+    try:
+        return function()
+    finally:
+        _concurrent_query_metadata.reset(token)
+
+
+def get_concurrent_query_metadata() -> Optional[ConcurrentQueryMetadata]:
+    return _concurrent_query_metadata.get()
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import functools
 import itertools
 import re
 from abc import ABC, abstractmethod
@@ -7,6 +8,7 @@ from typing import (
     Any,
     Callable,
     Iterator,
+    List,
     Mapping,
     MutableMapping,
     MutableSequence,
@@ -15,7 +17,6 @@ from typing import (
     Sequence,
     Tuple,
     TypedDict,
-    TypeVar,
 )
 
 from snuba.clickhouse.formatter.nodes import FormattedQuery
@@ -35,6 +36,119 @@ Result = TypedDict(
 )
 
 
+class ColumnarRows(MutableSequence[Row]):
+    """
+    The rows of a result kept as columns, one list of values per name.
+
+    Consumers that know about this class can work on the columns directly
+    (``get_columns``) without ever building a dictionary per row. Everybody
+    else sees a regular sequence of rows: any row level access converts the
+    whole result to row dictionaries once and keeps working on those from
+    then on, so changes made to the rows are never lost.
+    """
+
+    def __init__(self, names: Sequence[str], columns: Sequence[Sequence[Any]]) -> None:
+        assert len(names) == len(columns)
+        self.__names = list(names)
+        self.__columns: Optional[MutableSequence[MutableSequence[Any]]] = [
+            column if isinstance(column, list) else list(column) for column in columns
+        ]
+        self.__length = len(columns[0]) if columns else 0
+        self.__rows: Optional[MutableSequence[Row]] = None
+
+    def get_columns(
+        self,
+    ) -> Optional[Tuple[Sequence[str], MutableSequence[MutableSequence[Any]]]]:
+        """
+        Returns the names and the columns if the rows were not converted to
+        dictionaries yet. The columns can be modified in place as long as
+        their length does not change.
+        """
+        if self.__columns is None:
+            return None
+        return self.__names, self.__columns
+
+    def rename(self, mapping: Mapping[str, Sequence[str]]) -> None:
+        """
+        Renames columns, a column can be given more than one new name in
+        which case it is duplicated. Names missing in the mapping are kept.
+        """
+        if self.__rows is not None:
+            self.__rows[:] = [
+                {
+                    new_key: value
+                    for key, value in row.items()
+                    for new_key in mapping.get(key, [key])
+                }
+                for row in self.__rows
+            ]
+            return
+
+        assert self.__columns is not None
+        names: List[str] = []
+        columns: MutableSequence[MutableSequence[Any]] = []
+        for name, column in zip(self.__names, self.__columns):
+            for position, new_name in enumerate(mapping.get(name, [name])):
+                # Columns are copied when duplicated so they can still be
+                # modified in place independently.
+                new_column = column if position == 0 else list(column)
+                if new_name in names:
+                    # The same behavior as building a row dictionary: the
+                    # last value wins but the key keeps its position.
+                    columns[names.index(new_name)] = new_column
+                else:
+                    names.append(new_name)
+                    columns.append(new_column)
+        self.__names = names
+        self.__columns = columns
+
+    def to_rows(self) -> MutableSequence[Row]:
+        """
+        Builds the row dictionaries without converting this instance.
+        """
+        if self.__columns is None:
+            assert self.__rows is not None
+            return [{**row} for row in self.__rows]
+        names = self.__names
+        return [dict(zip(names, values)) for values in zip(*self.__columns)]
+
+    def __materialize(self) -> MutableSequence[Row]:
+        if self.__rows is None:
+            self.__rows = self.to_rows()
+            self.__columns = None
+        return self.__rows
+
+    def __len__(self) -> int:
+        if self.__rows is not None:
+            return len(self.__rows)
+        return self.__length
+
+    def __getitem__(self, index: Any) -> Any:
+        return self.__materialize()[index]
+
+    def __setitem__(self, index: Any, value: Any) -> None:
+        self.__materialize()[index] = value
+
+    def __delitem__(self, index: Any) -> None:
+        del self.__materialize()[index]
+
+    def insert(self, index: int, value: Row) -> None:
+        self.__materialize().insert(index, value)
+
+    def __iter__(self) -> Iterator[Row]:
+        return iter(self.__materialize())
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, ColumnarRows):
+            return self.to_rows() == other.to_rows()
+        if isinstance(other, list):
+            return self.to_rows() == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ColumnarRows({self.to_rows()!r})"
+
+
 def iterate_rows(result: Result) -> Iterator[Row]:
     if "totals" in result:
         return itertools.chain(result["data"], [result["totals"]])
@@ -65,53 +179,86 @@ def unwrap_nullable_type(type: str) -> Tuple[bool, str]:
         return False, type
 
 
-T = TypeVar("T")
-R = TypeVar("R")
+ValueTransformer = Callable[[Any], Any]
+# Transforms a whole column at once. It gets the values of the column,
+# which are never None, and returns the transformed values in order.
+ColumnTransformer = Callable[[Sequence[Any]], List[Any]]
+ColumnTransformation = Tuple[
+    Pattern[str], ValueTransformer, Optional[ColumnTransformer]
+]
+
+
+def _build_column_transformer(
+    transformer: ValueTransformer,
+    column_transformer: Optional[ColumnTransformer],
+    is_nullable: bool,
+) -> ColumnTransformer:
+    if column_transformer is None:
+
+        def transform_values(values: Sequence[Any]) -> List[Any]:
+            return list(map(transformer, values))
+
+        column_transformer = transform_values
 
+    if not is_nullable:
+        return column_transformer
 
-def transform_nullable(
-    function: Callable[[T], R]
-) -> Callable[[Optional[T]], Optional[R]]:
-    def transform_column(value: Optional[T]) -> Optional[R]:
-        if value is None:
-            return value
-        else:
-            return function(value)
+    bulk_transformer = column_transformer
 
-    return transform_column
+    def transform_nullable_values(values: Sequence[Any]) -> List[Any]:
+        if None not in values:
+            return bulk_transformer(values)
+        return [None if value is None else transformer(value) for value in values]
+
+    return transform_nullable_values
 
 
 def build_result_transformer(
-    column_transformations: Sequence[Tuple[Pattern[str], Callable[[Any], Any]]],
+    column_transformations: Sequence[ColumnTransformation],
 ) -> Callable[[Result], None]:
     """
     Builds and returns a function that can be used to mutate a ``Result``
     instance in-place by transforming all values for columns that have a
     transformation function specified for their data type.
+
+    Each transformation comes with a function transforming a single value
+    and, optionally, one transforming a whole column, which is used when
+    the column does not contain nulls. The transformer of each column type
+    is resolved once and cached.
     """
 
-    def transform_result(result: Result) -> None:
-        for column in result["meta"]:
-            is_nullable, type = unwrap_nullable_type(column["type"])
+    @functools.lru_cache(maxsize=1024)
+    def get_column_transformer(column_type: str) -> Optional[ColumnTransformer]:
+        is_nullable, type = unwrap_nullable_type(column_type)
+        for pattern, transformer, column_transformer in column_transformations:
+            if pattern.match(type):
+                return _build_column_transformer(
+                    transformer, column_transformer, is_nullable
+                )
+        return None
 
-            transformer = next(
-                (
-                    transformer
-                    for pattern, transformer in column_transformations
-                    if pattern.match(type)
-                ),
-                None,
-            )
+    def transform_result(result: Result) -> None:
+        data = result["data"]
+        columns = data.get_columns() if isinstance(data, ColumnarRows) else None
+        totals = result.get("totals")
 
+        for column in result["meta"]:
+            transformer = get_column_transformer(column["type"])
             if transformer is None:
                 continue
 
-            if is_nullable:
-                transformer = transform_nullable(transformer)
-
             name = column["name"]
-            for row in iterate_rows(result):
-                row[name] = transformer(row[name])
+            if columns is not None:
+                names, values = columns
+                index = names.index(name)
+                values[index] = transformer(values[index])
+            else:
+                transformed = transformer([row[name] for row in data])
+                for row, value in zip(data, transformed):
+                    row[name] = value
+
+            if totals is not None:
+                totals[name] = transformer([totals[name]])[0]
 
     return transform_result
 
@@ -131,8 +278,12 @@ class Reader(ABC):
         with_totals: bool = False,
         robust: bool = False,
         capture_trace: bool = False,
+        columnar: bool = False,
     ) -> Result:
-        """Execute a query."""
+        """
+        Execute a query. With ``columnar``, the reader may return the rows
+        as ``ColumnarRows``.
+        """
         raise NotImplementedError
 
     @property
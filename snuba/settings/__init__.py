@@ -49,6 +49,14 @@ DISABLED_DATASETS: Set[str] = set()
 
 # Clickhouse Options
 CLICKHOUSE_MAX_POOL_SIZE = 25
+# Number of connections each API worker opens to the query node of every
+# cluster when it starts, and how often idle connections are probed (0 to
+# disable either).
+CLICKHOUSE_POOL_WARMUP_CONNECTIONS = 0
+CLICKHOUSE_POOL_PROBE_INTERVAL_SEC = 0
+
+# Threads running the secondary pipelines of the pipeline delegator.
+PIPELINE_DELEGATOR_MAX_WORKERS = 8
 
 CLUSTERS: Sequence[Mapping[str, Any]] = [
     {
@@ -146,12 +154,19 @@ REDIS_CLUSTERS: RedisClusters = {
 }
 
 USE_RESULT_CACHE = True
+# Size in bytes of the per process result cache kept in front of the Redis
+# result cache (per cache partition). 0 disables it.
+LOCAL_RESULT_CACHE_MAX_BYTES = 0
 
 # Query Recording Options
 RECORD_QUERIES = False
 
 # Runtime Config Options
+# How often (seconds) the runtime config version is checked in Redis.
 CONFIG_MEMOIZE_TIMEOUT = 10
+# The whole runtime config is reloaded at least this often (seconds) even if
+# its version did not change.
+CONFIG_SNAPSHOT_MAX_AGE = 300
 
 # Sentry Options
 SENTRY_DSN: str | None = None
@@ -191,6 +206,10 @@ DEFAULT_MAX_BATCH_SIZE = 50000
 DEFAULT_MAX_BATCH_TIME_MS = 2 * 1000
 DEFAULT_QUEUED_MAX_MESSAGE_KBYTES = 10000
 DEFAULT_QUEUED_MIN_MESSAGES = 10000
+# Messages processed at once by consumers whose processor implements
+# process_batch, and how long they wait for a block to fill up.
+CONSUMER_PROCESS_BLOCK_SIZE = 500
+CONSUMER_PROCESS_BLOCK_TIME_MS = 200
 DISCARD_OLD_EVENTS = True
 CLICKHOUSE_HTTP_CHUNK_SIZE = 8192
 HTTP_WRITER_BUFFER_SIZE = 1
@@ -229,6 +248,12 @@ COLUMN_SPLIT_MIN_COLS = 6
 COLUMN_SPLIT_MAX_LIMIT = 1000
 COLUMN_SPLIT_MAX_RESULTS = 5000
 
+# Threads running the time split windows issued concurrently, shared by the
+# whole process, and the most windows a single query can have in flight
+# whatever the split_parallel_windows runtime config.
+TIME_SPLIT_MAX_WORKERS = 16
+TIME_SPLIT_MAX_PARALLEL_WINDOWS = 4
+
 # Migrations in skipped groups will not be run
 SKIPPED_MIGRATION_GROUPS: Set[str] = {"querylog", "profiles", "functions"}
 
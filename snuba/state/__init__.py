@@ -1,19 +1,27 @@
 from __future__ import absolute_import, annotations
 
 import logging
+import re
 import time
-from dataclasses import dataclass
+import uuid
+from dataclasses import dataclass, field, replace
 from functools import partial
+from types import MappingProxyType
 from typing import (
     Any,
     Callable,
+    FrozenSet,
     Iterable,
     Mapping,
+    MutableMapping,
     Optional,
+    Pattern,
     Sequence,
     SupportsFloat,
     Tuple,
     Type,
+    TypeVar,
+    cast,
 )
 
 import simplejson as json
@@ -40,6 +48,9 @@ config_description_hash = "snuba-config-description"
 config_history_hash = "snuba-config-history"
 config_changes_list = "snuba-config-changes"
 config_changes_list_limit = 25
+# Changed on every config write so readers can tell whether the snapshot
+# they hold is still current without fetching the whole config hash.
+config_version_key = "snuba-config-version"
 queries_list = "snuba-queries"
 
 # Rate Limiting and Deduplication
@@ -168,6 +179,7 @@ def set_config(
         else:
             p.hset(config_hash, key, enc_value)
             p.hset(config_history_hash, key, json.dumps(change_record))
+        p.set(config_version_key, uuid.uuid4().hex)
         p.lpush(config_changes_list, json.dumps((key, change_record)))
         p.ltrim(config_changes_list, 0, config_changes_list_limit)
         p.execute()
@@ -189,32 +201,181 @@ def set_configs(
 
 
 def get_config(key: str, default: Optional[Any] = None) -> Optional[Any]:
-    return get_all_configs().get(key, default)
+    return _get_config_snapshot().values.get(key, default)
 
 
 def get_configs(
     key_defaults: Iterable[Tuple[str, Optional[Any]]]
 ) -> Sequence[Optional[Any]]:
-    all_confs = get_all_configs()
+    all_confs = _get_config_snapshot().values
     return [all_confs.get(k, d) for k, d in key_defaults]
 
 
 def get_all_configs() -> Mapping[str, Optional[Any]]:
-    return {k: v for k, v in get_raw_configs().items()}
+    return get_raw_configs()
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """
+    Immutable, in process copy of the runtime config.
+
+    ``checked_at`` is the last time we verified ``version`` against Redis,
+    ``loaded_at`` the last time the whole hash was fetched. ``parsed`` holds
+    the values computed by ``get_parsed_config`` and is dropped together
+    with ``values`` when the config is reloaded.
+    """
+
+    values: Mapping[str, Optional[Any]]
+    version: Optional[bytes]
+    checked_at: float
+    loaded_at: float
+    parsed: MutableMapping[Tuple[str, Callable[[Any], Any]], Any] = field(
+        default_factory=dict, compare=False
+    )
+
+
+_config_snapshot = ConfigSnapshot(MappingProxyType({}), None, 0.0, 0.0)
+
+
+def _load_config_snapshot(now: float) -> ConfigSnapshot:
+    version = rds.get(config_version_key)
+    if version is None:
+        # Nobody has written a config since the version key was introduced
+        # (or Redis was flushed). Create one so that we stop reloading the
+        # whole hash on every check.
+        rds.set(config_version_key, uuid.uuid4().hex, nx=True)
+        version = rds.get(config_version_key)
+
+    snapshot = _config_snapshot
+    if (
+        snapshot.loaded_at > 0
+        and version == snapshot.version
+        and now < snapshot.loaded_at + settings.CONFIG_SNAPSHOT_MAX_AGE
+    ):
+        return replace(snapshot, checked_at=now)
+
+    all_configs = rds.hgetall(config_hash)
+    values = {
+        k.decode("utf-8"): get_typed_value(v.decode("utf-8"))
+        for k, v in all_configs.items()
+        if v is not None
+    }
+    metrics.increment("config_snapshot_reload")
+    return ConfigSnapshot(MappingProxyType(values), version, now, now)
 
 
-@memoize(settings.CONFIG_MEMOIZE_TIMEOUT)
 def get_raw_configs() -> Mapping[str, Optional[Any]]:
+    # Callers get a plain dict they can serialize or modify, the snapshot
+    # itself stays read only.
+    return dict(_get_config_snapshot().values)
+
+
+def _get_config_snapshot() -> ConfigSnapshot:
+    """
+    Returns the current runtime config snapshot. This is called on hot paths
+    so the common case is a timestamp comparison: Redis is only checked every
+    ``CONFIG_MEMOIZE_TIMEOUT`` seconds, and the whole config hash is only
+    fetched when the version key changed (or every
+    ``CONFIG_SNAPSHOT_MAX_AGE`` seconds, to pick up writes made by clients
+    that do not bump the version).
+
+    The values of the snapshot are read only and are not copied, unlike
+    the ones returned by ``get_raw_configs``.
+    """
+    global _config_snapshot
+    snapshot = _config_snapshot
+    now = time.time()
+    if now < snapshot.checked_at + settings.CONFIG_MEMOIZE_TIMEOUT:
+        return snapshot
+
     try:
-        all_configs = rds.hgetall(config_hash)
-        return {
-            k.decode("utf-8"): get_typed_value(v.decode("utf-8"))
-            for k, v in all_configs.items()
-            if v is not None
-        }
+        snapshot = _load_config_snapshot(now)
     except Exception as ex:
         logger.exception(ex)
-        return {}
+        # Keep serving the previous snapshot and do not retry before the
+        # next check is due.
+        snapshot = replace(snapshot, checked_at=now)
+    _config_snapshot = snapshot
+    return snapshot
+
+
+TParsed = TypeVar("TParsed")
+
+
+def get_parsed_config(
+    key: str, parser: Callable[[Any], TParsed], default: TParsed
+) -> TParsed:
+    """
+    Returns the config value parsed by ``parser``. The parsed value is
+    cached until the config snapshot is reloaded, so this is meant for
+    values read on hot paths (per message, per query) that would otherwise
+    be parsed on every read. ``parser`` should be a module level function
+    since it is part of the cache key. If the value is missing or cannot be
+    parsed ``default`` is returned.
+    """
+    snapshot = _get_config_snapshot()
+    cache_key = (key, parser)
+    try:
+        return cast(TParsed, snapshot.parsed[cache_key])
+    except KeyError:
+        pass
+
+    value = snapshot.values.get(key)
+    parsed = default
+    if value is not None:
+        try:
+            parsed = parser(value)
+        except Exception:
+            logger.exception("Invalid value %r for config %s", value, key)
+    snapshot.parsed[cache_key] = parsed
+    return parsed
+
+
+def _parse_list(value: Any) -> Sequence[str]:
+    # The expected format is [item,item,...]
+    value = str(value).strip()
+    if value.startswith("[") and value.endswith("]"):
+        value = value[1:-1]
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def parse_str_set(value: Any) -> FrozenSet[str]:
+    return frozenset(_parse_list(value))
+
+
+def parse_int_set(value: Any) -> FrozenSet[int]:
+    return frozenset(int(item) for item in _parse_list(value))
+
+
+def parse_regex(value: Any) -> Pattern[str]:
+    return re.compile(str(value))
+
+
+def get_str_set_config(key: str) -> FrozenSet[str]:
+    """
+    Returns a config of the form ``[item,item,...]`` as a set of strings.
+    """
+    return get_parsed_config(key, parse_str_set, frozenset())
+
+
+def get_int_set_config(key: str) -> FrozenSet[int]:
+    """
+    Returns a config of the form ``[1,2,...]`` as a set of integers.
+    """
+    return get_parsed_config(key, parse_int_set, frozenset())
+
+
+def get_int_config(key: str, default: int) -> int:
+    return get_parsed_config(key, int, default)
+
+
+def get_float_config(key: str, default: float) -> float:
+    return get_parsed_config(key, float, default)
+
+
+def get_regex_config(key: str) -> Optional[Pattern[str]]:
+    return get_parsed_config(key, parse_regex, None)
 
 
 def delete_config(key: str, user: Optional[Any] = None) -> None:
@@ -375,16 +536,7 @@ def is_project_in_rollout_list(rollout_key: str, project_id: int) -> bool:
 
     Returns `True` if `project_id` is present in the config.
     """
-    project_rollout_setting = get_config(rollout_key, "")
-    assert isinstance(project_rollout_setting, str)
-    if project_rollout_setting:
-        # The expected format is [project,project,...]
-        project_rollout_setting = project_rollout_setting[1:-1]
-        if project_rollout_setting:
-            for p in project_rollout_setting.split(","):
-                if int(p.strip()) == project_id:
-                    return True
-    return False
+    return project_id in get_int_set_config(rollout_key)
 
 
 def is_project_in_rollout_group(rollout_key: str, project_id: int) -> bool:
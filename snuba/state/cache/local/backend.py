@@ -0,0 +1,165 @@
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, NamedTuple, Optional
+
+from snuba import environment
+from snuba.state import get_config
+from snuba.state.cache.abstract import Cache, TValue
+from snuba.state.cache.redis.backend import RESULT_VALUE
+from snuba.utils.clock import Clock, SystemClock
+from snuba.utils.metrics.timer import Timer
+from snuba.utils.metrics.wrapper import MetricsWrapper
+
+logger = logging.getLogger(__name__)
+metrics = MetricsWrapper(environment.metrics, "local_cache")
+
+
+class _Entry(NamedTuple):
+    value: object
+    size: int
+    expires_at: float
+
+
+class LocalCache(Cache[TValue]):
+    """
+    In-process, size bounded LRU cache that sits in front of another
+    (usually remote) cache. Values are kept already decoded, so a hit on
+    this tier costs neither a network round trip nor a decode.
+
+    The capacity is expressed in bytes, as estimated by the provided
+    ``weigher``. Entries expire ``local_cache_expiry_sec`` (falling back
+    to ``cache_expiry_sec``) after they are stored locally. The expiry
+    starts over when a value is fetched again from the backing cache, whose
+    own expiry is not known here, so a value can be served for up to the
+    local expiry plus the expiry of the backing cache after it was first
+    computed.
+
+    Callers may mutate the values they get back, so every value is passed
+    through ``copier`` before leaving this cache.
+    """
+
+    def __init__(
+        self,
+        backing: Cache[TValue],
+        max_bytes: int,
+        weigher: Callable[[TValue], int],
+        copier: Callable[[TValue], TValue],
+        partition_id: str,
+        clock: Optional[Clock] = None,
+    ) -> None:
+        self.__backing = backing
+        self.__max_bytes = max_bytes
+        self.__weigher = weigher
+        self.__copier = copier
+        self.__clock = clock if clock is not None else SystemClock()
+        self.__metric_tags = {"partition_id": partition_id}
+
+        self.__entries: OrderedDict[str, _Entry] = OrderedDict()
+        self.__size = 0
+        self.__lock = Lock()
+
+    @property
+    def size(self) -> int:
+        return self.__size
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __get_local(self, key: str) -> Optional[TValue]:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                if entry.expires_at <= self.__clock.time():
+                    self.__remove(key)
+                    metrics.increment(
+                        "eviction", tags={**self.__metric_tags, "reason": "expired"}
+                    )
+                    entry = None
+                else:
+                    self.__entries.move_to_end(key)
+
+        if entry is None:
+            metrics.increment("miss", tags=self.__metric_tags)
+            return None
+
+        metrics.increment("hit", tags=self.__metric_tags)
+        value: TValue = entry.value  # type: ignore
+        return self.__copier(value)
+
+    def __set_local(self, key: str, value: TValue) -> None:
+        size = self.__weigher(value)
+        if size > self.__max_bytes:
+            # Storing this value would flush the whole cache, and it would be
+            # the next one to go anyway.
+            metrics.increment("too_large", tags=self.__metric_tags)
+            return
+
+        expiry = get_config("local_cache_expiry_sec", None)
+        if expiry is None:
+            expiry = get_config("cache_expiry_sec", 1)
+        assert isinstance(expiry, (int, float))
+
+        # The caller keeps a reference to ``value`` and may mutate it later,
+        # so we store our own copy.
+        entry = _Entry(self.__copier(value), size, self.__clock.time() + expiry)
+        with self.__lock:
+            if key in self.__entries:
+                self.__remove(key)
+            self.__entries[key] = entry
+            self.__size += size
+
+            evicted = 0
+            while self.__size > self.__max_bytes:
+                oldest = next(iter(self.__entries))
+                self.__remove(oldest)
+                evicted += 1
+
+        if evicted:
+            metrics.increment(
+                "eviction", evicted, tags={**self.__metric_tags, "reason": "size"}
+            )
+        metrics.gauge("bytes", self.__size, tags=self.__metric_tags)
+
+    def __remove(self, key: str) -> None:
+        # Must be called with the lock held.
+        entry = self.__entries.pop(key)
+        self.__size -= entry.size
+
+    def get(self, key: str) -> Optional[TValue]:
+        value = self.__get_local(key)
+        if value is not None:
+            return value
+
+        value = self.__backing.get(key)
+        if value is not None:
+            self.__set_local(key, value)
+        return value
+
+    def set(self, key: str, value: TValue) -> None:
+        self.__backing.set(key, value)
+        self.__set_local(key, value)
+
+    def get_readthrough(
+        self,
+        key: str,
+        function: Callable[[], TValue],
+        record_cache_hit_type: Callable[[int], None],
+        timeout: int,
+        timer: Optional[Timer] = None,
+    ) -> TValue:
+        value = self.__get_local(key)
+        if timer is not None:
+            timer.mark("local_cache_get")
+
+        if value is not None:
+            record_cache_hit_type(RESULT_VALUE)
+            return value
+
+        # Errors raised by the backing cache (including the ones replayed
+        # from other clients) are never stored locally.
+        value = self.__backing.get_readthrough(
+            key, function, record_cache_hit_type, timeout, timer
+        )
+        self.__set_local(key, value)
+        return value
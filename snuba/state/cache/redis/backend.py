@@ -9,7 +9,7 @@ from pkg_resources import resource_string
 from redis.exceptions import ResponseError
 from snuba import environment
 from snuba.redis import RedisClientType
-from snuba.state import get_config
+from snuba.state import get_config, get_configs
 from snuba.state.cache.abstract import (
     Cache,
     ExecutionError,
@@ -29,6 +29,21 @@ RESULT_VALUE = 0
 RESULT_EXECUTE = 1
 RESULT_WAIT = 2
 
+# Values larger than the ``cache_chunked_min_bytes`` runtime config are split
+# into several keys. The value key then only holds a manifest that starts with
+# this prefix, which can never be the start of a payload produced by the
+# result codecs (JSON or the binary formats.)
+CHUNK_MANIFEST_PREFIX = b"\x00chunked:"
+# Chunks outlive the manifest so that a reader that got the manifest right
+# before it expired can still find every chunk.
+CHUNK_TTL_MARGIN_SEC = 5
+# Number of chunks requested in a single MGET when reading a chunked value.
+CHUNK_READ_BATCH = 4
+
+
+class MissingChunkError(Exception):
+    pass
+
 
 class RedisCache(Cache[TValue]):
     def __init__(
@@ -59,18 +74,94 @@ class RedisCache(Cache[TValue]):
             [bit for bit in [prefix, f"{{{key}}}", suffix] if bit is not None]
         )
 
+    def __build_chunk_key(self, key: str, chunk_set: str, index: int) -> str:
+        # The chunk keys embed the same hash tag as the value key, so they
+        # live in the same cluster slot and can be read with MGET.
+        return self.__build_key(key, "chunks", f"{chunk_set}/{index}")
+
+    def __store(self, key: str, value: bytes, expiry: int) -> bytes:
+        """
+        Returns what needs to be written in the value key. When the value is
+        above the configured threshold it is written as separate chunks first
+        and only the manifest is returned.
+        """
+        raw_min_bytes, raw_chunk_size = get_configs(
+            [("cache_chunked_min_bytes", 0), ("cache_chunk_size_bytes", 1024 * 1024)]
+        )
+        min_bytes = int(raw_min_bytes or 0)
+        chunk_size = int(raw_chunk_size or 0)
+        if not min_bytes or len(value) <= min_bytes:
+            return value
+        if chunk_size <= 0:
+            logger.warning("Invalid cache_chunk_size_bytes %r", raw_chunk_size)
+            return value
+
+        chunk_set = uuid.uuid4().hex
+        chunk_count = (len(value) + chunk_size - 1) // chunk_size
+        pipeline = self.__client.pipeline(transaction=False)
+        for index in range(chunk_count):
+            pipeline.set(
+                self.__build_chunk_key(key, chunk_set, index),
+                value[index * chunk_size : (index + 1) * chunk_size],
+                ex=expiry + CHUNK_TTL_MARGIN_SEC,
+            )
+        pipeline.execute()
+
+        metrics.increment("chunked_write")
+        metrics.timing("chunked_write.chunks", chunk_count)
+        metrics.timing("chunked_write.bytes", len(value))
+        return CHUNK_MANIFEST_PREFIX + f"{chunk_set}:{chunk_count}".encode("utf-8")
+
+    def __load(self, key: str, stored: bytes) -> bytes:
+        """
+        Reverses ``__store``. Chunks are fetched a few at a time so that a
+        large value does not turn into a single huge Redis reply. Raises
+        ``MissingChunkError`` if any of the chunks has expired.
+        """
+        if not stored.startswith(CHUNK_MANIFEST_PREFIX):
+            return stored
+
+        chunk_set, raw_count = (
+            stored[len(CHUNK_MANIFEST_PREFIX) :].decode("utf-8").split(":")
+        )
+        chunk_count = int(raw_count)
+        chunks = []
+        for start in range(0, chunk_count, CHUNK_READ_BATCH):
+            batch = self.__client.mget(
+                [
+                    self.__build_chunk_key(key, chunk_set, index)
+                    for index in range(
+                        start, min(start + CHUNK_READ_BATCH, chunk_count)
+                    )
+                ]
+            )
+            if any(chunk is None for chunk in batch):
+                metrics.increment("chunk_missing")
+                raise MissingChunkError(f"missing chunk for key {key}")
+            chunks.extend(batch)
+
+        value = b"".join(chunks)
+        metrics.increment("chunked_read")
+        metrics.timing("chunked_read.chunks", chunk_count)
+        metrics.timing("chunked_read.bytes", len(value))
+        return value
+
     def get(self, key: str) -> Optional[TValue]:
         value = self.__client.get(self.__build_key(key))
         if value is None:
             return None
 
-        return self.__codec.decode(value)
+        try:
+            return self.__codec.decode(self.__load(key, value))
+        except MissingChunkError:
+            return None
 
     def set(self, key: str, value: TValue) -> None:
+        expiry = int(get_config("cache_expiry_sec", 1) or 1)
         self.__client.set(
             self.__build_key(key),
-            self.__codec.encode(value),
-            ex=get_config("cache_expiry_sec", 1),
+            self.__store(key, self.__codec.encode(value), expiry),
+            ex=expiry,
         )
 
     def get_readthrough(
@@ -141,14 +232,28 @@ class RedisCache(Cache[TValue]):
             timer.mark("cache_get")
         metric_tags = timer.tags if timer is not None else {}
 
-        # This updates the stats object and querylog
-        record_cache_hit_type(result[0])
-
         if result[0] == RESULT_VALUE:
             # If we got a cache hit, this is easy -- we just return it.
             logger.debug("Immediately returning result from cache hit.")
-            return self.__codec.decode(result[1])
-        elif result[0] == RESULT_EXECUTE:
+            try:
+                value = self.__codec.decode(self.__load(key, result[1]))
+            except MissingChunkError:
+                # The manifest outlived one of its chunks. There is no task
+                # to wait for, so just compute the value without caching it.
+                # This is a miss as far as the stats are concerned.
+                record_cache_hit_type(RESULT_EXECUTE)
+                try:
+                    return self.__executor.submit(function).result(timeout)
+                except concurrent.futures.TimeoutError as error:
+                    metrics.increment("execute_timeout", tags=metric_tags)
+                    raise TimeoutError("timed out waiting for value") from error
+            record_cache_hit_type(RESULT_VALUE)
+            return value
+
+        # This updates the stats object and querylog
+        record_cache_hit_type(result[0])
+
+        if result[0] == RESULT_EXECUTE:
 
             # If we were the first in line, we need to execute the function.
             # We'll also get back the task identity to use for sending
@@ -169,9 +274,6 @@ class RedisCache(Cache[TValue]):
                 # The task is run in a thread pool so that we can return
                 # control to the caller once the timeout is reached.
                 value = self.__executor.submit(function).result(task_timeout)
-                argv.extend(
-                    [self.__codec.encode(value), get_config("cache_expiry_sec", 1)]
-                )
             except concurrent.futures.TimeoutError as error:
                 metrics.increment("execute_timeout", tags=metric_tags)
                 raise TimeoutError("timed out waiting for value") from error
@@ -191,6 +293,18 @@ class RedisCache(Cache[TValue]):
                 # of a cached query can be fairly long (minutes).
                 redis_key_to_write_to = error_key
                 raise e
+            else:
+                expiry = int(get_config("cache_expiry_sec", 1) or 1)
+                try:
+                    argv.extend(
+                        [self.__store(key, self.__codec.encode(value), expiry), expiry]
+                    )
+                except Exception:
+                    # The function succeeded, failing to cache its value is
+                    # not an error for the caller. Without a value, waiting
+                    # clients are told the result could not be set.
+                    metrics.increment("cache_set_fail", tags=metric_tags)
+                    logger.warning("Error storing cache result!", exc_info=True)
             finally:
                 # Regardless of whether the function succeeded or failed, we
                 # need to mark the task as completed. If there is no result
@@ -258,7 +372,12 @@ class RedisCache(Cache[TValue]):
                             "no value at key: this means the original process executing the query crashed before the exception could be handled or an error was thrown setting the cache result"
                         )
                 else:
-                    return self.__codec.decode(raw_value)
+                    try:
+                        return self.__codec.decode(self.__load(key, raw_value))
+                    except MissingChunkError as error:
+                        raise ExecutionError(
+                            "chunked value expired before it could be read"
+                        ) from error
             else:
                 # We timed out waiting for the notification -- something went
                 # wrong with the client that was generating the cache value.
@@ -6,9 +6,13 @@ from collections import ChainMap, namedtuple
 from contextlib import AbstractContextManager, ExitStack, contextmanager
 from dataclasses import dataclass
 from types import TracebackType
+from typing import Any
 from typing import ChainMap as TypingChainMap
-from typing import Iterator, MutableMapping, Optional, Sequence, Type
+from typing import Iterator, List, MutableMapping, Optional, Sequence, Tuple, Type
 
+from pkg_resources import resource_string
+
+from redis.cluster import RedisCluster
 from snuba import environment, state
 from snuba.redis import RedisClientKey, get_redis_client
 from snuba.utils.metrics.wrapper import MetricsWrapper
@@ -26,6 +30,15 @@ metrics = MetricsWrapper(environment.metrics, "api")
 
 rds = get_redis_client(RedisClientKey.RATE_LIMITER)
 
+# Used by the batched mode of `RateLimitAggregator`, which evaluates all the
+# buckets of a query with a single script call on entry and one on exit.
+enter_script = rds.register_script(
+    resource_string("snuba", "state/scripts/rate_limit_enter.lua")
+)
+exit_script = rds.register_script(
+    resource_string("snuba", "state/scripts/rate_limit_exit.lua")
+)
+
 
 @dataclass(frozen=True)
 class RateLimitParameters:
@@ -92,6 +105,45 @@ class RateLimitStatsContainer:
         return ChainMap(*grouped_stats)
 
 
+def _get_bucket_key(rate_limit_params: RateLimitParameters) -> str:
+    return "{}{}".format(state.ratelimit_prefix, rate_limit_params.bucket)
+
+
+def _check_limits(
+    rate_limit_params: RateLimitParameters, stats: RateLimitStats
+) -> Optional[RateLimitExceeded]:
+    """
+    Returns the exception to raise if the stats exceed one of the limits.
+    """
+    rate_limit_name = rate_limit_params.rate_limit_name
+
+    Reason = namedtuple("Reason", "scope name val limit")
+    reasons = [
+        Reason(
+            rate_limit_name,
+            "concurrent",
+            stats.concurrent,
+            rate_limit_params.concurrent_limit,
+        ),
+        Reason(
+            rate_limit_name,
+            "per-second",
+            stats.rate,
+            rate_limit_params.per_second_limit,
+        ),
+    ]
+    reason = next((r for r in reasons if r.limit is not None and r.val > r.limit), None)
+    if reason is None:
+        return None
+    return RateLimitExceeded(
+        "{r.scope} {r.name} of {r.val:.0f} exceeds limit of {r.limit:.0f}".format(
+            r=reason
+        ),
+        scope=reason.scope,
+        name=reason.name,
+    )
+
+
 @contextmanager
 def rate_limit(
     rate_limit_params: RateLimitParameters,
@@ -120,7 +172,7 @@ def rate_limit(
                                  now
     """
 
-    bucket = "{}{}".format(state.ratelimit_prefix, rate_limit_params.bucket)
+    bucket = _get_bucket_key(rate_limit_params)
     query_id = str(uuid.uuid4())
 
     now = time.time()
@@ -192,25 +244,8 @@ def rate_limit(
 
     stats = RateLimitStats(rate=per_second, concurrent=concurrent)
 
-    rate_limit_name = rate_limit_params.rate_limit_name
-
-    Reason = namedtuple("Reason", "scope name val limit")
-    reasons = [
-        Reason(
-            rate_limit_name,
-            "concurrent",
-            concurrent,
-            rate_limit_params.concurrent_limit,
-        ),
-        Reason(
-            rate_limit_name,
-            "per-second",
-            per_second,
-            rate_limit_params.per_second_limit,
-        ),
-    ]
-    reason = next((r for r in reasons if r.limit is not None and r.val > r.limit), None)
-    if reason:
+    exceeded = _check_limits(rate_limit_params, stats)
+    if exceeded is not None:
         try:
             # Remove the query from the sorted set
             # because we rate limited it. It shouldn't count towards
@@ -219,13 +254,7 @@ def rate_limit(
         except Exception as ex:
             logger.exception(ex)
 
-        raise RateLimitExceeded(
-            "{r.scope} {r.name} of {r.val:.0f} exceeds limit of {r.limit:.0f}".format(
-                r=reason
-            ),
-            scope=reason.scope,
-            name=reason.name,
-        )
+        raise exceeded
 
     rate_limited = False
     try:
@@ -270,18 +299,57 @@ def _record_metrics(
         metrics.increment("rate-limited", tags=tags)
 
 
+def _format_limit(limit: Optional[float]) -> str:
+    return "" if limit is None else str(limit)
+
+
+def _group_by_slot(
+    rate_limit_params: Sequence[RateLimitParameters],
+) -> Sequence[Sequence[RateLimitParameters]]:
+    """
+    Splits the buckets into the groups that can be evaluated by a single
+    script call, preserving their order. All the keys of a script have to
+    be in the same slot on a Redis cluster, so consecutive buckets are only
+    grouped together if they share their slot.
+    """
+    if not isinstance(rds, RedisCluster):
+        return [rate_limit_params] if rate_limit_params else []
+
+    groups: List[List[RateLimitParameters]] = []
+    last_slot = None
+    for params in rate_limit_params:
+        slot = rds.keyslot(_get_bucket_key(params))
+        if groups and slot == last_slot:
+            groups[-1].append(params)
+        else:
+            groups.append([params])
+        last_slot = slot
+    return groups
+
+
 class RateLimitAggregator(AbstractContextManager):  # type: ignore
     """
     Runs the rate limits provided by the `rate_limit_params` configuration object.
 
     It runs the rate limits in the order described by `rate_limit_params`.
+
+    When the `rate_limit_batched` runtime config is set, all the buckets are
+    evaluated by one script call on entry and one on exit (one per slot on a
+    Redis cluster) instead of two round trips per bucket. The buckets are
+    checked and updated exactly like `rate_limit` does.
     """
 
     def __init__(self, rate_limit_params: Sequence[RateLimitParameters]) -> None:
         self.rate_limit_params = rate_limit_params
         self.stack = ExitStack()
+        # The groups of buckets the batched mode added the query to, with
+        # the members of the query in each bucket.
+        self.__entered: List[Tuple[Sequence[str], Sequence[str]]] = []
 
     def __enter__(self) -> RateLimitStatsContainer:
+        if state.get_config("rate_limit_batched", 0):
+            return self.__enter_batched()
+
         stats = RateLimitStatsContainer()
 
         for rate_limit_param in self.rate_limit_params:
@@ -301,6 +369,66 @@ class RateLimitAggregator(AbstractContextManager):  # type: ignore
 
         return stats
 
+    def __enter_batched(self) -> RateLimitStatsContainer:
+        stats = RateLimitStatsContainer()
+
+        bypass_rate_limit, rate_history_s = state.get_configs(
+            [("bypass_rate_limit", 0), ("rate_history_sec", 3600)]
+        )
+        assert isinstance(rate_history_s, (int, float))
+        if bypass_rate_limit == 1:
+            return stats
+
+        query_id = str(uuid.uuid4())
+        now = time.time()
+        # See `rate_limit` for how the scores are used.
+        args: List[Any] = [
+            "({:f}".format(now - rate_history_s),
+            now + state.max_query_duration_s,
+            now - state.rate_lookback_s,
+            "{:f}".format(now),
+            state.rate_lookback_s,
+        ]
+
+        for group in _group_by_slot(self.rate_limit_params):
+            keys = [_get_bucket_key(params) for params in group]
+            members = [f"{query_id}/{i}" for i in range(len(group))]
+            bucket_args = []
+            for member, params in zip(members, group):
+                bucket_args.extend(
+                    [
+                        member,
+                        _format_limit(params.per_second_limit),
+                        _format_limit(params.concurrent_limit),
+                    ]
+                )
+            try:
+                result = enter_script(keys=keys, args=[*args, *bucket_args])
+            except Exception as ex:
+                logger.exception(ex)
+                continue  # fail open if redis is having issues
+
+            exceeded_index = int(result[0])
+            for index, params in enumerate(group):
+                historical, concurrent = result[1 + 2 * index : 3 + 2 * index]
+                child_stats = RateLimitStats(
+                    rate=int(historical) / float(state.rate_lookback_s),
+                    concurrent=int(concurrent),
+                )
+                if index + 1 == exceeded_index:
+                    # The script already removed the query from this group,
+                    # roll back the groups evaluated before it.
+                    exceeded = _check_limits(params, child_stats)
+                    assert exceeded is not None
+                    self.__exit__(type(exceeded), exceeded, None)
+                    _record_metrics(exceeded, params)
+                    raise exceeded
+                stats.add_stats(params.rate_limit_name, child_stats)
+
+            self.__entered.append((keys, members))
+
+        return stats
+
     def __exit__(
         self,
         exc_type: Optional[Type[BaseException]],
@@ -308,3 +436,18 @@ class RateLimitAggregator(AbstractContextManager):  # type: ignore
         exc_tb: Optional[TracebackType],
     ) -> None:
         self.stack.pop_all().close()
+
+        entered, self.__entered = self.__entered, []
+        if not entered:
+            return
+        # If another rate limit was hit, the query is not counted against
+        # these limits.
+        action = "discard" if isinstance(exc_val, RateLimitExceeded) else "count"
+        for keys, members in entered:
+            try:
+                exit_script(
+                    keys=keys,
+                    args=[action, -float(state.max_query_duration_s), *members],
+                )
+            except Exception as ex:
+                logger.exception(ex)
@@ -0,0 +1,54 @@
+-- KEYS: The rate limit buckets, in the order they are evaluated.
+--
+-- ARGV[1]: The cutoff score, entries before it are removed. ("(123.0")
+-- ARGV[2]: The deadline of the query, used as its score while it runs.
+-- ARGV[3]: The start of the per-second rate lookback window.
+-- ARGV[4]: The current time.
+-- ARGV[5]: The length of the lookback window, in seconds.
+-- Then for each bucket:
+-- ARGV[6 + 3 * (i - 1)]: The member of the query in the bucket.
+-- ARGV[7 + 3 * (i - 1)]: The per-second limit, empty if there is none.
+-- ARGV[8 + 3 * (i - 1)]: The concurrent limit, empty if there is none.
+--
+-- Returns the index of the first bucket whose limit was exceeded (0 if none)
+-- followed by the historical and concurrent counts of every bucket evaluated.
+-- When a limit is exceeded, the query is removed from every bucket it was
+-- added to, so that it does not count towards future queries.
+local cutoff = ARGV[1]
+local deadline = ARGV[2]
+local lookback_start = ARGV[3]
+local now = ARGV[4]
+local lookback_s = tonumber(ARGV[5])
+
+local result = {0}
+for i, bucket in ipairs(KEYS) do
+    local member = ARGV[6 + 3 * (i - 1)]
+    local per_second_limit = ARGV[7 + 3 * (i - 1)]
+    local concurrent_limit = ARGV[8 + 3 * (i - 1)]
+
+    redis.call('ZREMRANGEBYSCORE', bucket, '-inf', cutoff)
+    redis.call('ZADD', bucket, deadline, member)
+
+    local historical = 0
+    if per_second_limit ~= '' then
+        historical = redis.call('ZCOUNT', bucket, lookback_start, now)
+    end
+    local concurrent = 0
+    if concurrent_limit ~= '' then
+        concurrent = redis.call('ZCOUNT', bucket, '(' .. now, '+inf')
+    end
+    table.insert(result, historical)
+    table.insert(result, concurrent)
+
+    if (concurrent_limit ~= '' and concurrent > tonumber(concurrent_limit))
+        or (per_second_limit ~= ''
+            and historical / lookback_s > tonumber(per_second_limit)) then
+        for j = 1, i do
+            redis.call('ZREM', KEYS[j], ARGV[6 + 3 * (j - 1)])
+        end
+        result[1] = i
+        return result
+    end
+end
+
+return result
@@ -0,0 +1,17 @@
+-- KEYS: The rate limit buckets the query was added to.
+--
+-- ARGV[1]: "discard" to remove the query from the buckets (another limit
+--          was exceeded), anything else to count it in the historical rate.
+-- ARGV[2]: The increment that brings the query back to its start time.
+-- ARGV[2 + i]: The member of the query in the i-th bucket.
+local discard = ARGV[1] == 'discard'
+local increment = ARGV[2]
+
+for i, bucket in ipairs(KEYS) do
+    local member = ARGV[2 + i]
+    if discard then
+        redis.call('ZREM', bucket, member)
+    else
+        redis.call('ZINCRBY', bucket, increment, member)
+    end
+end
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import math
+from threading import Condition
+from typing import Optional
+
+from snuba import state
+from snuba.utils.metrics import MetricsBackend
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Bounds the number of queries executed concurrently by the subscriptions
+    executor and adjusts that bound from what the executor observes, using
+    additive increase / multiplicative decrease (AIMD).
+
+    Every ``window_size`` completed queries the window is evaluated:
+
+    * If the error rate or the average query latency are above their
+      thresholds, ClickHouse is considered overloaded and the limit is
+      multiplied by ``backoff_ratio``.
+    * Otherwise, if every slot was in use at some point during the window or
+      tasks started later than the lag threshold after their scheduled time,
+      the executor is falling behind and the limit is increased by one.
+
+    The limit always stays between ``min_limit`` and ``max_limit``. The
+    thresholds are runtime configs so they can be tuned without restarting
+    the executor.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        metrics: MetricsBackend,
+        window_size: int = 20,
+        backoff_ratio: float = 0.75,
+    ) -> None:
+        assert 1 <= min_limit <= max_limit
+        self.__min_limit = min_limit
+        self.__max_limit = max_limit
+        self.__limit = min(max(initial_limit, min_limit), max_limit)
+        self.__metrics = metrics
+        self.__window_size = window_size
+        self.__backoff_ratio = backoff_ratio
+
+        self.__condition = Condition()
+        self.__in_flight = 0
+
+        self.__reset_window()
+        self.__report()
+
+    @property
+    def limit(self) -> int:
+        return self.__limit
+
+    @property
+    def max_limit(self) -> int:
+        return self.__max_limit
+
+    def __reset_window(self) -> None:
+        self.__samples = 0
+        self.__errors = 0
+        self.__total_latency_ms = 0.0
+        self.__max_lag_ms = 0.0
+        self.__saturated = False
+
+    def __report(self) -> None:
+        self.__metrics.gauge("executor.concurrency_limit", self.__limit)
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until a slot is available. Returns False if no slot became
+        available before the timeout.
+        """
+        with self.__condition:
+            if not self.__condition.wait_for(
+                lambda: self.__in_flight < self.__limit, timeout
+            ):
+                return False
+            self.__in_flight += 1
+            if self.__in_flight >= self.__limit:
+                self.__saturated = True
+            return True
+
+    def release(self, latency_ms: float, lag_ms: float, error: bool) -> None:
+        """
+        Releases a slot and records how the query that held it went. The lag
+        is the time between the scheduled time of the task and the moment
+        it started running.
+        """
+        with self.__condition:
+            self.__in_flight -= 1
+            self.__samples += 1
+            self.__errors += int(error)
+            self.__total_latency_ms += latency_ms
+            self.__max_lag_ms = max(self.__max_lag_ms, lag_ms)
+
+            if self.__samples >= self.__window_size:
+                self.__update_limit()
+                self.__reset_window()
+
+            self.__condition.notify_all()
+
+    def __update_limit(self) -> None:
+        (
+            latency_threshold_ms,
+            error_rate_threshold,
+            lag_threshold_ms,
+        ) = state.get_configs(
+            [
+                ("executor_adaptive_latency_threshold_ms", 5000),
+                ("executor_adaptive_error_rate_threshold", 0.05),
+                ("executor_adaptive_lag_threshold_ms", 10000),
+            ]
+        )
+        assert isinstance(latency_threshold_ms, (int, float))
+        assert isinstance(error_rate_threshold, (int, float))
+        assert isinstance(lag_threshold_ms, (int, float))
+
+        error_rate = self.__errors / self.__samples
+        average_latency_ms = self.__total_latency_ms / self.__samples
+
+        previous = self.__limit
+        if (
+            error_rate > error_rate_threshold
+            or average_latency_ms > latency_threshold_ms
+        ):
+            self.__limit = max(
+                self.__min_limit, math.floor(self.__limit * self.__backoff_ratio)
+            )
+            decision = "decrease"
+        elif self.__saturated or self.__max_lag_ms > lag_threshold_ms:
+            self.__limit = min(self.__max_limit, self.__limit + 1)
+            decision = "increase"
+        else:
+            decision = "keep"
+
+        self.__metrics.increment(
+            "executor.concurrency_limit.update", tags={"decision": decision}
+        )
+        if self.__limit != previous:
+            self.__report()
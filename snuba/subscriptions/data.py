@@ -27,12 +27,14 @@ from snuba.datasets.entity_subscriptions.entity_subscription import (
     InvalidSubscriptionError,
 )
 from snuba.datasets.entity_subscriptions.factory import get_entity_subscription
+from snuba.query import SelectedExpression
 from snuba.query.composite import CompositeQuery
 from snuba.query.conditions import (
     BooleanFunctions,
     ConditionFunctions,
     binary_condition,
     combine_and_conditions,
+    in_condition,
 )
 from snuba.query.data_source.simple import Entity
 from snuba.query.expressions import Column, Expression, Literal
@@ -48,6 +50,10 @@ from snuba.utils.metrics.timer import Timer
 
 SUBSCRIPTION_REFERRER = "subscription"
 
+# Name of the column carrying the project id in the result of a query run
+# on behalf of several subscriptions at once (see ``build_batched_request``).
+BATCHED_PROJECT_COLUMN = "subscription_project_id"
+
 logger = logging.getLogger("snuba.subscriptions")
 
 
@@ -85,6 +91,58 @@ class SubscriptionData:
         timestamp: datetime,
         offset: Optional[int],
         query: Union[CompositeQuery[Entity], Query],
+    ) -> None:
+        self.__add_conditions(
+            binary_condition(
+                ConditionFunctions.EQ,
+                Column(None, None, "project_id"),
+                Literal(None, self.project_id),
+            ),
+            timestamp,
+            offset,
+            query,
+        )
+
+    def add_batched_conditions(
+        self,
+        project_ids: Sequence[int],
+        timestamp: datetime,
+        offset: Optional[int],
+        query: Union[CompositeQuery[Entity], Query],
+    ) -> None:
+        """
+        Same as ``add_conditions`` but filters on all the projects provided
+        and groups the query by project so the result of each project can be
+        told apart. The limit of the subscription query, explicit or not,
+        applies to the rows of a single project: the batched query returns
+        one row per project instead, so its limit is the number of projects.
+        """
+        self.__add_conditions(
+            in_condition(
+                Column(None, None, "project_id"),
+                [Literal(None, project_id) for project_id in project_ids],
+            ),
+            timestamp,
+            offset,
+            query,
+        )
+        project_column = Column(f"_snuba_{BATCHED_PROJECT_COLUMN}", None, "project_id")
+        query.set_ast_selected_columns(
+            [
+                *query.get_selected_columns(),
+                SelectedExpression(BATCHED_PROJECT_COLUMN, project_column),
+            ]
+        )
+        query.set_ast_groupby([*query.get_groupby(), project_column])
+        query.set_limit(len(project_ids))
+        query.set_offset(0)
+
+    def __add_conditions(
+        self,
+        project_condition: Expression,
+        timestamp: datetime,
+        offset: Optional[int],
+        query: Union[CompositeQuery[Entity], Query],
     ) -> None:
         # TODO: Support composite queries with multiple entities.
         from_clause = query.get_from_clause()
@@ -98,11 +156,7 @@ class SubscriptionData:
             )
 
         conditions_to_add: Sequence[Expression] = [
-            binary_condition(
-                ConditionFunctions.EQ,
-                Column(None, None, "project_id"),
-                Literal(None, self.project_id),
-            ),
+            project_condition,
             binary_condition(
                 ConditionFunctions.GTE,
                 Column(None, None, required_timestamp_column),
@@ -168,6 +222,39 @@ class SubscriptionData:
         )
         return request
 
+    def build_batched_request(
+        self,
+        project_ids: Sequence[int],
+        dataset: Dataset,
+        timestamp: datetime,
+        offset: Optional[int],
+        timer: Timer,
+        metrics: Optional[MetricsBackend] = None,
+        referrer: str = SUBSCRIPTION_REFERRER,
+    ) -> Request:
+        """
+        Builds a single request that runs this subscription query for all the
+        projects provided. Every row of the result carries the project it
+        belongs to in the ``BATCHED_PROJECT_COLUMN`` column. Only the project
+        differs between the subscriptions served by such a request, so its
+        original body is the one of each of them.
+        """
+        schema = RequestSchema.build(SubscriptionQuerySettings)
+
+        return build_request(
+            {"query": self.query},
+            parse_snql_query,
+            SubscriptionQuerySettings,
+            schema,
+            dataset,
+            timer,
+            referrer,
+            [
+                self.entity_subscription.validate_query,
+                partial(self.add_batched_conditions, project_ids, timestamp, offset),
+            ],
+        )
+
     @classmethod
     def from_dict(
         cls, data: Mapping[str, Any], entity_key: EntityKey
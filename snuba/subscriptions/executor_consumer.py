@@ -3,10 +3,20 @@ from __future__ import annotations
 import logging
 import math
 import time
-from collections import deque
+from collections import defaultdict, deque
 from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import Deque, Mapping, Optional, Sequence, Tuple
+from typing import (
+    Any,
+    Deque,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
 
 import rapidjson
 from arroyo import Message, Partition, Topic
@@ -25,14 +35,23 @@ from snuba.datasets.entities.entity_key import EntityKey
 from snuba.datasets.entities.factory import get_entity, get_entity_name
 from snuba.datasets.factory import get_dataset
 from snuba.datasets.table_storage import KafkaTopicSpec
-from snuba.reader import Result
+from snuba.query import Query
+from snuba.query.expressions import (
+    CurriedFunctionCall,
+    Expression,
+    FunctionCall,
+    Literal,
+)
+from snuba.reader import Result, Row
 from snuba.request import Request
 from snuba.state import get_config
 from snuba.subscriptions.codecs import (
     SubscriptionScheduledTaskEncoder,
     SubscriptionTaskResultEncoder,
 )
+from snuba.subscriptions.concurrency import AdaptiveConcurrencyLimiter
 from snuba.subscriptions.data import (
+    BATCHED_PROJECT_COLUMN,
     ScheduledSubscriptionTask,
     SubscriptionTaskResult,
     SubscriptionTaskResultFuture,
@@ -45,6 +64,133 @@ from snuba.web.query import parse_and_run_query
 
 logger = logging.getLogger(__name__)
 
+BatchKey = Tuple[Any, ...]
+TaskBatch = List[Tuple[ScheduledSubscriptionTask, "Future[Tuple[Request, Result]]"]]
+
+
+def get_batch_key(task: ScheduledSubscriptionTask) -> BatchKey:
+    """
+    Scheduled tasks with the same batch key run the same query over the same
+    time range and only differ by the project they are run for, so they can
+    be executed as a single query grouped by project.
+    """
+    entity, subscription, tick_upper_offset = task.task
+    data = subscription.data
+    return (
+        entity,
+        task.timestamp,
+        tick_upper_offset,
+        data.time_window_sec,
+        data.query,
+        tuple(sorted(data.entity_subscription.to_dict().items())),
+    )
+
+
+def split_batched_result(result: Result) -> Mapping[int, Result]:
+    """
+    Splits the result of a batched subscription query into the result each
+    project would have got by running the query on its own.
+    """
+    rows_by_project: MutableMapping[int, List[Row]] = defaultdict(list)
+    for row in result["data"]:
+        row = dict(row)
+        rows_by_project[row.pop(BATCHED_PROJECT_COLUMN)].append(row)
+
+    meta = [
+        column for column in result["meta"] if column["name"] != BATCHED_PROJECT_COLUMN
+    ]
+
+    results: MutableMapping[int, Result] = {}
+    for project_id, rows in rows_by_project.items():
+        project_result = cast(Result, dict(result))
+        project_result["meta"] = meta
+        project_result["data"] = rows
+        results[project_id] = project_result
+    return results
+
+
+def _empty_aggregate_value(expression: Expression) -> Any:
+    """
+    The value ClickHouse returns for an aggregate expression with non
+    Nullable arguments evaluated on no rows. Raises ``ValueError`` when it
+    cannot be told from the expression alone.
+    """
+    if isinstance(expression, Literal) and isinstance(expression.value, (int, float)):
+        return expression.value
+    if isinstance(expression, CurriedFunctionCall):
+        expression = expression.internal_function
+    if not isinstance(expression, FunctionCall):
+        raise ValueError("not an aggregate", expression)
+
+    name = expression.function_name
+    if name.endswith("If"):
+        name = name[: -len("If")]
+    if name in ("count", "sum") or name.startswith("uniq"):
+        return 0
+    if name in ("avg", "median") or name.startswith("quantile"):
+        return math.nan
+
+    if name in ("plus", "minus", "multiply", "divide"):
+        left, right = (
+            _empty_aggregate_value(parameter) for parameter in expression.parameters
+        )
+        if name == "plus":
+            return left + right
+        if name == "minus":
+            return left - right
+        if name == "multiply":
+            return left * right
+        if right == 0:
+            return math.nan if left == 0 or math.isnan(left) else left * math.inf
+        return left / right
+
+    raise ValueError("unknown aggregate", name)
+
+
+def build_empty_batched_result(result: Result, query: Query) -> Optional[Result]:
+    """
+    Builds the result a project without any matching row would have got by
+    running the batched query on its own, since grouping by project leaves
+    such projects out of the batched result. Returns None if the value of
+    any selected expression on no rows is not known, which includes every
+    Nullable column: aggregates of Nullable arguments return NULL on no rows
+    and the meta does not tell which arguments are Nullable.
+    """
+    expressions = {
+        selected.name: selected.expression for selected in query.get_selected_columns()
+    }
+    meta = [
+        column for column in result["meta"] if column["name"] != BATCHED_PROJECT_COLUMN
+    ]
+
+    row: Row = {}
+    for column in meta:
+        expression = expressions.get(column["name"])
+        if expression is None or "Nullable(" in column["type"]:
+            return None
+        try:
+            value = _empty_aggregate_value(expression)
+        except ValueError:
+            return None
+        if "Float" in column["type"]:
+            value = float(value)
+        row[column["name"]] = value
+
+    empty_result = cast(Result, dict(result))
+    empty_result["meta"] = meta
+    empty_result["data"] = [row]
+    return empty_result
+
+
+def _copy_future_state(
+    target: Future[Tuple[Request, Result]], source: Future[Tuple[Request, Result]]
+) -> None:
+    exception = source.exception()
+    if exception is not None:
+        target.set_exception(exception)
+    else:
+        target.set_result(source.result())
+
 
 def calculate_max_concurrent_queries(
     assigned_partition_count: int,
@@ -207,6 +353,19 @@ class SubscriptionExecutorProcessingFactory(ProcessingStrategyFactory[KafkaPaylo
             "calculated_max_concurrent_queries", calculated_max_concurrent_queries
         )
 
+        concurrency_limiter = None
+        if state.get_config("executor_adaptive_concurrency", 0):
+            max_factor = state.get_config("executor_adaptive_max_factor", 2)
+            assert isinstance(max_factor, (int, float))
+            concurrency_limiter = AdaptiveConcurrencyLimiter(
+                initial_limit=calculated_max_concurrent_queries,
+                min_limit=1,
+                max_limit=max(
+                    1, math.ceil(calculated_max_concurrent_queries * max_factor)
+                ),
+                metrics=self.__metrics,
+            )
+
         return ExecuteQuery(
             self.__dataset,
             self.__entity_names,
@@ -214,6 +373,7 @@ class SubscriptionExecutorProcessingFactory(ProcessingStrategyFactory[KafkaPaylo
             self.__stale_threshold_seconds,
             self.__metrics,
             ProduceResult(self.__producer, self.__result_topic, commit),
+            concurrency_limiter,
         )
 
 
@@ -221,6 +381,20 @@ class ExecuteQuery(ProcessingStrategy[KafkaPayload]):
     """
     Decodes a scheduled subscription task from the Kafka payload, builds
     the request and executes the ClickHouse query.
+
+    When the ``subscription_executor_batching`` runtime config is set, tasks
+    that share a batch key (see ``get_batch_key``) are held for up to
+    ``subscription_executor_batch_max_wait_ms`` and executed as a single
+    query grouped by project. The grouped result is then split back into one
+    result per task. A project that does not appear in the grouped result
+    (the aggregation of an empty set) gets the value of the aggregations on
+    no rows when ``build_empty_batched_result`` can tell it, and is executed
+    on its own otherwise.
+
+    If a ``concurrency_limiter`` is provided, the number of queries running
+    at once, as well as the number of pending tasks allowed before applying
+    backpressure, follow its current limit instead of
+    ``max_concurrent_queries``.
     """
 
     def __init__(
@@ -231,11 +405,17 @@ class ExecuteQuery(ProcessingStrategy[KafkaPayload]):
         stale_threshold_seconds: Optional[int],
         metrics: MetricsBackend,
         next_step: ProcessingStrategy[SubscriptionTaskResult],
+        concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
     ) -> None:
         self.__dataset = dataset
         self.__entity_names = set(entity_names)
         self.__max_concurrent_queries = max_concurrent_queries
-        self.__executor = ThreadPoolExecutor(self.__max_concurrent_queries)
+        self.__concurrency_limiter = concurrency_limiter
+        self.__executor = ThreadPoolExecutor(
+            concurrency_limiter.max_limit
+            if concurrency_limiter is not None
+            else self.__max_concurrent_queries
+        )
         self.__stale_threshold_seconds = stale_threshold_seconds
         self.__metrics = metrics
         self.__next_step = next_step
@@ -246,6 +426,11 @@ class ExecuteQuery(ProcessingStrategy[KafkaPayload]):
             Tuple[Message[KafkaPayload], SubscriptionTaskResultFuture]
         ] = deque()
 
+        # Tasks waiting to be executed as part of a batch, with the future
+        # already queued for each of them.
+        self.__pending_batches: MutableMapping[BatchKey, TaskBatch] = {}
+        self.__pending_since: Optional[float] = None
+
         self.__closed = False
 
         self.__concurrent_gauge: Gauge = ThreadSafeGauge(
@@ -256,14 +441,41 @@ class ExecuteQuery(ProcessingStrategy[KafkaPayload]):
             self.__metrics, "executor.concurrent.clickhouse"
         )
 
+    def __run_query(self, request: Request, timer: Timer, lag_ms: float) -> Result:
+        if self.__concurrency_limiter is None:
+            return parse_and_run_query(
+                self.__dataset,
+                request,
+                timer,
+                robust=True,
+                concurrent_queries_gauge=self.__concurrent_clickhouse_gauge,
+            ).result
+
+        self.__concurrency_limiter.acquire()
+        start = time.time()
+        error = True
+        try:
+            result = parse_and_run_query(
+                self.__dataset,
+                request,
+                timer,
+                robust=True,
+                concurrent_queries_gauge=self.__concurrent_clickhouse_gauge,
+            ).result
+            error = False
+            return result
+        finally:
+            self.__concurrency_limiter.release(
+                (time.time() - start) * 1000, lag_ms, error
+            )
+
     def __execute_query(
         self, task: ScheduledSubscriptionTask, tick_upper_offset: int
     ) -> Tuple[Request, Result]:
         # Measure the amount of time that took between the task's scheduled
         # time and it beginning to execute.
-        self.__metrics.timing(
-            "executor.latency", (time.time() - task.timestamp.timestamp()) * 1000
-        )
+        lag_ms = (time.time() - task.timestamp.timestamp()) * 1000
+        self.__metrics.timing("executor.latency", lag_ms)
 
         timer = Timer("query")
 
@@ -277,17 +489,126 @@ class ExecuteQuery(ProcessingStrategy[KafkaPayload]):
                 "subscriptions_executor",
             )
 
-            result = parse_and_run_query(
-                self.__dataset,
-                request,
-                timer,
-                robust=True,
-                concurrent_queries_gauge=self.__concurrent_clickhouse_gauge,
-            ).result
+            result = self.__run_query(request, timer, lag_ms)
 
             return (request, result)
 
+    def __execute_batch(self, batch: TaskBatch) -> None:
+        first_task = batch[0][0]
+        now = time.time()
+        lag_ms = 0.0
+        for task, _ in batch:
+            task_lag_ms = (now - task.timestamp.timestamp()) * 1000
+            self.__metrics.timing("executor.latency", task_lag_ms)
+            lag_ms = max(lag_ms, task_lag_ms)
+
+        timer = Timer("query")
+        project_ids = sorted(
+            {task.task.subscription.data.project_id for task, _ in batch}
+        )
+
+        results: Mapping[int, Result] = {}
+        batched_result: Optional[Result] = None
+        try:
+            with self.__concurrent_gauge:
+                request = first_task.task.subscription.data.build_batched_request(
+                    project_ids,
+                    self.__dataset,
+                    first_task.timestamp,
+                    first_task.task.tick_upper_offset,
+                    timer,
+                    self.__metrics,
+                    "subscriptions_executor",
+                )
+                # Queries that are already grouped (allowed on some entities)
+                # cannot be told apart by project.
+                if len(request.query.get_groupby()) == 1:
+                    result = self.__run_query(request, timer, lag_ms)
+                    results = split_batched_result(result)
+                    batched_result = result
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        if batched_result is not None:
+            self.__metrics.increment("executor.batch.executed")
+        fallbacks = 0
+        for task, future in batch:
+            project_result = results.get(task.task.subscription.data.project_id)
+            if project_result is None and batched_result is not None:
+                # Projects without any matching row are not in the result.
+                project_result = build_empty_batched_result(
+                    batched_result, request.query
+                )
+            if project_result is not None:
+                future.set_result((request, project_result))
+            else:
+                fallbacks += 1
+                self.__execute_single(task, future)
+        self.__metrics.increment("executor.batch.fallback", fallbacks)
+
+    def __execute_single(
+        self, task: ScheduledSubscriptionTask, future: Future[Tuple[Request, Result]]
+    ) -> None:
+        try:
+            source = self.__executor.submit(
+                self.__execute_query, task, task.task.tick_upper_offset
+            )
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            source.add_done_callback(lambda source: _copy_future_state(future, source))
+
+    def __flush_batches(self, force: bool = False) -> None:
+        if self.__pending_since is None:
+            return
+
+        max_wait_ms = state.get_config("subscription_executor_batch_max_wait_ms", 100)
+        assert isinstance(max_wait_ms, (int, float))
+        if not force and (time.time() - self.__pending_since) * 1000 < max_wait_ms:
+            return
+
+        for batch in self.__pending_batches.values():
+            self.__submit_batch(batch)
+        self.__pending_batches.clear()
+        self.__pending_since = None
+
+    def __submit_batch(self, batch: TaskBatch) -> None:
+        self.__metrics.timing("executor.batch.size", len(batch))
+        if len(batch) == 1:
+            self.__execute_single(*batch[0])
+            return
+
+        try:
+            self.__executor.submit(self.__execute_batch, batch)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+
+    def __add_to_batch(
+        self, message: Message[KafkaPayload], task: ScheduledSubscriptionTask
+    ) -> None:
+        future: Future[Tuple[Request, Result]] = Future()
+        self.__queue.append((message, SubscriptionTaskResultFuture(task, future)))
+
+        key = get_batch_key(task)
+        batch = self.__pending_batches.setdefault(key, [])
+        batch.append((task, future))
+        if self.__pending_since is None:
+            self.__pending_since = time.time()
+
+        max_batch_size = state.get_config("subscription_executor_batch_max_size", 500)
+        assert isinstance(max_batch_size, int)
+        if len(batch) >= max_batch_size:
+            del self.__pending_batches[key]
+            self.__submit_batch(batch)
+            if not self.__pending_batches:
+                self.__pending_since = None
+
     def poll(self) -> None:
+        self.__flush_batches()
+
         while self.__queue:
             if not self.__queue[0][1].future.done():
                 break
@@ -317,7 +638,12 @@ class ExecuteQuery(ProcessingStrategy[KafkaPayload]):
         assert (
             queue_size_factor is not None
         ), "Invalid executor_queue_size_factor config"
-        max_queue_size = self.__max_concurrent_queries * queue_size_factor
+        max_concurrent_queries = (
+            self.__concurrency_limiter.limit
+            if self.__concurrency_limiter is not None
+            else self.__max_concurrent_queries
+        )
+        max_queue_size = max_concurrent_queries * queue_size_factor
 
         # Tell the consumer to pause until we have removed some futures from
         # the queue
@@ -341,7 +667,9 @@ class ExecuteQuery(ProcessingStrategy[KafkaPayload]):
         ):
             should_execute = False
 
-        if should_execute:
+        if should_execute and state.get_config("subscription_executor_batching", 0):
+            self.__add_to_batch(message, task)
+        elif should_execute:
             self.__queue.append(
                 (
                     message,
@@ -368,6 +696,8 @@ class ExecuteQuery(ProcessingStrategy[KafkaPayload]):
     def join(self, timeout: Optional[float] = None) -> None:
         start = time.time()
 
+        self.__flush_batches(force=True)
+
         while self.__queue:
             remaining = timeout - (time.time() - start) if timeout is not None else None
 
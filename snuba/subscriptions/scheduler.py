@@ -1,8 +1,11 @@
 import math
+import time
 from abc import ABC, abstractmethod
 from datetime import datetime, timedelta
 from enum import Enum
+from operator import itemgetter
 from typing import (
+    Collection,
     Iterator,
     List,
     Mapping,
@@ -12,6 +15,7 @@ from typing import (
     Tuple,
     TypeVar,
 )
+from uuid import UUID
 
 from snuba import settings, state
 from snuba.datasets.entities.entity_key import EntityKey
@@ -49,6 +53,16 @@ class TaskBuilder(ABC):
     def reset_metrics(self) -> Sequence[Tuple[str, int, Tags]]:
         raise NotImplementedError
 
+    def get_candidate_offsets(self, subscription: Subscription) -> Collection[int]:
+        """
+        Returns the values of ``timestamp % resolution`` for which
+        ``get_task`` may return a task for this subscription. The scheduler
+        uses this to only call ``get_task`` for the subscriptions that can
+        be due at a given timestamp. The default is every offset, which is
+        always correct but saves nothing.
+        """
+        return range(subscription.data.resolution_sec)
+
 
 class ImmediateTaskBuilder(TaskBuilder):
     """
@@ -77,6 +91,9 @@ class ImmediateTaskBuilder(TaskBuilder):
         self.__count = 0
         return metrics
 
+    def get_candidate_offsets(self, subscription: Subscription) -> Collection[int]:
+        return (0,)
+
 
 class JitteredTaskBuilder(TaskBuilder):
     """
@@ -140,6 +157,12 @@ class JitteredTaskBuilder(TaskBuilder):
         self.__count_max_resolution = 0
         return metrics
 
+    def get_candidate_offsets(self, subscription: Subscription) -> Collection[int]:
+        resolution = subscription.data.resolution_sec
+        if resolution > settings.MAX_RESOLUTION_FOR_JITTER:
+            return (0,)
+        return (subscription.identifier.uuid.int % resolution,)
+
 
 class TaskBuilderMode(Enum):
     IMMEDIATE = "immediate"
@@ -277,6 +300,60 @@ class DelegateTaskBuilder(TaskBuilder):
             *jittered_tagged,
         ]
 
+    def get_candidate_offsets(self, subscription: Subscription) -> Collection[int]:
+        # Offset 0 is always included (it is the immediate builder offset)
+        # which guarantees ``TaskBuilderModeState`` sees every resolution
+        # boundary and can complete transitions.
+        return {
+            *self.__immediate_builder.get_candidate_offsets(subscription),
+            *self.__jittered_builder.get_candidate_offsets(subscription),
+        }
+
+
+class ScheduleIndex:
+    """
+    Groups subscriptions by resolution and by the offset within the
+    resolution at which a task builder may schedule them, so that finding
+    the subscriptions to check at a timestamp costs one lookup per distinct
+    resolution instead of one ``get_task`` call per subscription.
+    """
+
+    def __init__(
+        self, builder: TaskBuilder, subscriptions: Sequence[Subscription]
+    ) -> None:
+        self.builder = builder
+        self.subscriptions = subscriptions
+        self.__index: MutableMapping[
+            int, MutableMapping[int, List[Tuple[int, Subscription]]]
+        ] = {}
+        for position, subscription in enumerate(subscriptions):
+            by_offset = self.__index.setdefault(subscription.data.resolution_sec, {})
+            for offset in builder.get_candidate_offsets(subscription):
+                by_offset.setdefault(offset, []).append((position, subscription))
+
+    def get_candidates(self, timestamp: int) -> Sequence[Subscription]:
+        """
+        Returns the subscriptions that may be due at ``timestamp`` in the
+        order in which they were provided.
+        """
+        due = [
+            candidates
+            for resolution, by_offset in self.__index.items()
+            for candidates in [by_offset.get(timestamp % resolution)]
+            if candidates
+        ]
+        if not due:
+            return []
+        if len(due) == 1:
+            return [subscription for _, subscription in due[0]]
+        return [
+            subscription
+            for _, subscription in sorted(
+                (entry for candidates in due for entry in candidates),
+                key=itemgetter(0),
+            )
+        ]
+
 
 class SubscriptionScheduler(SubscriptionSchedulerBase):
     def __init__(
@@ -294,7 +371,11 @@ class SubscriptionScheduler(SubscriptionSchedulerBase):
         self.__metrics = metrics
 
         self.__subscriptions: List[Subscription] = []
+        self.__subscriptions_by_id: MutableMapping[UUID, Subscription] = {}
+        self.__cursor: Optional[str] = None
         self.__last_refresh: Optional[datetime] = None
+        self.__last_full_reload: Optional[datetime] = None
+        self.__index: Optional[ScheduleIndex] = None
 
         self.__delegate_builder = DelegateTaskBuilder()
         self.__jittered_builder = JitteredTaskBuilder()
@@ -321,6 +402,67 @@ class SubscriptionScheduler(SubscriptionSchedulerBase):
             # We are transitioning between jittered and immediate mode. We must use the delegate builder.
             self.__builder = self.__delegate_builder
 
+    def __full_reload(self) -> None:
+        cursor, subscriptions = self.__store.all_with_cursor()
+        self.__subscriptions_by_id = {
+            uuid: Subscription(SubscriptionIdentifier(self.__partition_id, uuid), data)
+            for uuid, data in subscriptions
+        }
+        self.__cursor = cursor
+        self.__last_full_reload = datetime.now()
+
+    def __refresh(self, current_time: datetime) -> None:
+        """
+        Brings the cached subscriptions up to date. When enabled, and as
+        long as the store can provide them, only the subscriptions that
+        changed since the previous refresh are fetched and decoded.
+        """
+        tags = {"partition": str(self.__partition_id)}
+        incremental, full_sync_interval = state.get_configs(
+            [
+                ("subscription_store_incremental_sync", 0),
+                ("subscription_store_full_sync_interval_sec", 600),
+            ]
+        )
+        assert isinstance(full_sync_interval, (int, float))
+
+        start = time.time()
+        changes = None
+        if (
+            incremental
+            and self.__cursor is not None
+            and self.__last_full_reload is not None
+            and current_time - self.__last_full_reload
+            < timedelta(seconds=full_sync_interval)
+        ):
+            changes = self.__store.changes_since(self.__cursor)
+
+        if changes is None:
+            self.__full_reload()
+            self.__subscriptions = list(self.__subscriptions_by_id.values())
+            refresh_type = "full"
+        else:
+            self.__cursor, delta = changes
+            for uuid, data in delta.items():
+                if data is None:
+                    self.__subscriptions_by_id.pop(uuid, None)
+                else:
+                    self.__subscriptions_by_id[uuid] = Subscription(
+                        SubscriptionIdentifier(self.__partition_id, uuid), data
+                    )
+            # The list is only rebuilt when something changed, so the
+            # schedule index built on top of it stays valid otherwise.
+            if delta:
+                self.__subscriptions = list(self.__subscriptions_by_id.values())
+            self.__metrics.timing("schedule.refresh.delta_size", len(delta), tags=tags)
+            refresh_type = "delta"
+
+        self.__metrics.timing(
+            "schedule.refresh",
+            (time.time() - start) * 1000.0,
+            tags={**tags, "type": refresh_type},
+        )
+
     def __get_subscriptions(self) -> List[Subscription]:
         current_time = datetime.now()
 
@@ -328,10 +470,7 @@ class SubscriptionScheduler(SubscriptionSchedulerBase):
             self.__last_refresh is None
             or (current_time - self.__last_refresh) > self.__cache_ttl
         ):
-            self.__subscriptions = [
-                Subscription(SubscriptionIdentifier(self.__partition_id, uuid), data)
-                for uuid, data in self.__store.all()
-            ]
+            self.__refresh(current_time)
             self.__last_refresh = current_time
             self.__metrics.gauge(
                 "schedule.size",
@@ -346,18 +485,28 @@ class SubscriptionScheduler(SubscriptionSchedulerBase):
         )
         return self.__subscriptions
 
+    def __get_index(self) -> ScheduleIndex:
+        subscriptions = self.__get_subscriptions()
+        if (
+            self.__index is None
+            or self.__index.builder is not self.__builder
+            or self.__index.subscriptions is not subscriptions
+        ):
+            self.__index = ScheduleIndex(self.__builder, subscriptions)
+        return self.__index
+
     def find(self, tick: Tick) -> Iterator[ScheduledSubscriptionTask]:
         self.__reset_builder()
 
         interval = tick.timestamps
 
-        subscriptions = self.__get_subscriptions()
+        index = self.__get_index()
 
         for timestamp in range(
             math.ceil(interval.lower.timestamp()),
             math.ceil(interval.upper.timestamp()),
         ):
-            for subscription in subscriptions:
+            for subscription in index.get_candidates(timestamp):
                 task = self.__builder.get_task(
                     SubscriptionWithMetadata(
                         self.__entity_key, subscription, tick.offsets.upper
@@ -1,5 +1,5 @@
 import abc
-from typing import Iterable, Tuple
+from typing import Iterable, Mapping, Optional, Tuple
 from uuid import UUID
 
 from snuba.datasets.entities.entity_key import EntityKey
@@ -32,6 +32,27 @@ class SubscriptionDataStore(abc.ABC):
         """
         pass
 
+    def all_with_cursor(
+        self,
+    ) -> Tuple[Optional[str], Iterable[Tuple[UUID, SubscriptionData]]]:
+        """
+        Like `all` but also returns a cursor that can be passed to
+        `changes_since` to only fetch what changed afterwards. Stores that
+        do not keep a change log return no cursor.
+        """
+        return None, self.all()
+
+    def changes_since(
+        self, cursor: str
+    ) -> Optional[Tuple[str, Mapping[UUID, Optional[SubscriptionData]]]]:
+        """
+        Returns the subscriptions created, updated (mapped to their data)
+        or deleted (mapped to None) after `cursor`, with the new cursor.
+        Returns None when the changes cannot be provided (the change log was
+        truncated past the cursor) and the caller has to use `all`.
+        """
+        return None
+
 
 class RedisSubscriptionDataStore(SubscriptionDataStore):
     """
@@ -42,12 +63,23 @@ class RedisSubscriptionDataStore(SubscriptionDataStore):
 
     KEY_TEMPLATE = "subscriptions:{}:{}"
 
+    # Approximate number of entries kept in the change log. Readers that
+    # fall further behind than this go back to a full reload.
+    CHANGES_MAX_LENGTH = 10000
+    # The cursor of a reader that loaded the store before any change was
+    # ever recorded.
+    EMPTY_CURSOR = "0-0"
+
     def __init__(
         self, client: RedisClientType, entity: EntityKey, partition_id: PartitionId
     ):
         self.client = client
         self.codec = SubscriptionDataCodec(entity)
         self.__key = f"subscriptions:{entity.value}:{partition_id}"
+        # A Redis stream recording the ids of the subscriptions that were
+        # created or deleted. Stream ids are assigned by Redis and are
+        # strictly increasing, which is what makes them usable as cursors.
+        self.__changes_key = f"{self.__key}:changes"
 
     def create(self, key: UUID, data: SubscriptionData) -> None:
         """
@@ -55,12 +87,63 @@ class RedisSubscriptionDataStore(SubscriptionDataStore):
         subscriptions with the same id.
         """
         self.client.hset(self.__key, key.hex.encode("utf-8"), self.codec.encode(data))
+        self.__record_change(key)
 
     def delete(self, key: UUID) -> None:
         """
         Removes a subscription from the Redis store.
         """
         self.client.hdel(self.__key, key.hex.encode("utf-8"))
+        self.__record_change(key)
+
+    def __record_change(self, key: UUID) -> None:
+        # This has to happen after the hash is updated: a reader that sees
+        # the change log entry must also see the new value.
+        self.client.xadd(
+            self.__changes_key,
+            {b"key": key.hex.encode("utf-8")},
+            maxlen=self.CHANGES_MAX_LENGTH,
+            approximate=True,
+        )
+
+    def __get_cursor(self) -> str:
+        latest = self.client.xrevrange(self.__changes_key, count=1)
+        return latest[0][0].decode("utf-8") if latest else self.EMPTY_CURSOR
+
+    def all_with_cursor(
+        self,
+    ) -> Tuple[Optional[str], Iterable[Tuple[UUID, SubscriptionData]]]:
+        # The cursor is read first, so any change that lands while the hash
+        # is being fetched is applied again by the next ``changes_since``.
+        cursor = self.__get_cursor()
+        return cursor, self.all()
+
+    def changes_since(
+        self, cursor: str
+    ) -> Optional[Tuple[str, Mapping[UUID, Optional[SubscriptionData]]]]:
+        entries = self.client.xrange(self.__changes_key, min=cursor)
+        if cursor == self.EMPTY_CURSOR:
+            if self.client.xlen(self.__changes_key) >= self.CHANGES_MAX_LENGTH:
+                return None
+        else:
+            # The entry at the cursor is only missing if the log was trimmed
+            # past it, in which case we may have lost changes.
+            if not entries or entries[0][0].decode("utf-8") != cursor:
+                return None
+            entries = entries[1:]
+
+        if not entries:
+            return cursor, {}
+
+        # Keys are deduplicated, the hash holds the latest value anyway.
+        keys = list(dict.fromkeys(fields[b"key"] for _, fields in entries))
+        values = self.client.hmget(self.__key, keys)
+        return entries[-1][0].decode("utf-8"), {
+            UUID(key.decode("utf-8")): (
+                self.codec.decode(value) if value is not None else None
+            )
+            for key, value in zip(keys, values)
+        }
 
     def all(self) -> Iterable[Tuple[UUID, SubscriptionData]]:
         """
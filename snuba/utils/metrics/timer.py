@@ -1,10 +1,16 @@
+from __future__ import annotations
+
 from itertools import groupby
-from typing import Mapping, MutableSequence, Optional, Tuple, TypedDict
+from typing import Mapping, MutableSequence, Optional, Sequence, Tuple, TypedDict
 
 from snuba.utils.clock import Clock, SystemClock
 from snuba.utils.metrics.backends.abstract import MetricsBackend
 from snuba.utils.metrics.types import Tags
 
+# Marks the end of the timers merged into another one, see ``Timer.merge``.
+# It only moves the end of the timer and is not reported as a mark.
+_MERGED_MARK = "__merged__"
+
 
 class TimerData(TypedDict):
     timestamp: int
@@ -26,6 +32,7 @@ class Timer:
         self.__marks: MutableSequence[Tuple[str, float]] = [
             (self.__name, self.__clock.time())
         ]
+        self.__merged_durations: MutableSequence[Tuple[str, int]] = []
         self.__data: Optional[TimerData] = None
         self.__tags: Tags = tags or {}
 
@@ -33,6 +40,29 @@ class Timer:
         self.__data = None
         self.__marks.append((name, self.__clock.time()))
 
+    def merge(self, other: Timer) -> None:
+        """
+        Adds the marks of a timer that measured work done concurrently on
+        behalf of this one (on another thread for instance) to the marks of
+        this timer. The duration of this timer stays the wall clock time: it
+        is extended up to the last mark of ``other`` if that is later, and
+        the time spent waiting for ``other`` is not counted again by the
+        next mark of this timer.
+        """
+        self.__data = None
+        self.__merged_durations.extend(other.__get_durations())
+        end = other.__marks[-1][1]
+        if end > self.__marks[-1][1]:
+            self.__marks.append((_MERGED_MARK, end))
+
+    def __get_durations(self) -> Sequence[Tuple[str, int]]:
+        durations = [
+            (name, self.__diff_ms(self.__marks[i][1], ts))
+            for i, (name, ts) in enumerate(self.__marks[1:])
+            if name != _MERGED_MARK
+        ]
+        return [*durations, *self.__merged_durations]
+
     def __diff_ms(self, start: float, end: float) -> int:
         return int((end - start) * 1000)
 
@@ -55,10 +85,7 @@ class Timer:
         if self.__data is None:
             start = self.__marks[0][1]
             end = self.__clock.time() if len(self.__marks) == 1 else self.__marks[-1][1]
-            durations = [
-                (name, self.__diff_ms(self.__marks[i][1], ts))
-                for i, (name, ts) in enumerate(self.__marks[1:])
-            ]
+            durations = self.__get_durations()
 
             self.__data = {
                 "timestamp": int(start),
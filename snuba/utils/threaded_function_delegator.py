@@ -30,6 +30,9 @@ class ThreadedFunctionDelegator(Generic[TInput, TResult]):
     will be returned from "execute". Subsequent callables that are also selected
     are run in separate threads. The results of all functions are available via the
     callback function if one is provided.
+
+    Secondary callables and the callback run on the executor provided, a
+    module level pool shared by all delegators by default.
     """
 
     def __init__(
@@ -40,11 +43,13 @@ class ThreadedFunctionDelegator(Generic[TInput, TResult]):
             Callable[[Optional[Result[TResult]], List[Result[TResult]]], None]
         ],
         ignore_secondary_exceptions: bool = False,
+        executor: ThreadPoolExecutor = executor,
     ) -> None:
         self.__callables = callables
         self.__selector_func = selector_func
         self.__callback_func = callback_func
         self.__ignore_secondary_exceptions = ignore_secondary_exceptions
+        self.__executor = executor
 
     def __execute_callable(self, function_id: str) -> Result[TResult]:
         start_time = time.time()
@@ -58,7 +63,9 @@ class ThreadedFunctionDelegator(Generic[TInput, TResult]):
         primary_function_id, secondary_function_ids = self.__selector_func(input)
 
         futures = [
-            executor.submit(partial(self.__execute_callable, function_id=function_id))
+            self.__executor.submit(
+                partial(self.__execute_callable, function_id=function_id)
+            )
             for function_id in secondary_function_ids
         ]
 
@@ -89,4 +96,4 @@ class ThreadedFunctionDelegator(Generic[TInput, TResult]):
                     if not self.__ignore_secondary_exceptions:
                         logger.exception(error)
 
-            executor.submit(execute_callback)
+            self.__executor.submit(execute_callback)
@@ -1,8 +1,21 @@
 from __future__ import annotations
 
-from typing import Any, Mapping, NamedTuple, TypedDict, cast
-
-from snuba.reader import Column, Result, Row, transform_rows
+import math
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Mapping,
+    NamedTuple,
+    Sequence,
+    TypedDict,
+    cast,
+)
+
+import simplejson as json
+from simplejson.encoder import encode_basestring_ascii
+
+from snuba.reader import Column, ColumnarRows, Result, Row, transform_rows
 from snuba.utils.serializable_exception import JsonSerializable, SerializableException
 
 
@@ -62,7 +75,13 @@ def transform_column_names(
                 new_row[c] = value
         return new_row
 
-    transform_rows(result.result, transformer)
+    data = result.result["data"]
+    if isinstance(data, ColumnarRows):
+        data.rename(mapping)
+        if "totals" in result.result:
+            result.result["totals"] = transformer(result.result["totals"])
+    else:
+        transform_rows(result.result, transformer)
 
     new_meta = []
     for c in result.result["meta"]:
@@ -70,3 +89,48 @@ def transform_column_names(
         for n in names:
             new_meta.append(Column(name=n, type=c["type"]))
     result.result["meta"] = new_meta
+
+
+def _encode_json_value(value: Any) -> str:
+    return cast(str, json.dumps(value, default=str))
+
+
+def _encode_json_column(values: Sequence[Any]) -> Iterable[str]:
+    encoder: Callable[[Any], str]
+    if all(type(value) is int for value in values):
+        encoder = int.__repr__
+    elif all(type(value) is str for value in values):
+        encoder = encode_basestring_ascii
+    elif all(type(value) is float and math.isfinite(value) for value in values):
+        encoder = float.__repr__
+    else:
+        encoder = _encode_json_value
+    return map(encoder, values)
+
+
+def dump_payload(payload: Mapping[str, Any]) -> str:
+    """
+    Serializes a query response payload to JSON. When the result rows are
+    still columnar every column is encoded in bulk with the encoder for its
+    value type instead of walking one dictionary per row. The output is
+    equivalent to ``json.dumps(payload, default=str)``, with ``data`` as the
+    first key.
+    """
+    data = payload.get("data")
+    columnar = data.get_columns() if isinstance(data, ColumnarRows) else None
+    if data is None or columnar is None:
+        return cast(str, json.dumps(payload, default=str))
+
+    names, columns = columnar
+    keys = [encode_basestring_ascii(name) + ": " for name in names]
+    if names:
+        rows = [
+            "{" + ", ".join(map(str.__add__, keys, row)) + "}"
+            for row in zip(*map(_encode_json_column, columns))
+        ]
+    else:
+        rows = ["{}"] * len(data)
+    encoded = '{"data": [' + ", ".join(rows) + "]"
+
+    rest = _encode_json_value({k: v for k, v in payload.items() if k != "data"})
+    return encoded + ("}" if rest == "{}" else ", " + rest[1:])
@@ -0,0 +1,319 @@
+"""
+Per time bucket result cache for grouped timeseries queries.
+
+Dashboards run the same timeseries query every few seconds on a sliding
+time window, so the SQL, and with it the result cache key, changes at
+every request. When a query is grouped by a time bucket (the expressions
+built by ``TimeSeriesProcessor``), the rows of a bucket only depend on the
+data in that bucket. The rows of the buckets that are entirely within the
+time range and old enough not to receive new data anymore are cached
+individually, keyed by the query without its time range. A request then
+only queries ClickHouse for the buckets that are not cached (the partial
+buckets at the edges of the range and the most recent ones) and stitches
+the cached rows to the result.
+
+Queries on the tables of a storage with a replacer are not cached: a
+replacement changes the rows of past buckets without changing the query.
+"""
+from __future__ import annotations
+
+import calendar
+import copy
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from hashlib import md5
+from typing import (
+    Any,
+    FrozenSet,
+    Mapping,
+    MutableSequence,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+import rapidjson
+
+from snuba.clickhouse.formatter.query import format_query
+from snuba.clickhouse.query import Query
+from snuba.clickhouse.query_dsl.accessors import get_time_range
+from snuba.datasets.schemas.tables import TableSchema
+from snuba.query import OrderByDirection
+from snuba.query.composite import CompositeQuery
+from snuba.query.conditions import (
+    BooleanFunctions,
+    ConditionFunctions,
+    binary_condition,
+    combine_and_conditions,
+    get_first_level_and_conditions,
+)
+from snuba.query.data_source.simple import Table
+from snuba.query.expressions import Column, Expression, FunctionCall, Literal
+from snuba.query.processors.logical.timeseries_processor import get_time_bucket
+from snuba.reader import Row
+from snuba.redis import RedisClientType
+from snuba.util import parse_datetime
+from snuba.web.result_codecs import encode_json
+
+
+@dataclass(frozen=True)
+class TimeBucketedQuery:
+    """
+    A query that can be executed with the bucket cache: it is grouped by a
+    time bucket on the column its time range is defined on, and the rows
+    of the result can be assigned to their bucket.
+    """
+
+    query: Query
+    column: str
+    granularity: int
+    bucket_alias: str
+    from_ts: int
+    to_ts: int
+    # None if the rows are not sorted, otherwise whether they are sorted
+    # by descending time bucket.
+    descending: Optional[bool]
+
+
+def _to_timestamp(value: datetime) -> int:
+    # Datetimes in the query and in the results are UTC.
+    return calendar.timegm(value.utctimetuple())
+
+
+def _to_datetime(timestamp: int) -> datetime:
+    return datetime.utcfromtimestamp(timestamp)
+
+
+@lru_cache(maxsize=None)
+def get_replaced_tables() -> FrozenSet[str]:
+    """
+    Returns the tables of the storages that have a replacer.
+    """
+    # Imported here as the storages depend on most of the query modules.
+    from snuba.datasets.storages.factory import (
+        get_writable_storage,
+        get_writable_storage_keys,
+    )
+
+    tables: Set[str] = set()
+    for storage_key in get_writable_storage_keys():
+        storage = get_writable_storage(storage_key)
+        schema = storage.get_schema()
+        if (
+            isinstance(schema, TableSchema)
+            and storage.get_table_writer().get_replacer_processor() is not None
+        ):
+            tables.add(schema.get_table_name())
+    return frozenset(tables)
+
+
+def get_time_bucketed_query(
+    query: Union[Query, CompositeQuery[Table]]
+) -> Optional[TimeBucketedQuery]:
+    if not isinstance(query, Query):
+        return None
+    # Replacements rewrite the rows of buckets which are already cached,
+    # and the cached rows cannot be told apart from the current ones.
+    if query.get_from_clause().table_name in get_replaced_tables():
+        return None
+    # Totals, offsets and LIMIT BY span across buckets.
+    if query.has_totals() or query.get_offset() or query.get_limitby() is not None:
+        return None
+
+    selected_aliases = {
+        selected.expression.alias for selected in query.get_selected_columns()
+    }
+    for exp in query.get_groupby():
+        bucket = get_time_bucket(exp)
+        if bucket is not None and exp.alias in selected_aliases:
+            bucket_expression = exp
+            break
+    else:
+        return None
+
+    assert bucket_expression.alias is not None
+    column, granularity = bucket
+
+    orderby = query.get_orderby()
+    if any(o.expression != bucket_expression for o in orderby):
+        return None
+    descending = orderby[0].direction == OrderByDirection.DESC if orderby else None
+
+    from_date, to_date = get_time_range(query, column)
+    if from_date is None or to_date is None:
+        return None
+
+    return TimeBucketedQuery(
+        query=query,
+        column=column,
+        granularity=granularity,
+        bucket_alias=bucket_expression.alias,
+        from_ts=_to_timestamp(from_date),
+        to_ts=_to_timestamp(to_date),
+        descending=descending,
+    )
+
+
+def _is_time_range_condition(condition: Expression, column: str) -> bool:
+    return (
+        isinstance(condition, FunctionCall)
+        and condition.function_name in (ConditionFunctions.GTE, ConditionFunctions.LT)
+        and len(condition.parameters) == 2
+        and isinstance(condition.parameters[0], Column)
+        and condition.parameters[0].column_name == column
+        and isinstance(condition.parameters[1], Literal)
+        and isinstance(condition.parameters[1].value, datetime)
+    )
+
+
+def get_template_key(bucketed_query: TimeBucketedQuery) -> str:
+    """
+    Identifies the query regardless of its time range: the bucket rows
+    cached by a query can be reused by every query with the same key.
+    """
+    query = copy.copy(bucketed_query.query)
+    condition = query.get_condition()
+    assert condition is not None
+    other_conditions = [
+        c
+        for c in get_first_level_and_conditions(condition)
+        if not _is_time_range_condition(c, bucketed_query.column)
+    ]
+    query.set_ast_condition(
+        combine_and_conditions(other_conditions) if other_conditions else None
+    )
+    sql = format_query(query).get_sql()
+    return md5(f"{bucketed_query.granularity}:{sql}".encode("utf-8")).hexdigest()
+
+
+def get_cacheable_buckets(
+    bucketed_query: TimeBucketedQuery, now: int, min_age: int
+) -> Sequence[int]:
+    """
+    Returns the start of the buckets that are entirely within the time
+    range of the query and that ended at least ``min_age`` seconds ago.
+    """
+    granularity = bucketed_query.granularity
+    first = -(-bucketed_query.from_ts // granularity) * granularity
+    end = min(bucketed_query.to_ts, now - min_age) // granularity * granularity
+    return range(first, end, granularity)
+
+
+def longest_run(buckets: Sequence[int], granularity: int) -> Sequence[int]:
+    """
+    Returns the longest sequence of contiguous buckets. Buckets must be
+    sorted.
+    """
+    best: Sequence[int] = []
+    start = 0
+    for i in range(1, len(buckets) + 1):
+        if i == len(buckets) or buckets[i] != buckets[i - 1] + granularity:
+            if i - start > len(best):
+                best = buckets[start:i]
+            start = i
+    return best
+
+
+def exclude_buckets(bucketed_query: TimeBucketedQuery, buckets: Sequence[int]) -> Query:
+    """
+    Returns a copy of the query that does not read the given contiguous
+    buckets.
+    """
+    column = Column(None, None, bucketed_query.column)
+    end = buckets[-1] + bucketed_query.granularity
+    query = copy.copy(bucketed_query.query)
+    query.add_condition_to_ast(
+        binary_condition(
+            BooleanFunctions.OR,
+            binary_condition(
+                ConditionFunctions.LT,
+                column,
+                Literal(None, _to_datetime(buckets[0])),
+            ),
+            binary_condition(
+                ConditionFunctions.GTE,
+                column,
+                Literal(None, _to_datetime(end)),
+            ),
+        )
+    )
+    return query
+
+
+def get_bucket(bucketed_query: TimeBucketedQuery, row: Row) -> int:
+    # Results are transformed before reaching this point, so the bucket is
+    # an ISO 8601 string.
+    return _to_timestamp(parse_datetime(str(row[bucketed_query.bucket_alias])))
+
+
+def stitch_rows(
+    bucketed_query: TimeBucketedQuery,
+    cached: Sequence[Row],
+    fresh: Sequence[Row],
+) -> MutableSequence[Row]:
+    rows = [*cached, *fresh]
+    if bucketed_query.descending is not None:
+        rows.sort(
+            key=lambda row: get_bucket(bucketed_query, row),
+            reverse=bucketed_query.descending,
+        )
+    limit = bucketed_query.query.get_limit()
+    return rows[:limit] if limit is not None else rows
+
+
+class TimeBucketCache:
+    """
+    Stores the rows of each time bucket of a query template in its own key.
+    All the keys of a template share the same hash tag, so they can be read
+    with a single MGET on a Redis cluster.
+    """
+
+    def __init__(self, client: RedisClientType, prefix: str) -> None:
+        self.__client = client
+        self.__prefix = prefix
+
+    def __build_key(self, template: str, suffix: str) -> str:
+        return f"{self.__prefix}{{{template}}}/{suffix}"
+
+    def get(
+        self, template: str, buckets: Sequence[int]
+    ) -> Tuple[Optional[Sequence[Any]], Mapping[int, MutableSequence[Row]]]:
+        """
+        Returns the meta of the cached results and the rows of the buckets
+        found in the cache.
+        """
+        if not buckets:
+            return None, {}
+        values = self.__client.mget(
+            [
+                self.__build_key(template, "meta"),
+                *[self.__build_key(template, str(bucket)) for bucket in buckets],
+            ]
+        )
+        if values[0] is None:
+            return None, {}
+        return rapidjson.loads(values[0]), {
+            bucket: rapidjson.loads(value)
+            for bucket, value in zip(buckets, values[1:])
+            if value is not None
+        }
+
+    def set(
+        self,
+        template: str,
+        meta: Sequence[Any],
+        buckets: Mapping[int, Sequence[Row]],
+        expiry: int,
+    ) -> None:
+        if not buckets:
+            return
+        pipeline = self.__client.pipeline(transaction=False)
+        pipeline.set(self.__build_key(template, "meta"), encode_json(meta), ex=expiry)
+        for bucket, rows in buckets.items():
+            pipeline.set(
+                self.__build_key(template, str(bucket)), encode_json(rows), ex=expiry
+            )
+        pipeline.execute()
@@ -1,11 +1,24 @@
 from __future__ import annotations
 
 import logging
+import sys
+import time
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial, reduce
 from hashlib import md5
 from threading import Lock
-from typing import Any, Mapping, MutableMapping, Optional, Set, Union, cast
+from typing import (
+    Any,
+    Callable,
+    Mapping,
+    MutableMapping,
+    MutableSequence,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
 
 import rapidjson
 import sentry_sdk
@@ -16,7 +29,7 @@ from sentry_sdk.api import configure_scope
 from snuba import environment, settings, state
 from snuba.clickhouse.errors import ClickhouseError
 from snuba.clickhouse.formatter.nodes import FormattedQuery
-from snuba.clickhouse.formatter.query import format_query_anonymized
+from snuba.clickhouse.formatter.query import format_query, format_query_anonymized
 from snuba.clickhouse.query import Query
 from snuba.clickhouse.query_dsl.accessors import get_time_range_estimate
 from snuba.clickhouse.query_profiler import generate_profile
@@ -31,9 +44,10 @@ from snuba.querylog.query_metadata import (
     QueryStatus,
     SnubaQueryMetadata,
 )
-from snuba.reader import Reader, Result
+from snuba.reader import ColumnarRows, Reader, Result, Row
 from snuba.redis import RedisClientKey, get_redis_client
 from snuba.state.cache.abstract import Cache, ExecutionTimeoutError
+from snuba.state.cache.local.backend import LocalCache
 from snuba.state.cache.redis.backend import RESULT_VALUE, RESULT_WAIT, RedisCache
 from snuba.state.rate_limit import (
     ORGANIZATION_RATE_LIMIT_NAME,
@@ -51,18 +65,70 @@ from snuba.utils.serializable_exception import (
     SerializableException,
     SerializableExceptionDict,
 )
-from snuba.web import QueryException, QueryResult, constants
+from snuba.web import QueryException, QueryResult, constants, result_codecs
+from snuba.web.bucket_cache import (
+    TimeBucketCache,
+    TimeBucketedQuery,
+    exclude_buckets,
+    get_bucket,
+    get_cacheable_buckets,
+    get_template_key,
+    get_time_bucketed_query,
+    longest_run,
+    stitch_rows,
+)
+from snuba.web.result_codecs import ColumnarResultEncoder, build_columnar_encoder
 
 MAX_HASH_PLUS_ONE = 16**32  # Max value of md5 hash
 metrics = MetricsWrapper(environment.metrics, "db_query")
 
 
 class ResultCacheCodec(ExceptionAwareCodec[bytes, Result]):
+    """
+    Encodes results either as JSON or in the columnar binary format of
+    ``snuba.web.result_codecs``. The encoding is picked through the
+    ``result_cache_codec`` runtime config, which can be overridden per cache
+    partition with ``<partition_id>/result_cache_codec``. Decoding detects
+    the format of the payload, so the config can be changed at any time.
+    Exceptions are always encoded as JSON.
+    """
+
+    def __init__(self, partition_id: str = "default") -> None:
+        self.__partition_id = partition_id
+        self.__columnar_encoders: MutableMapping[
+            Tuple[str, int], ColumnarResultEncoder
+        ] = {}
+
+    def __get_columnar_encoder(self) -> Optional[ColumnarResultEncoder]:
+        default_codec, partition_codec, compression, level = state.get_configs(
+            [
+                ("result_cache_codec", result_codecs.JSON_CODEC),
+                (f"{self.__partition_id}/result_cache_codec", None),
+                ("result_cache_compression", "none"),
+                ("result_cache_compression_level", 3),
+            ]
+        )
+        codec = partition_codec if partition_codec is not None else default_codec
+        if codec != result_codecs.COLUMNAR_CODEC:
+            return None
+
+        encoder_key = (str(compression), int(cast(int, level)))
+        encoder = self.__columnar_encoders.get(encoder_key)
+        if encoder is None:
+            encoder = build_columnar_encoder(*encoder_key)
+            self.__columnar_encoders[encoder_key] = encoder
+        return encoder
+
     def encode(self, value: Result) -> bytes:
-        return cast(str, rapidjson.dumps(value, default=str)).encode("utf-8")
+        encoder = self.__get_columnar_encoder()
+        if encoder is not None:
+            encoded = encoder.encode(value)
+            if encoded is not None:
+                return encoded
+        return result_codecs.encode_json(value)
 
     def decode(self, value: bytes) -> Result:
-        ret = rapidjson.loads(value)
+        ret = result_codecs.decode_payload(value)
         if ret.get("__type__", "DNE") == "SerializableException":
             raise SerializableException.from_dict(cast(SerializableExceptionDict, ret))
         if not isinstance(ret, Mapping) or "meta" not in ret or "data" not in ret:
@@ -73,19 +139,80 @@ class ResultCacheCodec(ExceptionAwareCodec[bytes, Result]):
         return cast(str, rapidjson.dumps(value.to_dict())).encode("utf-8")
 
 
+def _estimate_result_size(value: Result) -> int:
+    """
+    Cheap approximation of the memory held by a result. This is only used
+    to bound the local result cache, so it deliberately ignores nested
+    containers and interning.
+    """
+    size = sys.getsizeof(value)
+    data = value["data"]
+    columns = data.get_columns() if isinstance(data, ColumnarRows) else None
+    if columns is not None:
+        for column in columns[1]:
+            size += sys.getsizeof(column)
+            for cell in column:
+                size += sys.getsizeof(cell)
+        return size
+
+    for row in data:
+        size += sys.getsizeof(row)
+        for cell in row.values():
+            size += sys.getsizeof(cell)
+    return size
+
+
+def _copy_result(value: Result) -> Result:
+    """
+    Results are mutated in place further up the stack (column renaming,
+    time split merging), so the local cache hands out row level copies.
+    Columnar data is copied column by column so it stays columnar.
+    """
+    result = cast(Result, {**value})
+    data = value["data"]
+    columns = data.get_columns() if isinstance(data, ColumnarRows) else None
+    if columns is not None:
+        names, values = columns
+        result["data"] = ColumnarRows(names, [list(column) for column in values])
+    else:
+        result["data"] = [{**row} for row in data]
+    if "totals" in value:
+        result["totals"] = {**value["totals"]}
+    return result
+
+
+def _build_cache_partition(partition_id: str, prefix: str) -> Cache[Result]:
+    cache: Cache[Result] = RedisCache(
+        get_redis_client(RedisClientKey.CACHE),
+        prefix,
+        ResultCacheCodec(partition_id),
+        ThreadPoolExecutor(),
+    )
+    if settings.LOCAL_RESULT_CACHE_MAX_BYTES > 0:
+        cache = LocalCache(
+            cache,
+            settings.LOCAL_RESULT_CACHE_MAX_BYTES,
+            _estimate_result_size,
+            _copy_result,
+            partition_id,
+        )
+    return cache
+
+
 DEFAULT_CACHE_PARTITION_ID = "default"
 
 # We are not initializing all the cache partitions here and instead relying on lazy
 # initialization because this module only learn of cache partitions ids from the
 # reader when running a query.
 cache_partitions: MutableMapping[str, Cache[Result]] = {
-    DEFAULT_CACHE_PARTITION_ID: RedisCache(
-        get_redis_client(RedisClientKey.CACHE),
-        "snuba-query-cache:",
-        ResultCacheCodec(),
-        ThreadPoolExecutor(),
+    DEFAULT_CACHE_PARTITION_ID: _build_cache_partition(
+        DEFAULT_CACHE_PARTITION_ID, "snuba-query-cache:"
     )
 }
+bucket_cache = TimeBucketCache(
+    get_redis_client(RedisClientKey.CACHE), "snuba-bucket-cache:"
+)
+
 # This lock prevents us from initializing the cache twice. The cache is initialized
 # with a thread pool. In case of race condition we could create the threads twice which
 # is a waste.
@@ -259,6 +386,7 @@ def execute_query(
         clickhouse_query_settings,
         with_totals=clickhouse_query.has_totals(),
         robust=robust,
+        columnar=query_settings.get_columnar_results(),
     )
 
     timer.mark("execute")
@@ -425,11 +553,8 @@ def _get_cache_partition(reader: Reader) -> Cache[Result]:
             # during the first query. So, for the vast majority of queries, the overhead
             # of acquiring the lock is not needed.
             if partition_id not in cache_partitions:
-                cache_partitions[partition_id] = RedisCache(
-                    get_redis_client(RedisClientKey.CACHE),
-                    f"snuba-query-cache:{partition_id}:",
-                    ResultCacheCodec(),
-                    ThreadPoolExecutor(),
+                cache_partitions[partition_id] = _build_cache_partition(
+                    partition_id, f"snuba-query-cache:{partition_id}:"
                 )
 
     return cache_partitions[
@@ -571,6 +696,148 @@ def execute_query_with_readthrough_caching(
     )
 
 
+@with_span(op="db")
+def execute_query_with_bucket_caching(
+    bucketed_query: TimeBucketedQuery,
+    execute_query_strategy: Callable[..., Result],
+    clickhouse_query: Union[Query, CompositeQuery[Table]],
+    query_settings: QuerySettings,
+    formatted_query: FormattedQuery,
+    formatted_query_sorted: Optional[FormattedQuery],
+    reader: Reader,
+    timer: Timer,
+    stats: MutableMapping[str, Any],
+    clickhouse_query_settings: MutableMapping[str, Any],
+    robust: bool,
+) -> Result:
+    """
+    Executes a query grouped by time bucket reusing the rows of the
+    buckets cached by previous queries. See ``snuba.web.bucket_cache``.
+
+    Only the longest contiguous run of cached buckets is reused, so the
+    rest of the time range can be read with a single query, which goes
+    through ``execute_query_strategy`` like any other query.
+    """
+    min_age, expiry = state.get_configs(
+        [("bucket_cache_min_age_sec", 600), ("bucket_cache_expiry_sec", 3600)]
+    )
+    min_age = int(min_age if min_age is not None else 600)
+    expiry = int(expiry if expiry is not None else 3600)
+
+    execute = partial(
+        execute_query_strategy,
+        query_settings=query_settings,
+        reader=reader,
+        timer=timer,
+        stats=stats,
+        clickhouse_query_settings=clickhouse_query_settings,
+        robust=robust,
+    )
+
+    granularity = bucketed_query.granularity
+    buckets = get_cacheable_buckets(bucketed_query, int(time.time()), min_age)
+    if not buckets:
+        return execute(
+            clickhouse_query,
+            formatted_query=formatted_query,
+            formatted_query_sorted=formatted_query_sorted,
+        )
+
+    partition_id = reader.cache_partition_id or DEFAULT_CACHE_PARTITION_ID
+    template = f"{partition_id}:{get_template_key(bucketed_query)}"
+    start = time.time()
+    try:
+        meta, cached = bucket_cache.get(template, buckets)
+    except Exception:
+        logger.warning("Failed to read from the bucket cache", exc_info=True)
+        meta, cached = None, {}
+    elapsed = time.time() - start
+    timer.mark("bucket_cache_get")
+
+    hits = longest_run(sorted(cached), granularity)
+    stats["bucket_cache_hits"] = len(hits)
+    stats["bucket_cache_misses"] = len(buckets) - len(hits)
+    metrics.increment("bucket_cache.hits", len(hits))
+    metrics.increment("bucket_cache.misses", len(buckets) - len(hits))
+    cached_rows = [row for bucket in hits for row in cached[bucket]]
+
+    if (
+        hits
+        and meta is not None
+        and hits[0] == bucketed_query.from_ts
+        and hits[-1] + granularity == bucketed_query.to_ts
+    ):
+        # The time range of these queries changes at every request, so a
+        # full hit stands for a query that would have reached ClickHouse
+        # and is rate limited like one.
+        with RateLimitAggregator(
+            query_settings.get_rate_limit_params()
+        ) as rate_limit_stats_container:
+            stats.update(rate_limit_stats_container.to_dict())
+            timer.mark("rate_limit")
+            _record_rate_limit_metrics(rate_limit_stats_container, reader, stats)
+            data = stitch_rows(bucketed_query, cached_rows, [])
+            profile = {
+                "bytes": 0,
+                "blocks": 0,
+                "rows": len(data),
+                "elapsed": elapsed,
+            }
+            return {
+                "data": data,
+                "meta": meta,
+                "profile": profile,
+                "trace_output": "",
+            }
+
+    if hits:
+        fresh_query = exclude_buckets(bucketed_query, hits)
+        formatted_fresh_query = format_query(fresh_query)
+        formatted_fresh_query_sorted = None
+    else:
+        fresh_query, formatted_fresh_query = bucketed_query.query, formatted_query
+        formatted_fresh_query_sorted = formatted_query_sorted
+
+    result = execute(
+        fresh_query,
+        formatted_query=formatted_fresh_query,
+        formatted_query_sorted=formatted_fresh_query_sorted,
+    )
+    fresh_rows = list(result["data"])
+
+    limit = bucketed_query.query.get_limit()
+    if limit is not None and len(fresh_rows) >= limit:
+        # The rows of some buckets may have been cut by the limit, so they
+        # cannot be cached nor stitched to the cached ones.
+        metrics.increment("bucket_cache.limit_reached")
+        if not hits:
+            return result
+        return execute(
+            clickhouse_query,
+            formatted_query=formatted_query,
+            formatted_query_sorted=formatted_query_sorted,
+        )
+
+    hit_buckets = set(hits)
+    fresh_buckets: MutableMapping[int, MutableSequence[Row]] = {
+        bucket: [] for bucket in buckets if bucket not in hit_buckets
+    }
+    for row in fresh_rows:
+        rows = fresh_buckets.get(get_bucket(bucketed_query, row))
+        if rows is not None:
+            rows.append(row)
+    try:
+        bucket_cache.set(template, result["meta"], fresh_buckets, expiry)
+    except Exception:
+        logger.warning("Failed to write to the bucket cache", exc_info=True)
+    timer.mark("bucket_cache_set")
+
+    # The result may be shared with the query cache, so it is not modified.
+    stitched_result = cast(Result, dict(result))
+    stitched_result["data"] = stitch_rows(bucketed_query, cached_rows, fresh_rows)
+    return stitched_result
+
+
 def _get_cache_wait_timeout(
     query_settings: MutableMapping[str, Any], reader: Reader
 ) -> int:
@@ -662,11 +929,20 @@ def raw_query(
         trace_id,
     )
 
-    execute_query_strategy = (
-        execute_query_with_readthrough_caching
-        if state.get_config("use_readthrough_query_cache", 1)
-        else execute_query_with_caching
+    bucketed_query = (
+        get_time_bucketed_query(clickhouse_query)
+        if state.get_config("use_bucket_cache", 0)
+        else None
     )
+    execute_query_strategy: Callable[..., Result]
+    if state.get_config("use_readthrough_query_cache", 1):
+        execute_query_strategy = execute_query_with_readthrough_caching
+    else:
+        execute_query_strategy = execute_query_with_caching
+    if bucketed_query is not None:
+        execute_query_strategy = partial(
+            execute_query_with_bucket_caching, bucketed_query, execute_query_strategy
+        )
 
     try:
         result = execute_query_strategy(
@@ -11,7 +11,8 @@ import sentry_sdk
 
 from snuba import environment
 from snuba import settings as snuba_settings
-from snuba.clickhouse.formatter.query import format_query
+from snuba.clickhouse.formatter.nodes import FormattedQuery
+from snuba.clickhouse.formatter.query import format_query, format_query_and_sorted
 from snuba.clickhouse.query import Query
 from snuba.clickhouse.query_dsl.accessors import (
     get_object_ids_in_query_ast,
@@ -29,7 +30,10 @@ from snuba.query.data_source.visitor import DataSourceVisitor
 from snuba.query.logical import Query as LogicalQuery
 from snuba.query.query_settings import QuerySettings
 from snuba.querylog import record_query
-from snuba.querylog.query_metadata import SnubaQueryMetadata
+from snuba.querylog.query_metadata import (
+    SnubaQueryMetadata,
+    get_concurrent_query_metadata,
+)
 from snuba.reader import Reader
 from snuba.request import Request
 from snuba.util import with_span
@@ -256,6 +260,11 @@ def _run_and_apply_column_names(
     those aliases now are needed to produce the names the user expects
     in the output.
     """
+    concurrent_query_metadata = get_concurrent_query_metadata()
+    if concurrent_query_metadata is not None:
+        # Running concurrently with other queries of the same request, the
+        # timings and queries are merged by the thread owning the request.
+        timer, query_metadata = concurrent_query_metadata.isolate(timer, query_metadata)
 
     result = _format_storage_query_and_run(
         timer,
@@ -310,12 +319,15 @@ def _format_storage_query_and_run(
     with sentry_sdk.start_span(description="create_query", op="db") as span:
         _apply_turbo_sampling_if_needed(clickhouse_query, query_settings)
 
-        formatted_query = format_query(clickhouse_query)
-        formatted_query_sorted = None
+        formatted_query_sorted: Optional[FormattedQuery] = None
 
         # Build formatted query with sorted fields and expressions
         if referrer not in EXCLUDED_REFERRERS_FROM_FIELDS_SORTING:
-            formatted_query_sorted = format_query(clickhouse_query, sort_fields=True)
+            formatted_query, formatted_query_sorted = format_query_and_sorted(
+                clickhouse_query
+            )
+        else:
+            formatted_query = format_query(clickhouse_query)
 
         formatted_sql = formatted_query.get_sql()
         query_size_bytes = len(formatted_sql.encode("utf-8"))
@@ -0,0 +1,355 @@
+"""
+Encodings used to store query results in the result cache.
+
+Two formats coexist in the cache:
+
+* The legacy JSON format: the whole ``Result`` dictionary serialized as
+  UTF-8 JSON. Serialized exceptions (see ``ExceptionAwareCodec``) always
+  use this format, so the error path is the same regardless of the codec
+  used for values.
+* A versioned, column oriented binary format. It starts with ``MAGIC``
+  followed by a version byte and a compression byte. Since JSON payloads
+  always start with ``{`` the two formats can be told apart from the first
+  byte and decoding never depends on runtime configuration.
+
+Binary layout (after the 5 bytes preamble, possibly compressed)::
+
+    uint32 header length | header (JSON) | (uint32 length | column)*
+
+The header contains everything but the row data (meta, totals, profile,
+trace output), the number of rows and the encoding of each column.
+"""
+from __future__ import annotations
+
+import logging
+import struct
+import sys
+from array import array
+from enum import Enum
+from typing import Any, Mapping, MutableSequence, Optional, Sequence, cast
+
+import rapidjson
+
+from snuba.reader import ColumnarRows, Result, Row, unwrap_nullable_type
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None  # type: ignore
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: no cover
+    lz4_frame = None  # type: ignore
+
+
+MAGIC = b"\x00SR"
+COLUMNAR_VERSION = 1
+
+_UINT32 = struct.Struct("<I")
+_PREAMBLE = struct.Struct("<3sBB")
+_NULL_LENGTH = 0xFFFFFFFF
+
+
+class Compression(Enum):
+    NONE = 0
+    ZSTD = 1
+    LZ4 = 2
+
+
+def is_compression_available(compression: Compression) -> bool:
+    if compression == Compression.ZSTD:
+        return zstandard is not None
+    if compression == Compression.LZ4:
+        return lz4_frame is not None
+    return True
+
+
+def _compress(compression: Compression, level: int, payload: bytes) -> bytes:
+    if compression == Compression.ZSTD:
+        return cast(bytes, zstandard.ZstdCompressor(level=level).compress(payload))
+    if compression == Compression.LZ4:
+        return cast(bytes, lz4_frame.compress(payload, compression_level=level))
+    return payload
+
+
+def _decompress(compression: Compression, payload: bytes) -> bytes:
+    if compression == Compression.ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd compressed cache value but zstandard is missing")
+        return cast(bytes, zstandard.ZstdDecompressor().decompress(payload))
+    if compression == Compression.LZ4:
+        if lz4_frame is None:
+            raise ValueError("lz4 compressed cache value but lz4 is missing")
+        return cast(bytes, lz4_frame.decompress(payload))
+    return payload
+
+
+def is_columnar_payload(value: bytes) -> bool:
+    return value[: len(MAGIC)] == MAGIC
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, ColumnarRows):
+        return value.to_rows()
+    return str(value)
+
+
+def encode_json(value: Any) -> bytes:
+    return cast(str, rapidjson.dumps(value, default=_json_default)).encode("utf-8")
+
+
+def decode_json_result(value: bytes) -> Any:
+    return rapidjson.loads(value)
+
+
+# Column encodings. The single letter is what is written in the header.
+KIND_INT = "i"
+KIND_UINT = "u"
+KIND_FLOAT = "f"
+KIND_STRING = "s"
+KIND_JSON = "j"
+
+_ARRAY_TYPECODES = {KIND_INT: "q", KIND_UINT: "Q", KIND_FLOAT: "d"}
+_PYTHON_TYPES = {KIND_INT: int, KIND_UINT: int, KIND_FLOAT: float, KIND_STRING: str}
+
+
+def _unwrap_low_cardinality(type: str) -> str:
+    if type.startswith("LowCardinality(") and type.endswith(")"):
+        return type[len("LowCardinality(") : -1]
+    return type
+
+
+def column_kind(type: str) -> tuple[bool, str]:
+    """
+    Maps a ClickHouse type, as it appears in the result meta, to the
+    column encoding to use and whether the column is nullable. Dates,
+    datetimes and UUIDs are strings by the time the result is cached.
+    """
+    is_nullable, inner = unwrap_nullable_type(_unwrap_low_cardinality(type))
+    inner = _unwrap_low_cardinality(inner)
+    if inner in ("Int8", "Int16", "Int32", "Int64", "UInt8", "UInt16", "UInt32"):
+        return is_nullable, KIND_INT
+    if inner == "UInt64":
+        return is_nullable, KIND_UINT
+    if inner in ("Float32", "Float64"):
+        return is_nullable, KIND_FLOAT
+    if (
+        inner in ("String", "UUID", "Date", "IPv4", "IPv6")
+        or inner.startswith("FixedString(")
+        or inner.startswith("DateTime")
+        or inner.startswith("Enum")
+    ):
+        return is_nullable, KIND_STRING
+    return is_nullable, KIND_JSON
+
+
+def _to_little_endian(values: array[Any]) -> bytes:
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, payload: bytes) -> array[Any]:
+    values = array(typecode)
+    values.frombytes(payload)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def _encode_column(kind: str, nullable: bool, values: Sequence[Any]) -> Optional[bytes]:
+    """
+    Packs a column. Returns None if a value does not have the Python type
+    expected for the column kind, in which case the caller falls back to
+    JSON for the column.
+    """
+    expected_type = _PYTHON_TYPES[kind]
+    if kind == KIND_STRING:
+        lengths = array("I")
+        chunks = []
+        for value in values:
+            if value is None and nullable:
+                lengths.append(_NULL_LENGTH)
+            elif type(value) is expected_type:
+                encoded = cast(str, value).encode("utf-8")
+                lengths.append(len(encoded))
+                chunks.append(encoded)
+            else:
+                return None
+        return _to_little_endian(lengths) + b"".join(chunks)
+
+    null_mask = b""
+    if nullable:
+        null_mask = bytes(value is None for value in values)
+        values = [0 if value is None else value for value in values]
+    if any(type(value) is not expected_type for value in values):
+        return None
+    try:
+        packed = array(_ARRAY_TYPECODES[kind], values)
+    except OverflowError:
+        return None
+    return null_mask + _to_little_endian(packed)
+
+
+def _decode_column(
+    kind: str, nullable: bool, rows: int, payload: bytes
+) -> Sequence[Any]:
+    if kind == KIND_JSON:
+        return cast(Sequence[Any], rapidjson.loads(payload))
+
+    if kind == KIND_STRING:
+        lengths = _from_little_endian("I", payload[: rows * 4])
+        blob = memoryview(payload)[rows * 4 :]
+        strings: MutableSequence[Optional[str]] = []
+        offset = 0
+        for length in lengths:
+            if length == _NULL_LENGTH:
+                strings.append(None)
+            else:
+                strings.append(str(blob[offset : offset + length], "utf-8"))
+                offset += length
+        return strings
+
+    if nullable:
+        null_mask = payload[:rows]
+        values = _from_little_endian(_ARRAY_TYPECODES[kind], payload[rows:])
+        return [None if is_null else value for is_null, value in zip(null_mask, values)]
+    return _from_little_endian(_ARRAY_TYPECODES[kind], payload).tolist()
+
+
+class ColumnarResultEncoder:
+    """
+    Encodes a ``Result`` in the column oriented binary format. Returns None
+    when the result does not have the regular shape this format relies on
+    (every row keyed exactly by the names in ``meta``), the caller is then
+    expected to use the JSON format.
+    """
+
+    def __init__(
+        self,
+        compression: Compression = Compression.NONE,
+        level: int = 3,
+        min_compress_bytes: int = 1024,
+    ) -> None:
+        self.__compression = compression
+        self.__level = level
+        self.__min_compress_bytes = min_compress_bytes
+
+    def encode(self, value: Result) -> Optional[bytes]:
+        meta = value.get("meta", [])
+        data = value.get("data", [])
+        names = [column["name"] for column in meta]
+        if len(set(names)) != len(names):
+            return None
+
+        # Columnar rows are encoded from their columns without building the
+        # row dictionaries.
+        columnar = data.get_columns() if isinstance(data, ColumnarRows) else None
+        columns_by_name = dict(zip(*columnar)) if columnar is not None else {}
+        if columnar is not None:
+            if len(columns_by_name) != len(names):
+                return None
+        elif any(len(row) != len(names) for row in data):
+            return None
+
+        encodings = []
+        columns = []
+        for column in meta:
+            nullable, kind = column_kind(column["type"])
+            try:
+                if columnar is not None:
+                    values = columns_by_name[column["name"]]
+                else:
+                    values = [row[column["name"]] for row in data]
+            except KeyError:
+                return None
+            encoded = None
+            if kind != KIND_JSON:
+                encoded = _encode_column(kind, nullable, values)
+            if encoded is None:
+                kind = KIND_JSON
+                encoded = encode_json(values)
+            encodings.append([kind, nullable])
+            columns.append(encoded)
+
+        header = {key: val for key, val in value.items() if key != "data"}
+        header["__rows__"] = len(data)
+        header["__columns__"] = encodings
+        encoded_header = encode_json(header)
+
+        parts = [_UINT32.pack(len(encoded_header)), encoded_header]
+        for encoded in columns:
+            parts.append(_UINT32.pack(len(encoded)))
+            parts.append(encoded)
+        body = b"".join(parts)
+
+        compression = self.__compression
+        if len(body) < self.__min_compress_bytes:
+            compression = Compression.NONE
+        body = _compress(compression, self.__level, body)
+        return _PREAMBLE.pack(MAGIC, COLUMNAR_VERSION, compression.value) + body
+
+
+def decode_columnar_result(value: bytes) -> Result:
+    magic, version, compression = _PREAMBLE.unpack_from(value)
+    assert magic == MAGIC
+    if version != COLUMNAR_VERSION:
+        raise ValueError(f"Unsupported result cache format version {version}")
+
+    body = memoryview(_decompress(Compression(compression), value[_PREAMBLE.size :]))
+
+    (header_length,) = _UINT32.unpack_from(body)
+    offset = _UINT32.size
+    header = rapidjson.loads(bytes(body[offset : offset + header_length]))
+    offset += header_length
+
+    rows = header.pop("__rows__")
+    encodings = header.pop("__columns__")
+    columns = []
+    for kind, nullable in encodings:
+        (length,) = _UINT32.unpack_from(body, offset)
+        offset += _UINT32.size
+        columns.append(
+            _decode_column(kind, nullable, rows, bytes(body[offset : offset + length]))
+        )
+        offset += length
+
+    names = [column["name"] for column in header["meta"]]
+    data: MutableSequence[Row]
+    if names:
+        data = [dict(zip(names, values)) for values in zip(*columns)]
+    else:
+        data = [{} for _ in range(rows)]
+
+    result = cast(Result, header)
+    result["data"] = data
+    return result
+
+
+# Codec names accepted by the ``result_cache_codec`` runtime config.
+JSON_CODEC = "json"
+COLUMNAR_CODEC = "columnar"
+
+
+def build_columnar_encoder(compression_name: str, level: int) -> ColumnarResultEncoder:
+    try:
+        compression = Compression[compression_name.upper()]
+    except KeyError:
+        logger.warning("Unknown result cache compression %r", compression_name)
+        compression = Compression.NONE
+    if not is_compression_available(compression):
+        logger.warning("Result cache compression %r is not installed", compression_name)
+        compression = Compression.NONE
+    return ColumnarResultEncoder(compression, level)
+
+
+def decode_payload(value: bytes) -> Mapping[str, Any]:
+    """
+    Decodes either format. The result is not validated.
+    """
+    if is_columnar_payload(value):
+        return cast(Mapping[str, Any], decode_columnar_result(value))
+    return cast(Mapping[str, Any], decode_json_result(value))
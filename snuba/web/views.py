@@ -66,7 +66,7 @@ from snuba.subscriptions.subscription import SubscriptionCreator, SubscriptionDe
 from snuba.util import with_span
 from snuba.utils.metrics.timer import Timer
 from snuba.utils.metrics.wrapper import MetricsWrapper
-from snuba.web import QueryException, QueryTooLongException
+from snuba.web import QueryException, QueryTooLongException, dump_payload
 from snuba.web.constants import get_http_status_for_clickhouse_error
 from snuba.web.converters import DatasetConverter, EntityConverter
 from snuba.web.query import parse_and_run_query
@@ -461,6 +461,8 @@ def dataset_query(
     request = build_request(
         body, parse_snql_query, HTTPQuerySettings, schema, dataset, timer, referrer
     )
+    if state.get_config("http_columnar_results", 0):
+        request.query_settings.set_columnar_results(True)
 
     try:
         result = parse_and_run_query(dataset, request, timer)
@@ -510,9 +512,7 @@ def dataset_query(
     if settings.STATS_IN_RESPONSE or request.query_settings.get_debug():
         payload.update(result.extra)
 
-    return Response(
-        json.dumps(payload, default=str), 200, {"Content-Type": "application/json"}
-    )
+    return Response(dump_payload(payload), 200, {"Content-Type": "application/json"})
 
 
 @application.errorhandler(InvalidSubscriptionError)
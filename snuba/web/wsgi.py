@@ -3,4 +3,11 @@ from snuba.environment import setup_logging, setup_sentry
 setup_logging()
 setup_sentry()
 
+from snuba import settings
+from snuba.clusters.cluster import prepare_query_connections
 from snuba.web.views import application  # noqa
+
+prepare_query_connections(
+    settings.CLICKHOUSE_POOL_WARMUP_CONNECTIONS,
+    settings.CLICKHOUSE_POOL_PROBE_INTERVAL_SEC,
+)
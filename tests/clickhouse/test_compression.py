@@ -0,0 +1,91 @@
+import gzip
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Mapping
+from unittest.mock import Mock
+
+import pytest
+
+from snuba.clickhouse import compression as compression_module
+from snuba.clickhouse.compression import Compression, InsertCompression
+from snuba.clickhouse.http import HTTPWriteBatch, InsertStatement
+
+
+def decompress_zstd(data: bytes) -> bytes:
+    return bytes(
+        compression_module.zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    )
+
+
+def decompress_lz4(data: bytes) -> bytes:
+    return bytes(compression_module.lz4_frame.decompress(data))
+
+
+DECOMPRESS: Mapping[Compression, Callable[[bytes], bytes]] = {
+    Compression.GZIP: gzip.decompress,
+    Compression.DEFLATE: zlib.decompress,
+    Compression.ZSTD: decompress_zstd,
+    Compression.LZ4: decompress_lz4,
+}
+
+AVAILABLE = {
+    Compression.GZIP: True,
+    Compression.DEFLATE: True,
+    Compression.ZSTD: compression_module.zstandard is not None,
+    Compression.LZ4: compression_module.lz4_frame is not None,
+}
+
+ROWS = [
+    b'{"project_id": %d, "message": "something happened"}\n' % i for i in range(100)
+]
+
+
+@pytest.mark.parametrize(
+    "compression",
+    [
+        pytest.param(
+            compression,
+            id=compression.value,
+            marks=pytest.mark.skipif(
+                not AVAILABLE[compression], reason="package not installed"
+            ),
+        )
+        for compression in Compression
+    ],
+)
+def test_stream_compressor(compression: Compression) -> None:
+    compressor = InsertCompression(compression, level=1).build_compressor()
+    compressed = b"".join([compressor.compress(row) for row in ROWS])
+    compressed += compressor.flush()
+    assert len(compressed) < len(b"".join(ROWS))
+    assert DECOMPRESS[compression](compressed) == b"".join(ROWS)
+
+
+def test_write_batch_compression() -> None:
+    requests: Mapping[str, Any] = {}
+
+    def urlopen(method: str, url: str, headers: Any, body: Any) -> Mock:
+        requests.update(headers=headers, body=b"".join(body))
+        return Mock(status=200)
+
+    pool = Mock()
+    pool.urlopen.side_effect = urlopen
+    batch = HTTPWriteBatch(
+        ThreadPoolExecutor(),
+        pool,
+        "default",
+        "",
+        InsertStatement("errors_local").with_format("JSONEachRow"),
+        None,
+        0,
+        {},
+        chunk_size=10,
+        compression=InsertCompression(Compression.GZIP),
+    )
+    for row in ROWS:
+        batch.append(row)
+    batch.close()
+    batch.join()
+
+    assert requests["headers"]["Content-Encoding"] == "gzip"
+    assert gzip.decompress(requests["body"]) == b"".join(ROWS)
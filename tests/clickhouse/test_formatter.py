@@ -300,3 +300,62 @@ test_escaped = [
 def test_escaping(expression: Expression, expected: str) -> None:
     visitor = ClickhouseExpressionFormatter()
     assert expression.accept(visitor) == expected
+
+
+def test_memoized_formatting() -> None:
+    def build() -> FunctionCall:
+        return FunctionCall(
+            "al",
+            "f",
+            (
+                Column("c", None, "col"),
+                Literal(None, "s"),
+                FunctionCall(None, "g", (Column(None, None, "col2"),)),
+            ),
+        )
+
+    f = build()
+    expected = "(f((col AS c), 's', g(col2)) AS al)"
+    assert f.accept(ClickhouseExpressionFormatter()) == expected
+
+    # The memoized formatting does not affect equality or hashing.
+    assert f == build()
+    assert hash(f) == hash(build())
+
+    # Aliases still depend on the context the expression is formatted in.
+    pc = ParsingContext()
+    assert f.accept(ClickhouseExpressionFormatter(pc)) == expected
+    assert f.accept(ClickhouseExpressionFormatter(pc)) == "al"
+    assert f.accept(ClickhouseExpressionFormatter()) == expected
+
+    # Functions and literals are memoized per formatter class, formatted
+    # columns are shared since the alias is applied afterwards.
+    assert (
+        f.accept(ExpressionFormatterAnonymized())
+        == "(f((col AS c), '$S', g(col2)) AS al)"
+    )
+    assert f.accept(ClickhouseExpressionFormatter()) == expected
+
+    # Sub-expressions containing AND/OR conditions are memoized separately
+    # for sorted fields.
+    condition = FunctionCall(
+        None,
+        "f",
+        (
+            binary_condition(
+                BooleanFunctions.OR,
+                binary_condition(
+                    ConditionFunctions.EQ, Column(None, None, "b"), Literal(None, 2)
+                ),
+                binary_condition(
+                    ConditionFunctions.EQ, Column(None, None, "a"), Literal(None, 1)
+                ),
+            ),
+        ),
+    )
+    sorted_formatter = ClickhouseExpressionFormatter(ParsingContext(sort_fields=True))
+    assert condition.accept(sorted_formatter) == "f((equals(a, 1) OR equals(b, 2)))"
+    assert (
+        condition.accept(ClickhouseExpressionFormatter())
+        == "f((equals(b, 2) OR equals(a, 1)))"
+    )
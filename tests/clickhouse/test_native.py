@@ -1,5 +1,6 @@
 import queue
-from datetime import datetime, timedelta
+import uuid
+from datetime import date, datetime, timedelta
 from typing import Any, Callable
 from unittest import mock
 
@@ -9,7 +10,17 @@ from dateutil.tz import tz
 
 from snuba import state
 from snuba.clickhouse.errors import ClickhouseError
-from snuba.clickhouse.native import ClickhousePool, transform_datetime
+from snuba.clickhouse.native import (
+    ClickhousePool,
+    HostLoadTracker,
+    transform_column_types,
+    transform_date,
+    transform_dates,
+    transform_datetime,
+    transform_datetimes,
+)
+from snuba.reader import ColumnarRows, Result
+from snuba.utils.clock import TestingClock
 
 
 def test_transform_datetime() -> None:
@@ -25,6 +36,68 @@ def test_transform_datetime() -> None:
     )
 
 
+def test_transform_columns() -> None:
+    values = [
+        datetime(2020, 1, 2, 3, 4, 5),
+        datetime(2020, 1, 2, 3, 4, 5, 123456),
+        datetime(2020, 1, 2, 11, 4, 5, tzinfo=tz.tzoffset("PST", timedelta(hours=8))),
+    ]
+    assert transform_datetimes(values) == [transform_datetime(v) for v in values]
+    dates = [date(2020, 1, 2), date(2020, 1, 3), date(2020, 1, 2)]
+    assert transform_dates(dates) == [transform_date(d) for d in dates]
+
+
+def test_transform_column_types() -> None:
+    now = datetime(2020, 1, 2, 3, 4, 5)
+    event_id = uuid.UUID("a7d67cf7-9677-4551-a95b-e6543cacd459")
+    meta = [
+        {"name": "timestamp", "type": "DateTime"},
+        {"name": "received", "type": "Nullable(DateTime('Universal'))"},
+        {"name": "event_id", "type": "UUID"},
+        {"name": "count", "type": "UInt64"},
+    ]
+    expected = [
+        {
+            "timestamp": "2020-01-02T03:04:05+00:00",
+            "received": None,
+            "event_id": str(event_id),
+            "count": 1,
+        },
+        {
+            "timestamp": "2020-01-02T03:04:05+00:00",
+            "received": "2020-01-02T03:04:05+00:00",
+            "event_id": str(event_id),
+            "count": 2,
+        },
+    ]
+
+    rows: Result = {
+        "meta": meta,
+        "data": [
+            {"timestamp": now, "received": None, "event_id": event_id, "count": 1},
+            {"timestamp": now, "received": now, "event_id": event_id, "count": 2},
+        ],
+        "totals": {"timestamp": now, "received": None, "event_id": event_id},
+    }
+    transform_column_types(rows)
+    assert rows["data"] == expected
+    assert rows["totals"] == {
+        "timestamp": "2020-01-02T03:04:05+00:00",
+        "received": None,
+        "event_id": str(event_id),
+    }
+
+    columnar: Result = {
+        "meta": meta,
+        "data": ColumnarRows(
+            ["timestamp", "received", "event_id", "count"],
+            [[now, now], [None, now], [event_id, event_id], [1, 2]],
+        ),
+    }
+    transform_column_types(columnar)
+    assert columnar["data"] == expected
+
+
 def test_robust_concurrency_limit() -> None:
     connection = mock.Mock()
     connection.execute.side_effect = ClickhouseError(
@@ -133,6 +206,7 @@ def test_fallback_logic() -> None:
 def teardown_function(_: Callable[..., Any]) -> None:
     state.delete_config("use_fallback_host_in_native_connection_pool")
     state.delete_config(f"fallback_hosts:{CLUSTER_HOST}:{CLUSTER_PORT}")
+    state.delete_config("native_pool_least_loaded_routing")
 
 
 @pytest.mark.parametrize(
@@ -159,3 +233,121 @@ def test_execute_retries(retryable: bool, expected: int) -> None:
     assert (
         socket_timeout_connection.execute.call_count == expected
     ), f"Expected {expected} (failed) attempts with main connection pool"
+
+
+def test_host_load_tracker() -> None:
+    tracker = HostLoadTracker(alpha=0.5)
+    host_a, host_b = ("a", 9000), ("b", 9000)
+
+    # Hosts without queries are tried first, then the least busy ones.
+    assert tracker.pick([host_a, host_b]) == host_a
+    tracker.start(host_a)
+    assert tracker.pick([host_a, host_b]) == host_b
+
+    tracker.finish(host_a, 10.0)
+    tracker.record(host_b, 30.0)
+    assert tracker.pick([host_a, host_b]) == host_a
+    for _ in range(3):
+        tracker.start(host_a)
+    assert tracker.pick([host_a, host_b]) == host_b
+
+    for _ in range(3):
+        tracker.finish(host_a, 50.0)
+    assert tracker.get_latency(host_a) == 45.0
+    assert not tracker.is_degraded(host_a, [host_a, host_b], 2.0)
+    tracker.record(host_a, 100.0)
+    assert tracker.is_degraded(host_a, [host_a, host_b], 2.0)
+    assert not tracker.is_degraded(("c", 9000), [host_a, host_b], 2.0)
+
+
+def test_host_load_tracker_recovery() -> None:
+    clock = TestingClock()
+    tracker = HostLoadTracker(alpha=0.5, max_age_sec=60, clock=clock)
+    host_a, host_b = ("a", 9000), ("b", 9000)
+
+    tracker.record(host_a, 10.0)
+    tracker.record(host_b, 100.0)
+    assert tracker.is_degraded(host_b, [host_a, host_b], 2.0)
+    assert tracker.pick([host_a, host_b]) == host_a
+
+    # Only the fast host keeps getting queries.
+    clock.sleep(30)
+    tracker.record(host_a, 10.0)
+    clock.sleep(31)
+
+    # The latency of the degraded host is forgotten, so it is tried again
+    # and measured anew.
+    assert tracker.get_latency(host_b) is None
+    assert not tracker.is_degraded(host_b, [host_a, host_b], 2.0)
+    assert tracker.pick([host_a, host_b]) == host_b
+    tracker.record(host_b, 12.0)
+    assert tracker.get_latency(host_b) == 12.0
+    assert not tracker.is_degraded(host_b, [host_a, host_b], 2.0)
+
+
+def test_release_failure() -> None:
+    state.set_config("native_pool_least_loaded_routing", 1)
+    state.set_config("native_pool_degraded_host_factor", "invalid")
+
+    connection = mock.Mock()
+    connection.execute.return_value = []
+    pool = ClickhousePool(
+        CLUSTER_HOST, CLUSTER_PORT, "test", "test", TEST_DB_NAME, max_pool_size=1
+    )
+    with mock.patch("snuba.clickhouse.native.Client", return_value=connection):
+        pool.execute("SELECT something")
+        # The connection is returned to the pool instead of losing its slot.
+        assert list(pool.pool.queue) == [connection]
+        pool.execute("SELECT something")
+        assert connection.execute.call_count == 2
+
+    state.delete_config("native_pool_degraded_host_factor")
+    state.delete_config("native_pool_least_loaded_routing")
+
+
+def test_least_loaded_routing() -> None:
+    state.set_config(f"fallback_hosts:{CLUSTER_HOST}:{CLUSTER_PORT}", "host1:100")
+    state.set_config("native_pool_least_loaded_routing", 1)
+
+    broken_connection = mock.Mock()
+    broken_connection.execute.side_effect = EOFError()
+    replica_connection = mock.Mock()
+    replica_connection.execute.return_value = []
+    connections = {CLUSTER_HOST: broken_connection, "host1": replica_connection}
+
+    pool = ClickhousePool(
+        CLUSTER_HOST, CLUSTER_PORT, "test", "test", TEST_DB_NAME, max_pool_size=1
+    )
+    with mock.patch(
+        "snuba.clickhouse.native.Client",
+        side_effect=lambda host, port, **kwargs: connections[host],
+    ):
+        # The connection opened to the host of the pool fails its probe.
+        assert pool.warmup(1) == 0
+        broken_connection.disconnect.assert_called_once()
+
+        # So queries go to the replica instead.
+        pool.execute("SELECT something")
+        replica_connection.execute.assert_called_once()
+        assert broken_connection.execute.call_count == 1
+
+
+def test_probe_idle() -> None:
+    healthy_connection = mock.Mock()
+    broken_connection = mock.Mock()
+    broken_connection.execute.side_effect = EOFError()
+
+    pool = ClickhousePool(CLUSTER_HOST, CLUSTER_PORT, "test", "test", TEST_DB_NAME)
+    pool.pool = queue.LifoQueue(3)
+    for connection in [None, healthy_connection, broken_connection]:
+        pool.pool.put(connection, block=False)
+
+    assert pool.probe_idle(0) == 2
+    healthy_connection.execute.assert_called_once_with("SELECT 1")
+    broken_connection.disconnect.assert_called_once()
+    assert sorted(map(str, pool.pool.queue)) == sorted(
+        map(str, [None, None, healthy_connection])
+    )
+
+    # Connections probed recently are left alone.
+    assert pool.probe_idle(60) == 0
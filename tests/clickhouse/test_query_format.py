@@ -9,6 +9,7 @@ from snuba.clickhouse.formatter.nodes import PaddingNode, SequenceNode, StringNo
 from snuba.clickhouse.formatter.query import (
     JoinFormatter,
     format_query,
+    format_query_and_sorted,
     format_query_anonymized,
 )
 from snuba.clickhouse.query import Query
@@ -563,6 +564,24 @@ def test_format_expressions(
     assert clickhouse_query_anonymized.get_sql() == formatted_anonymized_str
 
 
+@pytest.mark.parametrize(
+    "query, formatted_seq, formatted_str, formatted_anonymized_str", test_cases
+)
+def test_format_query_and_sorted(
+    query: Query,
+    formatted_seq: Sequence[Any],
+    formatted_str: str,
+    formatted_anonymized_str: str,
+) -> None:
+    clickhouse_query, clickhouse_query_sorted = format_query_and_sorted(query)
+    assert clickhouse_query.get_sql() == formatted_str
+    assert clickhouse_query.structured() == formatted_seq
+    assert (
+        clickhouse_query_sorted.get_sql()
+        == format_query(query, sort_fields=True).get_sql()
+    )
+
+
 def test_format_clickhouse_specific_query() -> None:
     """
     Adds a few of the Clickhosue specific fields to the query.
@@ -908,6 +927,9 @@ def test_format_sorted_expressions(
     assert clickhouse_query.structured() == formatted_seq
     assert clickhouse_query_anonymized.get_sql() == formatted_anonymized_str
 
+    _, clickhouse_query_sorted = format_query_and_sorted(query)
+    assert clickhouse_query_sorted.get_sql() == formatted_str
+
 
 TEST_JOIN = [
     pytest.param(
@@ -0,0 +1,113 @@
+import pickle
+import struct
+import uuid
+from datetime import date, datetime
+
+import pytest
+
+from snuba.clickhouse.columns import (
+    UUID,
+    AggregateFunction,
+    Array,
+    Column,
+    ColumnSet,
+    Date,
+    DateTime,
+    Enum,
+    FixedString,
+    Float,
+    IPv4,
+    Nested,
+    String,
+    UInt,
+)
+from snuba.clickhouse.row_binary import (
+    RowBinaryRowEncoder,
+    build_value_encoder,
+    encode_varint,
+)
+from snuba.utils.schemas import SchemaModifiers as Modifiers
+
+COLUMNS = ColumnSet(
+    [
+        Column("project_id", UInt(64)),
+        Column("timestamp", DateTime()),
+        Column("retention_days", UInt(16)),
+        Column("duration", Float(64)),
+        Column("event_id", UUID()),
+        Column("message", String()),
+        Column("level", String(Modifiers(nullable=True))),
+        Column("ip_address_v4", IPv4(Modifiers(nullable=True))),
+        Column("tags", Nested([("key", String()), ("value", String())])),
+        Column("partition", UInt(16, Modifiers(nullable=True))),
+    ]
+)
+
+EVENT_ID = uuid.UUID("6d0fbd2c-0b6b-4a6e-a0f8-b1c3e5f12a34")
+
+ROW = {
+    "project_id": 1,
+    "timestamp": datetime(2022, 1, 1, 12, 30),
+    "retention_days": 90,
+    "duration": 1.5,
+    "event_id": str(EVENT_ID),
+    "message": "héllo",
+    "level": None,
+    "ip_address_v4": "127.0.0.1",
+    "tags.key": ["a", "b"],
+    "tags.value": ["c", ""],
+    "partition": 3,
+}
+
+EXPECTED = b"".join(
+    [
+        struct.pack("<QIHd", 1, 1641040200, 90, 1.5),
+        EVENT_ID.bytes[7::-1] + EVENT_ID.bytes[:7:-1],
+        b"\x06h\xc3\xa9llo",
+        b"\x01",
+        b"\x00\x01\x00\x00\x7f",
+        b"\x02\x01a\x01b",
+        b"\x02\x01c\x00",
+        b"\x00\x03\x00",
+    ]
+)
+
+
+def test_encode_varint() -> None:
+    assert encode_varint(0) == b"\x00"
+    assert encode_varint(127) == b"\x7f"
+    assert encode_varint(128) == b"\x80\x01"
+    assert encode_varint(300) == b"\xac\x02"
+
+
+def test_encode_row() -> None:
+    encoder = RowBinaryRowEncoder(list(COLUMNS))
+    assert encoder.get_columns() == [column.flattened for column in COLUMNS]
+    assert encoder.encode(ROW) == EXPECTED
+
+    # Values of the numeric columns that do not fit the packed run are
+    # converted one by one, missing ones get the default of their type.
+    row = {**ROW, "project_id": "1", "retention_days": None}
+    del row["duration"]
+    assert encoder.encode(row)[:22] == struct.pack("<QIHd", 1, 1641040200, 0, 0.0)
+
+    # Encoders are sent to other processes.
+    assert pickle.loads(pickle.dumps(encoder)).encode(ROW) == EXPECTED
+
+
+def test_encode_values() -> None:
+    assert build_value_encoder(Date())("2022-01-02") == struct.pack("<H", 18994)
+    assert build_value_encoder(Date())(date(1970, 1, 2)) == b"\x01\x00"
+    assert build_value_encoder(DateTime())("2022-01-01T12:30:00") == struct.pack(
+        "<I", 1641040200
+    )
+    assert build_value_encoder(FixedString(4))("ab") == b"ab\x00\x00"
+    enum = Enum([("success", 0), ("error", 1)])
+    assert build_value_encoder(enum)("error") == b"\x01"
+    assert build_value_encoder(Array(UInt(8)))([1, 2]) == b"\x02\x01\x02"
+    assert build_value_encoder(Array(UInt(8)))(None) == b"\x00"
+
+    with pytest.raises(ValueError):
+        build_value_encoder(FixedString(1))("ab")
+    with pytest.raises(TypeError):
+        build_value_encoder(AggregateFunction("uniq", [UInt(64)]))
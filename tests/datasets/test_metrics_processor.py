@@ -215,6 +215,31 @@ def test_metrics_processor(
     )
 
 
+@patch.object(settings, "DISABLED_DATASETS", set())
+def test_metrics_processor_batch() -> None:
+    processor = CounterMetricsProcessor()
+    messages = [
+        (
+            message,
+            KafkaMessageMetadata(
+                offset=offset, partition=1, timestamp=datetime(1970, 1, 1)
+            ),
+        )
+        for offset, message in enumerate(
+            [SET_MESSAGE_SHARED, COUNTER_MESSAGE_SHARED, COUNTER_MESSAGE_SHARED]
+        )
+    ]
+    # Only the counters are processed, with the offset of their own message.
+    expected = []
+    for message, meta in messages[1:]:
+        result = processor.process_message(message, meta)
+        assert isinstance(result, InsertBatch)
+        expected.extend(result.rows)
+    assert [row["offset"] for row in expected] == [1, 2]
+    assert processor.process_batch(messages) == InsertBatch(expected, None)
+    assert processor.process_batch(messages[:1]) is None
+
+
 MOCK_TIME_BUCKET = expected_timestamp
 TEST_CASES_AGGREGATES = [
     pytest.param(
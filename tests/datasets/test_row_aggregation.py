@@ -0,0 +1,94 @@
+from datetime import datetime
+from typing import Any, Mapping
+
+from snuba.consumers.types import KafkaMessageMetadata
+from snuba.datasets.processors.metrics_bucket_processor import (
+    PolymorphicMetricsProcessor,
+)
+from snuba.datasets.row_aggregation import RowAggregation, sum_values
+from snuba.datasets.storages.factory import get_writable_storage
+from snuba.datasets.storages.storage_key import StorageKey
+from snuba.processor import InsertBatch
+
+TIMESTAMP = int(datetime.now().timestamp())
+
+
+def build_message(type: str, value: Any, tags: Mapping[str, int]) -> Mapping[str, Any]:
+    return {
+        "use_case_id": "release-health",
+        "org_id": 1,
+        "project_id": 2,
+        "metric_id": 3,
+        "type": type,
+        "timestamp": TIMESTAMP,
+        "tags": tags,
+        "value": value,
+        "retention_days": 90,
+    }
+
+
+def test_aggregate() -> None:
+    aggregation = RowAggregation(["id", "tags"], {"count": sum_values})
+    rows = [
+        {"id": 1, "tags": [1, 2], "count": 1},
+        {"id": 1, "tags": [1, 2], "count": 2},
+        {"id": 1, "tags": [1], "count": 4},
+        {"id": 1, "tags": [1, 2]},
+        {"id": 1, "count": 8},
+        {"id": 1, "tags": [1, 2], "count": 16, "other": 1},
+    ]
+    assert aggregation.aggregate(rows) == [
+        {"id": 1, "tags": [1, 2], "count": 3},
+        {"id": 1, "tags": [1], "count": 4},
+        {"id": 1, "count": 8},
+        {"id": 1, "tags": [1, 2], "count": 16, "other": 1},
+    ]
+    # The rows given are not modified.
+    assert rows[0] == {"id": 1, "tags": [1, 2], "count": 1}
+
+
+def test_metrics_raw_aggregation() -> None:
+    aggregation = (
+        get_writable_storage(StorageKey.METRICS_RAW)
+        .get_table_writer()
+        .get_row_aggregation()
+    )
+    assert aggregation is not None
+
+    processor = PolymorphicMetricsProcessor()
+    rows = []
+    for offset, (type, value, tags) in enumerate(
+        [
+            ("c", 1.0, {"10": 11}),
+            ("c", 2.5, {"10": 11}),
+            ("c", 4.0, {"10": 12}),
+            ("s", [1, 2], {"10": 11}),
+            ("s", [2, 3], {"10": 11}),
+            ("d", [1.0, 2.0], {"10": 11}),
+            ("d", [1.0], {"10": 11}),
+        ]
+    ):
+        result = processor.process_message(
+            build_message(type, value, tags),
+            KafkaMessageMetadata(offset, 0, datetime.now()),
+        )
+        assert isinstance(result, InsertBatch)
+        rows.extend(result.rows)
+
+    aggregated = aggregation.aggregate(rows)
+    assert [
+        (
+            row["metric_type"],
+            row["tags.value"],
+            row.get("count_value"),
+            row.get("set_values"),
+            row.get("distribution_values"),
+            row["offset"],
+        )
+        for row in aggregated
+    ] == [
+        ("counter", [11], 3.5, None, None, 1),
+        ("counter", [12], 4.0, None, None, 2),
+        ("set", [11], None, [1, 2, 3], None, 4),
+        ("distribution", [11], None, None, [1.0, 2.0, 1.0], 6),
+    ]
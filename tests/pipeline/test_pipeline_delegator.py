@@ -1,9 +1,13 @@
 import threading
+import time
 from typing import List, MutableSequence, Optional, Tuple, Union
 from unittest.mock import ANY, Mock, call
 
+import pytest
+
 from snuba.attribution import get_app_id
 from snuba.attribution.attribution_info import AttributionInfo
+from snuba.clickhouse.columns import ColumnSet
 from snuba.clickhouse.query import Query
 from snuba.datasets.factory import get_dataset
 from snuba.datasets.plans.single_storage import SingleStorageQueryPlanBuilder
@@ -11,11 +15,14 @@ from snuba.datasets.storages.factory import get_storage
 from snuba.datasets.storages.storage_key import StorageKey
 from snuba.pipeline.pipeline_delegator import (
     PipelineDelegator,
+    SharedQueryRunner,
     _is_query_copying_disallowed,
 )
 from snuba.pipeline.simple_pipeline import SimplePipelineBuilder
+from snuba.query import SelectedExpression
 from snuba.query.composite import CompositeQuery
 from snuba.query.data_source.simple import Table
+from snuba.query.expressions import Column
 from snuba.query.query_settings import HTTPQuerySettings, QuerySettings
 from snuba.query.snql.parser import parse_snql_query
 from snuba.reader import Reader
@@ -102,6 +109,8 @@ def test() -> None:
         return query_result
 
     set_config("pipeline_split_rate_limiter", 1)
+    # Both storages produce the same SQL, which would otherwise run once.
+    set_config("pipeline_delegator_share_executions", 0)
 
     with cv:
         query_settings = HTTPQuerySettings(referrer="ref")
@@ -120,6 +129,7 @@ def test() -> None:
         ).execute()
         cv.wait(timeout=5)
 
+    delete_config("pipeline_delegator_share_executions")
     assert runner_call_count == 2
     assert len(runner_settings) == 2
     settings, settings_ro = runner_settings
@@ -133,3 +143,107 @@ def test() -> None:
         Result("errors", query_result, ANY),
         [Result("errors_ro", query_result, ANY)],
     )
+
+
+def test_shared_query_runner() -> None:
+    started = threading.Event()
+    release = threading.Event()
+    runner = Mock()
+
+    def run_query(
+        query: Union[Query, CompositeQuery[Table]],
+        settings: QuerySettings,
+        reader: Reader,
+    ) -> QueryResult:
+        started.set()
+        release.wait(timeout=5)
+        return QueryResult(
+            {"data": [{"a": 1}], "meta": []},
+            {"stats": {}, "sql": "", "experiments": {}},
+        )
+
+    runner.side_effect = run_query
+    shared = SharedQueryRunner(runner)
+    reader = Mock()
+
+    def build_query(column: str) -> Query:
+        return Query(
+            Table("errors_local", ColumnSet([])),
+            selected_columns=[
+                SelectedExpression(column, Column(f"_snuba_{column}", None, column))
+            ],
+        )
+
+    results: MutableSequence[QueryResult] = []
+
+    def run() -> None:
+        results.append(shared(build_query("a"), HTTPQuerySettings(), reader))
+
+    leader = threading.Thread(target=run)
+    leader.start()
+    assert started.wait(timeout=5)
+    follower = threading.Thread(target=run)
+    follower.start()
+    # Let the follower find the running query before it completes.
+    time.sleep(0.1)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert runner.call_count == 1
+    assert results[0].result == results[1].result
+    assert results[0].result is not results[1].result
+
+    # Different SQL, or a query that already completed, runs again.
+    shared(build_query("b"), HTTPQuerySettings(), reader)
+    shared(build_query("a"), HTTPQuerySettings(), reader)
+    assert runner.call_count == 3
+
+
+def test_shared_query_runner_failure() -> None:
+    started = threading.Event()
+    release = threading.Event()
+    calls = 0
+
+    def run_query(
+        query: Union[Query, CompositeQuery[Table]],
+        settings: QuerySettings,
+        reader: Reader,
+    ) -> QueryResult:
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            started.set()
+            release.wait(timeout=5)
+            raise ValueError("rate limited")
+        return QueryResult(
+            {"data": [], "meta": []}, {"stats": {}, "sql": "", "experiments": {}}
+        )
+
+    shared = SharedQueryRunner(run_query)
+    query = Query(
+        Table("errors_local", ColumnSet([])),
+        selected_columns=[SelectedExpression("a", Column("_snuba_a", None, "a"))],
+    )
+    reader = Mock()
+
+    def run_leader() -> None:
+        with pytest.raises(ValueError):
+            shared(query, HTTPQuerySettings(), reader)
+
+    results: MutableSequence[QueryResult] = []
+    leader = threading.Thread(target=run_leader)
+    leader.start()
+    assert started.wait(timeout=5)
+    follower = threading.Thread(
+        target=lambda: results.append(shared(query, HTTPQuerySettings(), reader))
+    )
+    follower.start()
+    time.sleep(0.1)
+    release.set()
+    leader.join()
+    follower.join()
+
+    # The follower does not inherit the failure, it runs the query itself.
+    assert calls == 2
+    assert len(results) == 1
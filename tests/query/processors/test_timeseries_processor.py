@@ -20,6 +20,7 @@ from snuba.query.logical import Query
 from snuba.query.processors.logical.timeseries_processor import (
     TimeSeriesProcessor,
     extract_granularity_from_query,
+    get_time_bucket,
 )
 from snuba.query.query_settings import HTTPQuerySettings
 from snuba.util import parse_datetime
@@ -217,6 +218,8 @@ def test_timeseries_format_expressions(
         assert formatted_condition == ret
 
     assert extract_granularity_from_query(unprocessed, "finish_ts") == granularity
+    assert get_time_bucket(exp_column) == ("finish_ts", granularity)
+    assert get_time_bucket(Column(None, None, "finish_ts")) is None
 
 
 def test_invalid_datetime() -> None:
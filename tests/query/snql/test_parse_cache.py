@@ -0,0 +1,157 @@
+from typing import Sequence
+from unittest.mock import Mock
+
+import pytest
+
+from snuba.query.parser.exceptions import ParsingException
+from snuba.query.snql.parse_cache import CacheStatus, SnQLParseCache, tokenize
+from snuba.query.snql.parser import _parse_snql_body
+
+QUERY = (
+    "MATCH (events) SELECT count() AS c BY tags[{tag}] "
+    "WHERE project_id IN tuple({project_id}, 3) AND message = '{message}' "
+    "AND timestamp >= toDateTime('2021-01-01T00:00:00') "
+    "AND timestamp < toDateTime('2021-01-02T00:00:00') "
+    "AND duration > {duration} LIMIT {limit}"
+)
+
+
+def build_query(
+    project_id: int = 1,
+    message: str = "hello",
+    tag: str = "foo",
+    duration: str = "1.5",
+    limit: int = 10,
+) -> str:
+    return QUERY.format(
+        project_id=project_id,
+        message=message,
+        tag=tag,
+        duration=duration,
+        limit=limit,
+    )
+
+
+def test_tokenize() -> None:
+    shape, tokens = tokenize(
+        "MATCH (e2) SELECT a WHERE b = 'x\\'2' AND c IN tuple(3, 4.5)"
+    )
+    assert [(token.kind, token.text) for token in tokens] == [
+        ("s", "'x\\'2'"),
+        ("i", "3"),
+        ("f", "4.5"),
+    ]
+    assert shape == (
+        ("MATCH (e2) SELECT a WHERE b = ", " AND c IN tuple(", ", ", ")"),
+        ("s", "i", "f"),
+    )
+
+
+def test_parse_cache() -> None:
+    parse = Mock(side_effect=_parse_snql_body)
+    cache = SnQLParseCache(parse)
+
+    # A shape seen once only costs the regular parse, the template is built
+    # the second time it is seen.
+    body = build_query()
+    parsed, status = cache.parse(body)
+    assert status == CacheStatus.MISS
+    assert parsed == _parse_snql_body(body)
+    assert parse.call_count == 1
+
+    parsed, status = cache.parse(body)
+    assert status == CacheStatus.MISS
+    assert parsed == _parse_snql_body(body)
+    assert parse.call_count > 1
+
+    parse.reset_mock()
+    bodies: Sequence[str] = [
+        build_query(project_id=2, message="it\\'s", duration="2.25"),
+        build_query(project_id=5, message="other"),
+    ]
+    for body in bodies:
+        parsed, status = cache.parse(body)
+        assert status == CacheStatus.HIT
+        assert parsed == _parse_snql_body(body)
+    assert parse.call_count == 0
+
+    # The limit is not an expression so it cannot be lifted out. The lifted
+    # literals of the shape are known so one more parse builds its template.
+    parsed, status = cache.parse(build_query(limit=20))
+    assert status == CacheStatus.MISS
+    assert parsed.get_limit() == 20
+    assert parse.call_count == 2
+    assert cache.parse(build_query(limit=20, project_id=3))[1] == CacheStatus.HIT
+
+    # Neither can the subscript key.
+    parsed, status = cache.parse(build_query(tag="bar"))
+    assert status == CacheStatus.MISS
+    assert parsed == _parse_snql_body(build_query(tag="bar"))
+
+    # Returned queries are not shared.
+    first, _ = cache.parse(build_query())
+    second, _ = cache.parse(build_query())
+    first.set_limit(1)
+    assert second.get_limit() == 10
+
+    with pytest.raises(ParsingException):
+        cache.parse(build_query(duration="'a"))
+
+
+def test_parse_cache_uncacheable() -> None:
+    cache = SnQLParseCache(_parse_snql_body)
+    join = (
+        "MATCH (e: events) -[grouped]-> (g: groupedmessage) "
+        "SELECT count() AS c WHERE e.project_id = 1 AND g.project_id = 1 "
+        "AND e.timestamp >= toDateTime('2021-01-01T00:00:00') "
+        "AND e.timestamp < toDateTime('2021-01-02T00:00:00')"
+    )
+    for _ in range(2):
+        _, status = cache.parse(join)
+        assert status == CacheStatus.UNCACHEABLE
+
+    _, status = cache.parse("MATCH (events) SELECT count() AS c")
+    assert status == CacheStatus.UNCACHEABLE
+
+
+def test_parse_cache_uncacheable_eviction() -> None:
+    parse = Mock(side_effect=_parse_snql_body)
+    cache = SnQLParseCache(parse, max_size=1)
+
+    # No literal of the body can be lifted.
+    body = "MATCH (events) SELECT count() AS c LIMIT 5"
+    assert cache.parse(body)[1] == CacheStatus.MISS
+    assert cache.parse(body)[1] == CacheStatus.UNCACHEABLE
+
+    # Templates evicting each other do not evict the uncacheable shapes,
+    # which are not analysed again.
+    for tag in ["foo", "bar", "foo"]:
+        for _ in range(2):
+            cache.parse(build_query(tag=tag))
+    parse.reset_mock()
+    assert cache.parse(body)[1] == CacheStatus.UNCACHEABLE
+    assert parse.call_count == 1
+
+
+def test_parse_cache_selected_names() -> None:
+    cache = SnQLParseCache(_parse_snql_body)
+    query = (
+        "MATCH (events) SELECT quantile(0.5)(duration), count() AS c "
+        "WHERE project_id = {project_id} "
+        "AND timestamp >= toDateTime('2021-01-01T00:00:00') "
+        "AND timestamp < toDateTime('2021-01-02T00:00:00')"
+    )
+    for _ in range(2):
+        assert cache.parse(query.format(project_id=1))[1] == CacheStatus.MISS
+
+    # The literal in the unaliased expression is part of its name and stays
+    # in the template key, the others are still lifted.
+    body = query.format(project_id=2)
+    parsed, status = cache.parse(body)
+    assert status == CacheStatus.HIT
+    assert parsed == _parse_snql_body(body)
+
+    body = query.format(project_id=2).replace("0.5", "0.9")
+    parsed, status = cache.parse(body)
+    assert status == CacheStatus.MISS
+    assert parsed.get_selected_columns()[0].name == "quantile(0.9)(duration)"
@@ -5,15 +5,20 @@ import time
 from concurrent.futures import Future, ThreadPoolExecutor
 from functools import partial
 from threading import Thread
-from typing import Any, Callable, Iterator, cast
+from typing import Any, Callable, Iterator, List, cast
 from unittest import mock
 
 import pytest
 import rapidjson
 
+from snuba import state
 from snuba.redis import RedisClientKey, RedisClientType, get_redis_client
 from snuba.state.cache.abstract import Cache, ExecutionError, ExecutionTimeoutError
-from snuba.state.cache.redis.backend import RedisCache
+from snuba.state.cache.redis.backend import (
+    CHUNK_MANIFEST_PREFIX,
+    RESULT_EXECUTE,
+    RedisCache,
+)
 from snuba.utils.codecs import ExceptionAwareCodec
 from snuba.utils.serializable_exception import SerializableException
 from tests.assertions import assert_changes, assert_does_not_change
@@ -298,3 +303,128 @@ def test_notify_queue_ttl() -> None:
         assert pop_calls == num_waiters
     finally:
         redis_client.flushdb()
+
+
+@pytest.fixture
+def chunked_config() -> Iterator[None]:
+    state.set_config("cache_chunked_min_bytes", 8)
+    state.set_config("cache_chunk_size_bytes", 4)
+    try:
+        yield
+    finally:
+        state.delete_config("cache_chunked_min_bytes")
+        state.delete_config("cache_chunk_size_bytes")
+
+
+@pytest.mark.usefixtures("chunked_config")
+def test_chunked_get_set(backend: Cache[bytes]) -> None:
+    small = b"small"
+    large = b"a value that needs several chunks"
+
+    backend.set("small", small)
+    backend.set("large", large)
+
+    assert redis_client.get("test{small}") == small
+    assert cast(bytes, redis_client.get("test{large}")).startswith(
+        CHUNK_MANIFEST_PREFIX
+    )
+    assert backend.get("small") == small
+    assert backend.get("large") == large
+
+    # A missing chunk turns the value into a cache miss
+    chunk_keys = redis_client.keys("testchunks/{large}/*")
+    assert len(chunk_keys) == 9
+    redis_client.delete(chunk_keys[0])
+    assert backend.get("large") is None
+
+
+@pytest.mark.usefixtures("chunked_config")
+def test_chunked_get_readthrough(backend: Cache[bytes]) -> None:
+    key = "key"
+    value = b"a value that needs several chunks"
+    function = mock.MagicMock(return_value=value)
+
+    assert backend.get_readthrough(key, function, noop, 5) == value
+    assert backend.get_readthrough(key, function, noop, 5) == value
+    assert function.call_count == 1
+
+    def slow_function() -> bytes:
+        time.sleep(0.5)
+        return value
+
+    def worker() -> bytes:
+        return backend.get_readthrough("other", slow_function, noop, 10)
+
+    setter = execute(worker)
+    time.sleep(0.1)
+    waiter = execute(worker)
+    assert setter.result() == waiter.result() == value
+
+
+def test_float_expiry(backend: Cache[bytes]) -> None:
+    state.set_config("cache_expiry_sec", 1.5)
+    try:
+        backend.set("key", b"value")
+        assert backend.get("key") == b"value"
+        assert backend.get_readthrough("other", lambda: b"value", noop, 5) == b"value"
+        assert 0 < redis_client.pttl("test{other}") <= 1000
+    finally:
+        state.delete_config("cache_expiry_sec")
+
+
+def test_chunked_config_types(backend: Cache[bytes]) -> None:
+    value = b"a value that needs several chunks"
+    state.set_config("cache_chunked_min_bytes", 8.0)
+    state.set_config("cache_chunk_size_bytes", 4.0)
+    try:
+        backend.set("key", value)
+        assert backend.get("key") == value
+        assert len(redis_client.keys("testchunks/{key}/*")) == 9
+
+        # An invalid chunk size stores the value as a single key.
+        state.set_config("cache_chunk_size_bytes", 0)
+        backend.set("other", value)
+        assert redis_client.get("test{other}") == value
+    finally:
+        state.delete_config("cache_chunked_min_bytes")
+        state.delete_config("cache_chunk_size_bytes")
+
+
+@pytest.mark.usefixtures("chunked_config")
+def test_chunked_get_readthrough_missing_chunk(backend: Cache[bytes]) -> None:
+    key = "key"
+    value = b"a value that needs several chunks"
+    function = mock.MagicMock(return_value=value)
+    assert backend.get_readthrough(key, function, noop, 5) == value
+
+    redis_client.delete(redis_client.keys("testchunks/{key}/*")[0])
+    hit_types: List[int] = []
+    assert backend.get_readthrough(key, function, hit_types.append, 5) == value
+    assert function.call_count == 2
+    assert hit_types == [RESULT_EXECUTE]
+
+    def slow_function() -> bytes:
+        time.sleep(2)
+        return value
+
+    with pytest.raises(TimeoutError):
+        backend.get_readthrough(key, slow_function, noop, 1)
+
+
+@pytest.mark.usefixtures("chunked_config")
+def test_chunked_get_readthrough_store_error(backend: Cache[bytes]) -> None:
+    key = "key"
+    value = b"a value that needs several chunks"
+    function = mock.MagicMock(return_value=value)
+
+    # Failing to write the chunks does not fail the function, its value is
+    # only not cached.
+    with mock.patch.object(
+        redis_client, "pipeline", side_effect=ConnectionError("chunks")
+    ):
+        assert backend.get_readthrough(key, function, noop, 5) == value
+    assert redis_client.get("test{key}") is None
+    assert redis_client.get("testerror/{key}") is None
+
+    assert backend.get_readthrough(key, function, noop, 5) == value
+    assert function.call_count == 2
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from typing import Callable, MutableMapping, Optional
+from unittest import mock
+
+from snuba.state.cache.abstract import Cache
+from snuba.state.cache.local.backend import LocalCache
+from snuba.state.cache.redis.backend import RESULT_EXECUTE, RESULT_VALUE
+from snuba.utils.clock import TestingClock
+from snuba.utils.metrics.timer import Timer
+
+
+class DictCache(Cache[bytes]):
+    def __init__(self) -> None:
+        self.values: MutableMapping[str, bytes] = {}
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.values.get(key)
+
+    def set(self, key: str, value: bytes) -> None:
+        self.values[key] = value
+
+    def get_readthrough(
+        self,
+        key: str,
+        function: Callable[[], bytes],
+        record_cache_hit_type: Callable[[int], None],
+        timeout: int,
+        timer: Optional[Timer] = None,
+    ) -> bytes:
+        if key in self.values:
+            record_cache_hit_type(RESULT_VALUE)
+            return self.values[key]
+        record_cache_hit_type(RESULT_EXECUTE)
+        value = function()
+        self.values[key] = value
+        return value
+
+
+def build_cache(
+    max_bytes: int, clock: TestingClock
+) -> tuple[DictCache, LocalCache[bytes]]:
+    backing = DictCache()
+    return backing, LocalCache(backing, max_bytes, len, bytes, "test", clock=clock)
+
+
+def test_get_set() -> None:
+    backing, cache = build_cache(10, TestingClock())
+
+    assert cache.get("a") is None
+    cache.set("a", b"12345")
+    assert backing.values["a"] == b"12345"
+
+    # Served locally even if the backing cache lost the value.
+    del backing.values["a"]
+    assert cache.get("a") == b"12345"
+
+
+def test_size_eviction() -> None:
+    backing, cache = build_cache(10, TestingClock())
+
+    cache.set("a", b"1234")
+    cache.set("b", b"1234")
+    # Touch ``a`` so that ``b`` is the least recently used entry.
+    assert cache.get("a") == b"1234"
+    cache.set("c", b"1234")
+
+    assert len(cache) == 2
+    assert cache.size == 8
+
+    backing.values.clear()
+    assert cache.get("a") == b"1234"
+    assert cache.get("b") is None
+    assert cache.get("c") == b"1234"
+
+    # Values larger than the whole cache are never stored locally.
+    cache.set("d", b"12345678901")
+    assert len(cache) == 2
+
+
+def test_expiry() -> None:
+    clock = TestingClock()
+    backing, cache = build_cache(10, clock)
+
+    cache.set("a", b"1")
+    backing.values.clear()
+    clock.sleep(0.5)
+    assert cache.get("a") == b"1"
+    clock.sleep(1)
+    assert cache.get("a") is None
+    assert cache.size == 0
+
+
+def test_get_readthrough() -> None:
+    _, cache = build_cache(10, TestingClock())
+    function = mock.Mock(return_value=b"value")
+    hit_types: list[int] = []
+
+    assert cache.get_readthrough("a", function, hit_types.append, 5) == b"value"
+    assert cache.get_readthrough("a", function, hit_types.append, 5) == b"value"
+
+    assert function.call_count == 1
+    assert hit_types == [RESULT_EXECUTE, RESULT_VALUE]
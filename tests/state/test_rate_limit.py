@@ -188,3 +188,57 @@ def test_rate_limit_failures(vals: Tuple[int, int, int]) -> None:
             bucket, now - state.rate_lookback_s, now + state.rate_lookback_s
         )
         assert count == 0
+
+
+@pytest.mark.parametrize(
+    "vals",
+    tests,
+)
+def test_batched_rate_limit_failures(vals: Tuple[int, int, int]) -> None:
+    state.set_config("rate_limit_batched", 1)
+    test_rate_limit_failures(vals)
+
+
+def test_batched_aggregator() -> None:
+    state.set_config("rate_limit_batched", 1)
+    rds = get_redis_client(RedisClientKey.RATE_LIMITER)
+
+    def count(params: RateLimitParameters) -> int:
+        return rds.zcount(f"{state.ratelimit_prefix}{params.bucket}", "-inf", "+inf")
+
+    outer = RateLimitParameters("foo", str(uuid.uuid4()), 10, 3)
+    inner = RateLimitParameters("bar", str(uuid.uuid4()), None, None)
+
+    with RateLimitAggregator([outer, inner]) as stats:
+        assert stats.get_stats("foo") == RateLimitStats(rate=0, concurrent=1)
+        assert stats.get_stats("bar") == RateLimitStats(rate=0, concurrent=0)
+        assert count(outer) == 1
+
+        # The same bucket can be used by several rate limits of one query.
+        with RateLimitAggregator([outer, outer]) as nested_stats:
+            assert nested_stats.get_stats("foo") == RateLimitStats(rate=0, concurrent=3)
+
+        with pytest.raises(RateLimitExceeded) as excinfo:
+            with RateLimitAggregator([inner, outer, outer, outer]):
+                pass
+        assert excinfo.value.extra_data == {"scope": "foo", "name": "concurrent"}
+        assert count(inner) == 1
+        assert count(outer) == 3
+
+    # Queries that finished are counted in the historical rate.
+    with RateLimitAggregator([outer]) as stats:
+        stats_foo = stats.get_stats("foo")
+        assert stats_foo is not None
+        assert stats_foo.rate == 3 / state.rate_lookback_s
+        assert stats_foo.concurrent == 1
+
+    # Queries rejected by another rate limit are not counted.
+    with pytest.raises(RateLimitExceeded):
+        with RateLimitAggregator([inner]):
+            raise RateLimitExceeded("stuff")
+    assert count(inner) == 1
+
+    state.set_config("bypass_rate_limit", 1)
+    with RateLimitAggregator([outer]) as stats:
+        assert stats.get_stats("foo") is None
+    assert count(outer) == 4
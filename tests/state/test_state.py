@@ -1,14 +1,16 @@
+import json
 import random
 import time
 from collections import ChainMap
 from datetime import datetime
 from functools import partial
+from unittest import mock
 
 import pytest
 from arroyo import Message, Partition, Topic
 from arroyo.backends.kafka import KafkaPayload
 
-from snuba import state
+from snuba import settings, state
 from snuba.consumers.consumer import skip_kafka_message
 from snuba.state import MismatchedTypeException, safe_dumps
 
@@ -39,6 +41,52 @@ class TestState:
             all_configs[k] == v for k, v in [("foo", 1), ("bar", "quux"), ("baz", 3)]
         )
 
+    def test_config_snapshot_version(self) -> None:
+        state.set_config("foo", 1)
+        assert state.get_config("foo") == 1
+
+        # Writes that do not bump the version are only picked up once the
+        # snapshot gets too old.
+        state.rds.hset(state.config_hash, "foo", "2")
+        assert state.get_config("foo") == 1
+        with mock.patch.object(settings, "CONFIG_SNAPSHOT_MAX_AGE", 0):
+            assert state.get_config("foo") == 2
+
+        state.rds.hset(state.config_hash, "foo", "3")
+        state.set_config("bar", 1)
+        assert state.get_config("foo") == 3
+
+        # The snapshot is not copied on every read, the configs returned to
+        # callers are plain dicts.
+        snapshot = state._get_config_snapshot()
+        assert state._get_config_snapshot().values is snapshot.values
+        assert json.loads(json.dumps(state.get_raw_configs()))["bar"] == 1
+        assert json.loads(json.dumps(state.get_all_configs()))["foo"] == 3
+
+    def test_parsed_configs(self) -> None:
+        assert state.get_int_set_config("parsed_int_set") == frozenset()
+        state.set_config("parsed_int_set", "[1, 2,3]")
+        assert state.get_int_set_config("parsed_int_set") == {1, 2, 3}
+        assert state.is_project_in_rollout_list("parsed_int_set", 2)
+        assert not state.is_project_in_rollout_list("parsed_int_set", 4)
+
+        state.set_config("parsed_str_set", "[a:1:2,b:0:1]")
+        assert state.get_str_set_config("parsed_str_set") == {"a:1:2", "b:0:1"}
+
+        state.set_config("parsed_regex", "^foo.*")
+        regex = state.get_regex_config("parsed_regex")
+        assert regex is not None and regex.match("foobar")
+
+        assert state.get_int_config("parsed_int", 5) == 5
+        state.set_config("parsed_int", 10)
+        assert state.get_int_config("parsed_int", 5) == 10
+        state.set_config("parsed_float", 0.5)
+        assert state.get_float_config("parsed_float", 1.0) == 0.5
+
+        # Invalid values fall back to the default
+        state.set_config("parsed_int_set", "[1,a]", force=True)
+        assert state.get_int_set_config("parsed_int_set") == frozenset()
+
     def test_config_desc(self) -> None:
         state.set_config_description("foo", "Does foo")
         assert state.get_config_description("foo") == "Does foo"
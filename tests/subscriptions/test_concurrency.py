@@ -0,0 +1,55 @@
+from snuba import state
+from snuba.subscriptions.concurrency import AdaptiveConcurrencyLimiter
+from tests.backends.metrics import Gauge, TestingMetricsBackend
+
+
+def run_window(
+    limiter: AdaptiveConcurrencyLimiter,
+    concurrency: int,
+    latency_ms: float = 10.0,
+    lag_ms: float = 0.0,
+    errors: int = 0,
+) -> None:
+    for i in range(0, 4, concurrency):
+        for _ in range(concurrency):
+            assert limiter.acquire(timeout=0)
+        for j in range(concurrency):
+            limiter.release(latency_ms, lag_ms, i + j < errors)
+
+
+def test_acquire_up_to_limit() -> None:
+    limiter = AdaptiveConcurrencyLimiter(2, 1, 4, TestingMetricsBackend())
+    assert limiter.acquire(timeout=0)
+    assert limiter.acquire(timeout=0)
+    assert not limiter.acquire(timeout=0)
+    limiter.release(10.0, 0.0, False)
+    assert limiter.acquire(timeout=0)
+
+
+def test_adaptive_concurrency_limiter() -> None:
+    metrics = TestingMetricsBackend()
+    limiter = AdaptiveConcurrencyLimiter(2, 1, 4, metrics, window_size=4)
+    assert limiter.limit == 2
+    assert metrics.calls == [Gauge("executor.concurrency_limit", 2, None)]
+
+    # Healthy and every slot used: additive increase, up to the max limit
+    run_window(limiter, 1)
+    assert limiter.limit == 2
+    run_window(limiter, 2)
+    assert limiter.limit == 3
+    run_window(limiter, 1, lag_ms=60000)
+    assert limiter.limit == 4
+    run_window(limiter, 4)
+    assert limiter.limit == 4
+
+    # Slow queries or errors: multiplicative decrease, down to the min limit
+    run_window(limiter, 1, latency_ms=10000)
+    assert limiter.limit == 3
+    state.set_config("executor_adaptive_error_rate_threshold", 0.2)
+    run_window(limiter, 1, errors=1)
+    assert limiter.limit == 2
+    for _ in range(3):
+        run_window(limiter, 1, errors=4)
+    assert limiter.limit == 1
+
+    assert Gauge("executor.concurrency_limit", 4, None) in metrics.calls
@@ -1,4 +1,6 @@
+import calendar
 import json
+import math
 import time
 import uuid
 from datetime import datetime, timedelta
@@ -14,15 +16,24 @@ from arroyo.processing.strategies import MessageRejected
 from arroyo.utils.clock import TestingClock
 from confluent_kafka.admin import AdminClient
 
-from snuba import state
+from snuba import settings, state
+from snuba.datasets.entities.entity_data_model import EntityColumnSet
 from snuba.datasets.entities.entity_key import EntityKey
 from snuba.datasets.entities.factory import get_entity
 from snuba.datasets.entity_subscriptions.entity_subscription import EventsSubscription
 from snuba.datasets.entity_subscriptions.factory import get_entity_subscription
 from snuba.datasets.factory import get_dataset
+from snuba.datasets.storages.factory import get_writable_storage
+from snuba.datasets.storages.storage_key import StorageKey
+from snuba.processor import InsertEvent
+from snuba.query import SelectedExpression
+from snuba.query.data_source.simple import Entity as QueryEntity
+from snuba.query.expressions import Column, FunctionCall
+from snuba.query.logical import Query as LogicalQuery
 from snuba.reader import Result
 from snuba.subscriptions.codecs import SubscriptionScheduledTaskEncoder
 from snuba.subscriptions.data import (
+    BATCHED_PROJECT_COLUMN,
     PartitionId,
     ScheduledSubscriptionTask,
     Subscription,
@@ -34,8 +45,11 @@ from snuba.subscriptions.data import (
 from snuba.subscriptions.executor_consumer import (
     ExecuteQuery,
     ProduceResult,
+    build_empty_batched_result,
     build_executor_consumer,
     calculate_max_concurrent_queries,
+    get_batch_key,
+    split_batched_result,
 )
 from snuba.utils.manage_topics import create_topics
 from snuba.utils.metrics.timer import Timer
@@ -46,6 +60,7 @@ from snuba.utils.streams.configuration_builder import (
 )
 from snuba.utils.streams.topics import Topic as SnubaTopic
 from tests.backends.metrics import Increment, TestingMetricsBackend
+from tests.helpers import write_unprocessed_events
 
 
 @pytest.mark.ci_only
@@ -435,6 +450,176 @@ def test_skip_stale_message() -> None:
     assert Increment("skipped_execution", 1, {"entity": "events"}) in metrics.calls
 
 
+def test_split_batched_result() -> None:
+    result: Result = {
+        "meta": [
+            {"name": "count()", "type": "UInt64"},
+            {"name": BATCHED_PROJECT_COLUMN, "type": "UInt64"},
+        ],
+        "data": [
+            {"count()": 3, BATCHED_PROJECT_COLUMN: 1},
+            {"count()": 5, BATCHED_PROJECT_COLUMN: 2},
+        ],
+        "totals": {},
+    }
+
+    results = split_batched_result(result)
+    assert set(results) == {1, 2}
+    assert results[1]["meta"] == [{"name": "count()", "type": "UInt64"}]
+    assert results[1]["data"] == [{"count()": 3}]
+    assert results[2]["data"] == [{"count()": 5}]
+    # The batched result is left untouched
+    assert result["data"][0] == {"count()": 3, BATCHED_PROJECT_COLUMN: 1}
+
+
+def test_build_empty_batched_result() -> None:
+    def call(alias: str, function: str, *parameters: FunctionCall) -> FunctionCall:
+        return FunctionCall(alias, function, parameters)
+
+    count = call("count", "count")
+    query = LogicalQuery(
+        QueryEntity(EntityKey.EVENTS, EntityColumnSet([])),
+        selected_columns=[
+            SelectedExpression("count", count),
+            SelectedExpression("avg", call("avg", "avg")),
+            SelectedExpression("rate", call("rate", "divide", count, count)),
+            SelectedExpression(
+                BATCHED_PROJECT_COLUMN,
+                Column(BATCHED_PROJECT_COLUMN, None, "project_id"),
+            ),
+        ],
+    )
+    result: Result = {
+        "meta": [
+            {"name": "count", "type": "UInt64"},
+            {"name": "avg", "type": "Float64"},
+            {"name": "rate", "type": "Float64"},
+            {"name": BATCHED_PROJECT_COLUMN, "type": "UInt64"},
+        ],
+        "data": [{"count": 3, "avg": 1.0, "rate": 1.0, BATCHED_PROJECT_COLUMN: 1}],
+        "totals": {},
+    }
+
+    empty_result = build_empty_batched_result(result, query)
+    assert empty_result is not None
+    assert empty_result["meta"] == result["meta"][:3]
+    [row] = empty_result["data"]
+    assert row["count"] == 0
+    assert math.isnan(row["avg"])
+    assert math.isnan(row["rate"])
+
+    # The value of unknown functions on no rows cannot be guessed.
+    query.set_ast_selected_columns(
+        [SelectedExpression("count", call("count", "someFunction"))]
+    )
+    assert build_empty_batched_result(result, query) is None
+
+    # Aggregates of Nullable arguments return NULL on no rows, which only
+    # ClickHouse knows about.
+    query.set_ast_selected_columns([SelectedExpression("count", count)])
+    result["meta"] = [{"name": "count", "type": "Nullable(UInt64)"}]
+    assert build_empty_batched_result(result, query) is None
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        pytest.param("MATCH (events) SELECT count()", id="default limit"),
+        # The limit is smaller than the number of projects in the batch.
+        pytest.param("MATCH (events) SELECT count() LIMIT 1", id="explicit limit"),
+    ],
+)
+def test_execute_query_strategy_batched(query: str) -> None:
+    state.set_config("subscription_executor_batching", 1)
+    state.set_config("subscription_executor_batch_max_wait_ms", 0)
+    metrics = TestingMetricsBackend()
+    next_step = mock.Mock()
+
+    strategy = ExecuteQuery(
+        dataset=get_dataset("events"),
+        entity_names=["events"],
+        max_concurrent_queries=2,
+        stale_threshold_seconds=None,
+        metrics=metrics,
+        next_step=next_step,
+    )
+
+    timestamp = datetime.utcnow().replace(microsecond=0)
+    event_time = timestamp - timedelta(seconds=30)
+    events_per_project = {1: 2, 2: 1, 3: 0}
+    write_unprocessed_events(
+        get_writable_storage(StorageKey.ERRORS),
+        [
+            InsertEvent(
+                {
+                    "event_id": uuid.uuid4().hex,
+                    "group_id": 1,
+                    "primary_hash": uuid.uuid4().hex,
+                    "project_id": project_id,
+                    "message": "a message",
+                    "platform": "a",
+                    "datetime": event_time.strftime(settings.PAYLOAD_DATETIME_FORMAT),
+                    "data": {"received": calendar.timegm(event_time.timetuple())},
+                    "organization_id": 1,
+                    "retention_days": settings.DEFAULT_RETENTION_DAYS,
+                }
+            )
+            for project_id, count in events_per_project.items()
+            for _ in range(count)
+        ],
+    )
+
+    codec = SubscriptionScheduledTaskEncoder()
+    tasks = [
+        ScheduledSubscriptionTask(
+            timestamp,
+            SubscriptionWithMetadata(
+                EntityKey.EVENTS,
+                Subscription(
+                    SubscriptionIdentifier(PartitionId(1), uuid.uuid1()),
+                    SubscriptionData(
+                        project_id=project_id,
+                        time_window_sec=60,
+                        resolution_sec=60,
+                        query=query,
+                        entity_subscription=EventsSubscription(data_dict={}),
+                    ),
+                ),
+                1,
+            ),
+        )
+        for project_id in events_per_project
+    ]
+    assert len({get_batch_key(task) for task in tasks}) == 1
+
+    for offset, task in enumerate(tasks):
+        strategy.submit(
+            Message(Partition(Topic("test"), 0), offset, codec.encode(task), timestamp)
+        )
+
+    while next_step.submit.call_count < len(tasks):
+        time.sleep(0.1)
+        strategy.poll()
+
+    offsets = [call[0][0].offset for call in next_step.submit.call_args_list]
+    assert offsets == list(range(len(tasks)))
+    for call, task in zip(next_step.submit.call_args_list, tasks):
+        task_result = call[0][0].payload
+        assert task_result.task == task
+        request, result = task_result.result
+        assert request.original_body == {"query": query}
+        project_id = task.task.subscription.data.project_id
+        assert result["data"] == [{"count()": events_per_project[project_id]}]
+        assert result["meta"] == [{"name": "count()", "type": "UInt64"}]
+
+    assert Increment("executor.batch.executed", 1, None) in metrics.calls
+    # The project without events is not queried again.
+    assert Increment("executor.batch.fallback", 0, None) in metrics.calls
+
+    strategy.close()
+    strategy.join()
+
+
 # Formula for the max_concurrent_queries found in executor_consumer.py:
 # math.ceil(total_concurrent_queries / (math.ceil(partition_count / len(partitions)) or 1)
 max_concurrent_queries_tests = [
@@ -79,3 +79,41 @@ class TestRedisSubscriptionStore(BaseSubscriptionTest):
         store_2.create(new_subscription_id, self.subscription[1])
         assert store_1.all() == [(subscription_id, self.subscription[0])]
         assert store_2.all() == [(new_subscription_id, self.subscription[1])]
+
+    def test_changes_since(self) -> None:
+        store = self.build_store()
+        subscription_id = uuid1()
+        store.create(subscription_id, self.subscription[0])
+
+        cursor, subscriptions = store.all_with_cursor()
+        assert cursor is not None
+        assert list(subscriptions) == [(subscription_id, self.subscription[0])]
+        assert store.changes_since(cursor) == (cursor, {})
+
+        new_subscription_id = uuid1()
+        store.create(new_subscription_id, self.subscription[1])
+        store.delete(subscription_id)
+        changes = store.changes_since(cursor)
+        assert changes is not None
+        new_cursor, delta = changes
+        assert new_cursor != cursor
+        assert delta == {
+            new_subscription_id: self.subscription[1],
+            subscription_id: None,
+        }
+        assert store.changes_since(new_cursor) == (new_cursor, {})
+
+        # A cursor that is not in the change log anymore forces a full reload
+        assert store.changes_since("1-0") is None
+
+    def test_changes_since_empty_log(self) -> None:
+        store = self.build_store()
+        cursor, subscriptions = store.all_with_cursor()
+        assert cursor == RedisSubscriptionDataStore.EMPTY_CURSOR
+        assert list(subscriptions) == []
+
+        subscription_id = uuid1()
+        store.create(subscription_id, self.subscription[0])
+        changes = store.changes_since(cursor)
+        assert changes is not None
+        assert changes[1] == {subscription_id: self.subscription[0]}
@@ -14,6 +14,7 @@ from snuba.subscriptions.scheduler import (
     DelegateTaskBuilder,
     ImmediateTaskBuilder,
     JitteredTaskBuilder,
+    ScheduleIndex,
     Tags,
     TaskBuilder,
 )
@@ -238,3 +239,47 @@ def test_sequences(
 
     assert output == task_sequence
     assert builder.reset_metrics() == metrics
+
+
+@pytest.mark.parametrize(
+    "builder",
+    [
+        pytest.param(ImmediateTaskBuilder(), id="immediate"),
+        pytest.param(JitteredTaskBuilder(), id="jittered"),
+        pytest.param(DelegateTaskBuilder(), id="delegate"),
+    ],
+)
+def test_schedule_index(builder: TaskBuilder) -> None:
+    """
+    Every subscription the builder schedules at a timestamp must be a
+    candidate returned by the index for that timestamp.
+    """
+    state.set_config("subscription_primary_task_builder", "jittered")
+    subscriptions = [
+        build_subscription(timedelta(minutes=1), 0),
+        build_subscription(timedelta(minutes=1), 1),
+        build_subscription(timedelta(minutes=10), 0),
+        build_subscription(timedelta(hours=1), 1),
+    ]
+    index = ScheduleIndex(builder, subscriptions)
+
+    for timestamp in range(ALIGNED_TIMESTAMP - 600, ALIGNED_TIMESTAMP + 3600):
+        candidates = index.get_candidates(timestamp)
+        scheduled = [
+            subscription
+            for subscription in subscriptions
+            if builder.get_task(
+                SubscriptionWithMetadata(EntityKey.EVENTS, subscription, 1),
+                timestamp,
+            )
+        ]
+        assert all(
+            any(candidate is subscription for candidate in candidates)
+            for subscription in scheduled
+        )
+        # Candidates keep the order of the subscriptions
+        positions = [
+            next(i for i, s in enumerate(subscriptions) if s is candidate)
+            for candidate in candidates
+        ]
+        assert positions == sorted(positions)
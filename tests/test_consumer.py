@@ -2,9 +2,11 @@ import functools
 import itertools
 import json
 import pickle
+import threading
+import time
 from datetime import datetime
 from pickle import PickleBuffer
-from typing import MutableSequence, Optional
+from typing import MutableSequence, Optional, Sequence, Union
 from unittest.mock import Mock, call
 
 import pytest
@@ -12,27 +14,43 @@ from arroyo import Message, Partition, Topic
 from arroyo.backends.kafka import KafkaPayload
 from arroyo.backends.local.backend import LocalBroker as Broker
 from arroyo.backends.local.storages.memory import MemoryMessageStorage
+from arroyo.processing.strategies import MessageRejected, ProcessingStrategy
+from arroyo.processing.strategies.dead_letter_queue import InvalidMessages
 from arroyo.processing.strategies.factory import KafkaConsumerStrategyFactory
 from arroyo.types import Position
 from arroyo.utils.clock import TestingClock
 
+from snuba.clickhouse.http import JSONRowEncoder
 from snuba.clusters.cluster import ClickhouseClientSettings
 from snuba.consumers.consumer import (
     BytesInsertBatch,
     DeadLetterStep,
     InsertBatchWriter,
     MultistorageConsumerProcessingStrategyFactory,
+    PipelinedCollectStep,
+    ProcessBatchStep,
     ProcessedMessageBatchWriter,
     ReplacementBatchWriter,
+    get_rows_count,
     process_message,
 )
+from snuba.datasets.processors.metrics_bucket_processor import (
+    PolymorphicMetricsProcessor,
+)
+from snuba.datasets.processors.outcomes_processor import OutcomesProcessor
+from snuba.datasets.processors.querylog_processor import QuerylogProcessor
+from snuba.datasets.row_aggregation import RowAggregation, sum_values
 from snuba.datasets.schemas.tables import TableSchema
 from snuba.datasets.storage import Storage
-from snuba.processor import InsertBatch, ReplacementBatch
+from snuba.processor import (
+    InsertBatch,
+    ReplacementBatch,
+    supports_batch_processing,
+)
 from snuba.utils.metrics.wrapper import MetricsWrapper
 from tests.assertions import assert_changes
 from tests.backends.confluent_kafka import FakeConfluentKafkaProducer
-from tests.backends.metrics import TestingMetricsBackend, Timing
+from tests.backends.metrics import Gauge, Increment, TestingMetricsBackend, Timing
 
 
 def test_streaming_consumer_strategy() -> None:
@@ -116,6 +134,233 @@ def test_streaming_consumer_strategy() -> None:
         strategy.join()
 
 
+def test_supports_batch_processing() -> None:
+    assert supports_batch_processing(OutcomesProcessor())
+    assert supports_batch_processing(PolymorphicMetricsProcessor())
+    assert not supports_batch_processing(QuerylogProcessor())
+
+
+def test_process_batch_step() -> None:
+    def build_message(
+        partition: int, offset: int, value: bytes
+    ) -> Message[KafkaPayload]:
+        return Message(
+            Partition(Topic("outcomes"), partition),
+            offset,
+            KafkaPayload(None, value, []),
+            datetime(2022, 1, 1, 0, 0, offset),
+        )
+
+    processor = Mock()
+    processor.process_batch.side_effect = lambda messages: InsertBatch(
+        [
+            {"id": value["id"], "offset": metadata.offset}
+            for value, metadata in messages
+        ],
+        None,
+    )
+    next_step = Mock()
+    step = ProcessBatchStep(
+        processor, "consumer_group", next_step, 2, 60.0, TestingMetricsBackend()
+    )
+
+    step.submit(build_message(0, 1, b'{"id": 1}'))
+    step.poll()
+    assert next_step.submit.call_count == 0
+
+    # A full block is processed at once and submitted with the offset of its
+    # last message.
+    step.submit(build_message(0, 2, b'{"id": 2}'))
+    assert processor.process_batch.call_count == 1
+    (submitted,) = next_step.submit.call_args[0]
+    assert (submitted.partition.index, submitted.offset) == (0, 2)
+    assert [json.loads(row) for row in submitted.payload.rows] == [
+        {"id": 1, "offset": 1},
+        {"id": 2, "offset": 2},
+    ]
+
+    # Blocks do not span partitions.
+    step.submit(build_message(0, 3, b'{"id": 3}'))
+    step.submit(build_message(1, 1, b'{"id": 4}'))
+    (submitted,) = next_step.submit.call_args[0]
+    assert (submitted.partition.index, submitted.offset) == (0, 3)
+
+    # When a block fails its messages are processed one at a time, invalid
+    # ones are raised and the following ones are kept.
+    processor.process_message.side_effect = [InsertBatch([{"id": 4}], None)]
+    with pytest.raises(InvalidMessages):
+        step.submit(build_message(1, 2, b"{"))
+    (submitted,) = next_step.submit.call_args[0]
+    assert (submitted.partition.index, submitted.offset) == (1, 1)
+    assert [json.loads(row) for row in submitted.payload.rows] == [{"id": 4}]
+
+    # Rows rejected by the next step are kept, and messages are rejected
+    # until the next step accepts them.
+    next_step.submit.side_effect = MessageRejected()
+    step.submit(build_message(1, 3, b'{"id": 5}'))
+    step.submit(build_message(1, 4, b'{"id": 6}'))
+    with pytest.raises(MessageRejected):
+        step.submit(build_message(1, 5, b'{"id": 7}'))
+    next_step.submit.side_effect = None
+    step.poll()
+    (submitted,) = next_step.submit.call_args[0]
+    assert (submitted.partition.index, submitted.offset) == (1, 4)
+    assert [json.loads(row) for row in submitted.payload.rows] == [
+        {"id": 5, "offset": 3},
+        {"id": 6, "offset": 4},
+    ]
+
+    step.submit(build_message(1, 5, b'{"id": 7}'))
+    step.close()
+    step.join()
+    (submitted,) = next_step.submit.call_args[0]
+    assert (submitted.partition.index, submitted.offset) == (1, 5)
+    assert next_step.close.call_count == 1
+
+
+def test_pipelined_collect_step() -> None:
+    class BlockingStep(ProcessingStrategy[int]):
+        def __init__(self) -> None:
+            self.written = threading.Event()
+
+        def poll(self) -> None:
+            pass
+
+        def submit(self, message: Message[int]) -> None:
+            pass
+
+        def close(self) -> None:
+            assert self.written.wait(10)
+
+        def terminate(self) -> None:
+            pass
+
+        def join(self, timeout: Optional[float] = None) -> None:
+            pass
+
+    steps: MutableSequence[BlockingStep] = []
+
+    def build_step() -> BlockingStep:
+        steps.append(BlockingStep())
+        return steps[-1]
+
+    partition = Partition(Topic("topic"), 0)
+
+    def build_message(offset: int) -> Message[int]:
+        return Message(partition, offset, offset, datetime(2022, 1, 1))
+
+    def committed() -> Sequence[int]:
+        return [offsets[partition].offset for ((offsets,), _) in commit.call_args_list]
+
+    def wait_for_commits(count: int) -> None:
+        deadline = time.time() + 10
+        while len(commit.call_args_list) < count and time.time() < deadline:
+            time.sleep(0.01)
+            step.poll()
+
+    commit = Mock()
+    metrics = TestingMetricsBackend()
+    step = PipelinedCollectStep(build_step, commit, 1, 60.0, 2, metrics)
+
+    # Two batches are written at once, the third one is collected meanwhile
+    # and messages are rejected once it is full.
+    for offset in range(3):
+        step.submit(build_message(offset))
+        step.poll()
+    assert len(steps) == 3
+    with pytest.raises(MessageRejected):
+        step.submit(build_message(3))
+    assert Increment("pipelined_collect.rejected", 1, None) in metrics.calls
+
+    # Offsets are committed in the order of the batches.
+    steps[1].written.set()
+    time.sleep(0.05)
+    step.poll()
+    assert committed() == []
+
+    steps[0].written.set()
+    wait_for_commits(2)
+    assert committed() == [1, 2]
+
+    step.submit(build_message(3))
+    step.close()
+    for blocking_step in steps:
+        blocking_step.written.set()
+    step.join()
+    assert committed() == [1, 2, 3, 4]
+    assert Gauge("pipelined_collect.in_flight", 0, None) in metrics.calls
+
+
+def test_pipelined_collect_step_rows_count() -> None:
+    steps: MutableSequence[Mock] = []
+
+    def build_step() -> Mock:
+        steps.append(Mock())
+        return steps[-1]
+
+    partition = Partition(Topic("topic"), 0)
+
+    def build_message(
+        offset: int, rows: int
+    ) -> Message[Union[None, BytesInsertBatch, InsertBatch, ReplacementBatch]]:
+        return Message(
+            partition,
+            offset,
+            BytesInsertBatch([b"{}"] * rows, None),
+            datetime(2022, 1, 1),
+        )
+
+    step = PipelinedCollectStep(
+        build_step,
+        Mock(),
+        4,
+        60.0,
+        1,
+        TestingMetricsBackend(),
+        get_rows_count,
+    )
+
+    # Batches are full once they hold max_batch_size rows, whatever the
+    # number of messages carrying them.
+    step.submit(build_message(0, 3))
+    step.submit(build_message(1, 1))
+    step.submit(build_message(2, 2))
+    step.submit(build_message(3, 1))
+    step.close()
+    step.join()
+    assert [batch_step.submit.call_count for batch_step in steps] == [2, 2]
+
+
+def test_insert_batch_writer_aggregation() -> None:
+    writer = Mock()
+    metrics = TestingMetricsBackend()
+    step = InsertBatchWriter(
+        writer,
+        MetricsWrapper(metrics, "insertions"),
+        RowAggregation(["key"], {"count": sum_values}),
+        JSONRowEncoder(),
+    )
+
+    partition = Partition(Topic("topic"), 0)
+    for offset, rows in enumerate(
+        [
+            [{"key": 1, "count": 1}, {"key": 2, "count": 1}],
+            [{"key": 1, "count": 2}],
+        ]
+    ):
+        step.submit(Message(partition, offset, InsertBatch(rows, None), datetime.now()))
+    step.submit(Message(partition, 2, BytesInsertBatch([b"{}"], None), datetime.now()))
+    step.close()
+
+    (written,) = writer.write.call_args.args
+    assert [json.loads(row) for row in written] == [
+        {},
+        {"key": 1, "count": 3},
+        {"key": 2, "count": 1},
+    ]
+    assert Increment("insertions.batch_aggregated_msgs", 1, None) in metrics.calls
+
+
 def test_json_row_batch_pickle_simple() -> None:
     batch = BytesInsertBatch([b"foo", b"bar", b"baz"], datetime(2021, 1, 1, 11, 0, 1))
     assert pickle.loads(pickle.dumps(batch)) == batch
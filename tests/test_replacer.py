@@ -11,7 +11,7 @@ import simplejson as json
 from arroyo import Message, Partition, Topic
 from arroyo.backends.kafka import KafkaPayload
 
-from snuba import replacer, settings
+from snuba import replacer, settings, state
 from snuba.clusters.cluster import ClickhouseClientSettings
 from snuba.datasets import errors_replacer
 from snuba.datasets.errors_replacer import ProjectsQueryFlags
@@ -285,6 +285,46 @@ class TestReplacer:
         )
         redis_client.flushdb()
 
+    def test_query_time_flags_cache(self) -> None:
+        redis_client.flushdb()
+        errors_replacer.project_flags_cache.clear()
+        state.set_config("project_flags_cache_ttl_sec", 60.0)
+        project_ids = [1, 2, 3]
+
+        def load_uncached() -> ProjectsQueryFlags:
+            return ProjectsQueryFlags._load_from_redis(
+                project_ids, ReplacerState.ERRORS
+            )
+
+        flags = ProjectsQueryFlags.load_from_redis(project_ids, ReplacerState.ERRORS)
+        assert flags == ProjectsQueryFlags(False, set(), set(), None)
+
+        errors_replacer.set_project_needs_final(
+            1, ReplacerState.ERRORS, ReplacementType.EXCLUDE_GROUPS
+        )
+        errors_replacer.set_project_exclude_groups(
+            2, [4, 5], ReplacerState.ERRORS, ReplacementType.START_MERGE
+        )
+
+        # Within the TTL the cached flags are used without going to Redis
+        flags = ProjectsQueryFlags.load_from_redis(project_ids, ReplacerState.ERRORS)
+        assert flags == ProjectsQueryFlags(False, set(), set(), None)
+
+        # Past the TTL the version stamps written by the replacer invalidate
+        # the cached flags of the projects that had replacements.
+        state.set_config("project_flags_cache_ttl_sec", 0.001)
+        time.sleep(0.01)
+        flags = ProjectsQueryFlags.load_from_redis(project_ids, ReplacerState.ERRORS)
+        assert flags.needs_final
+        assert flags.group_ids_to_exclude == {4, 5}
+        assert flags == load_uncached()
+
+        time.sleep(0.01)
+        assert ProjectsQueryFlags.load_from_redis(
+            [3], ReplacerState.ERRORS
+        ) == ProjectsQueryFlags(False, set(), set(), None)
+        errors_replacer.project_flags_cache.clear()
+
     def test_query_time_flags_project(self) -> None:
         """
         Tests errors_replacer.set_project_needs_final()
@@ -1,9 +1,12 @@
+import threading
 from datetime import datetime
 from typing import Any, MutableMapping, Sequence
+from unittest import mock
 
 import pytest
 from snuba_sdk.legacy import json_to_snql
 
+from snuba import settings as snuba_settings
 from snuba import state
 from snuba.clickhouse.columns import ColumnSet, String
 from snuba.clickhouse.query import Query as ClickhouseQuery
@@ -23,7 +26,12 @@ from snuba.query.data_source.simple import Table
 from snuba.query.expressions import Column
 from snuba.query.query_settings import HTTPQuerySettings, QuerySettings
 from snuba.query.snql.parser import parse_snql_query
+from snuba.querylog.query_metadata import (
+    SnubaQueryMetadata,
+    get_concurrent_query_metadata,
+)
 from snuba.reader import Reader
+from snuba.utils.metrics.timer import Timer
 from snuba.web import QueryResult
 
 
@@ -452,3 +460,175 @@ def test_time_split_ast() -> None:
         ("2019-09-19T01:00:00", "2019-09-19T11:00:00"),
         ("2019-09-18T10:00:00", "2019-09-19T01:00:00"),
     ]
+
+
+def test_time_split_parallel() -> None:
+    state.set_config("split_parallel_windows", 2)
+    found_timestamps = []
+
+    def do_query(
+        query: ClickhouseQuery,
+        query_settings: QuerySettings,
+    ) -> QueryResult:
+        from_date_ast, to_date_ast = get_time_range(query, "timestamp")
+        assert from_date_ast is not None and isinstance(from_date_ast, datetime)
+        assert to_date_ast is not None and isinstance(to_date_ast, datetime)
+        assert query.get_limit() == 15
+        assert query.get_offset() == 0
+
+        found_timestamps.append((from_date_ast.isoformat(), to_date_ast.isoformat()))
+        if len(found_timestamps) == 1:
+            return QueryResult({"data": []}, {"stats": {"window": 1}})
+        return QueryResult({"data": [{"event_id": i} for i in range(15)]}, {})
+
+    body = """
+        MATCH (events)
+        SELECT event_id, level, logger, server_name, transaction, timestamp, project_id
+        WHERE timestamp >= toDateTime('2019-09-18T10:00:00')
+        AND timestamp < toDateTime('2019-09-19T12:00:00')
+        AND project_id IN tuple(1)
+        ORDER BY timestamp DESC
+        LIMIT 10
+        OFFSET 5
+        """
+
+    query, _ = parse_snql_query(body, get_dataset("events"))
+    entity = get_entity(query.get_from_clause().key)
+    settings = HTTPQuerySettings()
+    for p in entity.get_query_processors():
+        p.process_query(query, settings)
+
+    clickhouse_query = identity_translate(query)
+    original_condition = clickhouse_query.get_condition()
+    splitter = TimeSplitQueryStrategy("timestamp")
+    result = splitter.execute(clickhouse_query, settings, do_query)
+
+    assert result is not None
+    assert result.extra == {"stats": {"window": 1}}
+    assert result.result["data"] == [{"event_id": i} for i in range(5, 15)]
+    # The first two windows are issued together, the third one may have
+    # been cancelled.
+    assert set(found_timestamps[:2]) == {
+        ("2019-09-19T11:00:00", "2019-09-19T12:00:00"),
+        ("2019-09-19T01:00:00", "2019-09-19T11:00:00"),
+    }
+    assert found_timestamps[2:] in (
+        [],
+        [("2019-09-18T10:00:00", "2019-09-19T01:00:00")],
+    )
+    # The original query is not modified.
+    assert clickhouse_query.get_condition() == original_condition
+    assert clickhouse_query.get_limit() == 10
+
+
+def test_time_split_parallel_windows_cap() -> None:
+    state.set_config("split_parallel_windows", 10)
+    lock = threading.Lock()
+    running = [0]
+    max_running = [0]
+    queries = []
+
+    def do_query(
+        query: ClickhouseQuery,
+        query_settings: QuerySettings,
+    ) -> QueryResult:
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+            queries.append(query)
+        try:
+            return QueryResult({"data": []}, {})
+        finally:
+            with lock:
+                running[0] -= 1
+
+    body = """
+        MATCH (events)
+        SELECT event_id, timestamp, project_id
+        WHERE timestamp >= toDateTime('2019-09-18T10:00:00')
+        AND timestamp < toDateTime('2019-09-19T12:00:00')
+        AND project_id IN tuple(1)
+        ORDER BY timestamp DESC
+        LIMIT 10
+        """
+
+    query, _ = parse_snql_query(body, get_dataset("events"))
+    entity = get_entity(query.get_from_clause().key)
+    settings = HTTPQuerySettings()
+    for p in entity.get_query_processors():
+        p.process_query(query, settings)
+
+    clickhouse_query = identity_translate(query)
+    splitter = TimeSplitQueryStrategy("timestamp")
+    with mock.patch.object(snuba_settings, "TIME_SPLIT_MAX_PARALLEL_WINDOWS", 2):
+        splitter.execute(clickhouse_query, settings, do_query)
+
+    assert len(queries) == 3
+    assert max_running[0] <= 2
+    # Every window gets a query of its own. The immutable expressions are
+    # shared with the original query, the experiments are not.
+    assert len({id(query) for query in queries}) == 3
+    assert all(
+        query.get_experiments() is not clickhouse_query.get_experiments()
+        for query in queries
+    )
+
+
+def test_time_split_parallel_query_metadata() -> None:
+    state.set_config("split_parallel_windows", 3)
+    timer = Timer("query")
+    query_metadata = SnubaQueryMetadata(
+        request=mock.Mock(),
+        start_timestamp=None,
+        end_timestamp=None,
+        dataset="events",
+        entity="events",
+        timer=timer,
+        query_list=[],
+        projects=set(),
+        snql_anonymized="",
+    )
+
+    def do_query(
+        query: ClickhouseQuery,
+        query_settings: QuerySettings,
+    ) -> QueryResult:
+        concurrent_query_metadata = get_concurrent_query_metadata()
+        assert concurrent_query_metadata is not None
+        window_timer, window_metadata = concurrent_query_metadata.isolate(
+            timer, query_metadata
+        )
+        assert window_timer is not timer
+        assert window_metadata.query_list is not query_metadata.query_list
+        window_timer.mark("execute")
+        from_date_ast, _ = get_time_range(query, "timestamp")
+        window_metadata.query_list.append(mock.Mock(start_timestamp=from_date_ast))
+        return QueryResult({"data": []}, {})
+
+    body = """
+        MATCH (events)
+        SELECT event_id, timestamp, project_id
+        WHERE timestamp >= toDateTime('2019-09-18T10:00:00')
+        AND timestamp < toDateTime('2019-09-19T12:00:00')
+        AND project_id IN tuple(1)
+        ORDER BY timestamp DESC
+        LIMIT 10
+        """
+
+    query, _ = parse_snql_query(body, get_dataset("events"))
+    entity = get_entity(query.get_from_clause().key)
+    settings = HTTPQuerySettings()
+    for p in entity.get_query_processors():
+        p.process_query(query, settings)
+
+    splitter = TimeSplitQueryStrategy("timestamp")
+    splitter.execute(identity_translate(query), settings, do_query)
+
+    # The windows are merged in the order they are consumed.
+    assert [q.start_timestamp for q in query_metadata.query_list] == [
+        datetime(2019, 9, 19, 11),
+        datetime(2019, 9, 19, 1),
+        datetime(2019, 9, 18, 10),
+    ]
+    assert "execute" in timer.finish()["marks_ms"]
+    assert get_concurrent_query_metadata() is None
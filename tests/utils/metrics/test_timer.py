@@ -60,3 +60,34 @@ def test_timer_send_metrics() -> None:
             "timer.thing2", 10.0 * 1000, {"mark-key": "mark-value", **overridden_tags}
         ),
     ]
+
+
+def test_timer_merge() -> None:
+    time = TestingClock()
+
+    t = Timer("timer", clock=time)
+    time.sleep(10.0)
+    t.mark("thing1")
+
+    # Two timers running concurrently from here.
+    concurrent = [Timer("concurrent", clock=time), Timer("concurrent", clock=time)]
+    time.sleep(10.0)
+    for c in concurrent:
+        c.mark("thing2")
+    time.sleep(10.0)
+    concurrent[1].mark("thing3")
+
+    for c in concurrent:
+        t.merge(c)
+    time.sleep(10.0)
+    t.mark("thing1")
+    assert t.finish() == {
+        "timestamp": 0.0,
+        "duration_ms": 40.0 * 1000,
+        "marks_ms": {
+            "thing1": (10.0 + 10.0) * 1000,
+            "thing2": (10.0 + 10.0) * 1000,
+            "thing3": 10.0 * 1000,
+        },
+        "tags": {},
+    }
@@ -0,0 +1,254 @@
+from datetime import datetime, timedelta
+from typing import Any, MutableMapping, Optional
+from unittest import mock
+
+from snuba.clickhouse.columns import ColumnSet
+from snuba.clickhouse.formatter.expression import ClickhouseExpressionFormatter
+from snuba.clickhouse.formatter.query import format_query
+from snuba.clickhouse.query import Query
+from snuba.query import OrderBy, OrderByDirection, SelectedExpression
+from snuba.query.conditions import (
+    ConditionFunctions,
+    binary_condition,
+    combine_and_conditions,
+)
+from snuba.query.data_source.simple import Table
+from snuba.query.expressions import Column, FunctionCall, Literal
+from snuba.query.query_settings import HTTPQuerySettings
+from snuba.reader import Result, Row
+from snuba.redis import RedisClientKey, get_redis_client
+from snuba.utils.metrics.timer import Timer
+from snuba.web.bucket_cache import (
+    TimeBucketCache,
+    exclude_buckets,
+    get_cacheable_buckets,
+    get_template_key,
+    get_time_bucketed_query,
+    longest_run,
+    stitch_rows,
+)
+from snuba.web.db_query import (
+    DEFAULT_CACHE_PARTITION_ID,
+    bucket_cache,
+    execute_query_with_bucket_caching,
+)
+
+BUCKET = FunctionCall(
+    "_snuba_time",
+    "toStartOfHour",
+    (Column(None, None, "timestamp"), Literal(None, "Universal")),
+)
+
+
+def build_query(
+    from_date: datetime,
+    to_date: datetime,
+    limit: Optional[int] = None,
+    totals: bool = False,
+    table: str = "events",
+) -> Query:
+    timestamp = Column(None, None, "timestamp")
+    return Query(
+        Table(table, ColumnSet([])),
+        selected_columns=[
+            SelectedExpression("time", BUCKET),
+            SelectedExpression("count", FunctionCall("_snuba_count", "count", tuple())),
+        ],
+        condition=combine_and_conditions(
+            [
+                binary_condition(
+                    ConditionFunctions.EQ,
+                    Column(None, None, "project_id"),
+                    Literal(None, 1),
+                ),
+                binary_condition(
+                    ConditionFunctions.GTE, timestamp, Literal(None, from_date)
+                ),
+                binary_condition(
+                    ConditionFunctions.LT, timestamp, Literal(None, to_date)
+                ),
+            ]
+        ),
+        groupby=[BUCKET],
+        order_by=[OrderBy(OrderByDirection.ASC, BUCKET)],
+        limit=limit,
+        totals=totals,
+    )
+
+
+def test_time_bucketed_query() -> None:
+    query = build_query(datetime(2022, 1, 1, 10, 30), datetime(2022, 1, 1, 16, 10))
+    bucketed = get_time_bucketed_query(query)
+    assert bucketed is not None
+    assert bucketed.column == "timestamp"
+    assert bucketed.granularity == 3600
+    assert bucketed.bucket_alias == "_snuba_time"
+    assert bucketed.descending is False
+
+    assert (
+        get_time_bucketed_query(
+            build_query(datetime(2022, 1, 1), datetime(2022, 1, 2), totals=True)
+        )
+        is None
+    )
+    query.set_ast_groupby([Column(None, None, "project_id")])
+    assert get_time_bucketed_query(query) is None
+
+    # The errors storage has a replacer.
+    assert (
+        get_time_bucketed_query(
+            build_query(
+                datetime(2022, 1, 1), datetime(2022, 1, 2), table="errors_local"
+            )
+        )
+        is None
+    )
+
+
+def test_buckets() -> None:
+    bucketed = get_time_bucketed_query(
+        build_query(datetime(2022, 1, 1, 10, 30), datetime(2022, 1, 1, 16, 10))
+    )
+    assert bucketed is not None
+    start = 1641034800  # 2022-01-01T11:00:00 UTC
+
+    # Only the buckets entirely within the range and old enough.
+    assert list(get_cacheable_buckets(bucketed, 1641060000, 0)) == [
+        start + i * 3600 for i in range(5)
+    ]
+    assert list(get_cacheable_buckets(bucketed, 1641042000 + 60, 60)) == [
+        start,
+        start + 3600,
+    ]
+
+    assert longest_run([], 3600) == []
+    assert longest_run([0, 3600, 10800, 14400, 18000], 3600) == [10800, 14400, 18000]
+
+    fresh = exclude_buckets(bucketed, [start, start + 3600])
+    condition = fresh.get_condition()
+    assert condition is not None
+    assert condition.accept(ClickhouseExpressionFormatter()).startswith(
+        "(less(timestamp, toDateTime('2022-01-01T11:00:00', 'Universal')) "
+        "OR greaterOrEquals(timestamp, "
+        "toDateTime('2022-01-01T13:00:00', 'Universal'))) AND "
+    )
+
+
+def test_template_key() -> None:
+    def template_key(query: Query) -> str:
+        bucketed = get_time_bucketed_query(query)
+        assert bucketed is not None
+        return get_template_key(bucketed)
+
+    key = template_key(
+        build_query(datetime(2022, 1, 1, 10, 30), datetime(2022, 1, 1, 16, 10))
+    )
+    assert key == template_key(
+        build_query(datetime(2022, 1, 1, 10, 31), datetime(2022, 1, 1, 16, 11))
+    )
+    assert key != template_key(
+        build_query(
+            datetime(2022, 1, 1, 10, 31), datetime(2022, 1, 1, 16, 11), limit=10
+        )
+    )
+
+
+def test_stitch_rows() -> None:
+    query = build_query(datetime(2022, 1, 1), datetime(2022, 1, 2), limit=3)
+    query.set_ast_orderby([OrderBy(OrderByDirection.DESC, BUCKET)])
+    bucketed = get_time_bucketed_query(query)
+    assert bucketed is not None
+
+    def row(hour: int) -> Row:
+        return {"_snuba_time": f"2022-01-01T{hour:02d}:00:00+00:00", "_snuba_count": 1}
+
+    assert stitch_rows(bucketed, [row(1), row(2)], [row(0), row(3)]) == [
+        row(3),
+        row(2),
+        row(1),
+    ]
+
+
+def test_time_bucket_cache() -> None:
+    cache = TimeBucketCache(get_redis_client(RedisClientKey.CACHE), "test-buckets:")
+    assert cache.get("template", [0, 3600]) == (None, {})
+
+    meta = [{"name": "_snuba_time", "type": "DateTime"}]
+    cache.set("template", meta, {0: [{"_snuba_time": "a"}], 3600: []}, 60)
+    assert cache.get("template", [0, 3600, 7200]) == (
+        meta,
+        {0: [{"_snuba_time": "a"}], 3600: []},
+    )
+
+
+def test_bucket_caching_strategy() -> None:
+    def execute(query: Query) -> None:
+        bucketed_query = get_time_bucketed_query(query)
+        assert bucketed_query is not None
+        result: Result = {"data": [], "meta": [], "profile": None, "trace_output": ""}
+        strategy = mock.Mock(return_value=result)
+        assert (
+            execute_query_with_bucket_caching(
+                bucketed_query,
+                strategy,
+                query,
+                mock.Mock(),
+                format_query(query),
+                None,
+                mock.Mock(cache_partition_id=None),
+                Timer("test"),
+                {},
+                {},
+                robust=False,
+            )["data"]
+            == []
+        )
+        strategy.assert_called_once()
+        assert strategy.call_args[0][0] is query
+
+    # Without any bucket old enough to be cached, the query is run as is
+    # through the regular strategy.
+    now = datetime.utcnow()
+    execute(build_query(now - timedelta(minutes=10), now))
+
+    # Otherwise the buckets which are not cached yet are read through the
+    # regular strategy as well.
+    execute(build_query(datetime(2022, 1, 1, 10, 30), datetime(2022, 1, 1, 16, 10)))
+
+
+def test_bucket_caching_full_hit() -> None:
+    query = build_query(datetime(2022, 1, 1, 10), datetime(2022, 1, 1, 12))
+    bucketed_query = get_time_bucketed_query(query)
+    assert bucketed_query is not None
+    meta = [{"name": "_snuba_time", "type": "DateTime"}]
+    bucket_cache.set(
+        f"{DEFAULT_CACHE_PARTITION_ID}:{get_template_key(bucketed_query)}",
+        meta,
+        {
+            bucketed_query.from_ts: [{"_snuba_time": "2022-01-01T10:00:00+00:00"}],
+            bucketed_query.from_ts + 3600: [],
+        },
+        60,
+    )
+
+    strategy = mock.Mock()
+    stats: MutableMapping[str, Any] = {}
+    result = execute_query_with_bucket_caching(
+        bucketed_query,
+        strategy,
+        query,
+        HTTPQuerySettings(),
+        format_query(query),
+        None,
+        mock.Mock(cache_partition_id=None),
+        Timer("test"),
+        stats,
+        {},
+        robust=False,
+    )
+    strategy.assert_not_called()
+    assert result["data"] == [{"_snuba_time": "2022-01-01T10:00:00+00:00"}]
+    assert result["meta"] == meta
+    assert result["profile"] is not None
+    assert result["profile"]["rows"] == 1
+    assert stats["bucket_cache_hits"] == 2
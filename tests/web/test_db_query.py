@@ -3,7 +3,12 @@ from typing import Any, Mapping, MutableMapping, Optional
 import pytest
 
 from snuba import state
-from snuba.web.db_query import _get_query_settings_from_config
+from snuba.reader import ColumnarRows, Result
+from snuba.web.db_query import (
+    _copy_result,
+    _estimate_result_size,
+    _get_query_settings_from_config,
+)
 
 test_data = [
     pytest.param(
@@ -60,3 +65,34 @@ def test_query_settings_from_config(
     for k, v in query_config.items():
         state.set_config(k, v)
     assert _get_query_settings_from_config(query_prefix) == expected
+
+
+def test_copy_columnar_result() -> None:
+    result: Result = {
+        "meta": [{"name": "a", "type": "UInt8"}, {"name": "b", "type": "String"}],
+        "data": ColumnarRows(["a", "b"], [[1, 2], ["x", "y"]]),
+    }
+    size = _estimate_result_size(result)
+    copied = _copy_result(result)
+
+    # Neither call converts the cached rows to dictionaries.
+    data = result["data"]
+    assert isinstance(data, ColumnarRows)
+    assert data.get_columns() == (["a", "b"], [[1, 2], ["x", "y"]])
+    copied_data = copied["data"]
+    assert isinstance(copied_data, ColumnarRows)
+    assert copied_data.get_columns() == data.get_columns()
+    assert size == _estimate_result_size(copied)
+
+    # Changing the copy in place does not change the cached result.
+    columns = copied_data.get_columns()
+    assert columns is not None
+    columns[1][0][0] = 3
+    copied_data.rename({"b": ["c"]})
+    assert data.get_columns() == (["a", "b"], [[1, 2], ["x", "y"]])
+
+    # Results already converted to rows are copied row by row.
+    data[0]["a"] = 4
+    copied = _copy_result(result)
+    copied["data"][0]["a"] = 5
+    assert list(result["data"]) == [{"a": 4, "b": "x"}, {"a": 2, "b": "y"}]
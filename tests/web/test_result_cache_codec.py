@@ -1,8 +1,10 @@
 import pytest
 
+from snuba import state
 from snuba.reader import Result
 from snuba.utils.serializable_exception import SerializableException
 from snuba.web.db_query import ResultCacheCodec
+from snuba.web.result_codecs import ColumnarResultEncoder, is_columnar_payload
 
 
 def test_encode_decode() -> None:
@@ -23,3 +25,76 @@ def test_encode_decode_exception() -> None:
     encoded_exception = codec.encode_exception(SomeException("some message"))
     with pytest.raises(SomeException):
         codec.decode(encoded_exception)
+
+
+COLUMNAR_PAYLOAD: Result = {
+    "meta": [
+        {"name": "count", "type": "UInt64"},
+        {"name": "project_id", "type": "Nullable(Int32)"},
+        {"name": "avg", "type": "Float64"},
+        {"name": "title", "type": "LowCardinality(Nullable(String))"},
+        {"name": "time", "type": "DateTime"},
+        {"name": "tags", "type": "Array(String)"},
+        {"name": "mixed", "type": "Int64"},
+    ],
+    "data": [
+        {
+            "count": 2**64 - 1,
+            "project_id": 1,
+            "avg": 1.5,
+            "title": "héllo",
+            "time": "2022-10-01T00:00:00+00:00",
+            "tags": ["a", "b"],
+            "mixed": 1,
+        },
+        {
+            "count": 0,
+            "project_id": None,
+            "avg": -0.25,
+            "title": None,
+            "time": "2022-10-01T00:01:00+00:00",
+            "tags": [],
+            "mixed": "not an int",
+        },
+    ],
+    "totals": {"count": 10},
+    "profile": {"rows": 2},
+    "trace_output": "",
+}
+
+
+def test_columnar_encode_decode() -> None:
+    encoded = ColumnarResultEncoder().encode(COLUMNAR_PAYLOAD)
+    assert encoded is not None
+    assert is_columnar_payload(encoded)
+    assert ResultCacheCodec().decode(encoded) == COLUMNAR_PAYLOAD
+
+
+def test_columnar_irregular_rows() -> None:
+    payload: Result = {
+        "meta": [{"name": "foo", "type": "String"}],
+        "data": [{"foo": "bar", "extra": 1}],
+    }
+    assert ColumnarResultEncoder().encode(payload) is None
+
+
+def test_columnar_codec_from_config() -> None:
+    codec = ResultCacheCodec("some_partition")
+    assert not is_columnar_payload(codec.encode(COLUMNAR_PAYLOAD))
+
+    state.set_config("some_partition/result_cache_codec", "columnar")
+    try:
+        encoded = codec.encode(COLUMNAR_PAYLOAD)
+        assert is_columnar_payload(encoded)
+        assert codec.decode(encoded) == COLUMNAR_PAYLOAD
+        # Other partitions are not affected
+        assert not is_columnar_payload(ResultCacheCodec().encode(COLUMNAR_PAYLOAD))
+    finally:
+        state.delete_config("some_partition/result_cache_codec")
+
+    # Exceptions keep using the JSON path
+    class ColumnarCodecException(SerializableException):
+        pass
+
+    with pytest.raises(ColumnarCodecException):
+        codec.decode(codec.encode_exception(ColumnarCodecException("some message")))
@@ -1,11 +1,14 @@
 from __future__ import annotations
 
-from typing import Mapping
+import copy
+from datetime import datetime
+from typing import Any, Mapping
 
 import pytest
+import simplejson as json
 
-from snuba.reader import Column, Result
-from snuba.web import QueryExtraData, QueryResult, transform_column_names
+from snuba.reader import Column, ColumnarRows, Result
+from snuba.web import QueryExtraData, QueryResult, dump_payload, transform_column_names
 
 TEST_CASES = [
     pytest.param(
@@ -160,3 +163,83 @@ def test_transformation(
     transform_column_names(in_result, mapping)
 
     assert in_result == out_result
+
+
+def to_columnar(result: QueryResult) -> QueryResult:
+    result = copy.deepcopy(result)
+    names = [column["name"] for column in result.result["meta"]]
+    result.result["data"] = ColumnarRows(
+        names, [[row[name] for row in result.result["data"]] for name in names]
+    )
+    return result
+
+
+@pytest.mark.parametrize("in_result, out_result, mapping", TEST_CASES)
+def test_columnar_transformation(
+    in_result: QueryResult, out_result: QueryResult, mapping: Mapping[str, list[str]]
+) -> None:
+    columnar = to_columnar(in_result)
+    transform_column_names(columnar, mapping)
+
+    data = columnar.result["data"]
+    assert isinstance(data, ColumnarRows)
+    assert data.get_columns() is not None
+    assert columnar == out_result
+
+
+def test_columnar_rows_materialize() -> None:
+    rows = ColumnarRows(["a", "b"], [[1, 2], ["x", "y"]])
+    rows.rename({"a": ["a", "c"]})
+    assert rows.get_columns() == (["a", "c", "b"], [[1, 2], [1, 2], ["x", "y"]])
+    assert rows.to_rows() == [{"a": 1, "c": 1, "b": "x"}, {"a": 2, "c": 2, "b": "y"}]
+
+    # Row level changes convert the rows to dictionaries and are kept.
+    rows[0]["a"] = 10
+    assert rows.get_columns() is None
+    assert rows == [{"a": 10, "c": 1, "b": "x"}, {"a": 2, "c": 2, "b": "y"}]
+
+    rows.rename({"c": ["d"]})
+    assert list(rows) == [{"a": 10, "d": 1, "b": "x"}, {"a": 2, "d": 2, "b": "y"}]
+
+
+DUMP_TEST_CASES = [
+    pytest.param(
+        {
+            "data": ColumnarRows(
+                ["count", "title", "avg", "mixed", "time", "tags"],
+                [
+                    [1, 2, 2**70],
+                    ["a", '\u00e9"', ""],
+                    [0.5, 1e20, -3.25],
+                    [None, True, 1.5],
+                    [datetime(2022, 1, 1), None, datetime(2022, 1, 2)],
+                    [["x", "y"], [], ["z"]],
+                ],
+            ),
+            "meta": [{"name": "count", "type": "UInt64"}],
+            "timing": {"timestamp": 1, "duration_ms": 2},
+        },
+        id="Columnar",
+    ),
+    pytest.param(
+        {"data": ColumnarRows([], []), "meta": []},
+        id="No columns",
+    ),
+    pytest.param(
+        {"data": ColumnarRows(["nan"], [[float("nan"), 1.0]])},
+        id="Only data",
+    ),
+    pytest.param(
+        {"data": [{"a": 1}], "meta": [{"name": "a", "type": "UInt8"}]},
+        id="Rows",
+    ),
+]
+
+
+@pytest.mark.parametrize("payload", DUMP_TEST_CASES)
+def test_dump_payload(payload: Mapping[str, Any]) -> None:
+    data = payload["data"]
+    rows = data.to_rows() if isinstance(data, ColumnarRows) else data
+    expected = json.dumps({**payload, "data": rows}, default=str)
+
+    assert dump_payload(payload) == expected